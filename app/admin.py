@@ -1,3 +1,182 @@
 from django.contrib import admin
 
-# Register your models here.
+from app.models import (
+    AggregateRefreshQueue,
+    CohortAggregate,
+    Diagnosis,
+    DICOMFileManifest,
+    DICOMObject,
+    DICOMStudy,
+    DoseVolumeHistogram,
+    GammaAnalysis,
+    Job,
+    Patient,
+    RadiomicFeatureSet,
+    RadiotherapyBooking,
+    RadiotherapySimulation,
+    RegistrationShift,
+    StructureVolume,
+)
+from app.paginators import EstimatedCountPaginator
+
+PATIENT = 'diagnosis__patient'
+BOOKING_PATIENT = 'radiotherapy_booking__' + PATIENT
+SIMULATION_PATIENT = 'radiotherapy_simulation__' + BOOKING_PATIENT
+
+
+class JoinedModelAdmin(admin.ModelAdmin):
+    '''
+    ModelAdmin whose queries join the relations that __str__ and list_display follow.
+
+    get_queryset() also serves the autocomplete views, so the relations are
+    listed once in list_select_related and applied to both. Changelists skip
+    the count of the unfiltered table.
+    '''
+    list_select_related = ()
+    ordering = ('-pk',)
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(*self.list_select_related)
+
+
+class LargeTableAdmin(JoinedModelAdmin):
+    '''
+    JoinedModelAdmin for tables too large to count.
+    '''
+    paginator = EstimatedCountPaginator
+
+
+@admin.register(Patient)
+class PatientAdmin(JoinedModelAdmin):
+    list_display = ('patient_uid', 'name', 'gender', 'date_of_birth', 'date_of_registration')
+    list_filter = ('gender',)
+    search_fields = ('patient_uid', 'name')
+    ordering = ('patient_uid',)
+    date_hierarchy = 'date_of_registration'
+
+
+@admin.register(Diagnosis)
+class DiagnosisAdmin(JoinedModelAdmin):
+    list_display = ('patient', 'cancer_site', 'cancer_side', 'cancer_pathology', 'date_of_diagnosis', 'overall_stage')
+    list_select_related = ('patient', 'cancer_site', 'cancer_pathology')
+    list_filter = ('cancer_site', 'cancer_side')
+    search_fields = ('patient__patient_uid', 'patient__name')
+    autocomplete_fields = ('patient', 'cancer_site', 'cancer_pathology')
+
+
+@admin.register(RadiotherapyBooking)
+class RadiotherapyBookingAdmin(JoinedModelAdmin):
+    list_display = ('__str__', 'radiotherapy_treatment_intent', 'radiotherapy_treatment_technique', 'planned_total_dose', 'planned_total_number_of_fractions', 'proposed_treatment_start_date')
+    list_select_related = (PATIENT, 'radiotherapy_treatment_technique')
+    list_filter = ('radiotherapy_modality', 'radiotherapy_treatment_intent', 'radiotherapy_treatment_technique')
+    search_fields = ('diagnosis__patient__patient_uid', 'diagnosis__patient__name')
+    autocomplete_fields = ('diagnosis', 'radiotherapy_treatment_technique', 'radiotherapy_billing_category', 'systemic_therapy_type')
+
+
+@admin.register(RadiotherapySimulation)
+class RadiotherapySimulationAdmin(JoinedModelAdmin):
+    list_display = ('__str__', 'simulation_appointment_type', 'date_of_simulation', 'simulation_done')
+    list_select_related = (BOOKING_PATIENT,)
+    list_filter = ('simulation_appointment_type', 'simulation_done')
+    search_fields = ('radiotherapy_booking__diagnosis__patient__patient_uid',)
+    autocomplete_fields = ('radiotherapy_booking',)
+    date_hierarchy = 'date_of_simulation'
+
+
+@admin.register(DICOMStudy)
+class DICOMStudyAdmin(LargeTableAdmin):
+    list_display = ('study_instance_uid', 'radiotherapy_simulation', 'study_date_time', 'study_modality', 'study_description')
+    list_select_related = (SIMULATION_PATIENT,)
+    search_fields = ('=study_instance_uid', 'radiotherapy_simulation__radiotherapy_booking__diagnosis__patient__patient_uid')
+    autocomplete_fields = ('radiotherapy_simulation',)
+
+
+@admin.register(DICOMFileManifest)
+class DICOMFileManifestAdmin(LargeTableAdmin):
+    list_display = ('path', 'modality', 'sop_instance_uid', 'size', 'updated_at')
+    list_filter = ('modality',)
+    search_fields = ('=sop_instance_uid', '=study_instance_uid', '=series_instance_uid')
+    autocomplete_fields = ('dicom_study',)
+
+
+@admin.register(DICOMObject)
+class DICOMObjectAdmin(LargeTableAdmin):
+    list_display = ('sop_instance_uid', 'modality', 'size', 'content_hash', 'updated_at')
+    list_filter = ('modality',)
+    search_fields = ('=sop_instance_uid', '=study_instance_uid', '=series_instance_uid', '=content_hash')
+    autocomplete_fields = ('dicom_study',)
+
+
+class MeasurementAdmin(LargeTableAdmin):
+    '''
+    Admin of a per-ROI measurement table. The large payload fields are left out of list queries.
+    '''
+    deferred = ()
+    search_fields = ('roi_name', '=structure_set_uid', '=dicom_study__study_instance_uid')
+    autocomplete_fields = ('dicom_study',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer(*self.deferred)
+
+
+@admin.register(RadiomicFeatureSet)
+class RadiomicFeatureSetAdmin(MeasurementAdmin):
+    list_display = ('roi_name', 'structure_set_uid', 'series_instance_uid', 'parameter_hash', 'created_at')
+    deferred = ('values',)
+
+
+@admin.register(StructureVolume)
+class StructureVolumeAdmin(MeasurementAdmin):
+    list_display = ('roi_name', 'structure_set_uid', 'volume', 'slice_count', 'slice_thickness')
+
+
+@admin.register(DoseVolumeHistogram)
+class DoseVolumeHistogramAdmin(MeasurementAdmin):
+    list_display = ('roi_name', 'dose_uid', 'volume', 'd_mean', 'd_max', 'd_95', 'v_20')
+    deferred = ('histogram',)
+
+
+@admin.register(GammaAnalysis)
+class GammaAnalysisAdmin(LargeTableAdmin):
+    list_display = ('plan_uid', 'measured_dose_uid', '__str__', 'dimensions', 'points', 'pass_rate', 'gamma_mean')
+    list_filter = ('dose_percent', 'distance_mm', 'local', 'dimensions')
+    search_fields = ('=plan_uid', '=measured_dose_uid', '=dicom_study__study_instance_uid')
+    autocomplete_fields = ('dicom_study',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('histogram')
+
+
+@admin.register(RegistrationShift)
+class RegistrationShiftAdmin(LargeTableAdmin):
+    list_display = ('sop_instance_uid', 'radiotherapy_booking', 'acquired_at', 'translation_x', 'translation_y', 'translation_z')
+    list_select_related = (BOOKING_PATIENT,)
+    search_fields = ('=sop_instance_uid', '=dicom_study__study_instance_uid', 'radiotherapy_booking__diagnosis__patient__patient_uid')
+    autocomplete_fields = ('dicom_study', 'radiotherapy_booking')
+    date_hierarchy = 'acquired_at'
+
+
+@admin.register(CohortAggregate)
+class CohortAggregateAdmin(LargeTableAdmin):
+    list_display = ('metric', 'roi_name', 'grouping', 'cancer_site', 'count', 'mean', 'p50')
+    list_select_related = ('cancer_site',)
+    list_filter = ('source', 'grouping', 'cancer_site')
+    search_fields = ('metric', 'roi_name')
+    autocomplete_fields = ('cancer_site', 'cancer_pathology', 'radiotherapy_treatment_technique')
+
+
+@admin.register(AggregateRefreshQueue)
+class AggregateRefreshQueueAdmin(JoinedModelAdmin):
+    list_display = ('cancer_site', 'source', 'queued_at')
+    list_select_related = ('cancer_site',)
+
+
+@admin.register(Job)
+class JobAdmin(LargeTableAdmin):
+    list_display = ('pk', 'kind', 'dicom_study', 'status', 'priority', 'progress', 'attempts', 'message', 'worker', 'heartbeat_at')
+    list_select_related = ('dicom_study__' + SIMULATION_PATIENT,)
+    list_filter = ('status', 'kind')
+    search_fields = ('=dicom_study__study_instance_uid', 'worker')
+    autocomplete_fields = ('dicom_study',)
+    raw_id_fields = ('depends_on',)
@@ -0,0 +1,196 @@
+'''
+Group-wise summaries of dose metrics, structure volumes and radiomic features.
+
+Dashboards read CohortAggregate rows, which hold the count, mean, standard
+deviation, percentiles and a histogram of one measurement of one ROI name
+over a cohort, instead of scanning the measurement tables on each view.
+Cohorts are keyed on the diagnosis (cancer site, pathology, AJCC T/N/M
+stage) and the treatment technique of the booking, at several groupings that
+all include the cancer site.
+
+Aggregates are refreshed per cancer site and measurement source. Storing
+new measurements queues the site and the source they belong to in
+AggregateRefreshQueue, changing a diagnosis or booking queues every source
+of its old and new site, and refresh_aggregates() recomputes only the queued
+pairs. Percentiles and histograms cannot be updated from a delta of the
+values, so a queued pair is recomputed exactly from its measurements.
+'''
+import time
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from app.feature_vectors import feature_matrix
+from app.metrics import timed
+from app.models import (
+    AggregateGroupingChoices,
+    AggregateRefreshQueue,
+    AggregateSourceChoices,
+    CohortAggregate,
+    DICOMStudy,
+    DoseVolumeHistogram,
+    RadiomicFeatureSet,
+    StructureVolume,
+)
+from lookup.models import LookupCancerSite
+
+BOOKING = 'radiotherapy_simulation__radiotherapy_booking__'
+DIAGNOSIS = BOOKING + 'diagnosis__'
+
+# Cohort key fields of CohortAggregate and their path from DICOMStudy.
+COHORT_FIELDS = {
+    'cancer_site_id': DIAGNOSIS + 'cancer_site_id',
+    'cancer_pathology_id': DIAGNOSIS + 'cancer_pathology_id',
+    'ajcc_t_stage_major': DIAGNOSIS + 'ajcc_t_stage_major',
+    'ajcc_n_stage_major': DIAGNOSIS + 'ajcc_n_stage_major',
+    'ajcc_m_stage_major': DIAGNOSIS + 'ajcc_m_stage_major',
+    'radiotherapy_treatment_technique_id': BOOKING + 'radiotherapy_treatment_technique_id',
+}
+
+GROUPINGS = {
+    AggregateGroupingChoices.SITE: ('cancer_site_id',),
+    AggregateGroupingChoices.PATHOLOGY: ('cancer_site_id', 'cancer_pathology_id'),
+    AggregateGroupingChoices.STAGE: ('cancer_site_id', 'ajcc_t_stage_major', 'ajcc_n_stage_major', 'ajcc_m_stage_major'),
+    AggregateGroupingChoices.TECHNIQUE: ('cancer_site_id', 'radiotherapy_treatment_technique_id'),
+    AggregateGroupingChoices.FULL: tuple(COHORT_FIELDS),
+}
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+# The Dx, Dmean/min/max and Vx columns of DoseVolumeHistogram.
+DVH_METRICS = [field.name for field in DoseVolumeHistogram._meta.concrete_fields if field.name.startswith(('d_', 'v_'))]
+
+
+def enqueue_sites(site_ids, sources=AggregateSourceChoices.values):
+    '''
+    Mark the aggregates of the cancer sites computed from the measurement sources as out of date.
+    '''
+    now = timezone.now()
+    AggregateRefreshQueue.objects.bulk_create(
+        [
+            AggregateRefreshQueue(cancer_site_id=site_id, source=source, queued_at=now)
+            for site_id in set(site_ids) if site_id is not None
+            for source in sources
+        ],
+        update_conflicts=True,
+        unique_fields=['cancer_site', 'source'],
+        update_fields=['queued_at'],
+    )
+
+
+def enqueue_studies(study_ids, sources=AggregateSourceChoices.values):
+    '''
+    Mark the aggregates of the cancer sites of the DICOM studies computed from the measurement sources as out of date.
+    '''
+    sites = DICOMStudy.objects.filter(pk__in=study_ids).values_list(COHORT_FIELDS['cancer_site_id'], flat=True).distinct()
+    enqueue_sites(list(sites), sources)
+
+
+def measurements(site_id, sources=AggregateSourceChoices.values):
+    '''
+    Yield (study id, source, ROI name, metric, value) of every measurement of a cancer site from the sources.
+    '''
+    site = {f'dicom_study__{DIAGNOSIS}cancer_site_id': site_id}
+
+    if AggregateSourceChoices.DOSE in sources:
+        rows = DoseVolumeHistogram.objects.filter(**site).values_list('dicom_study_id', 'roi_name', *DVH_METRICS)
+        for study_id, roi_name, *values in rows.iterator(chunk_size=2000):
+            for metric, value in zip(DVH_METRICS, values):
+                yield study_id, AggregateSourceChoices.DOSE, roi_name, metric, value
+
+    if AggregateSourceChoices.VOLUME in sources:
+        rows = StructureVolume.objects.filter(volume__isnull=False, **site).values_list('dicom_study_id', 'roi_name', 'volume')
+        for study_id, roi_name, value in rows.iterator(chunk_size=2000):
+            yield study_id, AggregateSourceChoices.VOLUME, roi_name, 'volume', value
+
+    prefixes = tuple(settings.AGGREGATE_FEATURE_PREFIXES)
+    if AggregateSourceChoices.RADIOMICS not in sources or not prefixes:
+        return
+    matrix = feature_matrix(RadiomicFeatureSet.objects.filter(**site), prefixes=prefixes)
+    for study_id, roi_name, values in zip(matrix.study_ids.tolist(), matrix.roi_names, matrix.values):
+        for column in np.flatnonzero(np.isfinite(values)):
+            yield study_id, AggregateSourceChoices.RADIOMICS, roi_name, matrix.names[column], float(values[column])
+
+
+def summarize(values, bins):
+    '''
+    Return the CohortAggregate statistics of an array of values.
+    '''
+    minimum, maximum = float(values.min()), float(values.max())
+    percentiles = np.percentile(values, PERCENTILES)
+    counts = np.histogram(values, bins=bins, range=(minimum, maximum) if maximum > minimum else (minimum - 0.5, minimum + 0.5))[0]
+    return {
+        'count': len(values),
+        'mean': float(values.mean()),
+        'std': float(values.std()),
+        'minimum': minimum,
+        'maximum': maximum,
+        **{f'p{percent}': float(value) for percent, value in zip(PERCENTILES, percentiles)},
+        'histogram': counts.tolist(),
+    }
+
+
+def site_aggregates(site_id, sources=AggregateSourceChoices.values):
+    '''
+    Compute the CohortAggregate rows of one cancer site from the measurement tables of the sources.
+    '''
+    cohorts = {
+        study_id: dict(zip(COHORT_FIELDS, key))
+        for study_id, *key in DICOMStudy.objects.filter(**{COHORT_FIELDS['cancer_site_id']: site_id}).values_list('pk', *COHORT_FIELDS.values())
+    }
+
+    # Values by full cohort key, merged into the coarser groupings below.
+    values = defaultdict(list)
+    for study_id, source, roi_name, metric, value in measurements(site_id, sources):
+        if value is not None:
+            values[tuple(cohorts[study_id].values()), source, roi_name, metric].append(value)
+
+    objects = []
+    for grouping, fields in GROUPINGS.items():
+        grouped = defaultdict(list)
+        for (key, source, roi_name, metric), items in values.items():
+            cohort = dict(zip(COHORT_FIELDS, key))
+            grouped[tuple(cohort[name] for name in fields), source, roi_name, metric].extend(items)
+        for (key, source, roi_name, metric), items in grouped.items():
+            array = np.asarray(items, dtype=np.float64)
+            array = array[np.isfinite(array)]
+            if not len(array):
+                continue
+            objects.append(CohortAggregate(
+                grouping=grouping,
+                source=source,
+                roi_name=roi_name,
+                metric=metric,
+                **dict(zip(fields, key)),
+                **summarize(array, settings.AGGREGATE_HISTOGRAM_BINS),
+            ))
+    return objects
+
+
+@timed('aggregates')
+def refresh_aggregates(full=False, batch_size=1000):
+    '''
+    Recompute the aggregates of the queued cancer sites and sources, or of every site if full is set.
+
+    Returns (sites, rows, elapsed). Only the CohortAggregate rows of the
+    queued sources of a site are replaced. A pair queued again while it is
+    being recomputed stays in the queue for the next refresh.
+    '''
+    start = time.perf_counter()
+    if full:
+        enqueue_sites(LookupCancerSite.objects.values_list('pk', flat=True))
+    queued = defaultdict(dict)
+    for site_id, source, queued_at in AggregateRefreshQueue.objects.values_list('cancer_site_id', 'source', 'queued_at'):
+        queued[site_id][source] = queued_at
+    rows = 0
+    for site_id, sources in queued.items():
+        objects = site_aggregates(site_id, list(sources))
+        with transaction.atomic():
+            CohortAggregate.objects.filter(cancer_site_id=site_id, source__in=sources).delete()
+            rows += len(CohortAggregate.objects.bulk_create(objects, batch_size=batch_size))
+            for source, queued_at in sources.items():
+                AggregateRefreshQueue.objects.filter(cancer_site_id=site_id, source=source, queued_at=queued_at).delete()
+    return len(queued), rows, time.perf_counter() - start
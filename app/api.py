@@ -0,0 +1,180 @@
+'''
+Asynchronous read-only JSON API for the dashboards.
+
+Dashboards fan out many small concurrent requests. These views are async
+and read through Django's async ORM, so under an ASGI server one worker
+serves many of them at once instead of tying up a thread per request. Pages
+are keyset-paginated and every view runs a fixed number of indexed queries.
+'''
+import math
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required, permission_required
+from django.db.models import F
+from django.http import HttpResponseBadRequest, JsonResponse
+from django.views.decorators.http import require_GET
+
+from app.aggregates import DVH_METRICS
+from app.export import modality_filter
+from app.feature_vectors import DTYPE
+from app.models import DICOMStudy, DoseVolumeHistogram, RadiomicFeatureSchema, RadiomicFeatureSet, StructureVolume
+from app.search import KINDS, search
+from app.summaries import OVERVIEW_LIMIT, aoverview_page
+
+# Largest page of the study list.
+STUDY_LIMIT = 500
+
+# Most search results of each kind.
+SEARCH_LIMIT = 50
+
+PATIENT_UID = 'radiotherapy_simulation__radiotherapy_booking__diagnosis__patient__patient_uid'
+
+
+def page_limit(request, default, maximum):
+    limit = int(request.GET.get('limit', default))
+    if not 0 < limit <= maximum:
+        raise ValueError(f'limit must be between 1 and {maximum}')
+    return limit
+
+
+def next_page(request, **params):
+    query = request.GET.copy()
+    query.update(params)
+    return request.build_absolute_uri(f'{request.path}?{query.urlencode()}')
+
+
+async def study_id(study_instance_uid):
+    return await DICOMStudy.objects.filter(study_instance_uid=study_instance_uid).values_list('pk', flat=True).afirst()
+
+
+def study_not_found(study_instance_uid):
+    return JsonResponse({'error': f'DICOM study {study_instance_uid} does not exist'}, status=404)
+
+
+@require_GET
+@login_required
+@permission_required('app.view_patient', raise_exception=True)
+async def patient_overview(request):
+    '''
+    Return a page of the patient overview as JSON, newest registrations first.
+
+    The page holds `limit` patients (at most app.summaries.OVERVIEW_LIMIT) after
+    the opaque `cursor` returned as `next` by the previous page.
+    '''
+    try:
+        limit = page_limit(request, 50, OVERVIEW_LIMIT)
+        results, cursor = await aoverview_page(request.GET.get('cursor'), limit)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid cursor or limit')
+    return JsonResponse({'results': results, 'next': next_page(request, limit=limit, cursor=cursor) if cursor else None})
+
+
+@require_GET
+@login_required
+@permission_required('app.view_dicomstudy', raise_exception=True)
+async def study_list(request):
+    '''
+    Return a page of DICOM studies as JSON, newest first.
+
+    `patient_uid` and `modality` restrict the studies. The page holds `limit`
+    studies (at most STUDY_LIMIT) with an id below `after`.
+    '''
+    try:
+        limit = page_limit(request, 100, STUDY_LIMIT)
+        after = int(request.GET['after']) if 'after' in request.GET else None
+    except ValueError:
+        return HttpResponseBadRequest('Invalid limit or after')
+    queryset = DICOMStudy.objects.order_by('-pk')
+    if after is not None:
+        queryset = queryset.filter(pk__lt=after)
+    if request.GET.get('patient_uid'):
+        queryset = queryset.filter(**{PATIENT_UID: request.GET['patient_uid']})
+    if request.GET.get('modality'):
+        queryset = queryset.filter(modality_filter([request.GET['modality']]))
+    queryset = queryset.values('id', 'study_instance_uid', 'study_date_time', 'study_modality', 'study_description', patient_uid=F(PATIENT_UID))
+    rows = [row async for row in queryset[:limit + 1]]
+    next_url = next_page(request, after=rows[limit - 1]['id']) if len(rows) > limit else None
+    return JsonResponse({'results': rows[:limit], 'next': next_url})
+
+
+@require_GET
+@login_required
+@permission_required('app.view_patient', raise_exception=True)
+async def registry_search(request):
+    '''
+    Return the patients, diagnoses and DICOM studies matching `q` as JSON, best matches first.
+
+    `kind` (repeatable) restricts the results to some of app.search.KINDS and
+    `limit` (at most SEARCH_LIMIT) bounds the results of each kind.
+    '''
+    kinds = request.GET.getlist('kind')
+    try:
+        limit = page_limit(request, 10, SEARCH_LIMIT)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid limit')
+    if not set(kinds) <= set(KINDS):
+        return HttpResponseBadRequest(f"kind must be one of {', '.join(KINDS)}")
+    query = request.GET.get('q', '')
+    results = await sync_to_async(search)(query, kinds, limit)
+    return JsonResponse({'query': query, **results})
+
+
+@require_GET
+@login_required
+@permission_required('app.view_radiomicfeatureset', raise_exception=True)
+async def study_features(request, study_instance_uid):
+    '''
+    Return the radiomic features and structure volumes of every ROI of a DICOM study.
+
+    `prefix` (repeatable) keeps only the features whose name starts with it.
+    Features that pyradiomics returned as NaN are null.
+    '''
+    pk = await study_id(study_instance_uid)
+    if pk is None:
+        return study_not_found(study_instance_uid)
+    prefixes = tuple(request.GET.getlist('prefix'))
+    feature_sets = RadiomicFeatureSet.objects.filter(dicom_study_id=pk)
+    schemas = RadiomicFeatureSchema.objects.filter(pk__in=feature_sets.values('schema_id')).values_list('pk', 'names')
+    features = feature_sets.order_by('roi_name', 'pk').values(
+        'roi_name', 'roi_number', 'structure_set_uid', 'series_instance_uid', 'parameter_hash', 'schema_id', 'values',
+    )
+    volumes = StructureVolume.objects.filter(dicom_study_id=pk).order_by('roi_name', 'pk').values(
+        'roi_name', 'roi_number', 'structure_set_uid', 'volume', 'slice_count', 'slice_thickness',
+    )
+    names = {schema_id: schema_names async for schema_id, schema_names in schemas}
+    feature_rows = []
+    async for row in features:
+        values = np.frombuffer(bytes(row.pop('values')), dtype=DTYPE).tolist()
+        row['features'] = {
+            name: None if math.isnan(value) else value
+            for name, value in zip(names[row.pop('schema_id')], values) if not prefixes or name.startswith(prefixes)
+        }
+        feature_rows.append(row)
+    return JsonResponse({
+        'study_instance_uid': study_instance_uid,
+        'features': feature_rows,
+        'volumes': [row async for row in volumes],
+    })
+
+
+@require_GET
+@login_required
+@permission_required('app.view_dosevolumehistogram', raise_exception=True)
+async def study_dvhs(request, study_instance_uid):
+    '''
+    Return the DVH metrics of every ROI and dose of a DICOM study. `histogram=1` adds the cumulative histograms.
+    '''
+    pk = await study_id(study_instance_uid)
+    if pk is None:
+        return study_not_found(study_instance_uid)
+    fields = ['roi_name', 'roi_number', 'dose_uid', 'plan_uid', 'structure_set_uid', 'volume', 'bin_width', *DVH_METRICS]
+    with_histogram = request.GET.get('histogram') == '1'
+    if with_histogram:
+        fields.append('histogram')
+    rows = []
+    async for row in DoseVolumeHistogram.objects.filter(dicom_study_id=pk).order_by('roi_name', 'pk').values(*fields):
+        if with_histogram:
+            row['histogram'] = np.frombuffer(bytes(row['histogram']), dtype='<f4').tolist()
+        rows.append(row)
+    return JsonResponse({'study_instance_uid': study_instance_uid, 'dvhs': rows})
@@ -1,6 +1,35 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
 
 
 class AppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app'
+
+    def ready(self):
+        from app import metrics, signals
+        from app.models import Diagnosis, DICOMStudy, Patient, RadiotherapyBooking, RadiotherapySimulation
+
+        # Cohort aggregates are keyed on the diagnosis and the booking technique.
+        # The stored site is read before a save, so moving a row refreshes both sites.
+        pre_save.connect(signals.remember_diagnosis_site, sender=Diagnosis, dispatch_uid='aggregates_diagnosis_pre_save')
+        pre_save.connect(signals.remember_booking_site, sender=RadiotherapyBooking, dispatch_uid='aggregates_booking_pre_save')
+        post_save.connect(signals.queue_diagnosis_aggregates, sender=Diagnosis, dispatch_uid='aggregates_diagnosis_save')
+        post_delete.connect(signals.queue_diagnosis_aggregates, sender=Diagnosis, dispatch_uid='aggregates_diagnosis_delete')
+        post_save.connect(signals.queue_booking_aggregates, sender=RadiotherapyBooking, dispatch_uid='aggregates_booking_save')
+        post_delete.connect(signals.queue_booking_aggregates, sender=RadiotherapyBooking, dispatch_uid='aggregates_booking_delete')
+
+        # Patient summaries count the rows below each patient.
+        post_save.connect(signals.refresh_patient_summary, sender=Patient, dispatch_uid='summary_patient_save')
+        for model, receiver in [
+            (Diagnosis, signals.refresh_diagnosis_summary),
+            (RadiotherapyBooking, signals.refresh_booking_summary),
+            (RadiotherapySimulation, signals.refresh_simulation_summary),
+            (DICOMStudy, signals.refresh_study_summary),
+        ]:
+            post_save.connect(receiver, sender=model, dispatch_uid=f'summary_{model._meta.model_name}_save')
+            post_delete.connect(receiver, sender=model, dispatch_uid=f'summary_{model._meta.model_name}_delete')
+
+        # Queries of sampled requests are counted on every connection.
+        connection_created.connect(metrics.install_query_recorder, dispatch_uid='metrics_query_recorder')
@@ -0,0 +1,234 @@
+'''
+End-to-end benchmarks on a synthetic cohort.
+
+run_benchmark() generates a cohort of the requested size with
+app.synthetic, then times the main paths of the app against it: bulk
+validation of registry records, DICOM ingest, paging through the patient
+overview, the cohort export, radiomic feature extraction and the gamma
+analysis of a dose pair on a 2 mm 3D grid. The result is
+a plain dict written as JSON, so runs of different releases can be compared
+stage by stage with compare().
+
+Benchmarks write to the configured database and are meant to be run
+against an empty one. DICOM files are only written for dicom_studies
+studies, since a million CT series does not fit on a workstation.
+'''
+import datetime
+import json
+import os
+import platform
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+import numpy as np
+from django.db import connection
+
+from app.bulk_import import DiagnosisImporter, PatientImporter
+from app.export import cohort_queryset, export_chunks
+from app.gamma import gamma_index, parse_criteria
+from app.ingest import ingest_directory
+from app.models import DICOMStudy
+from app.summaries import OVERVIEW_LIMIT, overview_page
+from app.synthetic import LOOKUPS, generate_cohort, write_dicom
+from lookup.models import LookupCancerSite, LookupPathology
+
+# Gamma stage: a 20 x 20 x 16 cm dose grid of 2 mm voxels, compared with each criterion.
+GAMMA_SHAPE = (80, 100, 100)
+GAMMA_SPACING = (2.0, 2.0, 2.0)
+GAMMA_CRITERIA = ['3%/2mm', '2%/2mm', '3%/2mm local', '2%/1mm']
+
+SCALES = {
+    '1k': 1000,
+    '100k': 100_000,
+    '1m': 1_000_000,
+}
+
+
+def parse_scale(value):
+    '''
+    Return the number of patients of a scale name of SCALES or a plain number.
+    '''
+    if value.lower() in SCALES:
+        return SCALES[value.lower()]
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'Unknown scale {value!r}; use one of {", ".join(SCALES)} or a number of patients') from None
+
+
+def registry_records(patients, seed):
+    '''
+    Return valid patient and diagnosis records for the bulk importers.
+
+    The patients are new and the diagnoses belong to the generated cohort,
+    on a side the generator does not use, so every record passes validation.
+    '''
+    sites = [code for code, label in LOOKUPS[LookupCancerSite]]
+    pathologies = [code for code, label in LOOKUPS[LookupPathology]]
+    patient_records, diagnosis_records = [], []
+    for number in range(patients):
+        patient_records.append({'patient_uid': f'VAL{seed}-{number:07d}', 'name': f'Validation Patient {number}', 'date_of_birth': '1960-01-01', 'gender': 'F'})
+        diagnosis_records.append({
+            'patient_uid': f'SYN{seed}-{number:07d}', 'cancer_site': sites[number % len(sites)], 'cancer_side': 'BL',
+            'cancer_pathology': pathologies[number % len(pathologies)], 'date_of_diagnosis': '2020-01-01',
+        })
+    return patient_records, diagnosis_records
+
+
+def stage_generate(context):
+    report = generate_cohort(context['patients'], seed=context['seed'], batch_size=context['batch_size'])
+    return {'rows': report.patients, **vars(report)}
+
+
+def stage_validation(context):
+    patients, diagnoses = registry_records(context['patients'], context['seed'])
+    patient_result = PatientImporter(batch_size=context['batch_size'], dry_run=True).run(patients)
+    diagnosis_result = DiagnosisImporter(batch_size=context['batch_size'], dry_run=True).run(diagnoses)
+    return {'rows': patient_result.records + diagnosis_result.records, 'rejected': len(patient_result.errors) + len(diagnosis_result.errors)}
+
+
+def dicom_studies(context):
+    return DICOMStudy.objects.filter(study_modality__startswith='CT').order_by('pk')[:context['dicom_studies']]
+
+
+def stage_dicom(context):
+    studies = DICOMStudy.objects.filter(pk__in=[study.pk for study in dicom_studies(context)])
+    return {'rows': write_dicom(context['dicom_root'], studies, processes=context['processes'])}
+
+
+def stage_ingest(context):
+    report = ingest_directory(context['dicom_root'], processes=context['processes'], batch_size=context['batch_size'])
+    return {'rows': report.files, 'studies': report.studies, 'unmatched': len(report.unmatched)}
+
+
+def stage_overview(context):
+    rows, pages, cursor = 0, 0, None
+    while True:
+        results, cursor = overview_page(cursor, OVERVIEW_LIMIT)
+        rows += len(results)
+        pages += 1
+        if cursor is None:
+            return {'rows': rows, 'pages': pages}
+
+
+def stage_export(context):
+    size = 0
+    for chunk in export_chunks(cohort_queryset(), 'csv'):
+        size += len(chunk)
+    return {'rows': DICOMStudy.objects.count(), 'bytes': size}
+
+
+def stage_features(context):
+    try:
+        from app.features import extract_features
+    except ImportError as error:
+        return {'skipped': f'{error}'}
+    report = extract_features(dicom_studies(context), processes=context['processes'])
+    return {'rows': report.extracted, 'jobs': report.jobs, 'failed': len(report.failed)}
+
+
+def dose_pair(shape, spacing, seed):
+    '''
+    Return a measured and a calculated (z, y, x) dose in Gy: a 60 Gy box with 3 mm penumbrae, and the same box shifted by 1 mm, 1% hotter and noisy.
+    '''
+    rng = np.random.default_rng(seed)
+    axes = [(np.arange(size) - (size - 1) / 2) * step for size, step in zip(shape, spacing)]
+    half = [0.3 * size * step for size, step in zip(shape, spacing)]
+
+    def box(shift, scale):
+        profiles = [1 / (1 + np.exp((np.abs(axis - offset) - extent) / 3)) for axis, offset, extent in zip(axes, shift, half)]
+        return (scale * 60 * profiles[0][:, None, None] * profiles[1][None, :, None] * profiles[2][None, None, :]).astype(np.float32)
+
+    calculated = box((0.6, 0.6, 0.6), 1.01) + rng.normal(0, 0.3, shape).astype(np.float32)
+    return box((0, 0, 0), 1.0), calculated
+
+
+def stage_gamma(context):
+    measured, calculated = dose_pair(GAMMA_SHAPE, GAMMA_SPACING, context['seed'])
+    result = {'rows': 0, 'grid': list(GAMMA_SHAPE), 'criteria': {}}
+    with ProcessPoolExecutor(max_workers=context['processes']) as executor:
+        for text in GAMMA_CRITERIA:
+            start = time.perf_counter()
+            gamma = gamma_index(measured, calculated, GAMMA_SPACING, parse_criteria(text), executor=executor)
+            seconds = time.perf_counter() - start
+            result['rows'] += gamma.points
+            result['criteria'][text] = {
+                'points': gamma.points, 'pass_rate': round(gamma.pass_rate, 2),
+                'seconds': round(seconds, 3), 'points_per_second': round(gamma.points / seconds, 1),
+            }
+    return result
+
+
+# Stages in the order they run. dicom writes the files that ingest reads and features extracts from.
+STAGES = {
+    'generate': stage_generate,
+    'validation': stage_validation,
+    'dicom': stage_dicom,
+    'ingest': stage_ingest,
+    'overview': stage_overview,
+    'export': stage_export,
+    'features': stage_features,
+    'gamma': stage_gamma,
+}
+
+
+def run_benchmark(patients, seed=0, stages=None, dicom_studies=20, dicom_root=None, processes=None, batch_size=1000, label=''):
+    '''
+    Run the benchmark stages in order and return the results as a JSON-serializable dict.
+
+    Each stage records its wall time in seconds, the rows it handled and its
+    rate in rows per second. A stage that cannot run here records why it was
+    skipped instead.
+    '''
+    stages = [stage for stage in STAGES if not stages or stage in stages]
+    results = {
+        'label': label,
+        'patients': patients,
+        'seed': seed,
+        'started_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'cpus': os.cpu_count(),
+        },
+        'stages': {},
+    }
+    with tempfile.TemporaryDirectory(prefix='quantrad-benchmark-') as scratch:
+        context = {
+            'patients': patients,
+            'seed': seed,
+            'dicom_studies': dicom_studies,
+            'dicom_root': dicom_root or scratch,
+            'processes': processes,
+            'batch_size': batch_size,
+        }
+        for stage in stages:
+            start = time.perf_counter()
+            result = STAGES[stage](context)
+            seconds = time.perf_counter() - start
+            if 'skipped' not in result:
+                result['seconds'] = round(seconds, 3)
+                result['rows_per_second'] = round(result['rows'] / seconds, 1) if seconds else None
+            results['stages'][stage] = result
+    return results
+
+
+def compare(current, baseline):
+    '''
+    Return (stage, baseline seconds, current seconds, ratio) for the stages timed in both results.
+    '''
+    rows = []
+    for stage, result in current['stages'].items():
+        before = baseline['stages'].get(stage, {}).get('seconds')
+        after = result.get('seconds')
+        if before and after is not None:
+            rows.append((stage, before, after, after / before))
+    return rows
+
+
+def write_results(results, path):
+    with open(path, 'w') as handle:
+        json.dump(results, handle, indent=2)
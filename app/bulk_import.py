@@ -0,0 +1,346 @@
+'''
+Batch validation and bulk import of registry records.
+
+The model save() methods call full_clean() for every row, which costs several
+queries per row through foreign key validation, unique checks and parent
+lookups in clean(). The importers below resolve parents once per batch and
+lookup codes against the lookup cache, run the same field validation and
+clean() rules against the prefetched objects without touching the database,
+check uniqueness for the whole batch at once and write the valid rows with
+bulk_create. bulk_create sends no signals, so each batch refreshes the
+summaries of its patients itself.
+'''
+import csv
+import json
+from dataclasses import dataclass, field
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from app.models import Diagnosis, Patient, RadiotherapyBooking, RadiotherapySimulation
+from app.summaries import PATIENT_PATHS, schedule_patient_summaries
+from lookup.cache import lookup_cache
+from lookup.models import (
+    LookupBillingCode,
+    LookupCancerSite,
+    LookupPathology,
+    LookupRadiotherapyTreatmentTechnique,
+    LookupSystemicTherapyType,
+)
+
+
+@dataclass
+class ImportResult:
+    '''
+    Outcome of an import. errors holds (record number, {field: [messages]}) for every rejected record.
+    '''
+    records: int = 0
+    created: int = 0
+    errors: list = field(default_factory=list)
+
+
+def read_records(path, format=None):
+    '''
+    Yield records as dicts from a CSV, JSON (array of objects) or JSON Lines file.
+    '''
+    format = format or path.rsplit('.', 1)[-1].lower()
+    with open(path, newline='', encoding='utf-8') as handle:
+        if format == 'csv':
+            yield from csv.DictReader(handle)
+        elif format == 'json':
+            yield from json.load(handle)
+        elif format == 'jsonl':
+            for line in handle:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            raise ValueError(f'Unsupported import format: {format}')
+
+
+def split_codes(value):
+    '''
+    Return a list of codes from a list or a string separated by semicolons.
+    '''
+    if value in (None, ''):
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(code) for code in value]
+    return [code.strip() for code in str(value).split(';') if code.strip()]
+
+
+class ModelImporter:
+    '''
+    Base class for the bulk importers.
+
+    Subclasses declare the plain fields read from a record, the lookup foreign
+    keys (record key -> lookup model) and how parents are prefetched and
+    attached to each instance.
+    '''
+    model = None
+    fields = ()
+    lookups = {}
+
+    def __init__(self, batch_size=1000, dry_run=False):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+
+    def run(self, records):
+        # Unique keys accepted by earlier batches, which a dry run has not written to the database.
+        self.taken = set()
+        result = ImportResult()
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) == self.batch_size:
+                self.import_batch(batch, result)
+                batch = []
+        if batch:
+            self.import_batch(batch, result)
+        result.errors.sort(key=lambda error: error[0])
+        return result
+
+    def import_batch(self, records, result):
+        offset = result.records
+        result.records += len(records)
+        context = self.prefetch(records)
+        context['codes'] = {key: lookup_cache.labels(model) for key, model in self.lookups.items()}
+
+        valid = []
+        for number, record in enumerate(records, start=offset + 1):
+            errors = {}
+            instance = self.model()
+            self.convert(instance, record, errors)
+            self.resolve_lookups(instance, record, context, errors)
+            if self.attach_parents(instance, record, context, errors):
+                self.full_clean(instance, errors)
+            if errors:
+                result.errors.append((number, errors))
+            else:
+                valid.append((number, instance, record))
+
+        valid = self.check_batch(valid, context, result)
+        if not self.dry_run:
+            with transaction.atomic():
+                instances = [instance for number, instance, record in valid]
+                self.write(instances, [record for number, instance, record in valid])
+                schedule_patient_summaries(
+                    self.model.objects.filter(pk__in=[instance.pk for instance in instances]).values_list(PATIENT_PATHS[self.model], flat=True)
+                )
+        result.created += len(valid)
+
+    def convert(self, instance, record, errors):
+        '''
+        Convert record values with each field's to_python(). Empty values leave the model default in place.
+        '''
+        for name in self.fields:
+            value = record.get(name)
+            if value is None or value == '':
+                continue
+            model_field = self.model._meta.get_field(name)
+            try:
+                setattr(instance, model_field.attname, model_field.to_python(value))
+            except ValidationError as error:
+                errors.setdefault(name, []).extend(error.messages)
+
+    def resolve_lookups(self, instance, record, context, errors):
+        for key, model in self.lookups.items():
+            code = record.get(key)
+            if code in (None, ''):
+                errors.setdefault(key, []).append('This field cannot be blank.')
+            elif str(code) not in context['codes'][key]:
+                errors.setdefault(key, []).append(f"{model._meta.verbose_name} '{code}' does not exist.")
+            else:
+                setattr(instance, f'{key}_id', str(code))
+
+    def full_clean(self, instance, errors):
+        '''
+        Run the model's field validation and clean() rules.
+
+        Foreign keys, unique checks and constraints are validated for the whole
+        batch instead, and parents are already attached, so this does not query.
+        '''
+        exclude = {f.name for f in self.model._meta.concrete_fields if f.is_relation} | set(errors)
+        try:
+            instance.full_clean(exclude=exclude, validate_unique=False, validate_constraints=False)
+        except ValidationError as error:
+            for name, messages in error.message_dict.items():
+                errors.setdefault(name, []).extend(messages)
+
+    def prefetch(self, records):
+        return {}
+
+    def attach_parents(self, instance, record, context, errors):
+        return True
+
+    def check_batch(self, valid, context, result):
+        return valid
+
+    def write(self, instances, records):
+        self.model.objects.bulk_create(instances, batch_size=self.batch_size)
+
+
+class PatientImporter(ModelImporter):
+    model = Patient
+    fields = ('patient_uid', 'name', 'date_of_birth', 'gender')
+
+    def check_batch(self, valid, context, result):
+        uids = [instance.patient_uid for number, instance, record in valid]
+        taken = self.taken
+        taken.update(Patient.objects.filter(patient_uid__in=uids).values_list('patient_uid', flat=True))
+        accepted = []
+        for number, instance, record in valid:
+            if instance.patient_uid in taken:
+                result.errors.append((number, {'patient_uid': ['Patient with this Patient Hospital Unique ID already exists.']}))
+                continue
+            taken.add(instance.patient_uid)
+            accepted.append((number, instance, record))
+        return accepted
+
+
+class DiagnosisImporter(ModelImporter):
+    model = Diagnosis
+    fields = (
+        'cancer_side', 'date_of_diagnosis',
+        'ajcc_t_stage_prefix', 'ajcc_t_stage_major', 'ajcc_t_stage_suffix',
+        'ajcc_n_stage_prefix', 'ajcc_n_stage_major', 'ajcc_n_stage_suffix',
+        'ajcc_m_stage_prefix', 'ajcc_m_stage_major', 'ajcc_m_stage_suffix',
+        'overall_stage',
+    )
+    lookups = {
+        'cancer_site': LookupCancerSite,
+        'cancer_pathology': LookupPathology,
+    }
+
+    def prefetch(self, records):
+        uids = {record.get('patient_uid') for record in records}
+        patients = Patient.objects.filter(patient_uid__in=uids).only('pk', 'patient_uid', 'date_of_birth')
+        patients = {patient.patient_uid: patient for patient in patients}
+        existing = set(
+            Diagnosis.objects.filter(patient__in=patients.values())
+            .values_list('patient_id', 'cancer_site_id', 'cancer_side', 'cancer_pathology_id')
+        )
+        return {'patients': patients, 'existing': existing}
+
+    def attach_parents(self, instance, record, context, errors):
+        patient = context['patients'].get(record.get('patient_uid'))
+        if patient is None:
+            errors.setdefault('patient', []).append(f"Patient '{record.get('patient_uid')}' does not exist.")
+            return False
+        instance.patient = patient
+        return True
+
+    def check_batch(self, valid, context, result):
+        taken = self.taken
+        taken.update(context['existing'])
+        accepted = []
+        for number, instance, record in valid:
+            key = (instance.patient_id, instance.cancer_site_id, instance.cancer_side, instance.cancer_pathology_id)
+            if key in taken:
+                result.errors.append((number, {'__all__': ['Diagnosis with this Patient, Primary Site of the Cancer, Side of the Primary Cancer and Pathology of the Cancer already exists.']}))
+                continue
+            taken.add(key)
+            accepted.append((number, instance, record))
+        return accepted
+
+
+class RadiotherapyBookingImporter(ModelImporter):
+    '''
+    Bookings identify their diagnosis by patient_uid, cancer_site, cancer_side
+    and cancer_pathology, and list systemic therapy codes in systemic_therapy_type.
+    '''
+    model = RadiotherapyBooking
+    fields = (
+        'radiotherapy_treatment_intent', 'radiotherapy_treatment_sequence', 'radiotherapy_modality',
+        'concurrent_systemic_therapy', 'proposed_planning_image_date', 'proposed_treatment_start_date',
+        'planned_total_dose', 'planned_total_number_of_fractions',
+        'planned_number_of_fractions_per_day', 'planned_number_of_fractions_per_week',
+    )
+    lookups = {
+        'radiotherapy_treatment_technique': LookupRadiotherapyTreatmentTechnique,
+        'radiotherapy_billing_category': LookupBillingCode,
+    }
+
+    @staticmethod
+    def diagnosis_key(record):
+        return (
+            str(record.get('patient_uid', '')),
+            str(record.get('cancer_site', '')),
+            str(record.get('cancer_side', '')),
+            str(record.get('cancer_pathology', '')),
+        )
+
+    def prefetch(self, records):
+        uids = {record.get('patient_uid') for record in records}
+        diagnoses = Diagnosis.objects.filter(patient__patient_uid__in=uids).select_related('patient').only(
+            'pk', 'cancer_site_id', 'cancer_side', 'cancer_pathology_id', 'date_of_diagnosis', 'patient__patient_uid'
+        )
+        diagnoses = {
+            (diagnosis.patient.patient_uid, diagnosis.cancer_site_id, diagnosis.cancer_side, diagnosis.cancer_pathology_id): diagnosis
+            for diagnosis in diagnoses
+        }
+        return {'diagnoses': diagnoses, 'therapy_types': lookup_cache.labels(LookupSystemicTherapyType)}
+
+    def attach_parents(self, instance, record, context, errors):
+        therapy_types = split_codes(record.get('systemic_therapy_type'))
+        unknown = [code for code in therapy_types if code not in context['therapy_types']]
+        if unknown:
+            errors.setdefault('systemic_therapy_type', []).append(f"Systemic Therapy Type '{', '.join(unknown)}' does not exist.")
+        if therapy_types and not instance.concurrent_systemic_therapy:
+            errors.setdefault('systemic_therapy_type', []).append(
+                'Systemic Therapy Type can only be selected when Concurrent Systemic Therapy is planned.'
+            )
+
+        diagnosis = context['diagnoses'].get(self.diagnosis_key(record))
+        if diagnosis is None:
+            errors.setdefault('diagnosis', []).append('No diagnosis matches patient_uid, cancer_site, cancer_side and cancer_pathology.')
+            return False
+        instance.diagnosis = diagnosis
+        return True
+
+    def write(self, instances, records):
+        bookings = RadiotherapyBooking.objects.bulk_create(instances, batch_size=self.batch_size)
+        through = RadiotherapyBooking.systemic_therapy_type.through
+        through.objects.bulk_create(
+            [
+                through(radiotherapybooking_id=booking.pk, lookupsystemictherapytype_id=code)
+                for booking, record in zip(bookings, records)
+                for code in dict.fromkeys(split_codes(record.get('systemic_therapy_type')))
+            ],
+            batch_size=self.batch_size,
+        )
+
+
+class RadiotherapySimulationImporter(ModelImporter):
+    '''
+    Simulations identify their booking by its primary key in radiotherapy_booking.
+    '''
+    model = RadiotherapySimulation
+    fields = ('simulation_appointment_type', 'date_of_simulation', 'simulation_done', 'reason_why_simulation_not_done', 'image_sequences')
+
+    def prefetch(self, records):
+        ids = set()
+        for record in records:
+            try:
+                ids.add(int(record.get('radiotherapy_booking')))
+            except (TypeError, ValueError):
+                pass
+        return {'bookings': set(RadiotherapyBooking.objects.filter(pk__in=ids).values_list('pk', flat=True))}
+
+    def attach_parents(self, instance, record, context, errors):
+        try:
+            booking_id = int(record.get('radiotherapy_booking'))
+        except (TypeError, ValueError):
+            booking_id = None
+        if booking_id not in context['bookings']:
+            errors.setdefault('radiotherapy_booking', []).append(f"Radiotherapy Booking '{record.get('radiotherapy_booking')}' does not exist.")
+            return False
+        instance.radiotherapy_booking_id = booking_id
+        return True
+
+
+IMPORTERS = {
+    'patients': PatientImporter,
+    'diagnoses': DiagnosisImporter,
+    'bookings': RadiotherapyBookingImporter,
+    'simulations': RadiotherapySimulationImporter,
+}
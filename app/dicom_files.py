@@ -0,0 +1,58 @@
+'''
+Lookup of ingested DICOM objects through the object index.
+
+Each SOP instance is indexed once, so copies of an object that was ingested
+several times are returned once. Stages that process objects one by one mark
+the payloads they processed with mark_processed() and pass their stage name
+as unprocessed to skip them in later runs. Marks are kept per content hash, so
+a changed object is processed again.
+'''
+from django.db.models import Exists, OuterRef
+
+from app.ingest import chunked
+from app.models import DICOMObject, ProcessedObject
+
+
+def study_files(study_uids, modality, unprocessed=None):
+    '''
+    Return {study_instance_uid: [path, ...]} of the objects of one modality in the studies.
+
+    With unprocessed set to a stage name, objects that stage already processed are left out.
+    '''
+    files = {}
+    rows = DICOMObject.objects.filter(study_instance_uid__in=study_uids, modality=modality)
+    if unprocessed:
+        rows = rows.exclude(Exists(ProcessedObject.objects.filter(content_hash=OuterRef('content_hash'), stage=unprocessed)))
+    for study_instance_uid, path in rows.order_by('path').values_list('study_instance_uid', 'path'):
+        files.setdefault(study_instance_uid, []).append(path)
+    return files
+
+
+def series_files(series_uids):
+    '''
+    Return {series_instance_uid: [path, ...]} of the objects of the series.
+    '''
+    files = {}
+    rows = DICOMObject.objects.filter(series_instance_uid__in=series_uids).values_list('series_instance_uid', 'path')
+    for series_instance_uid, path in rows.order_by('path'):
+        files.setdefault(series_instance_uid, []).append(path)
+    return files
+
+
+def instance_files(sop_uids):
+    '''
+    Return {sop_instance_uid: path} of the objects.
+    '''
+    return dict(DICOMObject.objects.filter(sop_instance_uid__in=sop_uids).values_list('sop_instance_uid', 'path'))
+
+
+def mark_processed(stage, paths, batch_size=1000):
+    '''
+    Record that stage processed the objects at paths, as returned by study_files().
+    '''
+    for chunk in chunked(paths, batch_size):
+        hashes = set(DICOMObject.objects.filter(path__in=chunk).values_list('content_hash', flat=True))
+        ProcessedObject.objects.bulk_create(
+            [ProcessedObject(content_hash=content_hash, stage=stage) for content_hash in hashes],
+            ignore_conflicts=True,
+        )
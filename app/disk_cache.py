@@ -0,0 +1,161 @@
+'''
+Size-bounded on-disk cache, evicted least recently used first.
+
+An entry is the set of files named <key>.<suffix> in the cache directory. Arrays
+are stored as .npy files and opened memory-mapped, so cached data is shared
+through the page cache instead of being copied into every process. Use of an
+entry updates the modification time of its files, and eviction removes whole
+entries, oldest first, until the directory fits in max_bytes. The directory
+itself is the shared state, so several processes can use the same cache.
+'''
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+
+class DiskCache:
+    '''
+    Directory of cache entries bounded to max_bytes.
+    '''
+
+    def __init__(self, directory, max_bytes, lock_timeout=600):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock_timeout = lock_timeout
+
+    def path(self, key, suffix):
+        return self.directory / key[:2] / f'{key}.{suffix}'
+
+    def exists(self, key, suffix):
+        return self.path(key, suffix).exists()
+
+    def touch(self, key, *suffixes):
+        '''
+        Mark an entry as recently used.
+        '''
+        for suffix in suffixes:
+            try:
+                os.utime(self.path(key, suffix))
+            except FileNotFoundError:
+                pass
+
+    def _write(self, key, suffix, write):
+        path = self.path(key, suffix)
+        path.parent.mkdir(exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+        try:
+            with os.fdopen(handle, 'wb') as stream:
+                write(stream)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        return path
+
+    def write_bytes(self, key, suffix, data):
+        return self._write(key, suffix, lambda stream: stream.write(data))
+
+    def read_bytes(self, key, suffix):
+        path = self.path(key, suffix)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        self.touch(key, suffix)
+        return data
+
+    def write_json(self, key, suffix, data):
+        return self.write_bytes(key, suffix, json.dumps(data).encode())
+
+    def read_json(self, key, suffix):
+        data = self.read_bytes(key, suffix)
+        return None if data is None else json.loads(data)
+
+    def save_array(self, key, suffix, array):
+        return self._write(key, suffix, lambda stream: np.save(stream, np.ascontiguousarray(array), allow_pickle=False))
+
+    def load_array(self, key, suffix):
+        '''
+        Open a stored array memory-mapped and read-only, or return None if it is not cached.
+        '''
+        try:
+            array = np.load(self.path(key, suffix), mmap_mode='r', allow_pickle=False)
+        except FileNotFoundError:
+            return None
+        self.touch(key, suffix)
+        return array
+
+    @contextmanager
+    def lock(self, key):
+        '''
+        Hold an exclusive lock on an entry while it is computed.
+
+        Callers should check again whether the entry exists once the lock is
+        held, since another process may have completed it in the meantime.
+        Locks older than lock_timeout are treated as left behind by a crashed
+        process.
+        '''
+        path = self.path(key, 'lock')
+        path.parent.mkdir(exist_ok=True)
+        while True:
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - path.stat().st_mtime > self.lock_timeout:
+                        path.unlink(missing_ok=True)
+                except FileNotFoundError:
+                    pass
+                time.sleep(0.1)
+        try:
+            yield
+        finally:
+            path.unlink(missing_ok=True)
+
+    def entries(self):
+        '''
+        Return {key: (bytes, last used)} for every entry in the cache.
+        '''
+        entries = {}
+        for subdirectory in self.directory.iterdir():
+            if not subdirectory.is_dir():
+                continue
+            for path in subdirectory.iterdir():
+                if path.name.startswith('.tmp-') or path.suffix == '.lock':
+                    continue
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                key = path.name.split('.', 1)[0]
+                size, used = entries.get(key, (0, 0.0))
+                entries[key] = (size + stat.st_size, max(used, stat.st_mtime))
+        return entries
+
+    def remove(self, key):
+        directory = self.path(key, '').parent
+        for path in directory.glob(f'{key}.*'):
+            if path.suffix != '.lock':
+                path.unlink(missing_ok=True)
+
+    def evict(self, keep=()):
+        '''
+        Remove least recently used entries until the cache fits in max_bytes. Keys in keep are never removed.
+        '''
+        entries = self.entries()
+        total = sum(size for size, used in entries.values())
+        for key, (size, used) in sorted(entries.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            if key in keep:
+                continue
+            self.remove(key)
+            total -= size
+        return total
@@ -0,0 +1,340 @@
+'''
+Dose volume histograms of the ROIs of RT Structure Sets from RTDOSE grids.
+
+The dose grid is resampled onto the ROI masks of the mask store, which lie
+on the grid of the planning image: the dose at the centre of every mask voxel
+is interpolated trilinearly, and the doses are binned with np.bincount
+weighted by the voxel volume. ROIs covering few voxels are rasterized again
+on an in-plane supersampled grid so small structures get a smooth histogram.
+
+Each histogram is stored as a compact float32 array of cumulative volumes on
+fixed dose bins, and the usual Dx/Vx/Dmean/Dmax metrics are stored in indexed
+columns so cohort queries never read dose files again.
+'''
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import numpy as np
+import pydicom
+from django.conf import settings
+
+from app.aggregates import enqueue_studies
+from app.dicom_files import series_files, study_files
+from app.masks import MaskStore, rasterize
+from app.metrics import timed
+from app.models import AggregateSourceChoices, DoseVolumeHistogram
+from app.rtstruct import load_structure_set, read_series_geometry, referenced_series_uid
+
+# Dose summations a DVH is computed for; per beam and per control point doses are skipped.
+SUMMATION_TYPES = {'', 'PLAN', 'MULTI_PLAN'}
+
+# Percent of the ROI volume of the stored Dx metrics and dose in Gy of the Vx metrics.
+DOSE_METRICS = (2, 50, 95, 98)
+VOLUME_METRICS = (5, 10, 20, 30, 40, 50)
+
+# Internal histogram bins per stored bin, used for the metrics.
+FINE_BINS = 10
+
+
+@dataclass
+class DoseGrid:
+    '''
+    An RTDOSE distribution in Gy. dose is a (z, y, x) array and offsets the
+    positions of its planes along the normal, relative to origin.
+    '''
+    sop_instance_uid: str
+    plan_uid: str
+    dose: np.ndarray
+    origin: np.ndarray
+    row_direction: np.ndarray
+    column_direction: np.ndarray
+    normal: np.ndarray
+    spacing: tuple
+    offsets: np.ndarray
+
+    def sample(self, points):
+        '''
+        Interpolate the dose trilinearly at (N, 3) patient coordinates. Points beyond the grid get 0 Gy.
+        '''
+        relative = np.asarray(points, dtype=np.float64) - self.origin
+        depth, height, width = self.dose.shape
+        x = relative @ self.row_direction / self.spacing[0]
+        y = relative @ self.column_direction / self.spacing[1]
+        position = relative @ self.normal
+        if depth > 1:
+            z = np.interp(position, self.offsets, np.arange(depth))
+            beyond = (position < self.offsets[0] - 0.5 * (self.offsets[1] - self.offsets[0])) | (position > self.offsets[-1] + 0.5 * (self.offsets[-1] - self.offsets[-2]))
+        else:
+            z = np.zeros(len(position))
+            beyond = np.zeros(len(position), dtype=bool)
+        beyond |= (x < -0.5) | (x > width - 0.5) | (y < -0.5) | (y > height - 0.5)
+
+        index = np.column_stack([np.clip(z, 0, depth - 1), np.clip(y, 0, height - 1), np.clip(x, 0, width - 1)])
+        lower = np.minimum(np.floor(index).astype(np.int64), np.array(self.dose.shape) - 1)
+        upper = np.minimum(lower + 1, np.array(self.dose.shape) - 1)
+        fraction = index - lower
+        dose = np.zeros(len(index))
+        for corner in range(8):
+            pick = [(corner >> axis) & 1 for axis in range(3)]
+            z_index, y_index, x_index = (np.where(pick[axis], upper[:, axis], lower[:, axis]) for axis in range(3))
+            weight = np.prod([np.where(pick[axis], fraction[:, axis], 1 - fraction[:, axis]) for axis in range(3)], axis=0)
+            dose += weight * self.dose[z_index, y_index, x_index]
+        dose[beyond] = 0
+        return dose
+
+
+def read_dose(path):
+    dataset = pydicom.dcmread(path)
+    orientation = np.asarray(dataset.ImageOrientationPatient, dtype=np.float64)
+    normal = np.cross(orientation[:3], orientation[3:])
+    origin = np.asarray(dataset.ImagePositionPatient, dtype=np.float64)
+    offsets = np.asarray(dataset.get('GridFrameOffsetVector') or [0.0], dtype=np.float64)
+    if offsets[0] != 0:
+        # Offsets are absolute plane positions instead of relative to the first plane.
+        offsets = offsets - origin @ normal
+    dose = dataset.pixel_array.astype(np.float32) * np.float32(dataset.DoseGridScaling)
+    if dose.ndim == 2:
+        dose = dose[np.newaxis]
+    if len(offsets) > 1 and offsets[-1] < offsets[0]:
+        offsets, dose = offsets[::-1], dose[::-1]
+    row_spacing, column_spacing = (float(value) for value in dataset.PixelSpacing)
+    plans = dataset.get('ReferencedRTPlanSequence') or []
+    return DoseGrid(
+        sop_instance_uid=str(dataset.SOPInstanceUID),
+        plan_uid=str(plans[0].ReferencedSOPInstanceUID) if plans else '',
+        dose=np.ascontiguousarray(dose),
+        origin=origin,
+        row_direction=orientation[:3],
+        column_direction=orientation[3:],
+        normal=normal,
+        spacing=(column_spacing, row_spacing),
+        offsets=offsets,
+    )
+
+
+@dataclass
+class Histogram:
+    '''
+    Accumulates a dose histogram on fine bins of width resolution from weighted dose samples.
+    '''
+    resolution: float
+    counts: np.ndarray = field(default_factory=lambda: np.zeros(0))
+    volume: float = 0.0
+    integral: float = 0.0
+    minimum: float = np.inf
+    maximum: float = 0.0
+
+    def add(self, dose, weight):
+        if not len(dose):
+            return
+        counts = np.bincount((dose / self.resolution).astype(np.int64), minlength=len(self.counts)) * weight
+        counts[:len(self.counts)] += self.counts
+        self.counts = counts
+        self.volume += weight * len(dose)
+        self.integral += weight * float(dose.sum())
+        self.minimum = min(self.minimum, float(dose.min()))
+        self.maximum = max(self.maximum, float(dose.max()))
+
+    def cumulative(self):
+        '''
+        Return the volume receiving at least i × resolution for every fine bin.
+        '''
+        return self.volume - np.concatenate(([0.0], np.cumsum(self.counts)[:-1]))
+
+    def metrics(self):
+        cumulative = self.cumulative()
+        metrics = {'d_min': self.minimum, 'd_mean': self.integral / self.volume, 'd_max': self.maximum}
+        for percent in DOSE_METRICS:
+            covered = np.count_nonzero(cumulative >= self.volume * percent / 100 * (1 - 1e-9))
+            metrics[f'd_{percent}'] = max(covered - 1, 0) * self.resolution
+        for dose in VOLUME_METRICS:
+            index = int(round(dose / self.resolution))
+            metrics[f'v_{dose}'] = 100 * float(cumulative[index]) / self.volume if index < len(cumulative) else 0.0
+        return metrics
+
+
+def mask_doses(mask, offset, geometry, dose, chunk_voxels=1 << 20):
+    '''
+    Yield the dose at the centres of the voxels of a cropped mask, a slab of slices at a time.
+    '''
+    depth, height, width = mask.shape
+    step = max(1, chunk_voxels // max(height * width, 1))
+    for start in range(0, depth, step):
+        z, y, x = np.nonzero(mask[start:start + step])
+        index = np.column_stack([x + offset[2], y + offset[1], z + start + offset[0]])
+        yield dose.sample(geometry.to_points(index))
+
+
+def roi_histogram(structure_set_uid, roi, geometry, dose, store, bin_width):
+    '''
+    Return the Histogram of the dose in one ROI, or None if the ROI is not on the image.
+    '''
+    stored = store.get_or_rasterize(structure_set_uid, roi.number, roi.contours, geometry)
+    if stored is None:
+        return None
+    mask, offset = stored.cropped(), stored.offset
+    if stored.voxels < settings.DVH_SUPERSAMPLE_VOXELS:
+        geometry = geometry.supersampled(settings.DVH_SUPERSAMPLING)
+        mask, offset = rasterize(roi.contours, geometry)
+        if mask is None:
+            return None
+    histogram = Histogram(bin_width / FINE_BINS)
+    weight = float(np.prod(geometry.spacing)) / 1000
+    for doses in mask_doses(mask, offset, geometry, dose):
+        histogram.add(doses, weight)
+    return histogram if histogram.volume else None
+
+
+@dataclass
+class DvhJob:
+    '''
+    One dose x structure set pair. Carries only plain data so it can be sent to pool workers.
+    '''
+    dicom_study_id: int
+    dose_path: str
+    structure_set_path: str
+    image_paths: tuple
+
+
+def compute_job(job):
+    '''
+    Compute the DVHs of every ROI of the structure set of a job. Runs inside pool workers.
+
+    Returns (rows, error), rows being field name to value maps of DoseVolumeHistogram.
+    '''
+    try:
+        structure_set = load_structure_set(job.structure_set_path)
+        if structure_set is None:
+            raise ValueError(f'Cannot read {job.structure_set_path}')
+        dose = read_dose(job.dose_path)
+        geometry = read_series_geometry(job.image_paths)
+        store = MaskStore()
+        rows = []
+        for roi in structure_set.rois:
+            histogram = roi_histogram(structure_set.sop_instance_uid, roi, geometry, dose, store, settings.DVH_BIN_WIDTH)
+            if histogram is None:
+                continue
+            rows.append({
+                'dicom_study_id': job.dicom_study_id,
+                'dose_uid': dose.sop_instance_uid,
+                'plan_uid': dose.plan_uid,
+                'structure_set_uid': structure_set.sop_instance_uid,
+                'roi_number': roi.number,
+                'roi_name': roi.name,
+                'volume': histogram.volume,
+                'bin_width': settings.DVH_BIN_WIDTH,
+                'histogram': histogram.cumulative()[::FINE_BINS].astype('<f4').tobytes(),
+                **histogram.metrics(),
+            })
+    except Exception as error:
+        return [], f'{type(error).__name__}: {error}'
+    return rows, None
+
+
+REFERENCE_TAGS = [
+    'Modality', 'SOPInstanceUID', 'DoseSummationType',
+    'ReferencedRTPlanSequence', 'ReferencedStructureSetSequence', 'ReferencedFrameOfReferenceSequence',
+]
+
+
+def read_references(path):
+    '''
+    Return (SOP Instance UID, summation type, referenced UID) of an RTDOSE, RTPLAN or RTSTRUCT file.
+
+    The referenced UID is the plan of a dose, the structure set of a plan
+    and the image series of a structure set. Contours and beams are not read.
+    '''
+    try:
+        dataset = pydicom.dcmread(path, stop_before_pixels=True, specific_tags=REFERENCE_TAGS)
+        if dataset.get('Modality') == 'RTSTRUCT':
+            referenced = referenced_series_uid(dataset)
+        else:
+            references = dataset.get('ReferencedRTPlanSequence') or dataset.get('ReferencedStructureSetSequence') or []
+            referenced = str(references[0].ReferencedSOPInstanceUID) if references else ''
+        return str(dataset.SOPInstanceUID), str(dataset.get('DoseSummationType', '')), referenced
+    except Exception:
+        return None
+
+
+def build_jobs(studies, executor, recompute=False):
+    '''
+    Pair every plan dose of the studies with its structure set and image series.
+
+    A dose is paired through its plan with the structure set the plan
+    references, or with the only structure set of its study. Pairs already
+    stored are skipped unless recompute is set.
+    '''
+    study_ids = {study.study_instance_uid: study.pk for study in studies}
+    files = {modality: study_files(study_ids, modality) for modality in ('RTDOSE', 'RTPLAN', 'RTSTRUCT')}
+    paths = [path for study_paths in files.values() for paths in study_paths.values() for path in paths]
+    headers = {path: header for path, header in zip(paths, executor.map(read_references, paths, chunksize=16)) if header}
+
+    plan_structure_sets = {headers[path][0]: headers[path][2] for paths in files['RTPLAN'].values() for path in paths if path in headers}
+    structure_sets = {headers[path][0]: (path, headers[path][2]) for paths in files['RTSTRUCT'].values() for path in paths if path in headers}
+    images = series_files({series_instance_uid for path, series_instance_uid in structure_sets.values()})
+
+    pairs = []
+    for study_instance_uid, dose_paths in files['RTDOSE'].items():
+        study_structure_sets = [headers[path][0] for path in files['RTSTRUCT'].get(study_instance_uid, []) if path in headers]
+        for path in dose_paths:
+            if path not in headers or headers[path][1] not in SUMMATION_TYPES:
+                continue
+            dose_uid, summation, plan_uid = headers[path]
+            structure_set_uid = plan_structure_sets.get(plan_uid)
+            if structure_set_uid not in structure_sets and len(study_structure_sets) == 1:
+                structure_set_uid = study_structure_sets[0]
+            if structure_set_uid in structure_sets:
+                pairs.append((study_instance_uid, path, dose_uid, structure_set_uid))
+
+    stored = set()
+    if not recompute:
+        stored = set(DoseVolumeHistogram.objects.filter(dose_uid__in=[pair[2] for pair in pairs]).values_list('dose_uid', 'structure_set_uid').distinct())
+    jobs = []
+    for study_instance_uid, dose_path, dose_uid, structure_set_uid in pairs:
+        structure_set_path, series_instance_uid = structure_sets[structure_set_uid]
+        image_paths = tuple(images.get(series_instance_uid, ()))
+        if image_paths and (dose_uid, structure_set_uid) not in stored:
+            jobs.append(DvhJob(study_ids[study_instance_uid], dose_path, structure_set_path, image_paths))
+    return jobs
+
+
+def store_histograms(objects, batch_size):
+    metrics = [f'd_{percent}' for percent in DOSE_METRICS] + [f'v_{dose}' for dose in VOLUME_METRICS]
+    return DoseVolumeHistogram.objects.bulk_create(
+        objects,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['dose_uid', 'structure_set_uid', 'roi_number'],
+        update_fields=[
+            'dicom_study', 'plan_uid', 'roi_name', 'volume', 'bin_width', 'histogram',
+            'd_min', 'd_mean', 'd_max', *metrics, 'updated_at',
+        ],
+    )
+
+
+@timed('dvh')
+def compute_dvhs(studies, processes=None, batch_size=500, recompute=False):
+    '''
+    Compute and store the DVHs of every ROI for every plan dose of the DICOM studies.
+
+    Returns (pairs, histograms, failed, elapsed), failed being a list of (dose path, error).
+    '''
+    start = time.perf_counter()
+    histograms = 0
+    failed = []
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        jobs = build_jobs(list(studies), executor, recompute)
+        objects = []
+        for job, (rows, error) in zip(jobs, executor.map(compute_job, jobs)):
+            if error:
+                failed.append((job.dose_path, error))
+            objects.extend(DoseVolumeHistogram(**row) for row in rows)
+            if len(objects) >= batch_size:
+                histograms += len(store_histograms(objects, batch_size))
+                objects = []
+        histograms += len(store_histograms(objects, batch_size))
+    if histograms:
+        enqueue_studies({job.dicom_study_id for job in jobs}, [AggregateSourceChoices.DOSE])
+    return len(jobs), histograms, failed, time.perf_counter() - start
+
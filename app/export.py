@@ -0,0 +1,256 @@
+'''
+Streaming export of the cohort as a flat table.
+
+Every DICOM study is one row joined with its simulation, booking, diagnosis
+and patient. Rows are read with a server-side cursor in chunks of
+EXPORT_CHUNK_SIZE studies, with the chain of foreign keys fetched by
+select_related, the systemic therapy types prefetched per chunk and lookup
+labels resolved from the lookup cache. They are written as CSV or Parquet
+one chunk at a time, so memory does not grow with the size of the cohort.
+Parquet needs pyarrow.
+'''
+import csv
+import io
+import re
+
+from django.conf import settings
+from django.db.models import Q
+
+from app.models import AJCCSuffixChoices, DICOMStudy
+from lookup.cache import lookup_cache
+from lookup.models import (
+    LookupBillingCode,
+    LookupCancerSite,
+    LookupPathology,
+    LookupRadiotherapyTreatmentTechnique,
+    LookupSystemicTherapyType,
+)
+
+FORMATS = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+SIMULATION = 'radiotherapy_simulation'
+BOOKING = SIMULATION + '__radiotherapy_booking'
+DIAGNOSIS = BOOKING + '__diagnosis'
+PATIENT = DIAGNOSIS + '__patient'
+
+
+def modality_filter(modalities):
+    '''
+    Return a Q matching the DICOM studies with any of the modalities.
+
+    study_modality joins the modalities of a study with backslashes, as in
+    'CT\\RTDOSE\\RTSTRUCT', so each modality must match a whole component.
+    '''
+    alternatives = '|'.join(re.escape(modality) for modality in modalities)
+    return Q(study_modality__regex=rf'(^|\\)({alternatives})(\\|$)')
+
+
+# Query filters accepted by the endpoint and the command, and the DICOMStudy
+# lookup they apply or the function returning their Q.
+FILTERS = {
+    'cancer_site': DIAGNOSIS + '__cancer_site__in',
+    'cancer_pathology': DIAGNOSIS + '__cancer_pathology__in',
+    'technique': BOOKING + '__radiotherapy_treatment_technique__in',
+    'modality': modality_filter,
+}
+
+
+# Exported columns and their Parquet types, in the order of study_row().
+COLUMNS = [
+    ('patient_uid', 'string'),
+    ('gender', 'string'),
+    ('date_of_birth', 'date'),
+    ('date_of_registration', 'date'),
+    ('cancer_site', 'string'),
+    ('cancer_side', 'string'),
+    ('cancer_pathology', 'string'),
+    ('date_of_diagnosis', 'date'),
+    ('ajcc_t_stage', 'string'),
+    ('ajcc_n_stage', 'string'),
+    ('ajcc_m_stage', 'string'),
+    ('overall_stage', 'string'),
+    ('treatment_intent', 'string'),
+    ('treatment_sequence', 'string'),
+    ('radiotherapy_modality', 'string'),
+    ('treatment_technique', 'string'),
+    ('billing_category', 'string'),
+    ('concurrent_systemic_therapy', 'bool'),
+    ('systemic_therapy_types', 'string'),
+    ('planned_total_dose', 'float'),
+    ('planned_total_number_of_fractions', 'int'),
+    ('planned_dose_per_fraction', 'float'),
+    ('proposed_treatment_start_date', 'date'),
+    ('simulation_appointment_type', 'string'),
+    ('date_of_simulation', 'date'),
+    ('study_instance_uid', 'string'),
+    ('study_date_time', 'datetime'),
+    ('study_modality', 'string'),
+    ('study_description', 'string'),
+]
+
+HEADER = [name for name, kind in COLUMNS]
+
+
+def cohort_queryset(**filters):
+    '''
+    Return the DICOM studies to export, filtered by lists of codes named as in FILTERS.
+    '''
+    queryset = DICOMStudy.objects.select_related(PATIENT).prefetch_related(BOOKING + '__systemic_therapy_type').order_by('pk')
+    for name, values in filters.items():
+        if values:
+            lookup = FILTERS[name]
+            queryset = queryset.filter(lookup(values) if callable(lookup) else Q(**{lookup: values}))
+    return queryset
+
+
+# AJCC notation for each stage suffix, e.g. N0(i+) or N1(mi).
+STAGE_SUFFIXES = {
+    AJCCSuffixChoices.i: '(i+)',
+    AJCCSuffixChoices.m: '(m)',
+    AJCCSuffixChoices.mi: '(mi)',
+}
+
+
+def stage(prefix, category, major, suffix):
+    return f"{prefix}{category}{major}{STAGE_SUFFIXES.get(suffix, '')}"
+
+
+def study_row(study):
+    '''
+    Return the values of COLUMNS for a DICOM study fetched by cohort_queryset().
+    '''
+    simulation = study.radiotherapy_simulation
+    booking = simulation.radiotherapy_booking
+    diagnosis = booking.diagnosis
+    patient = diagnosis.patient
+    return [
+        patient.patient_uid,
+        patient.gender,
+        patient.date_of_birth,
+        patient.date_of_registration,
+        lookup_cache.label(LookupCancerSite, diagnosis.cancer_site_id, diagnosis.cancer_site_id),
+        diagnosis.cancer_side,
+        lookup_cache.label(LookupPathology, diagnosis.cancer_pathology_id, diagnosis.cancer_pathology_id),
+        diagnosis.date_of_diagnosis,
+        stage(diagnosis.ajcc_t_stage_prefix, 'T', diagnosis.ajcc_t_stage_major, diagnosis.ajcc_t_stage_suffix),
+        stage(diagnosis.ajcc_n_stage_prefix, 'N', diagnosis.ajcc_n_stage_major, diagnosis.ajcc_n_stage_suffix),
+        stage(diagnosis.ajcc_m_stage_prefix, 'M', diagnosis.ajcc_m_stage_major, diagnosis.ajcc_m_stage_suffix),
+        diagnosis.overall_stage,
+        booking.radiotherapy_treatment_intent,
+        booking.radiotherapy_treatment_sequence,
+        booking.radiotherapy_modality,
+        lookup_cache.label(LookupRadiotherapyTreatmentTechnique, booking.radiotherapy_treatment_technique_id, booking.radiotherapy_treatment_technique_id),
+        lookup_cache.label(LookupBillingCode, booking.radiotherapy_billing_category_id, booking.radiotherapy_billing_category_id),
+        booking.concurrent_systemic_therapy,
+        ';'.join(sorted(lookup_cache.label(LookupSystemicTherapyType, therapy.pk, therapy.pk) for therapy in booking.systemic_therapy_type.all())),
+        booking.planned_total_dose,
+        booking.planned_total_number_of_fractions,
+        booking.planned_dose_per_fraction,
+        booking.proposed_treatment_start_date,
+        simulation.simulation_appointment_type,
+        simulation.date_of_simulation,
+        study.study_instance_uid,
+        study.study_date_time,
+        study.study_modality,
+        study.study_description,
+    ]
+
+
+def export_rows(queryset, chunk_size=None):
+    '''
+    Yield the row of every DICOM study, reading chunk_size studies at a time.
+    '''
+    for study in queryset.iterator(chunk_size=chunk_size or settings.EXPORT_CHUNK_SIZE):
+        yield study_row(study)
+
+
+def batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def csv_chunks(rows, chunk_size=None):
+    '''
+    Yield the CSV text of the header and of every chunk of rows.
+    '''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(HEADER)
+    yield buffer.getvalue()
+    for batch in batched(rows, chunk_size or settings.EXPORT_CHUNK_SIZE):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(batch)
+        yield buffer.getvalue()
+
+
+class ChunkSink:
+    '''
+    Write-only stream that keeps what was written until it is drained.
+    '''
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_chunks(rows, chunk_size=None):
+    '''
+    Yield the bytes of a Parquet file with one row group per chunk of rows.
+    '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {'string': pa.string(), 'date': pa.date32(), 'datetime': pa.timestamp('us', tz='UTC'), 'bool': pa.bool_(), 'float': pa.float64(), 'int': pa.int64()}
+    schema = pa.schema([(name, types[kind]) for name, kind in COLUMNS])
+    sink = ChunkSink()
+    with pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema) as writer:
+        for batch in batched(rows, chunk_size or settings.EXPORT_CHUNK_SIZE):
+            columns = [
+                [None if value is None else float(value) if kind == 'float' else value for value in column]
+                for (name, kind), column in zip(COLUMNS, zip(*batch))
+            ]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def export_chunks(queryset, format, chunk_size=None):
+    '''
+    Yield the export of the queryset in a format of FORMATS, a chunk at a time.
+    '''
+    rows = export_rows(queryset, chunk_size)
+    if format == 'csv':
+        return csv_chunks(rows, chunk_size)
+    if format == 'parquet':
+        return parquet_chunks(rows, chunk_size)
+    raise ValueError(f'Unknown export format {format!r}')
@@ -0,0 +1,128 @@
+'''
+Columnar storage of radiomic features and cohort feature matrices.
+
+Each RadiomicFeatureSet holds the features of one ROI as a single
+little-endian float32 vector, indexed like the names of its
+RadiomicFeatureSchema. A schema is kept per parameter file and list of
+feature names, so the names are stored once rather than in every row, and a
+pyradiomics version that returns other features starts a new schema instead
+of shifting the columns of the old one.
+
+feature_matrix() reads an N ROIs x M features matrix straight into a NumPy
+array: the vectors of a schema are joined into one buffer and reinterpreted,
+without a model instance or dict per row. When only a few features are asked
+for, the database slices them out of each vector, so a cohort query on one
+feature reads 4 bytes per ROI.
+'''
+import hashlib
+from dataclasses import dataclass
+
+import numpy as np
+from django.db.models import BinaryField
+from django.db.models.functions import Substr
+
+from app.models import RadiomicFeatureSchema, RadiomicFeatureSet
+
+DTYPE = '<f4'
+
+# Requests for at most this many features of a schema are sliced out of the vectors by the database.
+MAX_SLICES = 32
+
+
+@dataclass
+class FeatureMatrix:
+    '''
+    Features of N ROIs x M feature names. Features missing from the schema of a ROI are NaN.
+    '''
+    ids: np.ndarray
+    study_ids: np.ndarray
+    roi_names: list
+    names: list
+    values: np.ndarray
+
+    def column(self, name):
+        return self.values[:, self.names.index(name)]
+
+
+def names_hash(names):
+    return hashlib.sha256('\0'.join(names).encode()).hexdigest()
+
+
+def get_schema(parameter_hash, names):
+    '''
+    Return the RadiomicFeatureSchema of the feature names extracted with a parameter file, creating it if needed.
+    '''
+    names = list(names)
+    schema, _ = RadiomicFeatureSchema.objects.get_or_create(
+        parameter_hash=parameter_hash, names_hash=names_hash(names), defaults={'names': names},
+    )
+    return schema
+
+
+def encode(features, names):
+    '''
+    Return the float32 vector of {name: value} features in the order of names, as stored in RadiomicFeatureSet.values.
+    '''
+    return np.array([features[name] for name in names], dtype=DTYPE).tobytes()
+
+
+def select_names(schemas, names=None, prefixes=()):
+    '''
+    Return the columns of a matrix over schemas: names as given, or the schema names starting with prefixes, first seen first.
+    '''
+    if names is not None:
+        return list(names)
+    columns = {}
+    for schema_names in schemas:
+        columns.update((name, None) for name in schema_names if not prefixes or name.startswith(prefixes))
+    return list(columns)
+
+
+def schema_block(queryset, schema_names, columns):
+    '''
+    Return (rows, values) of the feature sets of one schema, values holding the columns of the matrix.
+    '''
+    index = {name: position for position, name in enumerate(schema_names)}
+    present = [column for column, name in enumerate(columns) if name in index]
+    positions = [index[columns[column]] for column in present]
+    fields = ['pk', 'dicom_study_id', 'roi_name']
+    if len(positions) <= MAX_SLICES:
+        slices = {
+            f'feature_{position}': Substr('values', position * 4 + 1, 4, output_field=BinaryField())
+            for position in positions
+        }
+        rows = list(queryset.annotate(**slices).values_list(*fields, *slices))
+        data = np.frombuffer(b''.join(value for row in rows for value in row[3:]), dtype=DTYPE).reshape(len(rows), len(positions))
+    else:
+        rows = list(queryset.values_list(*fields, 'values'))
+        data = np.frombuffer(b''.join(row[3] for row in rows), dtype=DTYPE).reshape(len(rows), len(schema_names))[:, positions]
+    values = np.full((len(rows), len(columns)), np.nan, dtype=np.float32)
+    values[:, present] = data
+    return rows, values
+
+
+def feature_matrix(queryset=None, names=None, prefixes=()):
+    '''
+    Return the FeatureMatrix of the feature sets of queryset (default: all), ordered by schema and primary key.
+
+    names selects the columns by feature name and prefixes by name prefix;
+    with neither every feature of the schemas is returned.
+    '''
+    queryset = RadiomicFeatureSet.objects.all() if queryset is None else queryset
+    schemas = list(
+        RadiomicFeatureSchema.objects.filter(pk__in=queryset.order_by().values('schema_id')).order_by('pk').values_list('pk', 'names')
+    )
+    columns = select_names([schema_names for _, schema_names in schemas], names, tuple(prefixes))
+    rows, blocks = [], []
+    for pk, schema_names in schemas:
+        schema_rows, values = schema_block(queryset.filter(schema_id=pk).order_by('pk'), schema_names, columns)
+        rows.extend(row[:3] for row in schema_rows)
+        blocks.append(values)
+    ids, study_ids, roi_names = (list(column) for column in zip(*rows)) if rows else ([], [], [])
+    return FeatureMatrix(
+        ids=np.array(ids, dtype=np.int64),
+        study_ids=np.array(study_ids, dtype=np.int64),
+        roi_names=roi_names,
+        names=columns,
+        values=np.vstack(blocks) if blocks else np.empty((0, len(columns)), dtype=np.float32),
+    )
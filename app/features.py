@@ -0,0 +1,252 @@
+'''
+Parallel extraction of radiomic features for the ROIs of RT Structure Sets.
+
+Every ROI x image pair is an independent job run in a process pool. Each
+ROI of a structure set gets one row per parameter file, which carries a
+cache key hashed from the image series UID, the ROI contour data and the
+parameter file. Re-running a cohort only extracts ROIs whose key changed,
+and ROIs with the inputs of a stored ROI, such as the same contours in a
+copied structure set, reuse its values. Features are stored as float32 vectors
+against the schema of their names (see app/feature_vectors.py).
+'''
+import hashlib
+import logging
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+import numpy as np
+import SimpleITK as sitk
+from django.conf import settings
+
+from app import filters
+from app.aggregates import enqueue_studies
+from app.dicom_files import series_files, study_files
+from app.feature_vectors import encode, get_schema
+from app.masks import MaskStore
+from app.metrics import timed
+from app.models import AggregateSourceChoices, RadiomicFeatureSet
+from app.rtstruct import Geometry, load_structure_set
+from app.series_cache import get_series_cache
+
+logging.getLogger('radiomics').setLevel(logging.ERROR)
+
+
+@dataclass
+class ExtractionJob:
+    '''
+    One ROI x image extraction. Carries only plain data so it can be sent to pool workers.
+    '''
+    cache_key: str
+    dicom_study_id: int
+    structure_set_uid: str
+    roi_number: int
+    roi_name: str
+    series_instance_uid: str
+    image_paths: tuple
+    contours: list
+    parameter_file: str = None
+
+
+@dataclass
+class ExtractionReport:
+    '''
+    Summary of a single extraction run.
+    '''
+    jobs: int = 0
+    cached: int = 0
+    extracted: int = 0
+    failed: list = field(default_factory=list)
+    elapsed: float = 0.0
+
+
+def parameter_hash(parameter_file):
+    '''
+    Return the SHA-256 of the parameter file, or of an empty file when pyradiomics defaults are used.
+    '''
+    digest = hashlib.sha256()
+    if parameter_file:
+        with open(parameter_file, 'rb') as handle:
+            digest.update(handle.read())
+    return digest.hexdigest()
+
+
+def cache_key(series_instance_uid, roi, parameters):
+    digest = hashlib.sha256()
+    digest.update(series_instance_uid.encode())
+    digest.update(b'\0')
+    digest.update(roi.contour_bytes())
+    digest.update(b'\0')
+    digest.update(parameters.encode())
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=4)
+def get_extractor(parameter_file):
+    # pyradiomics is imported by the workers that extract, not by every module that imports this one.
+    from radiomics import featureextractor
+
+    if parameter_file:
+        return featureextractor.RadiomicsFeatureExtractor(parameter_file)
+    return featureextractor.RadiomicsFeatureExtractor()
+
+
+@lru_cache(maxsize=2)
+def get_image(series_instance_uid, image_paths):
+    '''
+    Keep the last images read by this worker, so consecutive ROIs on the same series read it once.
+
+    The voxels come from the series cache, so a series is only decoded once across workers and runs.
+    '''
+    return get_series_cache().load(series_instance_uid, image_paths).image()
+
+
+@lru_cache(maxsize=1)
+def get_mask_store():
+    return MaskStore()
+
+
+def extract(job):
+    '''
+    Extract the features of one job. Runs inside pool workers, so it must not touch the database.
+
+    Returns (cache_key, features, error).
+    '''
+    try:
+        image = get_image(job.series_instance_uid, job.image_paths)
+        stored = get_mask_store().get_or_rasterize(job.structure_set_uid, job.roi_number, job.contours, Geometry.from_image(image))
+        if stored is None:
+            raise ValueError('ROI does not overlap the image')
+        mask = sitk.GetImageFromArray(stored.dense().astype(np.uint8))
+        mask.CopyInformation(image)
+        result = get_extractor(job.parameter_file).execute(image, mask, label=1)
+    except Exception as error:
+        return job.cache_key, None, f'{type(error).__name__}: {error}'
+    features = {name: float(value) for name, value in result.items() if not name.startswith('diagnostics_')}
+    return job.cache_key, features, None
+
+
+def build_jobs(studies, executor, parameter_file=None):
+    '''
+    Read the structure sets of the studies and return one ExtractionJob per ROI.
+    '''
+    parameters = parameter_hash(parameter_file)
+    study_ids = {study.study_instance_uid: study.pk for study in studies}
+    paths = [path for study_paths in study_files(study_ids, 'RTSTRUCT').values() for path in study_paths]
+    structure_sets = [
+        structure_set for structure_set in executor.map(load_structure_set, paths)
+        if structure_set is not None and structure_set.referenced_series_uid
+    ]
+    images = series_files({structure_set.referenced_series_uid for structure_set in structure_sets})
+
+    jobs = []
+    for structure_set in structure_sets:
+        image_paths = tuple(images.get(structure_set.referenced_series_uid, ()))
+        if not image_paths:
+            continue
+        for roi in structure_set.rois:
+            jobs.append(ExtractionJob(
+                cache_key=cache_key(structure_set.referenced_series_uid, roi, parameters),
+                dicom_study_id=study_ids[structure_set.study_instance_uid],
+                structure_set_uid=structure_set.sop_instance_uid,
+                roi_number=roi.number,
+                roi_name=roi.name,
+                series_instance_uid=structure_set.referenced_series_uid,
+                image_paths=image_paths,
+                contours=roi.contours,
+                parameter_file=parameter_file,
+            ))
+    return jobs, parameters
+
+
+def feature_set(job, parameters, schema_id, values):
+    return RadiomicFeatureSet(
+        dicom_study_id=job.dicom_study_id,
+        structure_set_uid=job.structure_set_uid,
+        roi_number=job.roi_number,
+        roi_name=job.roi_name,
+        series_instance_uid=job.series_instance_uid,
+        parameter_hash=parameters,
+        cache_key=job.cache_key,
+        schema_id=schema_id,
+        values=values,
+    )
+
+
+def store_feature_sets(objects, batch_size):
+    '''
+    Write the feature sets, replacing the stored row of a ROI and parameter file whose inputs changed.
+    '''
+    return RadiomicFeatureSet.objects.bulk_create(
+        objects,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['structure_set_uid', 'roi_number', 'parameter_hash'],
+        update_fields=['dicom_study', 'roi_name', 'series_instance_uid', 'cache_key', 'schema', 'values'],
+    )
+
+
+@timed('radiomics')
+def extract_features(studies, parameter_file=None, processes=None, batch_size=500):
+    '''
+    Extract and store radiomic features for every ROI of the given DICOM studies.
+
+    ROIs stored with the same cache key are skipped, and ROIs whose cache key
+    is stored for another ROI copy its values; both count as cached. ROIs
+    sharing a cache key are extracted once. Jobs are ordered by image series
+    so each worker mostly reuses the image it has loaded, and filtered
+    derivatives of an image are shared through the filter cache.
+    '''
+    report = ExtractionReport()
+    start = time.perf_counter()
+
+    initargs = (settings.RADIOMICS_FILTER_CACHE_DIR, settings.RADIOMICS_FILTER_CACHE_BYTES)
+    with ProcessPoolExecutor(max_workers=processes, initializer=filters.install, initargs=initargs) as executor:
+        jobs, parameters = build_jobs(list(studies), executor, parameter_file)
+        report.jobs = len(jobs)
+        stored = {
+            (structure_set_uid, roi_number): key
+            for structure_set_uid, roi_number, key in RadiomicFeatureSet.objects.filter(
+                parameter_hash=parameters, structure_set_uid__in={job.structure_set_uid for job in jobs},
+            ).values_list('structure_set_uid', 'roi_number', 'cache_key')
+        }
+        outdated = [job for job in jobs if stored.get((job.structure_set_uid, job.roi_number)) != job.cache_key]
+        known = {
+            key: (schema_id, bytes(values))
+            for key, schema_id, values in RadiomicFeatureSet.objects.filter(
+                cache_key__in={job.cache_key for job in outdated},
+            ).values_list('cache_key', 'schema_id', 'values')
+        }
+        by_key = defaultdict(list)
+        for job in outdated:
+            if job.cache_key not in known:
+                by_key[job.cache_key].append(job)
+        pending = sorted((group[0] for group in by_key.values()), key=lambda job: job.series_instance_uid)
+        report.cached = report.jobs - sum(len(group) for group in by_key.values())
+
+        results = [feature_set(job, parameters, *known[job.cache_key]) for job in outdated if job.cache_key in known]
+        written = {result.dicom_study_id for result in results}
+        schemas = {}
+        for key, features, error in executor.map(extract, pending, chunksize=4):
+            group = by_key[key]
+            if error:
+                report.failed.extend((job.structure_set_uid, job.roi_name, error) for job in group)
+                continue
+            names = tuple(features)
+            if names not in schemas:
+                schemas[names] = get_schema(parameters, names)
+            values = encode(features, names)
+            results.extend(feature_set(job, parameters, schemas[names].pk, values) for job in group)
+            report.extracted += len(group)
+            written.update(job.dicom_study_id for job in group)
+            if len(results) >= batch_size:
+                store_feature_sets(results, batch_size)
+                results = []
+        store_feature_sets(results, batch_size)
+
+    if written:
+        enqueue_studies(written, [AggregateSourceChoices.RADIOMICS])
+    report.elapsed = time.perf_counter() - start
+    return report
@@ -0,0 +1,130 @@
+'''
+Shared cache of filtered image derivatives for radiomic feature extraction.
+
+pyradiomics applies every enabled image filter (Wavelet, LoG, Square, Gradient,
+...) to the whole image once per ROI, so the same filtered volume is computed
+again for every structure on a CT. pyradiomics looks the filters up by name on
+radiomics.imageoperations, and install() replaces them in the worker process
+with wrappers that store each derivative in a DiskCache. The cache key is a
+hash of the image content and geometry, the filter and only the settings
+that filter reads, so a derivative is reused by every ROI and by every
+parameter set that enables the same filter.
+'''
+import hashlib
+import json
+
+import numpy as np
+import SimpleITK as sitk
+
+from app.disk_cache import DiskCache
+
+# Settings read by each filter. Filters not listed here are keyed on all settings.
+FILTER_SETTINGS = {
+    'LoG': ('sigma', 'force2D', 'force2Ddimension'),
+    'Wavelet': ('wavelet', 'start_level', 'level', 'force2D', 'force2Ddimension'),
+    'Square': (),
+    'SquareRoot': (),
+    'Logarithm': (),
+    'Exponential': (),
+    'Gradient': ('gradientUseSpacing',),
+    'LBP2D': ('lbp2DRadius', 'lbp2DSamples', 'lbp2DMethod', 'force2D', 'force2Ddimension'),
+    'LBP3D': ('lbp3DLevels', 'lbp3DIcosphereRadius', 'lbp3DIcosphereSubdivision'),
+}
+
+_cache = None
+_image_keys = {}
+
+
+def image_key(image):
+    '''
+    Return a hash of the voxel data and geometry of a SimpleITK image.
+
+    The last few hashes are remembered by object identity, so the image passed
+    to every filter of one extraction is hashed once.
+    '''
+    identity = id(image)
+    if identity in _image_keys and _image_keys[identity][0] is image:
+        return _image_keys[identity][1]
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.ascontiguousarray(sitk.GetArrayViewFromImage(image)).data)
+    digest.update(repr((image.GetPixelIDValue(), image.GetOrigin(), image.GetSpacing(), image.GetDirection())).encode())
+    key = digest.hexdigest()
+    if len(_image_keys) >= 8:
+        _image_keys.clear()
+    _image_keys[identity] = (image, key)
+    return key
+
+
+def filter_key(image, image_type, settings):
+    names = FILTER_SETTINGS.get(image_type)
+    if names is None:
+        names = sorted(settings)
+    relevant = {name: settings[name] for name in names if name in settings}
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(image_key(image).encode())
+    digest.update(image_type.encode())
+    digest.update(json.dumps(relevant, sort_keys=True, default=repr).encode())
+    return digest.hexdigest()
+
+
+def to_image(array, metadata):
+    image = sitk.GetImageFromArray(np.asarray(array))
+    image.SetOrigin(metadata['origin'])
+    image.SetSpacing(metadata['spacing'])
+    image.SetDirection(metadata['direction'])
+    return image
+
+
+def cached_filter(image_type, compute):
+    '''
+    Wrap a pyradiomics filter generator so its derivatives are read from and written to the cache.
+    '''
+    def generator(inputImage, inputMask, **kwargs):
+        if _cache is None:
+            yield from compute(inputImage, inputMask, **kwargs)
+            return
+        key = filter_key(inputImage, image_type, kwargs)
+        index = _cache.read_json(key, 'json')
+        if index is None:
+            with _cache.lock(key):
+                index = _cache.read_json(key, 'json')
+                if index is None:
+                    index = []
+                    for image, name, _ in compute(inputImage, inputMask, **kwargs):
+                        _cache.save_array(key, f'{len(index)}.npy', sitk.GetArrayViewFromImage(image))
+                        index.append({
+                            'name': name,
+                            'origin': image.GetOrigin(),
+                            'spacing': image.GetSpacing(),
+                            'direction': image.GetDirection(),
+                        })
+                        yield image, name, kwargs
+                    _cache.write_json(key, 'json', index)
+                    _cache.evict(keep={key})
+                    return
+        arrays = [_cache.load_array(key, f'{number}.npy') for number in range(len(index))]
+        if any(array is None for array in arrays):
+            yield from compute(inputImage, inputMask, **kwargs)
+            return
+        for array, metadata in zip(arrays, index):
+            yield to_image(array, metadata), metadata['name'], kwargs
+    return generator
+
+
+def install(directory, max_bytes):
+    '''
+    Route the pyradiomics filters of this process through a cache in directory bounded to max_bytes.
+
+    Used as the initializer of the extraction process pool.
+    '''
+    from radiomics import imageoperations
+
+    global _cache
+    _cache = DiskCache(directory, max_bytes)
+    for image_type in FILTER_SETTINGS:
+        name = f'get{image_type}Image'
+        compute = getattr(imageoperations, name, None)
+        if compute is not None and not getattr(compute, 'filter_cache', False):
+            wrapper = cached_filter(image_type, compute)
+            wrapper.filter_cache = True
+            setattr(imageoperations, name, wrapper)
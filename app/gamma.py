@@ -0,0 +1,421 @@
+'''
+Gamma index comparison of measured and calculated doses for plan QA.
+
+A measured dose (a plane from an array or EPID, or a volume from a 3D
+detector) exported as RTDOSE is compared with the calculated dose of the
+same plan. The calculated dose is resampled onto the grid of the measured
+one, padded by the search radius, and the gamma of every measured point
+above the threshold is the minimum over the search offsets of
+
+    (calculated(point + offset) - measured(point))² / ΔD² + |offset|² / DTA²
+
+with ΔD a percentage of the maximum measured dose (global) or of the dose
+at the point (local). A 2D measured plane gives a 2D gamma: only in-plane
+offsets are searched.
+
+The naive evaluation compares every point with every other point. Here
+the offsets lie on a lattice of DTA / GAMMA_STEPS within GAMMA_MAX × DTA,
+sorted by distance. For a fixed offset, the trilinear interpolation of the
+calculated dose has the same eight neighbours and weights at every point,
+so it is eight gathers at constant flat index deltas over all the points
+at once. After each distance shell, the points whose gamma cannot fall any
+more drop out, so well-matched points stop after a few shells. Each point
+then searches around its best offset at half, a quarter, ... of the lattice
+step (GAMMA_REFINEMENTS rounds), which costs far less than a finer lattice.
+Gammas are capped at GAMMA_MAX. Slabs of points run in a process pool.
+
+Pass rates and gamma histograms are stored per measured dose, calculated
+dose and criterion, so plans are reported without reading doses again.
+'''
+import itertools
+import math
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+import pydicom
+from django.conf import settings
+
+from app.dicom_files import study_files
+from app.dvh import SUMMATION_TYPES, read_dose
+from app.metrics import timed
+from app.models import GammaAnalysis
+
+
+@dataclass(frozen=True)
+class GammaCriteria:
+    '''
+    Dose difference in percent and distance to agreement in mm, with the dose difference relative to the local dose or not.
+    '''
+    dose_percent: float
+    distance_mm: float
+    local: bool = False
+
+    def __str__(self):
+        return f'{self.dose_percent:g}%/{self.distance_mm:g}mm' + (' local' if self.local else '')
+
+
+CRITERIA_PATTERN = re.compile(r'^\s*([\d.]+)\s*%\s*/\s*([\d.]+)\s*mm\s*(local|global)?\s*$', re.IGNORECASE)
+
+
+def parse_criteria(text):
+    '''
+    Parse criteria written as 3%/2mm, optionally followed by local or global.
+    '''
+    match = CRITERIA_PATTERN.match(text)
+    if match is None or not float(match[1]) > 0 or not float(match[2]) > 0:
+        raise ValueError(f'Invalid gamma criteria {text!r}; write them as 3%/2mm or 2%/1mm local')
+    return GammaCriteria(float(match[1]), float(match[2]), (match[3] or '').lower() == 'local')
+
+
+def search_offsets(criteria, max_gamma, steps, planar):
+    '''
+    Return the (N, 3) search offsets in mm, (z, y, x), and their squared distances in DTA units, nearest first.
+    '''
+    step = criteria.distance_mm / steps
+    count = int(max_gamma * steps)
+    axis = np.arange(-count, count + 1) * step
+    offsets = np.stack(np.meshgrid(np.zeros(1) if planar else axis, axis, axis, indexing='ij'), axis=-1).reshape(-1, 3)
+    distances = np.round((offsets ** 2).sum(axis=1) / criteria.distance_mm ** 2, 9)
+    keep = distances < max_gamma ** 2
+    order = np.argsort(distances[keep], kind='stable')
+    return offsets[keep][order], distances[keep][order]
+
+
+def search_margin(spacing, criteria, max_gamma, planar):
+    '''
+    Return the voxels, (z, y, x), the calculated dose must extend beyond the measured grid on each side.
+    '''
+    radius = max_gamma * criteria.distance_mm
+    return tuple(0 if planar and axis == 0 else math.ceil(radius / spacing[axis]) + 1 for axis in range(3))
+
+
+def stencil(offset, spacing, strides):
+    '''
+    Return [(flat index delta, weight), ...] interpolating trilinearly at an offset in mm from a voxel.
+    '''
+    spacing = np.asarray(spacing, dtype=np.float64)
+    # Planes have no spacing along z and are never searched along it.
+    position = np.divide(offset, spacing, out=np.zeros(3), where=spacing > 0)
+    lower = np.floor(position)
+    fraction = position - lower
+    corners = []
+    for corner in itertools.product((0, 1), repeat=3):
+        weight = float(np.prod([fraction[axis] if corner[axis] else 1 - fraction[axis] for axis in range(3)]))
+        if weight > 1e-9:
+            corners.append((int(((lower + corner) * strides).sum()), np.float32(weight)))
+    return corners
+
+
+def interpolate(flat, strides, positions, planar):
+    '''
+    Interpolate a flattened (z, y, x) array trilinearly at (N, 3) fractional voxel positions.
+    '''
+    lower = np.floor(positions)
+    fraction = (positions - lower).astype(np.float32)
+    index = (lower.astype(np.int64) * strides).sum(axis=1)
+    value = np.zeros(len(positions), dtype=np.float32)
+    for corner in itertools.product((0, 1), repeat=3):
+        if planar and corner[0]:
+            continue
+        weight = np.prod([fraction[:, axis] if corner[axis] else 1 - fraction[:, axis] for axis in range(1 if planar else 0, 3)], axis=0)
+        value += weight * flat[index + int((np.array(corner) * strides).sum())]
+    return value
+
+
+def gamma_slab(task):
+    '''
+    Return the gammas of a slab of measured points, NaN below the threshold. Runs inside pool workers.
+
+    calculated is the calculated dose on the grid of the slab, padded by
+    margin voxels on each side. The lattice search is followed by rounds of
+    refinement: each point tries the neighbours of its best offset at half
+    the previous step, so the gammas are as accurate as a lattice 2^rounds
+    times finer.
+    '''
+    measured, calculated, margin, spacing, criteria, normalization, threshold, max_gamma, steps, rounds, planar = task
+    mask = measured >= threshold
+    gamma = np.full(measured.shape, np.nan, dtype=np.float32)
+    if not mask.any():
+        return gamma
+    calculated = np.ascontiguousarray(calculated, dtype=np.float32)
+    strides = np.array(calculated.strides) // calculated.itemsize
+    flat = calculated.ravel()
+    coordinates = np.column_stack(np.nonzero(mask)) + np.array(margin)
+    base = coordinates @ strides
+    dose = measured[mask].astype(np.float32)
+    tolerance = criteria.dose_percent / 100 * (dose if criteria.local else np.full_like(dose, normalization))
+    scale = (1 / np.maximum(tolerance, 1e-6) ** 2).astype(np.float32)
+
+    best = np.full(len(dose), max_gamma ** 2, dtype=np.float32)
+    best_offset = np.zeros((len(dose), 3))
+    active = np.arange(len(dose))
+    shell = None
+    for offset, distance in zip(*search_offsets(criteria, max_gamma, steps, planar)):
+        if distance != shell:
+            # Points whose gamma² is at most this distance are final.
+            active = active[best[active] > distance]
+            if not len(active):
+                break
+            shell = distance
+            points, point_dose, point_scale = base[active], dose[active], scale[active]
+        value = np.zeros(len(active), dtype=np.float32)
+        for delta, weight in stencil(offset, spacing, strides):
+            value += weight * flat[points + delta]
+        candidate = (value - point_dose) ** 2 * point_scale + np.float32(distance)
+        improved = candidate < best[active]
+        best[active[improved]] = candidate[improved]
+        best_offset[active[improved]] = offset
+
+    # Capped points found no minimum to refine, and points with a gamma of 0 cannot improve.
+    refined = np.flatnonzero((best < max_gamma ** 2) & (best > 0))
+    voxel = np.divide(1, spacing, out=np.zeros(3), where=np.asarray(spacing) > 0)
+    directions = [direction for direction in itertools.product((-1, 0, 1), repeat=3) if any(direction) and not (planar and direction[0])]
+    step = criteria.distance_mm / steps
+    for _ in range(rounds):
+        step /= 2
+        for direction in directions:
+            offsets = best_offset[refined] + step * np.array(direction)
+            distance = ((offsets ** 2).sum(axis=1) / criteria.distance_mm ** 2).astype(np.float32)
+            value = interpolate(flat, strides, coordinates[refined] + offsets * voxel, planar)
+            candidate = (value - dose[refined]) ** 2 * scale[refined] + distance
+            improved = (candidate < best[refined]) & (distance < max_gamma ** 2)
+            best[refined[improved]] = candidate[improved]
+            best_offset[refined[improved]] = offsets[improved]
+    gamma[mask] = np.sqrt(best)
+    return gamma
+
+
+@dataclass
+class GammaResult:
+    '''
+    Gammas of the measured points, NaN where the measured dose is below the threshold, and capped at max_gamma.
+    '''
+    criteria: GammaCriteria
+    gamma: np.ndarray
+    max_gamma: float
+
+    @property
+    def values(self):
+        return self.gamma[~np.isnan(self.gamma)]
+
+    @property
+    def points(self):
+        return len(self.values)
+
+    @property
+    def pass_rate(self):
+        '''
+        Percent of the points with a gamma of at most 1.
+        '''
+        return 100 * float(np.count_nonzero(self.values <= 1)) / self.points if self.points else 0.0
+
+    def histogram(self, bin_width):
+        '''
+        Return the percent of the points in each gamma bin from 0 to max_gamma. Capped gammas fall in the last bin.
+        '''
+        bins = max(1, int(round(self.max_gamma / bin_width)))
+        counts = np.bincount(np.minimum((self.values / bin_width).astype(np.int64), bins - 1), minlength=bins)
+        return 100 * counts / max(self.points, 1)
+
+
+def gamma_index(measured, calculated, spacing, criteria, threshold_percent=None, normalization=None,
+                max_gamma=None, steps=None, rounds=None, executor=None, chunk_points=1 << 16):
+    '''
+    Compute the gamma index of a (z, y, x) measured dose against a calculated dose on the same grid.
+
+    spacing is the (z, y, x) voxel size in mm; a measured dose one plane deep
+    gives a 2D gamma. calculated either has the shape of measured, and is
+    extended by repeating its edges, or is already padded by search_margin()
+    voxels on each side. normalization defaults to the maximum measured
+    dose. Slabs of chunk_points points run with executor.map if given.
+    '''
+    threshold_percent = settings.GAMMA_THRESHOLD_PERCENT if threshold_percent is None else threshold_percent
+    max_gamma = max_gamma or settings.GAMMA_MAX
+    steps = steps or settings.GAMMA_STEPS
+    rounds = settings.GAMMA_REFINEMENTS if rounds is None else rounds
+    measured = np.asarray(measured, dtype=np.float32)
+    planar = measured.shape[0] == 1
+    margin = search_margin(spacing, criteria, max_gamma, planar)
+    if calculated.shape == measured.shape:
+        calculated = np.pad(np.asarray(calculated, dtype=np.float32), [(extent, extent) for extent in margin], mode='edge')
+    elif calculated.shape != tuple(size + 2 * extent for size, extent in zip(measured.shape, margin)):
+        raise ValueError(f'Calculated dose of shape {calculated.shape} does not match the measured dose of shape {measured.shape}')
+    normalization = float(measured.max()) if normalization is None else normalization
+    threshold = threshold_percent / 100 * normalization
+
+    # Slabs along z, or along y for a plane.
+    axis = 1 if planar else 0
+    step = max(1, chunk_points // max(1, measured.size // measured.shape[axis]))
+    tasks = []
+    for start in range(0, measured.shape[axis], step):
+        stop = min(start + step, measured.shape[axis])
+        slab = [slice(None)] * 3
+        slab[axis] = slice(start, stop)
+        padded = [slice(None)] * 3
+        padded[axis] = slice(start, stop + 2 * margin[axis])
+        tasks.append((measured[tuple(slab)], calculated[tuple(padded)], margin, spacing, criteria, normalization, threshold, max_gamma, steps, rounds, planar))
+    slabs = list((executor.map if executor else map)(gamma_slab, tasks))
+    return GammaResult(criteria, np.concatenate(slabs, axis=axis), max_gamma)
+
+
+def dose_spacing(dose):
+    '''
+    Return the (z, y, x) voxel size in mm of a DoseGrid. Planes must be evenly spaced.
+    '''
+    if len(dose.offsets) < 2:
+        return (0.0, dose.spacing[1], dose.spacing[0])
+    thickness = float(dose.offsets[1] - dose.offsets[0])
+    if not np.allclose(np.diff(dose.offsets), thickness, atol=1e-3):
+        raise ValueError(f'Dose {dose.sop_instance_uid} has unevenly spaced planes')
+    return (thickness, dose.spacing[1], dose.spacing[0])
+
+
+def resample(calculated, measured, margin, chunk_voxels=1 << 20):
+    '''
+    Return the calculated DoseGrid sampled on the grid of the measured one, extended by margin voxels on each side.
+    '''
+    thickness, row_spacing, column_spacing = dose_spacing(measured)
+    depth, height, width = (size + 2 * extent for size, extent in zip(measured.dose.shape, margin))
+    z = (measured.offsets[0] + thickness * (np.arange(depth) - margin[0]))
+    y = row_spacing * (np.arange(height) - margin[1])
+    x = column_spacing * (np.arange(width) - margin[2])
+    plane = (measured.origin + y[:, np.newaxis, np.newaxis] * measured.column_direction + x[np.newaxis, :, np.newaxis] * measured.row_direction).reshape(-1, 3)
+    step = max(1, chunk_voxels // len(plane))
+    slabs = []
+    for start in range(0, depth, step):
+        points = (plane[np.newaxis] + z[start:start + step, np.newaxis, np.newaxis] * measured.normal).reshape(-1, 3)
+        slabs.append(calculated.sample(points).astype(np.float32).reshape(-1, height, width))
+    return np.concatenate(slabs)
+
+
+DOSE_TAGS = ['SOPInstanceUID', 'DoseSummationType', 'ReferencedRTPlanSequence', 'SeriesDescription', 'DoseComment']
+
+
+def read_dose_header(path):
+    '''
+    Return (SOP Instance UID, summation type, plan UID, description) of an RTDOSE file. Runs inside pool workers.
+    '''
+    try:
+        dataset = pydicom.dcmread(path, stop_before_pixels=True, specific_tags=DOSE_TAGS)
+        plans = dataset.get('ReferencedRTPlanSequence') or []
+        description = ' '.join(str(dataset.get(tag, '') or '') for tag in ('SeriesDescription', 'DoseComment'))
+        return str(dataset.SOPInstanceUID), str(dataset.get('DoseSummationType', '')), str(plans[0].ReferencedSOPInstanceUID) if plans else '', description
+    except Exception:
+        return None
+
+
+@dataclass
+class GammaJob:
+    '''
+    A measured dose and the calculated dose of its plan.
+    '''
+    dicom_study_id: int
+    plan_uid: str
+    measured_path: str
+    calculated_path: str
+
+
+def build_jobs(studies, executor, criteria, recompute=False):
+    '''
+    Pair every measured dose of the studies with the calculated dose of its plan.
+
+    Doses whose series description or dose comment match
+    QA_DOSE_DESCRIPTION are measured; the plan summation dose of the same
+    plan is the calculated one. Pairs stored with every criterion are
+    skipped unless recompute is set.
+    '''
+    study_ids = {study.study_instance_uid: study.pk for study in studies}
+    files = study_files(study_ids, 'RTDOSE')
+    paths = [path for study_paths in files.values() for path in study_paths]
+    headers = dict(zip(paths, executor.map(read_dose_header, paths, chunksize=16)))
+    pattern = re.compile(settings.QA_DOSE_DESCRIPTION, re.IGNORECASE)
+
+    pairs = []
+    for study_instance_uid, dose_paths in files.items():
+        measured, calculated = [], {}
+        for path in dose_paths:
+            if headers[path] is None or not headers[path][2]:
+                continue
+            dose_uid, summation, plan_uid, description = headers[path]
+            if pattern.search(description):
+                measured.append((path, plan_uid))
+            elif summation in SUMMATION_TYPES:
+                calculated.setdefault(plan_uid, path)
+        pairs.extend((study_instance_uid, path, plan_uid, calculated[plan_uid]) for path, plan_uid in measured if plan_uid in calculated)
+
+    stored = {}
+    if not recompute:
+        rows = GammaAnalysis.objects.filter(measured_dose_uid__in=[headers[pair[1]][0] for pair in pairs]).values_list(
+            'measured_dose_uid', 'calculated_dose_uid', 'dose_percent', 'distance_mm', 'local',
+        )
+        for measured_uid, calculated_uid, dose_percent, distance_mm, local in rows:
+            stored.setdefault((measured_uid, calculated_uid), set()).add(GammaCriteria(dose_percent, distance_mm, local))
+    return [
+        GammaJob(study_ids[study_instance_uid], plan_uid, measured_path, calculated_path)
+        for study_instance_uid, measured_path, plan_uid, calculated_path in pairs
+        if not set(criteria) <= stored.get((headers[measured_path][0], headers[calculated_path][0]), set())
+    ]
+
+
+def analyse(job, criteria, executor=None):
+    '''
+    Compare the doses of a job with each criterion. Returns GammaAnalysis objects, unsaved.
+    '''
+    measured, calculated = read_dose(job.measured_path), read_dose(job.calculated_path)
+    spacing = dose_spacing(measured)
+    planar = measured.dose.shape[0] == 1
+    objects = []
+    for criterion in criteria:
+        margin = search_margin(spacing, criterion, settings.GAMMA_MAX, planar)
+        result = gamma_index(measured.dose, resample(calculated, measured, margin), spacing, criterion, executor=executor)
+        objects.append(GammaAnalysis(
+            dicom_study_id=job.dicom_study_id,
+            plan_uid=job.plan_uid,
+            measured_dose_uid=measured.sop_instance_uid,
+            calculated_dose_uid=calculated.sop_instance_uid,
+            dose_percent=criterion.dose_percent,
+            distance_mm=criterion.distance_mm,
+            local=criterion.local,
+            threshold_percent=settings.GAMMA_THRESHOLD_PERCENT,
+            dimensions=2 if planar else 3,
+            points=result.points,
+            pass_rate=result.pass_rate,
+            gamma_mean=float(result.values.mean()) if result.points else 0.0,
+            gamma_max=float(result.values.max()) if result.points else 0.0,
+            bin_width=settings.GAMMA_BIN_WIDTH,
+            histogram=result.histogram(settings.GAMMA_BIN_WIDTH).astype('<f4').tobytes(),
+        ))
+    return objects
+
+
+@timed('gamma')
+def compute_gamma(studies, criteria=None, processes=None, recompute=False, batch_size=500):
+    '''
+    Compare every measured dose of the DICOM studies with the calculated dose of its plan and store the results.
+
+    Returns (pairs, analyses, failed, elapsed), failed being a list of (measured dose path, error).
+    '''
+    start = time.perf_counter()
+    criteria = criteria or [parse_criteria(text) for text in settings.GAMMA_CRITERIA]
+    objects, failed = [], []
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        jobs = build_jobs(list(studies), executor, criteria, recompute)
+        for job in jobs:
+            try:
+                objects.extend(analyse(job, criteria, executor))
+            except Exception as error:
+                failed.append((job.measured_path, f'{type(error).__name__}: {error}'))
+    GammaAnalysis.objects.bulk_create(
+        objects,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['measured_dose_uid', 'calculated_dose_uid', 'dose_percent', 'distance_mm', 'local'],
+        update_fields=[
+            'dicom_study', 'plan_uid', 'threshold_percent', 'dimensions', 'points', 'pass_rate',
+            'gamma_mean', 'gamma_max', 'bin_width', 'histogram', 'updated_at',
+        ],
+    )
+    return len(jobs), len(objects), failed, time.perf_counter() - start
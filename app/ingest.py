@@ -0,0 +1,548 @@
+'''
+Bulk ingestion of DICOM headers into DICOM Study records.
+
+Headers are read in a process pool (pixel data is never loaded), grouped into
+studies and series, matched to the Radiotherapy Simulation of the patient and
+written with batched bulk inserts. Every file read is recorded in the
+DICOMFileManifest so that incremental runs only parse new or changed files.
+
+Files are hashed first, and only payloads missing from the DICOMObject index
+are parsed: re-exported or re-sent copies take the stored header. Each SOP
+instance is indexed once, at its payload in the object store (see
+app/object_store.py) or at an ingested copy when the store is disabled.
+'''
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import pydicom
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from app.metrics import timed
+from app.models import DICOMFileManifest, DICOMObject, DICOMStudy, RadiotherapySimulation
+from app.object_store import get_object_store
+from app.summaries import patients_of, schedule_patient_summaries
+
+# Only these elements are parsed from each file.
+HEADER_TAGS = [
+    'PatientID',
+    'StudyInstanceUID',
+    'SeriesInstanceUID',
+    'SOPInstanceUID',
+    'Modality',
+    'StudyDate',
+    'StudyTime',
+    'StudyDescription',
+]
+
+MAX_CHAR_LENGTH = DICOMStudy._meta.get_field('study_description').max_length
+
+MANIFEST_FIELDS = ['size', 'mtime_ns', 'sop_instance_uid', 'study_instance_uid', 'series_instance_uid', 'modality', 'content_hash']
+
+OBJECT_FIELDS = ['study_instance_uid', 'series_instance_uid', 'modality', 'content_hash', 'size', 'path', 'header']
+
+# Header elements kept in the object index, as returned by read_header().
+HEADER_FIELDS = [
+    'patient_id', 'study_instance_uid', 'series_instance_uid', 'sop_instance_uid',
+    'modality', 'study_date', 'study_time', 'study_description',
+]
+
+
+@dataclass
+class StudyGroup:
+    '''
+    Instances of one DICOM study grouped by series.
+    '''
+    study_instance_uid: str
+    patient_id: str
+    study_date: str
+    study_time: str
+    study_description: str
+    series: dict = field(default_factory=dict)
+    instances: int = 0
+
+    @property
+    def modalities(self):
+        return sorted(set(self.series.values()))
+
+
+@dataclass
+class IngestReport:
+    '''
+    Summary of a single ingestion run.
+    '''
+    files: int = 0
+    changed: int = 0
+    removed: int = 0
+    dicom_files: int = 0
+    new_payloads: int = 0
+    studies: int = 0
+    series: int = 0
+    created: int = 0
+    updated: int = 0
+    unmatched: list = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def files_per_second(self):
+        '''
+        Files read per second. Unchanged files skipped by an incremental run are not counted.
+        '''
+        return self.changed / self.elapsed if self.elapsed else 0.0
+
+
+def scan_files(root):
+    '''
+    Return {path: (size, mtime_ns)} for every regular file below root.
+    '''
+    files = {}
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def content_hash(path, block_size=1 << 20):
+    '''
+    Return the SHA-256 hex digest of a file.
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_header(path):
+    '''
+    Read the header elements listed in HEADER_TAGS from a DICOM file.
+
+    Returns None for files that are not DICOM or lack a Study Instance UID.
+    Runs inside pool workers, so it must not touch the database.
+    '''
+    try:
+        dataset = pydicom.dcmread(path, stop_before_pixels=True, defer_size='1 KB', specific_tags=HEADER_TAGS)
+    except Exception:
+        return None
+    study_instance_uid = str(dataset.get('StudyInstanceUID', '') or '')
+    if not study_instance_uid:
+        return None
+    return {
+        'path': path,
+        'patient_id': str(dataset.get('PatientID', '') or ''),
+        'study_instance_uid': study_instance_uid,
+        'series_instance_uid': str(dataset.get('SeriesInstanceUID', '') or ''),
+        'sop_instance_uid': str(dataset.get('SOPInstanceUID', '') or ''),
+        'modality': str(dataset.get('Modality', '') or ''),
+        'study_date': str(dataset.get('StudyDate', '') or ''),
+        'study_time': str(dataset.get('StudyTime', '') or ''),
+        'study_description': str(dataset.get('StudyDescription', '') or ''),
+    }
+
+
+def hash_file(path):
+    '''
+    Return (path, content hash), with a hash of None if the file cannot be read. Runs inside pool workers.
+    '''
+    try:
+        return path, content_hash(path)
+    except OSError:
+        return path, None
+
+
+def read_object(task):
+    '''
+    Read the header of a new payload and add it to the object store, if any. Runs inside pool workers.
+
+    Returns (content hash, header, path of the payload), with a header of
+    None for files that are not DICOM.
+    '''
+    path, digest, store = task
+    header = read_header(path)
+    if header is None:
+        return digest, None, None
+    del header['path']
+    if store is not None and header['sop_instance_uid']:
+        path = str(store.put(path, digest))
+    return digest, header, path
+
+
+def stored_headers(hashes, batch_size=1000):
+    '''
+    Return {content_hash: header} of the payloads that are already in the object index.
+    '''
+    headers = {}
+    for chunk in chunked(hashes, batch_size):
+        headers.update(DICOMObject.objects.filter(content_hash__in=chunk).values_list('content_hash', 'header'))
+    return headers
+
+
+def read_files(paths, store=None, processes=None, chunksize=64, batch_size=1000, progress=None):
+    '''
+    Hash paths in a process pool and read the headers of the payloads that are not indexed yet.
+
+    Returns ([header, ...], {content_hash: path of the payload}): a header with
+    the path and content hash of every readable file, and where the payloads
+    read in this run are stored. Copies of a payload that is already indexed,
+    or read earlier in the run, are not parsed again: they get its header.
+    Files that are not DICOM get a header with empty UIDs, so they are not
+    read again until they change. progress, if given, is called as
+    progress(done, elapsed) every 5000 files hashed.
+    '''
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        hashes = {}
+        for done, (path, digest) in enumerate(executor.map(hash_file, paths, chunksize=chunksize), start=1):
+            if progress and done % 5000 == 0:
+                progress(done, time.perf_counter() - start)
+            if digest is not None:
+                hashes[path] = digest
+        known = stored_headers(set(hashes.values()), batch_size)
+        pending = {}
+        for path, digest in hashes.items():
+            if digest not in known:
+                pending.setdefault(digest, path)
+        tasks = [(path, digest, store) for digest, path in pending.items()]
+        for digest, header, path in executor.map(read_object, tasks, chunksize=chunksize):
+            known[digest] = header
+            if header is not None:
+                pending[digest] = path
+            else:
+                del pending[digest]
+    headers = [{**(known[digest] or {}), 'path': path, 'content_hash': digest} for path, digest in hashes.items()]
+    return headers, pending
+
+
+def group_studies(headers):
+    '''
+    Group instance headers into StudyGroup objects keyed by Study Instance UID.
+    '''
+    studies = {}
+    for header in headers:
+        if not header.get('study_instance_uid'):
+            continue
+        study = studies.get(header['study_instance_uid'])
+        if study is None:
+            study = studies[header['study_instance_uid']] = StudyGroup(
+                study_instance_uid=header['study_instance_uid'],
+                patient_id=header['patient_id'],
+                study_date=header['study_date'],
+                study_time=header['study_time'],
+                study_description=header['study_description'],
+            )
+        study.series.setdefault(header['series_instance_uid'], header['modality'])
+        study.instances += 1
+    return studies
+
+
+def study_datetime(study_date, study_time):
+    '''
+    Convert DICOM DA and TM strings to an aware datetime, or None if the date is missing.
+    '''
+    try:
+        date = datetime.strptime(study_date[:8], '%Y%m%d')
+    except ValueError:
+        return None
+    digits = (study_time or '').split('.')[0].strip()
+    digits = (digits + '000000')[:6] if digits.isdigit() else '000000'
+    value = date.replace(hour=int(digits[:2]), minute=int(digits[2:4]), second=int(digits[4:6]))
+    return timezone.make_aware(value)
+
+
+def load_simulations(patient_ids):
+    '''
+    Return {patient_uid: [(date_of_simulation, simulation_done, pk), ...]} in a single query.
+    '''
+    simulations = {}
+    rows = RadiotherapySimulation.objects.filter(
+        radiotherapy_booking__diagnosis__patient__patient_uid__in=patient_ids
+    ).values_list('radiotherapy_booking__diagnosis__patient__patient_uid', 'date_of_simulation', 'simulation_done', 'pk')
+    for patient_uid, date_of_simulation, simulation_done, pk in rows:
+        simulations.setdefault(patient_uid, []).append((date_of_simulation, simulation_done, pk))
+    return simulations
+
+
+def match_simulation(candidates, acquired, date_tolerance=0):
+    '''
+    Pick the simulation closest in date to the study, preferring completed simulations.
+    '''
+    best = None
+    for date_of_simulation, simulation_done, pk in candidates:
+        offset = abs((date_of_simulation - acquired.date()).days)
+        if offset > date_tolerance:
+            continue
+        rank = (offset, not simulation_done, -pk)
+        if best is None or rank < best[0]:
+            best = (rank, pk)
+    return best[1] if best else None
+
+
+def chunked(items, size):
+    items = list(items)
+    for offset in range(0, len(items), size):
+        yield items[offset:offset + size]
+
+
+def load_manifest(root):
+    '''
+    Return {path: (size, mtime_ns, study_instance_uid, dicom_study_id)} for manifest entries below root.
+    '''
+    prefix = os.path.join(root, '')
+    return {
+        path: tuple(entry)
+        for path, *entry in DICOMFileManifest.objects.filter(path__startswith=prefix)
+        .values_list('path', 'size', 'mtime_ns', 'study_instance_uid', 'dicom_study_id')
+        .iterator(chunk_size=10000)
+    }
+
+
+def indexed_studies(study_uids, batch_size=1000):
+    '''
+    Group the headers of the studies in the object index into StudyGroup objects, without reading their files.
+    '''
+    headers = []
+    for chunk in chunked(study_uids, batch_size):
+        headers.extend(DICOMObject.objects.filter(study_instance_uid__in=chunk).values_list('header', flat=True))
+    return group_studies(headers)
+
+
+def study_modalities(study_uids, batch_size=1000):
+    '''
+    Return {study_instance_uid: [modality, ...]} from the manifest.
+    '''
+    modalities = {}
+    for chunk in chunked(study_uids, batch_size):
+        rows = DICOMFileManifest.objects.filter(study_instance_uid__in=chunk).values_list('study_instance_uid', 'modality').distinct()
+        for study_instance_uid, modality in rows:
+            modalities.setdefault(study_instance_uid, set()).add(modality)
+    return {uid: sorted(values) for uid, values in modalities.items()}
+
+
+def upsert_manifest(headers, stats, batch_size=1000):
+    '''
+    Insert or update the manifest entries of the files that were read.
+    '''
+    entries = [
+        DICOMFileManifest(
+            path=header['path'],
+            size=stats[header['path']][0],
+            mtime_ns=stats[header['path']][1],
+            sop_instance_uid=header.get('sop_instance_uid', ''),
+            study_instance_uid=header.get('study_instance_uid', ''),
+            series_instance_uid=header.get('series_instance_uid', ''),
+            modality=header.get('modality', '')[:16],
+            content_hash=header['content_hash'],
+        )
+        for header in headers
+    ]
+    DICOMFileManifest.objects.bulk_create(
+        entries,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['path'],
+        update_fields=MANIFEST_FIELDS + ['updated_at'],
+    )
+
+
+def upsert_objects(headers, stats, payloads, store=None, batch_size=1000):
+    '''
+    Insert or update the DICOMObject of every SOP instance that was read.
+
+    payloads maps the content hashes of the payloads read in this run to
+    their path. Copies of indexed payloads are added to the store if it
+    lacks them, and otherwise leave the index as it is. Of several payloads
+    of one SOP instance the most recently modified file wins, as the latest
+    ingested one does across runs.
+    '''
+    latest = {}
+    for header in headers:
+        sop_instance_uid = header.get('sop_instance_uid')
+        if sop_instance_uid and (sop_instance_uid not in latest or stats[header['path']][1] > stats[latest[sop_instance_uid]['path']][1]):
+            latest[sop_instance_uid] = header
+
+    objects = []
+    for sop_instance_uid, header in latest.items():
+        digest = header['content_hash']
+        if digest in payloads:
+            path = payloads[digest]
+        elif store is not None:
+            path = str(store.put(header['path'], digest))
+        else:
+            continue
+        objects.append(DICOMObject(
+            sop_instance_uid=sop_instance_uid,
+            study_instance_uid=header['study_instance_uid'],
+            series_instance_uid=header['series_instance_uid'],
+            modality=header['modality'][:16],
+            content_hash=digest,
+            size=stats[header['path']][0],
+            path=path,
+            header={key: header[key] for key in HEADER_FIELDS},
+        ))
+    DICOMObject.objects.bulk_create(
+        objects,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['sop_instance_uid'],
+        update_fields=OBJECT_FIELDS + ['updated_at'],
+    )
+
+
+def unlink_objects(removed, batch_size=1000):
+    '''
+    Point the objects indexed at removed files to another ingested copy of their payload, and drop those left without one.
+
+    Only objects indexed where they were ingested, with the object store disabled, point at ingested files.
+    '''
+    for chunk in chunked(removed, batch_size):
+        objects = list(DICOMObject.objects.filter(path__in=chunk).only('pk', 'sop_instance_uid', 'content_hash', 'path'))
+        if not objects:
+            continue
+        copies = {
+            (sop_instance_uid, digest): path
+            for sop_instance_uid, digest, path in DICOMFileManifest.objects.filter(
+                sop_instance_uid__in=[dicom_object.sop_instance_uid for dicom_object in objects]
+            ).values_list('sop_instance_uid', 'content_hash', 'path')
+        }
+        moved = []
+        for dicom_object in objects:
+            dicom_object.path = copies.get((dicom_object.sop_instance_uid, dicom_object.content_hash))
+            if dicom_object.path:
+                moved.append(dicom_object)
+        DICOMObject.objects.bulk_update(moved, ['path'], batch_size=batch_size)
+        DICOMObject.objects.filter(pk__in=[dicom_object.pk for dicom_object in objects if not dicom_object.path]).delete()
+
+
+def upsert_studies(studies, affected, report, batch_size=1000, date_tolerance=0):
+    '''
+    Create or update the DICOM Study records of the affected Study Instance UIDs.
+
+    Modalities are taken from the manifest, so they cover every file of the
+    study rather than only the files read in this run. Only studies whose
+    modality, description or date changed count as updated.
+    '''
+    modalities = study_modalities(affected, batch_size)
+    existing = {}
+    for chunk in chunked(affected, batch_size):
+        existing.update((study.study_instance_uid, study) for study in DICOMStudy.objects.filter(study_instance_uid__in=chunk))
+
+    updates = []
+    for study_instance_uid, study in existing.items():
+        if study_instance_uid not in modalities:
+            continue
+        before = (study.study_modality, study.study_description, study.study_date_time)
+        study.study_modality = '\\'.join(modalities[study_instance_uid])[:MAX_CHAR_LENGTH]
+        group = studies.get(study_instance_uid)
+        if group is not None:
+            study.study_description = group.study_description[:MAX_CHAR_LENGTH]
+            study.study_date_time = study_datetime(group.study_date, group.study_time) or study.study_date_time
+        if (study.study_modality, study.study_description, study.study_date_time) != before:
+            updates.append(study)
+    DICOMStudy.objects.bulk_update(updates, ['study_modality', 'study_description', 'study_date_time'], batch_size=batch_size)
+    report.updated = len(updates)
+
+    pending = [study for uid, study in studies.items() if uid not in existing]
+    simulations = load_simulations({study.patient_id for study in pending})
+    objects = []
+    for study in pending:
+        acquired = study_datetime(study.study_date, study.study_time)
+        simulation_id = None
+        if acquired is not None:
+            simulation_id = match_simulation(simulations.get(study.patient_id, ()), acquired, date_tolerance)
+        if simulation_id is None:
+            report.unmatched.append(study.study_instance_uid)
+            continue
+        objects.append(DICOMStudy(
+            radiotherapy_simulation_id=simulation_id,
+            study_instance_uid=study.study_instance_uid,
+            study_date_time=acquired,
+            study_modality='\\'.join(modalities.get(study.study_instance_uid, study.modalities))[:MAX_CHAR_LENGTH],
+            study_description=study.study_description[:MAX_CHAR_LENGTH],
+        ))
+    # A study created by a concurrent ingest since it was looked up is updated instead.
+    raced = set()
+    for chunk in chunked([study.study_instance_uid for study in objects], batch_size):
+        raced.update(DICOMStudy.objects.filter(study_instance_uid__in=chunk).values_list('study_instance_uid', flat=True))
+    DICOMStudy.objects.bulk_create(
+        objects,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['study_instance_uid'],
+        update_fields=['study_modality', 'study_description', 'study_date_time'],
+    )
+    report.created = len(objects) - len(raced)
+    report.updated += len(raced)
+    schedule_patient_summaries(patients_of(RadiotherapySimulation, {study.radiotherapy_simulation_id for study in objects}))
+
+    for chunk in chunked(affected, batch_size):
+        for model in (DICOMFileManifest, DICOMObject):
+            model.objects.filter(study_instance_uid__in=chunk).update(
+                dicom_study=Subquery(DICOMStudy.objects.filter(study_instance_uid=OuterRef('study_instance_uid')).values('pk')[:1])
+            )
+
+
+@timed('ingest')
+def ingest_directory(root, incremental=False, processes=None, batch_size=1000, chunksize=64, date_tolerance=0, progress=None):
+    '''
+    Read the DICOM files below root and create or update their DICOM Study records.
+
+    With incremental=True only files that are missing from the manifest or
+    whose size or modification time changed are read, so a run costs
+    O(changed files), and only payloads new to the object index are
+    parsed. Manifest entries of deleted files are removed.
+    Studies whose patient has no Radiotherapy Simulation within
+    date_tolerance days of the study date are reported in
+    IngestReport.unmatched and skipped. They are matched again on every
+    run, from their indexed headers, until their simulation exists.
+    '''
+    report = IngestReport()
+    start = time.perf_counter()
+    root = os.path.abspath(root)
+
+    stats = scan_files(root)
+    manifest = load_manifest(root)
+    report.files = len(stats)
+    if incremental:
+        changed = [path for path, stat in stats.items() if manifest.get(path, (None, None))[:2] != stat]
+    else:
+        changed = list(stats)
+    removed = [path for path in manifest if path not in stats]
+    report.changed, report.removed = len(changed), len(removed)
+
+    store = get_object_store()
+    headers, payloads = read_files(changed, store, processes, chunksize, batch_size, progress)
+    report.dicom_files = sum(1 for header in headers if header.get('study_instance_uid'))
+    report.new_payloads = len(payloads)
+    studies = group_studies(headers)
+    report.studies = len(studies)
+    report.series = sum(len(study.series) for study in studies.values())
+
+    affected = set(studies)
+    affected.update(manifest[path][2] for path in changed + removed if path in manifest)
+    unlinked = {entry[2] for path, entry in manifest.items() if entry[3] is None and path in stats} - affected
+    unlinked.discard('')
+    studies.update(indexed_studies(unlinked, batch_size))
+    affected.update(unlinked)
+    affected.discard('')
+
+    with transaction.atomic():
+        upsert_manifest(headers, stats, batch_size)
+        for chunk in chunked(removed, batch_size):
+            DICOMFileManifest.objects.filter(path__in=chunk).delete()
+        upsert_objects(headers, stats, payloads, store, batch_size)
+        unlink_objects(removed, batch_size)
+        upsert_studies(studies, affected, report, batch_size, date_tolerance)
+
+    report.elapsed = time.perf_counter() - start
+    return report
@@ -0,0 +1,315 @@
+'''
+Database-backed job queue for the imaging computations.
+
+Rasterizing structure sets, computing DVHs and extracting radiomic features
+take minutes per study, so they run as Job rows picked up by worker
+processes started with `manage.py run_workers`. A worker claims the pending
+job of highest priority with SELECT ... FOR UPDATE SKIP LOCKED, so any
+number of workers share the table without a broker and without claiming
+the same job twice.
+
+A job may depend on another job of the same study and is only claimed once
+that job is done. enqueue_pipeline() chains rasterize -> DVH -> radiomics
+per study, so the masks are stored before the DVH and radiomics jobs read
+them. Failed jobs are retried after JOB_RETRY_DELAY seconds, doubled on
+every attempt, up to max_attempts. Once a job has failed for good its
+dependents are failed too. Running jobs report progress and a heartbeat,
+and a job whose worker stopped sending heartbeats for JOB_STALE_AFTER
+seconds is put back in the queue. A worker only records the outcome of a
+job while it still owns it, so a slow worker whose job was requeued and
+claimed again does not overwrite the new run.
+'''
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count, Exists, OuterRef
+from django.utils import timezone
+
+from app.models import DICOMStudy, Job, JobKindChoices, JobStatusChoices
+
+logger = logging.getLogger(__name__)
+
+# Kinds run per study by enqueue_pipeline(), each depending on the previous one.
+PIPELINE = [JobKindChoices.RASTERIZE, JobKindChoices.DVH, JobKindChoices.RADIOMICS]
+
+
+def run_rasterize(study, progress):
+    from app.masks import rasterize_studies
+
+    progress(0, 'Rasterizing structure sets')
+    rois, stored, elapsed = rasterize_studies([study], processes=1)
+    return f'Stored {stored} masks of {rois} ROIs'
+
+
+def run_volumes(study, progress):
+    from app.volumes import compute_volumes
+
+    progress(0, 'Computing structure volumes')
+    rois, elapsed = compute_volumes([study], processes=1)
+    return f'Stored the volumes of {rois} ROIs'
+
+
+def run_dvh(study, progress):
+    from app.dvh import compute_dvhs
+
+    progress(0, 'Computing dose volume histograms')
+    pairs, histograms, failed, elapsed = compute_dvhs([study], processes=1)
+    if failed and not histograms:
+        raise RuntimeError('; '.join(f'{path}: {error}' for path, error in failed))
+    return f'Stored {histograms} histograms for {pairs} doses ({len(failed)} failed)'
+
+
+def run_radiomics(study, progress):
+    from app.features import extract_features
+
+    progress(0, 'Extracting radiomic features')
+    report = extract_features([study], processes=1)
+    if report.failed and not report.extracted and not report.cached:
+        raise RuntimeError('; '.join(f'{roi_name}: {error}' for structure_set_uid, roi_name, error in report.failed))
+    return f'Extracted {report.extracted} of {report.jobs} ROIs ({report.cached} cached, {len(report.failed)} failed)'
+
+
+def run_tiles(study, progress):
+    from app.tiles import render_study_tiles
+
+    progress(0, 'Rendering slice tiles')
+    series = render_study_tiles(study)
+    return f'Rendered the tiles of {series} series'
+
+
+def run_gamma(study, progress):
+    from app.gamma import compute_gamma
+
+    progress(0, 'Comparing measured and calculated doses')
+    pairs, analyses, failed, elapsed = compute_gamma([study], processes=1)
+    if failed and not analyses:
+        raise RuntimeError('; '.join(f'{path}: {error}' for path, error in failed))
+    return f'Stored {analyses} gamma analyses for {pairs} measured doses ({len(failed)} failed)'
+
+
+# Handlers by job kind. Each takes the DICOMStudy and a progress(fraction, message) callable and returns a summary message.
+HANDLERS = {
+    JobKindChoices.RASTERIZE: run_rasterize,
+    JobKindChoices.VOLUMES: run_volumes,
+    JobKindChoices.DVH: run_dvh,
+    JobKindChoices.RADIOMICS: run_radiomics,
+    JobKindChoices.TILES: run_tiles,
+    JobKindChoices.GAMMA: run_gamma,
+}
+
+
+def enqueue(kind, studies, priority=0, depends_on=None):
+    '''
+    Create a pending job of a kind for every DICOM study. depends_on maps study ids to the job each one waits for.
+
+    Returns {study id: job}.
+    '''
+    depends_on = depends_on or {}
+    jobs = Job.objects.bulk_create([
+        Job(kind=kind, dicom_study_id=study_id, priority=priority, depends_on=depends_on.get(study_id), max_attempts=settings.JOB_MAX_ATTEMPTS)
+        for study_id in study_ids(studies)
+    ])
+    return {job.dicom_study_id: job for job in jobs}
+
+
+def enqueue_pipeline(studies, priority=0, kinds=PIPELINE):
+    '''
+    Create a chain of jobs of the kinds, in order, for every DICOM study.
+
+    Returns the number of jobs created.
+    '''
+    ids = study_ids(studies)
+    previous, created = None, 0
+    for kind in kinds:
+        previous = enqueue(kind, ids, priority, previous)
+        created += len(previous)
+    return created
+
+
+def study_ids(studies):
+    return [study.pk if isinstance(study, DICOMStudy) else study for study in studies]
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim(worker, kinds=None):
+    '''
+    Mark the next runnable job as running for the worker and return it, or None if there is none.
+
+    A job is runnable once it is pending, due, and its dependency, if any, is done.
+    '''
+    now = timezone.now()
+    unfinished_dependency = Job.objects.filter(pk=OuterRef('depends_on_id')).exclude(status=JobStatusChoices.DONE)
+    with transaction.atomic():
+        queryset = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=JobStatusChoices.PENDING, run_after__lte=now)
+            .exclude(Exists(unfinished_dependency))
+            .order_by('-priority', 'created_at')
+        )
+        if kinds:
+            queryset = queryset.filter(kind__in=kinds)
+        job = queryset.first()
+        if job is None:
+            return None
+        job.status = JobStatusChoices.RUNNING
+        job.worker = worker
+        job.attempts += 1
+        job.progress = 0
+        job.started_at = job.heartbeat_at = now
+        job.save(update_fields=['status', 'worker', 'attempts', 'progress', 'started_at', 'heartbeat_at'])
+    return job
+
+
+def owned(job):
+    '''
+    Return the row of a job while it is running for the worker that claimed it.
+    '''
+    return Job.objects.filter(pk=job.pk, status=JobStatusChoices.RUNNING, worker=job.worker)
+
+
+def report_progress(job, fraction, message=''):
+    '''
+    Record the progress of a running job. Also serves as its heartbeat.
+    '''
+    owned(job).update(
+        progress=min(max(fraction, 0.0), 1.0), message=message[:1024], heartbeat_at=timezone.now(),
+    )
+
+
+def fail_dependents(job):
+    '''
+    Fail every pending job that depends, directly or not, on a job that failed for good.
+    '''
+    failed = [job.pk]
+    while failed:
+        dependents = list(Job.objects.filter(depends_on__in=failed, status=JobStatusChoices.PENDING).values_list('pk', flat=True))
+        Job.objects.filter(pk__in=dependents).update(
+            status=JobStatusChoices.FAILED, error=f'Job {job.pk} it depends on failed', finished_at=timezone.now(),
+        )
+        failed = dependents
+
+
+def retry_delay(attempts):
+    return datetime.timedelta(seconds=settings.JOB_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def disowned(job):
+    logger.warning('Job %s was requeued while %s ran it, its outcome is dropped', job.pk, job.worker)
+
+
+def finish(job, message):
+    '''
+    Mark a job done. Returns False, leaving the job as it is, if the worker no longer owns it.
+    '''
+    if owned(job).update(status=JobStatusChoices.DONE, progress=1, message=message[:1024], error='', finished_at=timezone.now()):
+        return True
+    disowned(job)
+    return False
+
+
+def fail(job, error):
+    '''
+    Put a job whose run raised back in the queue, or fail it and its dependents after its last attempt.
+
+    Nothing is recorded if the worker no longer owns the job.
+    '''
+    if job.attempts < job.max_attempts:
+        if not owned(job).update(
+            status=JobStatusChoices.PENDING, error=error, worker='', run_after=timezone.now() + retry_delay(job.attempts),
+        ):
+            disowned(job)
+        return
+    with transaction.atomic():
+        if not owned(job).update(status=JobStatusChoices.FAILED, error=error, finished_at=timezone.now()):
+            disowned(job)
+            return
+        fail_dependents(job)
+
+
+def heartbeat(job, stop):
+    '''
+    Refresh the heartbeat of a running job until stop is set. Runs in its own thread and database connection.
+    '''
+    interval = settings.JOB_STALE_AFTER / 4
+    try:
+        while not stop.wait(interval):
+            owned(job).update(heartbeat_at=timezone.now())
+    finally:
+        connection.close()
+
+
+def run(job):
+    '''
+    Run a claimed job and record its outcome. Returns True if it is done.
+    '''
+    stop = threading.Event()
+    beat = threading.Thread(target=heartbeat, args=(job, stop), daemon=True)
+    beat.start()
+    try:
+        message = HANDLERS[job.kind](job.dicom_study, lambda fraction, message='': report_progress(job, fraction, message))
+    except Exception:
+        logger.exception('Job %s (%s of study %s) failed', job.pk, job.kind, job.dicom_study_id)
+        fail(job, traceback.format_exc())
+        return False
+    finally:
+        stop.set()
+        beat.join()
+    return finish(job, message)
+
+
+def requeue_stale():
+    '''
+    Put running jobs without a heartbeat for JOB_STALE_AFTER seconds back in the queue, as a failed attempt.
+
+    Returns the number of jobs requeued.
+    '''
+    cutoff = timezone.now() - datetime.timedelta(seconds=settings.JOB_STALE_AFTER)
+    stale = list(Job.objects.filter(status=JobStatusChoices.RUNNING, heartbeat_at__lt=cutoff))
+    for job in stale:
+        fail(job, f'Worker {job.worker} stopped responding')
+    return len(stale)
+
+
+def work(worker=None, kinds=None, burst=False, stop=None, poll_interval=None):
+    '''
+    Claim and run jobs until stop is set, or until the queue has no runnable job if burst is set.
+
+    Returns the number of jobs run.
+    '''
+    worker = worker or worker_name()
+    poll_interval = settings.JOB_POLL_INTERVAL if poll_interval is None else poll_interval
+    ran = 0
+    while stop is None or not stop.is_set():
+        close_old_connections()
+        job = claim(worker, kinds)
+        if job is None:
+            requeue_stale()
+            if burst:
+                break
+            if stop is not None:
+                stop.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+            continue
+        logger.info('%s running job %s (%s of study %s)', worker, job.pk, job.kind, job.dicom_study_id)
+        run(job)
+        ran += 1
+    return ran
+
+
+def queue_status():
+    '''
+    Return {(kind, status): count} over the job table.
+    '''
+    rows = Job.objects.order_by().values_list('kind', 'status').annotate(count=Count('pk'))
+    return {(kind, status): count for kind, status, count in rows}
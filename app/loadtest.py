@@ -0,0 +1,122 @@
+'''
+HTTP load test of the read API.
+
+run_loadtest() sends GET requests to a running server from a number of
+threads, each over its own keep-alive connection, and reports the
+throughput and latency percentiles. It does not care how the server is
+deployed, so the same run against a WSGI server (gunicorn quantrad.wsgi)
+and an ASGI server (uvicorn quantrad.asgi) compares the two at equal
+concurrency. Results are plain dicts written as JSON, like app.benchmark.
+'''
+import datetime
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def percentile(latencies, fraction):
+    '''
+    Return the latency below which the fraction of the sorted latencies fall.
+    '''
+    if not latencies:
+        return None
+    return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+
+def connect(url, timeout):
+    connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+    return connection_class(url.netloc, timeout=timeout)
+
+
+def client(urls, headers, deadline, requests, timeout, latencies, errors, lock):
+    '''
+    Request the urls in turn over one connection until the deadline or until the shared requests counter runs out.
+    '''
+    connection = None
+    position = 0
+    while time.perf_counter() < deadline:
+        with lock:
+            if requests[0] == 0:
+                break
+            requests[0] -= 1
+        url = urls[position % len(urls)]
+        position += 1
+        start = time.perf_counter()
+        try:
+            if connection is None:
+                connection = connect(url, timeout)
+            connection.request('GET', url.path + (f'?{url.query}' if url.query else ''), headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                raise http.client.HTTPException(f'{url.geturl()} returned {response.status}')
+        except (OSError, http.client.HTTPException) as error:
+            if connection is not None:
+                connection.close()
+                connection = None
+            with lock:
+                errors.append(str(error))
+            continue
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+    if connection is not None:
+        connection.close()
+
+
+def run_loadtest(urls, concurrency=10, duration=10.0, requests=None, headers=None, timeout=30.0, label=''):
+    '''
+    Load the urls from concurrency threads for duration seconds, or until requests requests were sent.
+
+    Returns a JSON-serializable dict with the requests, errors, requests per
+    second and latency percentiles in milliseconds.
+    '''
+    urls = [urlsplit(url) for url in urls]
+    latencies, errors = [], []
+    lock = threading.Lock()
+    remaining = [-1 if requests is None else requests]
+    start = time.perf_counter()
+    deadline = start + duration
+    threads = [
+        threading.Thread(target=client, args=(urls, headers or {}, deadline, remaining, timeout, latencies, errors, lock), daemon=True)
+        for _ in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    latencies.sort()
+    milliseconds = {
+        name: round(percentile(latencies, fraction) * 1000, 2) if latencies else None
+        for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0))
+    }
+    return {
+        'label': label,
+        'started_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'urls': [url.geturl() for url in urls],
+        'concurrency': concurrency,
+        'seconds': round(seconds, 3),
+        'requests': len(latencies),
+        'errors': len(errors),
+        'error_samples': sorted(set(errors))[:5],
+        'requests_per_second': round(len(latencies) / seconds, 1) if seconds else None,
+        'latency_ms': milliseconds,
+    }
+
+
+def compare(current, baseline):
+    '''
+    Return (measure, baseline, current, ratio) for the throughput and latency percentiles of two results.
+    '''
+    rows = [('requests_per_second', baseline['requests_per_second'], current['requests_per_second'])]
+    rows += [(name, baseline['latency_ms'][name], value) for name, value in current['latency_ms'].items()]
+    return [(name, before, after, after / before) for name, before, after in rows if before and after is not None]
+
+
+def write_results(results, path):
+    with open(path, 'w') as handle:
+        json.dump(results, handle, indent=2)
@@ -0,0 +1,60 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.benchmark import STAGES, compare, parse_scale, run_benchmark, write_results
+from app.models import Patient
+
+
+class Command(BaseCommand):
+    help = 'Time ingest, validation, overview, export, feature extraction and gamma analysis on a synthetic cohort. Run it against an empty database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', default='1k', help='Number of patients, or 1k, 100k or 1m')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic cohort')
+        parser.add_argument('--stage', action='append', choices=list(STAGES), help='Stage to run (repeatable, default: all)')
+        parser.add_argument('--dicom-studies', type=int, default=20, help='Studies to write DICOM files for')
+        parser.add_argument('--dicom-root', help='Directory for the DICOM files (default: a temporary directory)')
+        parser.add_argument('--processes', type=int, default=None, help='Worker processes (default: CPU count)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per batch when generating and importing')
+        parser.add_argument('--label', default='', help='Release or commit the results belong to')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+        parser.add_argument('--allow-existing', action='store_true', help='Run even though the database already holds patients')
+
+    def handle(self, *args, **options):
+        try:
+            patients = parse_scale(options['scale'])
+        except ValueError as error:
+            raise CommandError(str(error))
+        if options['compare'] and not os.path.isfile(options['compare']):
+            raise CommandError(f"{options['compare']} does not exist")
+        if Patient.objects.exists() and not options['allow_existing']:
+            raise CommandError('The database already holds patients; use an empty database or pass --allow-existing')
+
+        results = run_benchmark(
+            patients,
+            seed=options['seed'],
+            stages=options['stage'],
+            dicom_studies=options['dicom_studies'],
+            dicom_root=options['dicom_root'],
+            processes=options['processes'],
+            batch_size=options['batch_size'],
+            label=options['label'],
+        )
+
+        for stage, result in results['stages'].items():
+            if 'skipped' in result:
+                self.stdout.write(self.style.WARNING(f"{stage:<12} skipped: {result['skipped']}"))
+            else:
+                self.stdout.write(f"{stage:<12} {result['seconds']:>10.3f}s {result['rows']:>10} rows {result['rows_per_second'] or 0:>12.1f} rows/s")
+        if options['output']:
+            write_results(results, options['output'])
+            self.stdout.write(self.style.SUCCESS(f"Wrote results to {options['output']}"))
+        if options['compare']:
+            with open(options['compare']) as handle:
+                baseline = json.load(handle)
+            for stage, before, after, ratio in compare(results, baseline):
+                style = self.style.ERROR if ratio > 1.1 else self.style.SUCCESS
+                self.stdout.write(style(f'{stage:<12} {before:>10.3f}s -> {after:>10.3f}s ({ratio:.2f}x)'))
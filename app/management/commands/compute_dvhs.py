@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from app.dvh import compute_dvhs
+from app.models import DICOMStudy
+
+
+class Command(BaseCommand):
+    help = 'Compute the dose volume histogram of every ROI for every plan dose of the DICOM studies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--study', action='append', dest='studies', default=[], help='Study Instance UID to process (repeatable, default: all studies)')
+        parser.add_argument('--processes', type=int, default=None, help='Number of processes (default: CPU count)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Histograms per bulk insert')
+        parser.add_argument('--recompute', action='store_true', help='Recompute doses whose histograms are already stored')
+
+    def handle(self, *args, **options):
+        studies = DICOMStudy.objects.only('pk', 'study_instance_uid')
+        if options['studies']:
+            studies = studies.filter(study_instance_uid__in=options['studies'])
+
+        pairs, histograms, failed, elapsed = compute_dvhs(
+            studies,
+            processes=options['processes'],
+            batch_size=options['batch_size'],
+            recompute=options['recompute'],
+        )
+
+        for path, error in failed:
+            self.stdout.write(self.style.ERROR(f'{path}: {error}'))
+        self.stdout.write(self.style.SUCCESS(f'Stored {histograms} histograms for {pairs} doses in {elapsed:.1f}s'))
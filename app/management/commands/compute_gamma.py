@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.gamma import compute_gamma, parse_criteria
+from app.models import DICOMStudy
+
+
+class Command(BaseCommand):
+    help = 'Compare every measured dose of the DICOM studies with the calculated dose of its plan using the gamma index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--study', action='append', dest='studies', default=[], help='Study Instance UID to process (repeatable, default: all studies)')
+        parser.add_argument('--criteria', action='append', default=[], help='Criteria such as 3%%/2mm or 2%%/1mm local (repeatable, default: GAMMA_CRITERIA)')
+        parser.add_argument('--processes', type=int, default=None, help='Number of processes (default: CPU count)')
+        parser.add_argument('--recompute', action='store_true', help='Recompute dose pairs whose analyses are already stored')
+
+    def handle(self, *args, **options):
+        try:
+            criteria = [parse_criteria(text) for text in options['criteria']]
+        except ValueError as error:
+            raise CommandError(str(error))
+        studies = DICOMStudy.objects.only('pk', 'study_instance_uid')
+        if options['studies']:
+            studies = studies.filter(study_instance_uid__in=options['studies'])
+
+        pairs, analyses, failed, elapsed = compute_gamma(studies, criteria=criteria, processes=options['processes'], recompute=options['recompute'])
+
+        for path, error in failed:
+            self.stdout.write(self.style.ERROR(f'{path}: {error}'))
+        self.stdout.write(self.style.SUCCESS(f'Stored {analyses} gamma analyses for {pairs} measured doses in {elapsed:.1f}s'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from app.models import DICOMStudy
+from app.volumes import compute_volumes
+
+
+class Command(BaseCommand):
+    help = 'Compute the volume, extent and centroid of every ROI of the RT Structure Sets in the DICOM studies from their contours'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--study', action='append', dest='studies', default=[], help='Study Instance UID to process (repeatable, default: all studies)')
+        parser.add_argument('--processes', type=int, default=None, help='Number of processes reading structure sets (default: CPU count)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Volumes per bulk insert')
+        parser.add_argument('--recompute', action='store_true', help='Also process structure sets that were processed before')
+
+    def handle(self, *args, **options):
+        studies = DICOMStudy.objects.only('pk', 'study_instance_uid')
+        if options['studies']:
+            studies = studies.filter(study_instance_uid__in=options['studies'])
+
+        rois, elapsed = compute_volumes(list(studies), processes=options['processes'], batch_size=options['batch_size'], recompute=options['recompute'])
+
+        self.stdout.write(self.style.SUCCESS(f'Computed volumes of {rois} ROIs in {elapsed:.2f}s'))
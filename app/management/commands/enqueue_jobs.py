@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from app.jobs import PIPELINE, enqueue_pipeline, queue_status
+from app.models import DICOMStudy, JobKindChoices
+
+
+class Command(BaseCommand):
+    help = 'Queue background jobs for DICOM studies, chained rasterize -> DVH -> radiomics by default'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--study', action='append', dest='studies', default=[], help='Study Instance UID to queue (repeatable, default: all studies)')
+        parser.add_argument('--kind', action='append', dest='kinds', choices=JobKindChoices.values, help='Job kind, chained in the order given (repeatable, default: the pipeline)')
+        parser.add_argument('--priority', type=int, default=0, help='Priority of the jobs; higher runs first')
+
+    def handle(self, *args, **options):
+        studies = DICOMStudy.objects.all()
+        if options['studies']:
+            studies = studies.filter(study_instance_uid__in=options['studies'])
+
+        created = enqueue_pipeline(studies.values_list('pk', flat=True), priority=options['priority'], kinds=options['kinds'] or PIPELINE)
+
+        self.stdout.write(self.style.SUCCESS(f'Queued {created} jobs'))
+        for (kind, status), count in sorted(queue_status().items()):
+            self.stdout.write(f'{kind:<12} {status:<10} {count}')
@@ -0,0 +1,40 @@
+import sys
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.export import FORMATS, cohort_queryset, export_chunks
+
+
+class Command(BaseCommand):
+    help = 'Write the cohort as a flat CSV or Parquet table, streaming it in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Output file, or - for standard output")
+        parser.add_argument('--format', choices=sorted(FORMATS), default=None, help='Output format (default: from the file extension, else csv)')
+        parser.add_argument('--cancer-site', action='append', dest='cancer_site', default=[], help='Cancer site code to export (repeatable)')
+        parser.add_argument('--cancer-pathology', action='append', dest='cancer_pathology', default=[], help='Cancer pathology code to export (repeatable)')
+        parser.add_argument('--technique', action='append', default=[], help='Treatment technique code to export (repeatable)')
+        parser.add_argument('--modality', action='append', default=[], help='Study modality to export (repeatable)')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Studies read and written at a time (default: EXPORT_CHUNK_SIZE)')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        suffix = Path(output).suffix.lstrip('.')
+        format = options['format'] or (suffix if suffix in FORMATS else 'csv')
+        queryset = cohort_queryset(**{name: options[name] for name in ('cancer_site', 'cancer_pathology', 'technique', 'modality')})
+
+        stream = sys.stdout.buffer if output == '-' else open(output, 'wb')
+        try:
+            for chunk in export_chunks(queryset, format, options['chunk_size']):
+                stream.write(chunk.encode() if isinstance(chunk, str) else chunk)
+        except ImportError as error:
+            raise CommandError(f'{format} export needs {error.name} to be installed')
+        finally:
+            if output == '-':
+                stream.flush()
+            else:
+                stream.close()
+
+        if output != '-':
+            self.stdout.write(self.style.SUCCESS(f'Wrote {output}'))
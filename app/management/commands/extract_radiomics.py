@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.features import extract_features
+from app.models import DICOMStudy
+
+
+class Command(BaseCommand):
+    help = 'Extract radiomic features for every ROI of the RT Structure Sets in the DICOM studies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--study', action='append', dest='studies', default=[], help='Study Instance UID to process (repeatable, default: all studies)')
+        parser.add_argument('--params', default=None, help='pyradiomics parameter file (default: RADIOMICS_PARAMETER_FILE)')
+        parser.add_argument('--processes', type=int, default=None, help='Number of extraction processes (default: CPU count)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Feature sets per bulk insert')
+
+    def handle(self, *args, **options):
+        studies = DICOMStudy.objects.only('pk', 'study_instance_uid')
+        if options['studies']:
+            studies = studies.filter(study_instance_uid__in=options['studies'])
+
+        report = extract_features(
+            studies,
+            parameter_file=options['params'] or settings.RADIOMICS_PARAMETER_FILE,
+            processes=options['processes'],
+            batch_size=options['batch_size'],
+        )
+
+        for structure_set_uid, roi_name, error in report.failed:
+            self.stdout.write(self.style.ERROR(f'{roi_name} ({structure_set_uid}): {error}'))
+        self.stdout.write(self.style.SUCCESS(
+            f'{report.jobs} ROIs: {report.cached} cached, {report.extracted} extracted, '
+            f'{len(report.failed)} failed in {report.elapsed:.1f}s'
+        ))
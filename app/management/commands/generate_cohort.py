@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.models import DICOMStudy
+from app.synthetic import generate_cohort, write_dicom
+
+
+class Command(BaseCommand):
+    help = 'Create a synthetic cohort of patients, optionally with DICOM files for some of its studies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('patients', type=int, help='Number of patients to create')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator')
+        parser.add_argument('--prefix', default='SYN', help='Prefix of the patient UIDs')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Patients created per transaction')
+        parser.add_argument('--dicom-root', help='Directory to write DICOM files to')
+        parser.add_argument('--dicom-studies', type=int, default=10, help='Number of planning CT studies to write DICOM files for')
+        parser.add_argument('--registrations', type=int, default=0, help='Spatial Registrations (treatment fractions) to write per study')
+        parser.add_argument('--processes', type=int, default=None, help='Worker processes writing DICOM files (default: CPU count)')
+
+    def handle(self, *args, **options):
+        if options['patients'] < 1:
+            raise CommandError('patients must be at least 1')
+
+        report = generate_cohort(options['patients'], seed=options['seed'], batch_size=options['batch_size'], prefix=options['prefix'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {report.patients} patients, {report.diagnoses} diagnoses, {report.bookings} bookings '
+            f'({report.systemic_therapies} systemic therapies), {report.simulations} simulations and {report.studies} studies'
+        ))
+
+        if options['dicom_root']:
+            prefix = f"{options['prefix']}{options['seed']}-"
+            studies = DICOMStudy.objects.filter(radiotherapy_simulation__radiotherapy_booking__diagnosis__patient__patient_uid__startswith=prefix)
+            studies = DICOMStudy.objects.filter(pk__in=list(studies.filter(study_modality__startswith='CT').order_by('pk').values_list('pk', flat=True)[:options['dicom_studies']]))
+            files = write_dicom(options['dicom_root'], studies, processes=options['processes'], registrations=options['registrations'])
+            self.stdout.write(self.style.SUCCESS(f"Wrote {files} DICOM files to {options['dicom_root']}"))
@@ -0,0 +1,36 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.bulk_import import IMPORTERS, read_records
+
+
+class Command(BaseCommand):
+    help = 'Validate and bulk import registry records from a CSV, JSON or JSON Lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS), help='Type of record in the file')
+        parser.add_argument('path', help='File to import')
+        parser.add_argument('--format', choices=['csv', 'json', 'jsonl'], default=None, help='File format (default: taken from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Records validated and inserted per batch')
+        parser.add_argument('--dry-run', action='store_true', help='Validate the records without writing them')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.isfile(path):
+            raise CommandError(f'{path} does not exist')
+
+        importer = IMPORTERS[options['kind']](batch_size=options['batch_size'], dry_run=options['dry_run'])
+        try:
+            result = importer.run(read_records(path, options['format']))
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        for number, errors in result.errors:
+            for field, messages in errors.items():
+                for message in messages:
+                    self.stdout.write(self.style.ERROR(f'Record {number}: {field}: {message}'))
+        action = 'Validated' if options['dry_run'] else 'Imported'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {result.created} of {result.records} {options["kind"]} ({len(result.errors)} rejected)'
+        ))
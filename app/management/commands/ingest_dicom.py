@@ -0,0 +1,47 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.ingest import ingest_directory
+
+
+class Command(BaseCommand):
+    help = 'Read DICOM headers below a directory tree and create or update the matching DICOM Study records'
+
+    def add_arguments(self, parser):
+        parser.add_argument('root', help='Directory to scan for DICOM files')
+        parser.add_argument('--incremental', action='store_true', help='Only read files that are new or changed since the last run')
+        parser.add_argument('--processes', type=int, default=None, help='Number of header reader processes (default: CPU count)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per bulk insert')
+        parser.add_argument('--chunk-size', type=int, default=64, help='Files handed to a reader process at a time')
+        parser.add_argument('--date-tolerance', type=int, default=0, help='Maximum days between study date and simulation date')
+
+    def handle(self, *args, **options):
+        root = options['root']
+        if not os.path.isdir(root):
+            raise CommandError(f'{root} is not a directory')
+
+        def progress(done, elapsed):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{done} files read ({done / elapsed:.0f} files/s)')
+
+        report = ingest_directory(
+            root,
+            incremental=options['incremental'],
+            processes=options['processes'],
+            batch_size=options['batch_size'],
+            chunksize=options['chunk_size'],
+            date_tolerance=options['date_tolerance'],
+            progress=progress,
+        )
+
+        for study_instance_uid in report.unmatched if options['verbosity'] > 1 else ():
+            self.stdout.write(self.style.WARNING(f'No matching simulation for study {study_instance_uid}'))
+        self.stdout.write(
+            f'{report.files} files, {report.changed} read ({report.new_payloads} new payloads), {report.removed} removed, '
+            f'{report.dicom_files} DICOM instances in {report.studies} studies and {report.series} series'
+        )
+        self.stdout.write(f'{len(report.unmatched)} studies without a matching simulation')
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {report.created} and updated {report.updated} DICOM studies in {report.elapsed:.1f}s ({report.files_per_second:.0f} files read/s)'
+        ))
@@ -0,0 +1,62 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.loadtest import compare, run_loadtest, write_results
+
+
+class Command(BaseCommand):
+    help = 'Measure the throughput and latency of a running server on API urls, e.g. to compare a WSGI and an ASGI deployment.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', help='Urls to request in turn')
+        parser.add_argument('--concurrency', type=int, default=10, help='Concurrent connections')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run for')
+        parser.add_argument('--requests', type=int, default=None, help='Stop after this many requests')
+        parser.add_argument('--header', action='append', default=[], help='Request header as "Name: value" (repeatable)')
+        parser.add_argument('--cookie', help='Cookie header to send, e.g. "sessionid=..." of a logged in user')
+        parser.add_argument('--label', default='', help='Deployment the results belong to, e.g. wsgi or asgi')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be at least 1')
+        if options['compare'] and not os.path.isfile(options['compare']):
+            raise CommandError(f"{options['compare']} does not exist")
+        headers = {}
+        for header in options['header']:
+            name, separator, value = header.partition(':')
+            if not separator:
+                raise CommandError(f'Invalid header {header!r}; use "Name: value"')
+            headers[name.strip()] = value.strip()
+        if options['cookie']:
+            headers['Cookie'] = options['cookie']
+
+        results = run_loadtest(
+            options['urls'],
+            concurrency=options['concurrency'],
+            duration=options['duration'],
+            requests=options['requests'],
+            headers=headers,
+            label=options['label'],
+        )
+
+        latency = results['latency_ms']
+        self.stdout.write(
+            f"{results['requests']} requests in {results['seconds']:.1f}s ({results['requests_per_second'] or 0:.1f}/s), "
+            f"p50 {latency['p50']} ms, p90 {latency['p90']} ms, p99 {latency['p99']} ms, max {latency['max']} ms"
+        )
+        if results['errors']:
+            self.stdout.write(self.style.WARNING(f"{results['errors']} errors, e.g. {'; '.join(results['error_samples'])}"))
+        if options['output']:
+            write_results(results, options['output'])
+            self.stdout.write(self.style.SUCCESS(f"Wrote results to {options['output']}"))
+        if options['compare']:
+            with open(options['compare']) as handle:
+                baseline = json.load(handle)
+            for measure, before, after, ratio in compare(results, baseline):
+                worse = ratio < 0.9 if measure == 'requests_per_second' else ratio > 1.1
+                style = self.style.ERROR if worse else self.style.SUCCESS
+                self.stdout.write(style(f'{measure:<20} {before:>10.1f} -> {after:>10.1f} ({ratio:.2f}x)'))
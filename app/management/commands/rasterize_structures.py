@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from app.masks import rasterize_studies
+from app.models import DICOMStudy
+
+
+class Command(BaseCommand):
+    help = 'Rasterize the ROIs of the RT Structure Sets in the DICOM studies into the mask store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--study', action='append', dest='studies', default=[], help='Study Instance UID to process (repeatable, default: all studies)')
+        parser.add_argument('--processes', type=int, default=None, help='Number of rasterizing processes (default: CPU count)')
+
+    def handle(self, *args, **options):
+        studies = DICOMStudy.objects.only('pk', 'study_instance_uid')
+        if options['studies']:
+            studies = studies.filter(study_instance_uid__in=options['studies'])
+
+        rois, stored, elapsed = rasterize_studies(list(studies), processes=options['processes'])
+
+        self.stdout.write(self.style.SUCCESS(f'Stored masks for {stored} of {rois} ROIs in {elapsed:.1f}s'))
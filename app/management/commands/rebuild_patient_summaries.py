@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from app.summaries import refresh_patient_summaries
+
+
+class Command(BaseCommand):
+    help = 'Recompute the overview summary of every patient'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Summaries per bulk upsert')
+
+    def handle(self, *args, **options):
+        written = refresh_patient_summaries(batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} patient summaries'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from app.aggregates import refresh_aggregates
+
+
+class Command(BaseCommand):
+    help = 'Recompute the group-wise aggregates of the cancer sites queued for refresh'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute the aggregates of every cancer site')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Aggregate rows per bulk insert')
+
+    def handle(self, *args, **options):
+        sites, rows, elapsed = refresh_aggregates(full=options['full'], batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f'Refreshed {rows} aggregates of {sites} cancer sites in {elapsed:.1f}s'))
@@ -0,0 +1,69 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.models import DICOMStudy, RegistrationShift
+from app.registration import SHIFT_FIELDS, ingest_registrations, setup_errors
+
+
+def values(array):
+    '''
+    Return an array as a list for JSON, with NaN as None.
+    '''
+    return [None if value != value else value for value in array.tolist()]
+
+
+class Command(BaseCommand):
+    help = 'Report the systematic and random setup errors, margins and drifting courses from the registrations of verification imaging'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ingest', action='store_true', help='Parse the REG files of the studies before reporting')
+        parser.add_argument('--study', action='append', dest='studies', default=[], help='Study Instance UID to ingest and report (repeatable, default: all studies)')
+        parser.add_argument('--cancer-site', action='append', dest='cancer_site', default=[], help='Cancer site code to report (repeatable)')
+        parser.add_argument('--processes', type=int, default=None, help='Number of processes parsing REG files (default: CPU count)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Shifts per bulk insert')
+        parser.add_argument('--recompute', action='store_true', help='With --ingest, also parse REG files that were parsed before')
+        parser.add_argument('--drift-threshold', type=float, default=0.5, help='Translation drift in mm per fraction above which a course is listed')
+        parser.add_argument('--output', help='Write the report as JSON to this file')
+
+    def handle(self, *args, **options):
+        if options['ingest']:
+            studies = DICOMStudy.objects.only('pk', 'study_instance_uid')
+            if options['studies']:
+                studies = studies.filter(study_instance_uid__in=options['studies'])
+            registrations, elapsed = ingest_registrations(studies, processes=options['processes'], batch_size=options['batch_size'], recompute=options['recompute'])
+            self.stdout.write(self.style.SUCCESS(f'Stored {registrations} registrations in {elapsed:.1f}s'))
+
+        shifts = RegistrationShift.objects.all()
+        if options['studies']:
+            shifts = shifts.filter(dicom_study__study_instance_uid__in=options['studies'])
+        if options['cancer_site']:
+            shifts = shifts.filter(radiotherapy_booking__diagnosis__cancer_site__in=options['cancer_site'])
+        report = setup_errors(shifts)
+        if report is None:
+            raise CommandError('No registrations match')
+
+        margins = report.margins()
+        drifting = report.drifting(options['drift_threshold'])
+        self.stdout.write(f'{report.fractions} fractions of {len(report.courses)} courses')
+        self.stdout.write(f"{'':14}{'M':>8}{'Σ':>8}{'σ':>8}")
+        for index, field in enumerate(SHIFT_FIELDS):
+            self.stdout.write(f'{field:14}' + ''.join(f'{values[index]:8.2f}' for values in (report.mean, report.systematic, report.random)))
+        for recipe, margin in margins.items():
+            self.stdout.write(f'{recipe} margin (mm): ' + ', '.join(f'{value:.1f}' for value in margin))
+        self.stdout.write(f"{len(drifting)} courses drift by more than {options['drift_threshold']} mm per fraction")
+
+        if options['output']:
+            data = {
+                'fractions': report.fractions,
+                'courses': len(report.courses),
+                'components': SHIFT_FIELDS,
+                'mean': values(report.mean),
+                'systematic': values(report.systematic),
+                'random': values(report.random),
+                'margins': {recipe: values(margin) for recipe, margin in margins.items()},
+                'drifting_bookings': drifting.tolist(),
+            }
+            with open(options['output'], 'w') as output:
+                json.dump(data, output, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
@@ -0,0 +1,60 @@
+import logging
+import multiprocessing
+import os
+import signal
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from app.models import JobKindChoices
+
+
+def worker_process(kinds, burst, stop, poll_interval):
+    '''
+    Entry point of a worker process. Stops after its current job on SIGTERM; SIGINT is left to the parent.
+    '''
+    import django
+
+    django.setup()
+    from app.jobs import work
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(processName)s %(message)s')
+    work(kinds=kinds, burst=burst, stop=stop, poll_interval=poll_interval)
+
+
+class Command(BaseCommand):
+    help = 'Run worker processes that claim and run background jobs until interrupted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes (default: CPU count)')
+        parser.add_argument('--kind', action='append', dest='kinds', choices=JobKindChoices.values, help='Only run jobs of this kind (repeatable)')
+        parser.add_argument('--poll-interval', type=float, default=None, help='Seconds an idle worker waits between polls (default: JOB_POLL_INTERVAL)')
+        parser.add_argument('--burst', action='store_true', help='Exit once no job is runnable')
+
+    def handle(self, *args, **options):
+        stop = multiprocessing.Event()
+        # Workers open their own connections; a connection inherited through fork would be shared.
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(
+                target=worker_process,
+                args=(options['kinds'], options['burst'], stop, options['poll_interval']),
+                name=f'worker-{number}',
+            )
+            for number in range(options['workers'])
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(self.style.SUCCESS(f'Started {len(processes)} workers'))
+
+        def shutdown(signum, frame):
+            self.stdout.write('Stopping workers after their current job')
+            stop.set()
+
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+        for process in processes:
+            process.join()
+        self.stdout.write(self.style.SUCCESS('Workers stopped'))
@@ -0,0 +1,235 @@
+'''
+Vectorized rasterization of RTSTRUCT contours and an on-disk store of the masks.
+
+All contours of a ROI are rasterized at once with a scanline fill: every
+polygon edge is expanded into its crossings with the pixel rows of its slice,
+and a pixel is inside when an odd number of crossings lies to its right.
+Holes and several polygons per slice therefore follow the even-odd rule, as
+in the DICOM standard.
+
+Masks are stored cropped to their bounding box and bit-packed in a DiskCache,
+keyed by the SOP Instance UID of the structure set and the ROI number.
+Consumers open them memory-mapped instead of rasterizing again. The digest
+of the contours is stored with each mask, so a structure set resent under
+the same UID with edited contours is rasterized again.
+'''
+import hashlib
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+from django.conf import settings
+
+from app.dicom_files import series_files, study_files
+from app.disk_cache import DiskCache
+from app.metrics import timed
+from app.rtstruct import Geometry, load_structure_set, read_series_geometry
+
+
+def rasterize(contours, geometry):
+    '''
+    Rasterize contours onto the geometry.
+
+    Returns (mask, offset): a boolean (z, y, x) array cropped to the bounding
+    box of the contours and the (z, y, x) index of its first voxel, or
+    (None, None) if no contour falls on the grid.
+    '''
+    size_x, size_y, size_z = geometry.size
+    if not contours:
+        return None, None
+    lengths = np.array([len(contour) for contour in contours])
+    index = geometry.to_index(np.concatenate(contours))
+    contour_id = np.repeat(np.arange(len(contours)), lengths)
+
+    slices = np.rint(np.bincount(contour_id, weights=index[:, 2]) / lengths).astype(np.int64)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    following = np.arange(len(index)) + 1
+    following[starts + lengths - 1] = starts
+
+    x_a, y_a = index[:, 0], index[:, 1]
+    x_b, y_b = x_a[following], y_a[following]
+    z = slices[contour_id]
+    on_grid = (z >= 0) & (z < size_z) & (y_a != y_b)
+    x_a, y_a, x_b, y_b, z = x_a[on_grid], y_a[on_grid], x_b[on_grid], y_b[on_grid], z[on_grid]
+    if not len(z):
+        return None, None
+
+    # Each edge crosses the rows r with min(y) <= r < max(y).
+    first_row = np.maximum(np.ceil(np.minimum(y_a, y_b)), 0).astype(np.int64)
+    end_row = np.minimum(np.ceil(np.maximum(y_a, y_b)), size_y).astype(np.int64)
+    rows_per_edge = np.maximum(end_row - first_row, 0)
+    edge = np.repeat(np.arange(len(z)), rows_per_edge)
+    if not len(edge):
+        return None, None
+    row = first_row[edge] + np.arange(len(edge)) - np.repeat(np.cumsum(rows_per_edge) - rows_per_edge, rows_per_edge)
+    crossing = x_a[edge] + (row - y_a[edge]) * (x_b[edge] - x_a[edge]) / (y_b[edge] - y_a[edge])
+
+    x0 = max(int(np.floor(min(x_a.min(), x_b.min()))), 0)
+    x1 = min(int(np.ceil(max(x_a.max(), x_b.max()))) + 1, size_x)
+    z0, z1 = int(z.min()), int(z.max()) + 1
+    y0, y1 = int(row.min()), int(row.max()) + 1
+    if x0 >= x1:
+        return None, None
+    shape = (z1 - z0, y1 - y0, x1 - x0)
+
+    # A crossing at x lies at or left of pixel c exactly when ceil(x) <= c.
+    column = np.clip(np.ceil(crossing).astype(np.int64) - x0, 0, shape[2])
+    line = (z[edge] - z0) * shape[1] + (row - y0)
+    counts = np.bincount(line * (shape[2] + 1) + column, minlength=shape[0] * shape[1] * (shape[2] + 1))
+    counts = counts.reshape(shape[0], shape[1], shape[2] + 1)
+    left = np.cumsum(counts[:, :, :-1], axis=2)
+    total = counts.sum(axis=2, keepdims=True)
+    mask = (total - left) % 2 == 1
+    return mask, (z0, y0, x0)
+
+
+def contour_digest(contours):
+    '''
+    Return a digest of the contour points, stored with a mask to tell whether it is still current.
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    for contour in contours:
+        points = np.ascontiguousarray(contour, dtype=np.float64)
+        digest.update(len(points).to_bytes(8, 'little'))
+        digest.update(points.tobytes())
+    return digest.hexdigest()
+
+
+@dataclass
+class StoredMask:
+    '''
+    A mask opened from the store. packed is a memory-mapped array of packed bits.
+    '''
+    packed: np.ndarray
+    offset: tuple
+    shape: tuple
+    geometry: Geometry
+
+    def cropped(self):
+        '''
+        Return the boolean (z, y, x) mask cropped to its bounding box.
+        '''
+        count = int(np.prod(self.shape))
+        return np.unpackbits(self.packed, count=count).reshape(self.shape).view(bool)
+
+    def dense(self):
+        '''
+        Return the boolean (z, y, x) mask on the full image grid.
+        '''
+        size_x, size_y, size_z = self.geometry.size
+        mask = np.zeros((size_z, size_y, size_x), dtype=bool)
+        z0, y0, x0 = self.offset
+        depth, height, width = self.shape
+        mask[z0:z0 + depth, y0:y0 + height, x0:x0 + width] = self.cropped()
+        return mask
+
+    @property
+    def voxels(self):
+        return int(np.unpackbits(self.packed).sum())
+
+
+class MaskStore:
+    '''
+    Bit-packed, bounding-box-cropped masks keyed by structure set SOP Instance UID and ROI number.
+    '''
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.cache = DiskCache(directory or settings.MASK_STORE_DIR, max_bytes or settings.MASK_STORE_BYTES)
+
+    @staticmethod
+    def key(structure_set_uid, roi_number):
+        return hashlib.blake2b(f'{structure_set_uid}/{roi_number}'.encode(), digest_size=16).hexdigest()
+
+    def open(self, structure_set_uid, roi_number, geometry=None, digest=None):
+        '''
+        Open a stored mask, or return None if it is missing, was rasterized on a
+        different geometry or, when digest is given, from other contours.
+        '''
+        key = self.key(structure_set_uid, roi_number)
+        metadata = self.cache.read_json(key, 'json')
+        if metadata is None:
+            return None
+        if digest is not None and metadata.get('contours') != digest:
+            return None
+        stored_geometry = Geometry(*(tuple(metadata['geometry'][name]) for name in ('origin', 'spacing', 'direction', 'size')))
+        if geometry is not None and not np.allclose(
+            np.concatenate([stored_geometry.origin, stored_geometry.spacing, stored_geometry.direction, stored_geometry.size]),
+            np.concatenate([geometry.origin, geometry.spacing, geometry.direction, geometry.size]),
+        ):
+            return None
+        packed = self.cache.load_array(key, 'npy')
+        if packed is None:
+            return None
+        return StoredMask(packed, tuple(metadata['offset']), tuple(metadata['shape']), stored_geometry)
+
+    def save(self, structure_set_uid, roi_number, mask, offset, geometry, digest=None):
+        key = self.key(structure_set_uid, roi_number)
+        self.cache.save_array(key, 'npy', np.packbits(mask, axis=None))
+        self.cache.write_json(key, 'json', {
+            'structure_set_uid': structure_set_uid,
+            'roi_number': roi_number,
+            'contours': digest,
+            'offset': list(offset),
+            'shape': list(mask.shape),
+            'geometry': {
+                'origin': list(geometry.origin),
+                'spacing': list(geometry.spacing),
+                'direction': list(geometry.direction),
+                'size': list(geometry.size),
+            },
+        })
+        self.cache.evict(keep={key})
+        return self.open(structure_set_uid, roi_number)
+
+    def get_or_rasterize(self, structure_set_uid, roi_number, contours, geometry):
+        '''
+        Return the stored mask of a ROI, rasterizing and storing it first if needed.
+
+        Returns None if the contours do not fall on the geometry.
+        '''
+        digest = contour_digest(contours)
+        stored = self.open(structure_set_uid, roi_number, geometry, digest)
+        if stored is not None:
+            return stored
+        mask, offset = rasterize(contours, geometry)
+        if mask is None:
+            return None
+        return self.save(structure_set_uid, roi_number, mask, offset, geometry, digest)
+
+
+def rasterize_structure_set(structure_set, image_paths):
+    '''
+    Rasterize every ROI of a structure set into the store. Runs inside pool workers.
+
+    Returns the number of ROIs stored.
+    '''
+    try:
+        geometry = read_series_geometry(image_paths)
+    except Exception:
+        return 0
+    store = MaskStore()
+    return sum(
+        store.get_or_rasterize(structure_set.sop_instance_uid, roi.number, roi.contours, geometry) is not None
+        for roi in structure_set.rois
+    )
+
+
+@timed('rasterize')
+def rasterize_studies(studies, processes=None):
+    '''
+    Rasterize the ROIs of every structure set in the DICOM studies into the mask store.
+
+    Returns (rois, stored, elapsed).
+    '''
+    start = time.perf_counter()
+    study_uids = [study.study_instance_uid for study in studies]
+    paths = [path for study_paths in study_files(study_uids, 'RTSTRUCT').values() for path in study_paths]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        structure_sets = [structure_set for structure_set in executor.map(load_structure_set, paths) if structure_set is not None]
+        images = series_files({structure_set.referenced_series_uid for structure_set in structure_sets})
+        structure_sets = [structure_set for structure_set in structure_sets if structure_set.referenced_series_uid in images]
+        image_paths = [images[structure_set.referenced_series_uid] for structure_set in structure_sets]
+        stored = sum(executor.map(rasterize_structure_set, structure_sets, image_paths))
+    rois = sum(len(structure_set.rois) for structure_set in structure_sets)
+    return rois, stored, time.perf_counter() - start
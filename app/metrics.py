@@ -0,0 +1,270 @@
+'''
+In-process performance metrics in the Prometheus text exposition format.
+
+MetricsMiddleware records, per URL pattern, the latency, number of queries,
+time spent in the database and size of the responses to a sample of
+METRICS_SAMPLE_RATE of the requests. Queries are counted by an execute
+wrapper installed on every database connection, which looks up the recorder
+of the current request in a context variable, so it follows async views
+into the threads their queries run in. Unsampled requests set no recorder,
+which leaves them with a random() call and a context variable lookup per
+query. Sampled requests slower than METRICS_SLOW_REQUEST_SECONDS are logged
+with their queries.
+
+timed() records the duration of the ingest, rasterization, DVH, radiomics
+and other stages wherever they run. The metrics view serves everything as
+histograms for a Prometheus server to scrape.
+
+Metrics are kept per process: with several server or worker processes each
+one exposes its own, so scrape them one by one or run a single process.
+'''
+import bisect
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (1 << 10, 1 << 12, 1 << 14, 1 << 16, 1 << 18, 1 << 20, 1 << 22, 1 << 24)
+STAGE_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    '''
+    Monotonic counter by label values.
+    '''
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}{format_labels(self.labels, labels)} {format_value(value)}'
+
+
+class Histogram:
+    '''
+    Distribution of observed values over fixed buckets, by label values.
+    '''
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                # Counts per bucket, then the +Inf bucket, then the sum.
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self.lock:
+            values = {labels: list(counts) for labels, counts in self.values.items()}
+        for labels, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                le = bound if bound == '+Inf' else format_value(bound)
+                yield f'{self.name}_bucket{format_labels(self.labels, labels, [("le", le)])} {cumulative}'
+            yield f'{self.name}_sum{format_labels(self.labels, labels)} {format_value(counts[-1])}'
+            yield f'{self.name}_count{format_labels(self.labels, labels)} {cumulative}'
+
+
+class Registry:
+    '''
+    The metrics of this process.
+    '''
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def expose(self):
+        '''
+        Return every metric in the Prometheus text exposition format.
+        '''
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_seconds = registry.register(Histogram('quantrad_request_seconds', 'Latency of sampled requests by URL pattern.', ('route', 'method')))
+request_queries = registry.register(Histogram('quantrad_request_queries', 'Database queries of sampled requests by URL pattern.', ('route', 'method'), QUERY_BUCKETS))
+request_db_seconds = registry.register(Histogram('quantrad_request_db_seconds', 'Database time of sampled requests by URL pattern.', ('route', 'method')))
+response_bytes = registry.register(Histogram('quantrad_response_bytes', 'Size of the non-streaming responses to sampled requests by URL pattern.', ('route', 'method'), SIZE_BUCKETS))
+responses = registry.register(Counter('quantrad_responses_total', 'Sampled responses by URL pattern and status code.', ('route', 'method', 'status')))
+stage_seconds = registry.register(Histogram('quantrad_stage_seconds', 'Duration of processing stages.', ('stage',), STAGE_BUCKETS))
+stage_failures = registry.register(Counter('quantrad_stage_failures_total', 'Processing stages that raised.', ('stage',)))
+
+
+@contextmanager
+def timed(stage):
+    '''
+    Record the duration of the block as a run of a processing stage, and log it. Also usable as a decorator.
+
+    The duration is logged too, since stages run by the job workers are not
+    in the registry of the server process.
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        stage_failures.inc(stage)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        stage_seconds.observe(seconds, stage)
+        logger.info('Stage %s took %.3fs', stage, seconds)
+
+
+class QueryRecorder:
+    '''
+    Database execute wrapper counting the queries of a request and their time.
+    '''
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    @property
+    def seconds(self):
+        return sum(seconds for sql, seconds in self.queries)
+
+
+# Recorder of the queries of the current request, None when it is not sampled.
+current_recorder = ContextVar('current_recorder', default=None)
+
+
+def record_queries(execute, sql, params, many, context):
+    recorder = current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    '''
+    Install record_queries on a new database connection. Connected to connection_created.
+    '''
+    if record_queries not in connection.execute_wrappers:
+        # First, so wrappers pushed and popped with connection.execute_wrapper() stay on top.
+        connection.execute_wrappers.insert(0, record_queries)
+
+
+def route(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unmatched>'
+    return f'{match.namespace}:{match.route}' if match.namespace else match.route
+
+
+def record(request, response, recorder, seconds):
+    labels = (route(request), request.method)
+    request_seconds.observe(seconds, *labels)
+    request_queries.observe(len(recorder.queries), *labels)
+    request_db_seconds.observe(recorder.seconds, *labels)
+    if not response.streaming:
+        response_bytes.observe(len(response.content), *labels)
+    responses.inc(*labels, str(response.status_code))
+    if seconds >= settings.METRICS_SLOW_REQUEST_SECONDS:
+        logger.warning(
+            'Slow request %s %s: %.3fs, %d queries in %.3fs\n%s',
+            request.method, request.get_full_path(), seconds, len(recorder.queries), recorder.seconds,
+            '\n'.join(f'{seconds * 1000:8.1f} ms  {sql}' for sql, seconds in recorder.queries),
+        )
+
+
+class MetricsMiddleware:
+    '''
+    Record the latency, queries, database time and response size of a sample of the requests.
+
+    Serves sync and async views without adapting either.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        record(request, response, recorder, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            return await self.get_response(request)
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        record(request, response, recorder, time.perf_counter() - start)
+        return response
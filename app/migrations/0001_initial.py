@@ -0,0 +1,130 @@
+# Generated by Django 5.2.9 on 2026-10-18 00:30
+
+import django.core.validators
+import django.db.models.deletion
+import django.db.models.expressions
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('lookup', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Patient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('patient_uid', models.CharField(help_text="Enter the patient's Hospital Unique ID", max_length=255, unique=True, verbose_name='Patient Hospital Unique ID')),
+                ('name', models.CharField(help_text="Enter the patient's name", max_length=255, verbose_name='Patient Name')),
+                ('date_of_birth', models.DateField(help_text="Enter the patient's date of birth", verbose_name='Date of Birth')),
+                ('gender', models.CharField(choices=[('M', 'Male'), ('F', 'Female'), ('O', 'Other')], help_text="Enter the patient's gender", max_length=10, verbose_name='Gender')),
+                ('date_of_registration', models.DateField(auto_now_add=True, help_text="Enter the patient's date of registration", verbose_name='Date of Registration')),
+                ('age_at_registration', models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(models.F('date_of_registration'), '-', models.F('date_of_birth')), output_field=models.DurationField())),
+                ('created_at', models.DateTimeField(auto_now_add=True, help_text="Enter Date Time when this patient's record was created", verbose_name='Created At')),
+                ('modified_at', models.DateTimeField(auto_now=True, help_text="Enter the Date Time when this patient's record was modified", verbose_name='Modified At')),
+            ],
+            options={
+                'verbose_name': 'Patient',
+                'verbose_name_plural': 'Patients',
+            },
+        ),
+        migrations.CreateModel(
+            name='Diagnosis',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cancer_side', models.CharField(choices=[('L', 'Left'), ('R', 'Right'), ('BL', 'Bilateral'), ('ML', 'Midline'), ('C', 'Central'), ('NA', 'Not Applicable')], help_text='Enter side where the primary cancer occured. Again this is the site of the primary disease not of the metastases', max_length=20, verbose_name='Side of the Primary Cancer')),
+                ('date_of_diagnosis', models.DateField(help_text="Enter the patient's date of primary cancer diagnosis. Note that this date can be earlier than the date of present reason why radiotherapy is being administered.", verbose_name='Date of Primary Diagnosis')),
+                ('ajcc_t_stage_prefix', models.CharField(choices=[('c', 'Clinical or radiological'), ('p', 'Pathological'), ('r', 'Retreatment'), ('yp', 'Post Neoadjuvant Pathological'), ('yc', 'Post Neoadjuvant Clinical')], default='c', help_text='Enter the AJCC T Stage Prefix', max_length=20, verbose_name='AJCC T Stage Prefix')),
+                ('ajcc_t_stage_major', models.CharField(choices=[('is', 'Tis'), ('x', 'Tx'), ('0', 'T0'), ('1', 'T1'), ('1a', 'T1a'), ('1b', 'T1b'), ('1c', 'T1c'), ('1d', 'T1d'), ('2', 'T2'), ('2a', 'T2a'), ('2b', 'T2b'), ('2c', 'T2c'), ('2d', 'T2d'), ('3', 'T3'), ('3a', 'T3a'), ('3b', 'T3b'), ('3c', 'T3c'), ('3d', 'T3d'), ('4', 'T4'), ('4a', 'T4a'), ('4b', 'T4b'), ('4c', 'T4c'), ('4d', 'T4d')], default='0', help_text='Enter the AJCC T Stage Major', max_length=20, verbose_name='AJCC T Stage Major')),
+                ('ajcc_t_stage_suffix', models.CharField(blank=True, choices=[('i', 'isolated tumor cells'), ('m', 'multifocal'), ('mi', 'micrometastasis')], help_text='Enter the AJCC T Stage Suffix', max_length=20, null=True, verbose_name='AJCC T Stage Suffix')),
+                ('ajcc_n_stage_prefix', models.CharField(choices=[('c', 'Clinical or radiological'), ('p', 'Pathological'), ('r', 'Retreatment'), ('yp', 'Post Neoadjuvant Pathological'), ('yc', 'Post Neoadjuvant Clinical')], default='c', help_text='Enter the AJCC N Stage Prefix', max_length=20, verbose_name='AJCC N Stage Prefix')),
+                ('ajcc_n_stage_major', models.CharField(choices=[('0', 'N0'), ('1', 'N1'), ('1a', 'N1a'), ('1b', 'N1b'), ('1c', 'N1c'), ('1d', 'N1d'), ('2', 'N2'), ('2a', 'N2a'), ('2b', 'N2b'), ('2c', 'N2c'), ('2d', 'N2d'), ('3', 'N3'), ('3a', 'N3a'), ('3b', 'N3b'), ('3c', 'N3c'), ('3d', 'N3d'), ('4', 'N4'), ('4a', 'N4a'), ('4b', 'N4b'), ('4c', 'N4c'), ('4d', 'N4d'), ('x', 'Nx')], default='0', help_text='Enter the AJCC N Stage Major', max_length=20, verbose_name='AJCC N Stage Major')),
+                ('ajcc_n_stage_suffix', models.CharField(blank=True, choices=[('i', 'isolated tumor cells'), ('m', 'multifocal'), ('mi', 'micrometastasis')], help_text='Enter the AJCC N Stage Suffix', max_length=20, null=True, verbose_name='AJCC N Stage Suffix')),
+                ('ajcc_m_stage_prefix', models.CharField(choices=[('c', 'Clinical or radiological'), ('p', 'Pathological'), ('r', 'Retreatment'), ('yp', 'Post Neoadjuvant Pathological'), ('yc', 'Post Neoadjuvant Clinical')], default='c', help_text='Enter the AJCC M Stage Prefix', max_length=20, verbose_name='AJCC M Stage Prefix')),
+                ('ajcc_m_stage_major', models.CharField(choices=[('0', 'M0'), ('1', 'M1'), ('1a', 'M1a'), ('1b', 'M1b'), ('1c', 'M1c')], default='0', help_text='Enter the AJCC M Stage Major', max_length=20, verbose_name='AJCC M Stage Major')),
+                ('ajcc_m_stage_suffix', models.CharField(blank=True, choices=[('i', 'isolated tumor cells'), ('m', 'multifocal'), ('mi', 'micrometastasis')], help_text='Enter the AJCC M Stage Suffix', max_length=20, null=True, verbose_name='AJCC M Stage Suffix')),
+                ('overall_stage', models.CharField(blank=True, help_text='Enter the Overall Stage', max_length=20, null=True, verbose_name='Overall Stage')),
+                ('created_at', models.DateTimeField(auto_now_add=True, help_text="Enter Date Time when this patient's record was created", verbose_name='Created At')),
+                ('modified_at', models.DateTimeField(auto_now=True, help_text="Enter the Date Time when this patient's record was modified", verbose_name='Modified At')),
+                ('cancer_pathology', models.ForeignKey(help_text="Enter the patient's primary cancer pathology.", on_delete=django.db.models.deletion.CASCADE, to='lookup.lookuppathology', verbose_name='Pathology of the Cancer')),
+                ('cancer_site', models.ForeignKey(help_text="Enter the patient's primary cancer site. For example if the patient has been diagnosed with a brain metastases from a breast cancer, enter breast cancer here not brain metastases.", on_delete=django.db.models.deletion.CASCADE, to='lookup.lookupcancersite', verbose_name='Primary Site of the Cancer')),
+                ('patient', models.ForeignKey(help_text="Enter the patient's name", on_delete=django.db.models.deletion.CASCADE, to='app.patient', verbose_name='Patient')),
+            ],
+            options={
+                'verbose_name': 'Diagnosis',
+                'verbose_name_plural': 'Diagnoses',
+            },
+        ),
+        migrations.CreateModel(
+            name='RadiotherapyBooking',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('radiotherapy_treatment_intent', models.CharField(choices=[('curative', 'Curative'), ('palliative', 'Palliative')], help_text='Enter the treatment intent', max_length=30, verbose_name='Radiotherapy Treatment Intent')),
+                ('radiotherapy_treatment_sequence', models.CharField(choices=[('definitive', 'Definitive'), ('adjuvant', 'Adjuvant'), ('neoadjuvant', 'Neoadjuvant'), ('prophylactic', 'Prophylactic'), ('palliative', 'Palliative')], help_text='Enter the treatment sequence', max_length=30, verbose_name='Radiotherapy Treatment Sequence')),
+                ('radiotherapy_modality', models.CharField(choices=[('EBRT', 'External Beam Radiotherapy'), ('BRT', 'Brachytherapy')], help_text='Enter the radiotherapy modality', max_length=30, verbose_name='Radiotherapy Modality')),
+                ('concurrent_systemic_therapy', models.BooleanField(default=False, help_text='Enter if concurrent systemic therapy is planned', verbose_name='Concurrent Systemic Therapy Planned')),
+                ('proposed_planning_image_date', models.DateField(blank=True, help_text='Enter the proposed date for radiotherapy planning', null=True, verbose_name='Proposed Planning Imaging Date')),
+                ('proposed_treatment_start_date', models.DateField(blank=True, help_text='Enter the proposed treatment start date', null=True, verbose_name='Proposed Treatment Start Date')),
+                ('planned_total_dose', models.DecimalField(decimal_places=2, default=0, help_text='Enter the planned total dose (Gy)', max_digits=5, validators=[django.core.validators.MaxValueValidator(300), django.core.validators.MinValueValidator(0)], verbose_name='Planned Total Dose')),
+                ('planned_total_number_of_fractions', models.IntegerField(default=1, help_text='Enter the planned total number of fractions', validators=[django.core.validators.MaxValueValidator(300), django.core.validators.MinValueValidator(0)], verbose_name='Planned Total Number of Fractions')),
+                ('planned_number_of_fractions_per_day', models.IntegerField(blank=True, default=1, help_text='Enter the planned number of fractions per day', null=True, validators=[django.core.validators.MaxValueValidator(4), django.core.validators.MinValueValidator(1)], verbose_name='Planned Number of Fractions per Day')),
+                ('planned_number_of_fractions_per_week', models.IntegerField(blank=True, default=5, help_text='Enter the planned number of fractions per week', null=True, validators=[django.core.validators.MaxValueValidator(28), django.core.validators.MinValueValidator(1)], verbose_name='Planned Number of Fractions per Week')),
+                ('planned_dose_per_fraction', models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(models.F('planned_total_dose'), '/', models.F('planned_total_number_of_fractions')), help_text='The planned dose per fraction', output_field=models.DecimalField(decimal_places=2, max_digits=5), verbose_name='Planned Dose per Fraction')),
+                ('planned_overall_treatment_duration', models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('planned_total_number_of_fractions'), '*', models.Value(7)), '/', models.F('planned_number_of_fractions_per_day')), '*', models.F('planned_number_of_fractions_per_week')), help_text='The planned overall treatment duration in days', output_field=models.IntegerField(), verbose_name='Planned Overall Treatment Duration in days')),
+                ('created_at', models.DateTimeField(auto_now_add=True, help_text="Enter Date Time when this patient's record was created", verbose_name='Created At')),
+                ('modified_at', models.DateTimeField(auto_now=True, help_text="Enter the Date Time when this patient's record was modified", verbose_name='Modified At')),
+                ('diagnosis', models.ForeignKey(help_text='Enter the diagnosis for the patient', on_delete=django.db.models.deletion.CASCADE, to='app.diagnosis', verbose_name='Linked Diagnosis')),
+                ('radiotherapy_billing_category', models.ForeignKey(help_text='Enter the billing code', on_delete=django.db.models.deletion.CASCADE, to='lookup.lookupbillingcode', verbose_name='Radiotherapy Billing Category')),
+                ('radiotherapy_treatment_technique', models.ForeignKey(help_text='Enter the radiotherapy treatment technique', on_delete=django.db.models.deletion.CASCADE, to='lookup.lookupradiotherapytreatmenttechnique', verbose_name='Radiotherapy Treatment Technique')),
+                ('systemic_therapy_type', models.ManyToManyField(help_text='Select the systemic therapy type(s) to be administered concurrently with radiotherapy', to='lookup.lookupsystemictherapytype', verbose_name='Concurrent Systemic Therapy Type')),
+            ],
+            options={
+                'verbose_name': 'Radiotherapy Booking',
+                'verbose_name_plural': 'Radiotherapy Bookings',
+            },
+        ),
+        migrations.CreateModel(
+            name='RadiotherapySimulation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('simulation_appointment_type', models.CharField(choices=[('Practice', 'Practice Session'), ('Final', 'Final Scan Session')], help_text='Enter the type of simulation appointment', max_length=256, verbose_name='Simulation Appointment Type')),
+                ('date_of_simulation', models.DateField(help_text='Enter the date when the simulation was performed', verbose_name='Date of Simulation')),
+                ('simulation_done', models.BooleanField(default=False, help_text='Check if the simulation was done', verbose_name='Simulation Done')),
+                ('reason_why_simulation_not_done', models.TextField(blank=True, null=True, verbose_name='Reason Why Simulation Not Done')),
+                ('image_sequences', models.CharField(blank=True, help_text='Enter the image sequences acquired during simulation', max_length=256, null=True, verbose_name='Image Sequences')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('radiotherapy_booking', models.ForeignKey(help_text='Select the Radiotherapy Booking for which the simulation was performed', on_delete=django.db.models.deletion.CASCADE, to='app.radiotherapybooking', verbose_name='Radiotherapy Booking')),
+            ],
+            options={
+                'verbose_name': 'Radiotherapy Simulation',
+                'verbose_name_plural': 'Radiotherapy Simulations',
+            },
+        ),
+        migrations.CreateModel(
+            name='DICOMStudy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('study_instance_uid', models.CharField(help_text='Enter the Study Instance UID of the DICOM study', max_length=256, verbose_name='Study Instance UID')),
+                ('study_date_time', models.DateTimeField(help_text='Enter the date and time when the DICOM study was acquired', verbose_name='Study Date Time')),
+                ('study_modality', models.CharField(help_text='Enter the modality of the DICOM study', max_length=256, verbose_name='Study Modality')),
+                ('study_description', models.CharField(help_text='Enter the description of the DICOM study', max_length=256, verbose_name='Study Description')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('radiotherapy_simulation', models.ForeignKey(help_text='Select the Radiotherapy Simulation for which the DICOM study was acquired', on_delete=django.db.models.deletion.CASCADE, to='app.radiotherapysimulation', verbose_name='Radiotherapy Simulation')),
+            ],
+            options={
+                'verbose_name': 'DICOM Study',
+                'verbose_name_plural': 'DICOM Studies',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='diagnosis',
+            constraint=models.UniqueConstraint(fields=('patient', 'cancer_site', 'cancer_side', 'cancer_pathology'), name='unique_patient_cancer_site_side_pathology'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.9 on 2026-10-18 00:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DICOMFileManifest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(help_text='Absolute path of the file', max_length=1024, unique=True, verbose_name='Path')),
+                ('size', models.BigIntegerField(help_text='Size of the file in bytes when it was ingested', verbose_name='Size')),
+                ('mtime_ns', models.BigIntegerField(help_text='Modification time of the file in nanoseconds when it was ingested', verbose_name='Modification Time')),
+                ('sop_instance_uid', models.CharField(blank=True, db_index=True, help_text='SOP Instance UID of the file, empty if the file is not DICOM', max_length=256, verbose_name='SOP Instance UID')),
+                ('study_instance_uid', models.CharField(blank=True, db_index=True, max_length=256, verbose_name='Study Instance UID')),
+                ('series_instance_uid', models.CharField(blank=True, max_length=256, verbose_name='Series Instance UID')),
+                ('modality', models.CharField(blank=True, max_length=16, verbose_name='Modality')),
+                ('content_hash', models.CharField(help_text='SHA-256 of the file content', max_length=64, verbose_name='Content Hash')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('dicom_study', models.ForeignKey(blank=True, help_text='DICOM Study the file was ingested into', null=True, on_delete=django.db.models.deletion.SET_NULL, to='app.dicomstudy', verbose_name='DICOM Study')),
+            ],
+            options={
+                'verbose_name': 'DICOM File Manifest Entry',
+                'verbose_name_plural': 'DICOM File Manifest',
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.9 on 2026-10-18 00:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_dicom_file_manifest'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dicomfilemanifest',
+            name='series_instance_uid',
+            field=models.CharField(blank=True, db_index=True, max_length=256, verbose_name='Series Instance UID'),
+        ),
+        migrations.CreateModel(
+            name='RadiomicFeatureSet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('structure_set_uid', models.CharField(max_length=256, verbose_name='Structure Set SOP Instance UID')),
+                ('roi_number', models.IntegerField(verbose_name='ROI Number')),
+                ('roi_name', models.CharField(max_length=256, verbose_name='ROI Name')),
+                ('series_instance_uid', models.CharField(help_text='Series Instance UID of the image the features were extracted from', max_length=256, verbose_name='Image Series Instance UID')),
+                ('parameter_hash', models.CharField(help_text='SHA-256 of the extraction parameter file', max_length=64, verbose_name='Parameter Hash')),
+                ('cache_key', models.CharField(help_text='SHA-256 of the image series UID, ROI contour data and parameter file', max_length=64, unique=True, verbose_name='Cache Key')),
+                ('features', models.JSONField(help_text='Feature name to value map returned by pyradiomics', verbose_name='Features')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('dicom_study', models.ForeignKey(help_text='DICOM Study containing the structure set and image', on_delete=django.db.models.deletion.CASCADE, to='app.dicomstudy', verbose_name='DICOM Study')),
+            ],
+            options={
+                'verbose_name': 'Radiomic Feature Set',
+                'verbose_name_plural': 'Radiomic Feature Sets',
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.9 on 2026-10-18 00:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_radiomic_feature_set'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StructureVolume',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('structure_set_uid', models.CharField(max_length=256, verbose_name='Structure Set SOP Instance UID')),
+                ('roi_number', models.IntegerField(verbose_name='ROI Number')),
+                ('roi_name', models.CharField(max_length=256, verbose_name='ROI Name')),
+                ('volume', models.FloatField(blank=True, help_text='Contoured area times slice thickness, empty if the slice thickness is unknown', null=True, verbose_name='Volume (cm³)')),
+                ('centroid_x', models.FloatField(verbose_name='Centroid X (mm)')),
+                ('centroid_y', models.FloatField(verbose_name='Centroid Y (mm)')),
+                ('centroid_z', models.FloatField(verbose_name='Centroid Z (mm)')),
+                ('extent_x', models.FloatField(help_text='Size of the bounding box of the contour points', verbose_name='Extent X (mm)')),
+                ('extent_y', models.FloatField(help_text='Size of the bounding box of the contour points', verbose_name='Extent Y (mm)')),
+                ('extent_z', models.FloatField(help_text='Size of the bounding box of the contour points', verbose_name='Extent Z (mm)')),
+                ('slice_count', models.IntegerField(help_text='Number of contoured planes', verbose_name='Slice Count')),
+                ('slice_thickness', models.FloatField(blank=True, help_text='Smallest spacing between contoured planes', null=True, verbose_name='Slice Thickness (mm)')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('dicom_study', models.ForeignKey(help_text='DICOM Study containing the structure set', on_delete=django.db.models.deletion.CASCADE, to='app.dicomstudy', verbose_name='DICOM Study')),
+            ],
+            options={
+                'verbose_name': 'Structure Volume',
+                'verbose_name_plural': 'Structure Volumes',
+                'constraints': [models.UniqueConstraint(fields=('structure_set_uid', 'roi_number'), name='unique_structure_set_roi_volume')],
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.9 on 2026-10-18 00:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_structure_volume'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoseVolumeHistogram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dose_uid', models.CharField(max_length=256, verbose_name='RT Dose SOP Instance UID')),
+                ('plan_uid', models.CharField(blank=True, db_index=True, help_text='Plan referenced by the dose, empty if none', max_length=256, verbose_name='RT Plan SOP Instance UID')),
+                ('structure_set_uid', models.CharField(max_length=256, verbose_name='Structure Set SOP Instance UID')),
+                ('roi_number', models.IntegerField(verbose_name='ROI Number')),
+                ('roi_name', models.CharField(db_index=True, max_length=256, verbose_name='ROI Name')),
+                ('volume', models.FloatField(help_text='Volume of the ROI mask the dose was sampled on', verbose_name='Volume (cm³)')),
+                ('bin_width', models.FloatField(verbose_name='Bin Width (Gy)')),
+                ('histogram', models.BinaryField(help_text='Cumulative volume in cm³ receiving at least i × bin width, as little-endian float32', verbose_name='Histogram')),
+                ('d_min', models.FloatField(verbose_name='Dmin (Gy)')),
+                ('d_mean', models.FloatField(db_index=True, verbose_name='Dmean (Gy)')),
+                ('d_max', models.FloatField(db_index=True, verbose_name='Dmax (Gy)')),
+                ('d_2', models.FloatField(db_index=True, verbose_name='D2% (Gy)')),
+                ('d_50', models.FloatField(db_index=True, verbose_name='D50% (Gy)')),
+                ('d_95', models.FloatField(db_index=True, verbose_name='D95% (Gy)')),
+                ('d_98', models.FloatField(db_index=True, verbose_name='D98% (Gy)')),
+                ('v_5', models.FloatField(db_index=True, verbose_name='V5Gy (%)')),
+                ('v_10', models.FloatField(db_index=True, verbose_name='V10Gy (%)')),
+                ('v_20', models.FloatField(db_index=True, verbose_name='V20Gy (%)')),
+                ('v_30', models.FloatField(db_index=True, verbose_name='V30Gy (%)')),
+                ('v_40', models.FloatField(db_index=True, verbose_name='V40Gy (%)')),
+                ('v_50', models.FloatField(db_index=True, verbose_name='V50Gy (%)')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('dicom_study', models.ForeignKey(help_text='DICOM Study containing the dose and structure set', on_delete=django.db.models.deletion.CASCADE, to='app.dicomstudy', verbose_name='DICOM Study')),
+            ],
+            options={
+                'verbose_name': 'Dose Volume Histogram',
+                'verbose_name_plural': 'Dose Volume Histograms',
+                'constraints': [models.UniqueConstraint(fields=('dose_uid', 'structure_set_uid', 'roi_number'), name='unique_dose_structure_set_roi_dvh')],
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.9 on 2026-10-18 00:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_dose_volume_histogram'),
+        ('lookup', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AggregateRefreshQueue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('dose', 'Dose Volume Histogram Metrics'), ('radiomics', 'Radiomic Features'), ('volume', 'Structure Volumes')], max_length=20, verbose_name='Measurement Source')),
+                ('queued_at', models.DateTimeField(auto_now_add=True, verbose_name='Queued At')),
+                ('cancer_site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='lookup.lookupcancersite', verbose_name='Primary Site of the Cancer')),
+            ],
+            options={
+                'verbose_name': 'Aggregate Refresh Queue Entry',
+                'verbose_name_plural': 'Aggregate Refresh Queue',
+                'constraints': [models.UniqueConstraint(fields=('cancer_site', 'source'), name='aggregate_refresh_queue_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CohortAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('grouping', models.CharField(choices=[('site', 'Cancer Site'), ('pathology', 'Cancer Site and Pathology'), ('stage', 'Cancer Site and AJCC Stage'), ('technique', 'Cancer Site and Treatment Technique'), ('full', 'Cancer Site, Pathology, AJCC Stage and Treatment Technique')], help_text='Cohort key the statistics are grouped by; fields outside the grouping are empty', max_length=20, verbose_name='Grouping')),
+                ('ajcc_t_stage_major', models.CharField(blank=True, choices=[('is', 'Tis'), ('x', 'Tx'), ('0', 'T0'), ('1', 'T1'), ('1a', 'T1a'), ('1b', 'T1b'), ('1c', 'T1c'), ('1d', 'T1d'), ('2', 'T2'), ('2a', 'T2a'), ('2b', 'T2b'), ('2c', 'T2c'), ('2d', 'T2d'), ('3', 'T3'), ('3a', 'T3a'), ('3b', 'T3b'), ('3c', 'T3c'), ('3d', 'T3d'), ('4', 'T4'), ('4a', 'T4a'), ('4b', 'T4b'), ('4c', 'T4c'), ('4d', 'T4d')], max_length=20, null=True, verbose_name='AJCC T Stage Major')),
+                ('ajcc_n_stage_major', models.CharField(blank=True, choices=[('0', 'N0'), ('1', 'N1'), ('1a', 'N1a'), ('1b', 'N1b'), ('1c', 'N1c'), ('1d', 'N1d'), ('2', 'N2'), ('2a', 'N2a'), ('2b', 'N2b'), ('2c', 'N2c'), ('2d', 'N2d'), ('3', 'N3'), ('3a', 'N3a'), ('3b', 'N3b'), ('3c', 'N3c'), ('3d', 'N3d'), ('4', 'N4'), ('4a', 'N4a'), ('4b', 'N4b'), ('4c', 'N4c'), ('4d', 'N4d'), ('x', 'Nx')], max_length=20, null=True, verbose_name='AJCC N Stage Major')),
+                ('ajcc_m_stage_major', models.CharField(blank=True, choices=[('0', 'M0'), ('1', 'M1'), ('1a', 'M1a'), ('1b', 'M1b'), ('1c', 'M1c')], max_length=20, null=True, verbose_name='AJCC M Stage Major')),
+                ('source', models.CharField(choices=[('dose', 'Dose Volume Histogram Metrics'), ('radiomics', 'Radiomic Features'), ('volume', 'Structure Volumes')], max_length=20, verbose_name='Source')),
+                ('roi_name', models.CharField(max_length=256, verbose_name='ROI Name')),
+                ('metric', models.CharField(help_text='DVH metric, radiomic feature name or volume', max_length=256, verbose_name='Metric')),
+                ('count', models.IntegerField(verbose_name='Count')),
+                ('mean', models.FloatField(verbose_name='Mean')),
+                ('std', models.FloatField(verbose_name='Standard Deviation')),
+                ('minimum', models.FloatField(verbose_name='Minimum')),
+                ('maximum', models.FloatField(verbose_name='Maximum')),
+                ('p5', models.FloatField(verbose_name='5th Percentile')),
+                ('p25', models.FloatField(verbose_name='25th Percentile')),
+                ('p50', models.FloatField(verbose_name='Median')),
+                ('p75', models.FloatField(verbose_name='75th Percentile')),
+                ('p95', models.FloatField(verbose_name='95th Percentile')),
+                ('histogram', models.JSONField(help_text='Counts of equal-width bins between minimum and maximum', verbose_name='Histogram')),
+                ('refreshed_at', models.DateTimeField(auto_now=True, verbose_name='Refreshed At')),
+                ('cancer_pathology', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='lookup.lookuppathology', verbose_name='Pathology of the Cancer')),
+                ('cancer_site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='lookup.lookupcancersite', verbose_name='Primary Site of the Cancer')),
+                ('radiotherapy_treatment_technique', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='lookup.lookupradiotherapytreatmenttechnique', verbose_name='Radiotherapy Treatment Technique')),
+            ],
+            options={
+                'verbose_name': 'Cohort Aggregate',
+                'verbose_name_plural': 'Cohort Aggregates',
+                'indexes': [models.Index(fields=['source', 'metric', 'roi_name', 'grouping'], name='cohort_aggregate_metric_idx'), models.Index(fields=['cancer_site', 'grouping'], name='cohort_aggregate_site_idx')],
+            },
+        ),
+    ]
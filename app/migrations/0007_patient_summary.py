@@ -0,0 +1,39 @@
+# Generated by Django 5.2.9 on 2026-10-18 00:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_cohort_aggregates'),
+        ('lookup', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientSummary',
+            fields=[
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='app.patient', verbose_name='Patient')),
+                ('patient_uid', models.CharField(max_length=255, verbose_name='Patient Hospital Unique ID')),
+                ('name', models.CharField(max_length=255, verbose_name='Patient Name')),
+                ('gender', models.CharField(choices=[('M', 'Male'), ('F', 'Female'), ('O', 'Other')], max_length=10, verbose_name='Gender')),
+                ('date_of_birth', models.DateField(verbose_name='Date of Birth')),
+                ('date_of_registration', models.DateField(verbose_name='Date of Registration')),
+                ('latest_date_of_diagnosis', models.DateField(blank=True, null=True, verbose_name='Date of the Latest Diagnosis')),
+                ('booking_count', models.IntegerField(default=0, verbose_name='Radiotherapy Bookings')),
+                ('last_simulation_date', models.DateField(blank=True, null=True, verbose_name='Date of the Last Simulation')),
+                ('study_count', models.IntegerField(default=0, verbose_name='DICOM Studies')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('latest_cancer_pathology', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='lookup.lookuppathology', verbose_name='Pathology of the Latest Cancer')),
+                ('latest_cancer_site', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='lookup.lookupcancersite', verbose_name='Primary Site of the Latest Cancer')),
+                ('latest_diagnosis', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='app.diagnosis', verbose_name='Latest Diagnosis')),
+            ],
+            options={
+                'verbose_name': 'Patient Summary',
+                'verbose_name_plural': 'Patient Summaries',
+                'indexes': [models.Index(fields=['date_of_registration', 'patient'], name='patient_summary_keyset_idx')],
+            },
+        ),
+    ]
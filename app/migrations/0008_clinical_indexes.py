@@ -0,0 +1,54 @@
+# Generated by Django 5.2.9 on 2026-10-18 00:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_patient_summary'),
+        ('lookup', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='diagnosis',
+            index=models.Index(fields=['date_of_diagnosis'], name='diagnosis_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='diagnosis',
+            index=models.Index(fields=['patient', '-date_of_diagnosis', '-id'], name='diagnosis_patient_latest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='diagnosis',
+            index=models.Index(fields=['cancer_site', 'date_of_diagnosis'], include=('patient',), name='diagnosis_site_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='radiotherapybooking',
+            index=models.Index(fields=['proposed_treatment_start_date'], name='booking_start_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='radiotherapybooking',
+            index=models.Index(fields=['proposed_planning_image_date'], name='booking_planning_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='radiotherapybooking',
+            index=models.Index(fields=['radiotherapy_treatment_technique', 'diagnosis'], name='booking_technique_dx_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='radiotherapysimulation',
+            index=models.Index(fields=['date_of_simulation'], name='simulation_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='radiotherapysimulation',
+            index=models.Index(fields=['radiotherapy_booking', 'date_of_simulation'], include=('simulation_done',), name='simulation_booking_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='radiotherapysimulation',
+            index=models.Index(condition=models.Q(('simulation_done', False)), fields=['date_of_simulation'], name='simulation_pending_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dicomstudy',
+            constraint=models.UniqueConstraint(fields=('study_instance_uid',), name='unique_study_instance_uid'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.9 on 2026-10-18 00:32
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_clinical_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('rasterize', 'Rasterize Structure Sets'), ('volumes', 'Structure Volumes'), ('dvh', 'Dose Volume Histograms'), ('radiomics', 'Radiomic Features')], max_length=20, verbose_name='Kind')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20, verbose_name='Status')),
+                ('priority', models.IntegerField(default=0, help_text='Jobs with a higher priority are claimed first', verbose_name='Priority')),
+                ('attempts', models.IntegerField(default=0, verbose_name='Attempts')),
+                ('max_attempts', models.IntegerField(default=3, verbose_name='Maximum Attempts')),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, help_text='The job is not claimed before this time, which delays retries', verbose_name='Run After')),
+                ('progress', models.FloatField(default=0, help_text='Fraction of the job done, from 0 to 1', verbose_name='Progress')),
+                ('message', models.CharField(blank=True, max_length=1024, verbose_name='Message')),
+                ('error', models.TextField(blank=True, verbose_name='Last Error')),
+                ('worker', models.CharField(blank=True, max_length=255, verbose_name='Worker')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Started At')),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True, verbose_name='Heartbeat At')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finished At')),
+                ('depends_on', models.ForeignKey(blank=True, help_text='Job that must be done before this one can start', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='dependents', to='app.job', verbose_name='Depends On')),
+                ('dicom_study', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='app.dicomstudy', verbose_name='DICOM Study')),
+            ],
+            options={
+                'verbose_name': 'Job',
+                'verbose_name_plural': 'Jobs',
+                'indexes': [models.Index(condition=models.Q(('status', 'pending')), fields=['-priority', 'created_at'], name='job_claim_idx'), models.Index(fields=['status', 'heartbeat_at'], name='job_status_heartbeat_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-18 00:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_job_queue'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('rasterize', 'Rasterize Structure Sets'), ('volumes', 'Structure Volumes'), ('dvh', 'Dose Volume Histograms'), ('radiomics', 'Radiomic Features'), ('tiles', 'Slice Tiles')], max_length=20, verbose_name='Kind'),
+        ),
+    ]
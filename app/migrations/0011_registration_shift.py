@@ -0,0 +1,39 @@
+# Generated by Django 5.2.9 on 2026-10-18 00:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_alter_job_kind'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistrationShift',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sop_instance_uid', models.CharField(max_length=256, unique=True, verbose_name='Registration SOP Instance UID')),
+                ('fixed_frame_uid', models.CharField(help_text='Frame of reference of the planning image', max_length=256, verbose_name='Fixed Frame of Reference UID')),
+                ('moving_frame_uid', models.CharField(help_text='Frame of reference of the verification image', max_length=256, verbose_name='Moving Frame of Reference UID')),
+                ('acquired_at', models.DateTimeField(blank=True, help_text='Content date and time of the registration', null=True, verbose_name='Acquired At')),
+                ('translation_x', models.FloatField(verbose_name='Translation X (mm)')),
+                ('translation_y', models.FloatField(verbose_name='Translation Y (mm)')),
+                ('translation_z', models.FloatField(verbose_name='Translation Z (mm)')),
+                ('rotation_x', models.FloatField(verbose_name='Rotation X (°)')),
+                ('rotation_y', models.FloatField(verbose_name='Rotation Y (°)')),
+                ('rotation_z', models.FloatField(verbose_name='Rotation Z (°)')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('dicom_study', models.ForeignKey(help_text='DICOM Study containing the registration', on_delete=django.db.models.deletion.CASCADE, to='app.dicomstudy', verbose_name='DICOM Study')),
+                ('radiotherapy_booking', models.ForeignKey(help_text='Course the fraction belongs to', on_delete=django.db.models.deletion.CASCADE, related_name='registration_shifts', to='app.radiotherapybooking', verbose_name='Radiotherapy Booking')),
+            ],
+            options={
+                'verbose_name': 'Registration Shift',
+                'verbose_name_plural': 'Registration Shifts',
+                'indexes': [models.Index(fields=['radiotherapy_booking', 'acquired_at'], name='registration_booking_date_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.9 on 2026-10-18 00:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_registration_shift'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('rasterize', 'Rasterize Structure Sets'), ('volumes', 'Structure Volumes'), ('dvh', 'Dose Volume Histograms'), ('radiomics', 'Radiomic Features'), ('tiles', 'Slice Tiles'), ('gamma', 'Gamma Analysis')], max_length=20, verbose_name='Kind'),
+        ),
+        migrations.CreateModel(
+            name='GammaAnalysis',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('plan_uid', models.CharField(db_index=True, max_length=256, verbose_name='RT Plan SOP Instance UID')),
+                ('measured_dose_uid', models.CharField(max_length=256, verbose_name='Measured RT Dose SOP Instance UID')),
+                ('calculated_dose_uid', models.CharField(max_length=256, verbose_name='Calculated RT Dose SOP Instance UID')),
+                ('dose_percent', models.FloatField(verbose_name='Dose Difference (%)')),
+                ('distance_mm', models.FloatField(verbose_name='Distance to Agreement (mm)')),
+                ('local', models.BooleanField(help_text='Dose difference relative to the local dose instead of the maximum dose', verbose_name='Local')),
+                ('threshold_percent', models.FloatField(help_text='Measured points below this percent of the maximum dose are not evaluated', verbose_name='Threshold (%)')),
+                ('dimensions', models.IntegerField(help_text='2 for a measured plane, 3 for a measured volume', verbose_name='Dimensions')),
+                ('points', models.IntegerField(help_text='Number of measured points evaluated', verbose_name='Points')),
+                ('pass_rate', models.FloatField(db_index=True, help_text='Percent of the points with a gamma of at most 1', verbose_name='Pass Rate (%)')),
+                ('gamma_mean', models.FloatField(verbose_name='Mean Gamma')),
+                ('gamma_max', models.FloatField(help_text='Gammas are capped at the end of the search radius', verbose_name='Maximum Gamma')),
+                ('bin_width', models.FloatField(verbose_name='Bin Width')),
+                ('histogram', models.BinaryField(help_text='Percent of the points in each gamma bin of bin width, as little-endian float32', verbose_name='Histogram')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('dicom_study', models.ForeignKey(help_text='DICOM Study containing the doses', on_delete=django.db.models.deletion.CASCADE, to='app.dicomstudy', verbose_name='DICOM Study')),
+            ],
+            options={
+                'verbose_name': 'Gamma Analysis',
+                'verbose_name_plural': 'Gamma Analyses',
+                'constraints': [models.UniqueConstraint(fields=('measured_dose_uid', 'calculated_dose_uid', 'dose_percent', 'distance_mm', 'local'), name='unique_gamma_doses_criteria')],
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.9 on 2026-10-18 00:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_gamma_analysis'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedObject',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(help_text='SHA-256 of the processed payload', max_length=64, verbose_name='Content Hash')),
+                ('stage', models.CharField(max_length=32, verbose_name='Stage')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+            ],
+            options={
+                'verbose_name': 'Processed Object',
+                'verbose_name_plural': 'Processed Objects',
+                'constraints': [models.UniqueConstraint(fields=('content_hash', 'stage'), name='unique_processed_object_stage')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DICOMObject',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sop_instance_uid', models.CharField(max_length=256, unique=True, verbose_name='SOP Instance UID')),
+                ('study_instance_uid', models.CharField(max_length=256, verbose_name='Study Instance UID')),
+                ('series_instance_uid', models.CharField(db_index=True, max_length=256, verbose_name='Series Instance UID')),
+                ('modality', models.CharField(blank=True, max_length=16, verbose_name='Modality')),
+                ('content_hash', models.CharField(db_index=True, help_text='SHA-256 of the payload', max_length=64, verbose_name='Content Hash')),
+                ('size', models.BigIntegerField(help_text='Size of the payload in bytes', verbose_name='Size')),
+                ('path', models.CharField(db_index=True, help_text='Absolute path of the payload in the object store, or of an ingested copy when the store is disabled', max_length=1024, verbose_name='Path')),
+                ('header', models.JSONField(help_text='Header elements read at ingestion, reused for further copies of the payload', verbose_name='Header')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('dicom_study', models.ForeignKey(blank=True, help_text='DICOM Study the object was ingested into', null=True, on_delete=django.db.models.deletion.SET_NULL, to='app.dicomstudy', verbose_name='DICOM Study')),
+            ],
+            options={
+                'verbose_name': 'DICOM Object',
+                'verbose_name_plural': 'DICOM Objects',
+                'indexes': [models.Index(fields=['study_instance_uid', 'modality'], name='dicom_object_study_idx')],
+            },
+        ),
+    ]
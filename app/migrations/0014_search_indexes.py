@@ -0,0 +1,22 @@
+# Generated by Django 5.2.9 on 2026-10-18 00:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_dicom_object_store'),
+        ('lookup', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='diagnosis',
+            index=models.Index(fields=['cancer_pathology', 'date_of_diagnosis'], name='diagnosis_pathology_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dicomstudy',
+            index=models.Index(fields=['study_date_time'], name='dicom_study_date_idx'),
+        ),
+    ]
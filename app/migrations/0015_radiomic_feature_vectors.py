@@ -0,0 +1,78 @@
+# Generated by Django 5.2.9 on 2026-10-18 00:34
+
+import hashlib
+
+import django.db.models.deletion
+import numpy as np
+from django.db import migrations, models
+
+
+def vectorize_features(apps, schema_editor):
+    '''
+    Move the {name: value} features of every feature set into a float32 vector against the schema of its names.
+    '''
+    RadiomicFeatureSchema = apps.get_model('app', 'RadiomicFeatureSchema')
+    RadiomicFeatureSet = apps.get_model('app', 'RadiomicFeatureSet')
+    schemas = {}
+    for feature_set in RadiomicFeatureSet.objects.iterator():
+        names = list(feature_set.features)
+        key = (feature_set.parameter_hash, tuple(names))
+        if key not in schemas:
+            schemas[key], _ = RadiomicFeatureSchema.objects.get_or_create(
+                parameter_hash=feature_set.parameter_hash,
+                names_hash=hashlib.sha256('\0'.join(names).encode()).hexdigest(),
+                defaults={'names': names},
+            )
+        feature_set.schema = schemas[key]
+        feature_set.values = np.array([feature_set.features[name] for name in names], dtype='<f4').tobytes()
+        feature_set.save(update_fields=['schema', 'values'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='radiomicfeatureset',
+            name='values',
+            field=models.BinaryField(help_text='Feature values in the order of the schema names, as little-endian float32', null=True, verbose_name='Values'),
+        ),
+        migrations.CreateModel(
+            name='RadiomicFeatureSchema',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('parameter_hash', models.CharField(help_text='SHA-256 of the extraction parameter file', max_length=64, verbose_name='Parameter Hash')),
+                ('names_hash', models.CharField(help_text='SHA-256 of the feature names, so a pyradiomics version returning other features gets a new schema', max_length=64, verbose_name='Names Hash')),
+                ('names', models.JSONField(help_text='Feature names in the order of the feature vectors', verbose_name='Names')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+            ],
+            options={
+                'verbose_name': 'Radiomic Feature Schema',
+                'verbose_name_plural': 'Radiomic Feature Schemas',
+                'constraints': [models.UniqueConstraint(fields=('parameter_hash', 'names_hash'), name='unique_feature_schema')],
+            },
+        ),
+        migrations.AddField(
+            model_name='radiomicfeatureset',
+            name='schema',
+            field=models.ForeignKey(help_text='Feature names of the values', null=True, on_delete=django.db.models.deletion.PROTECT, to='app.radiomicfeatureschema', verbose_name='Schema'),
+        ),
+        migrations.RunPython(vectorize_features),
+        migrations.RemoveField(
+            model_name='radiomicfeatureset',
+            name='features',
+        ),
+        migrations.AlterField(
+            model_name='radiomicfeatureset',
+            name='schema',
+            field=models.ForeignKey(help_text='Feature names of the values', on_delete=django.db.models.deletion.PROTECT, to='app.radiomicfeatureschema', verbose_name='Schema'),
+        ),
+        migrations.AlterField(
+            model_name='radiomicfeatureset',
+            name='values',
+            field=models.BinaryField(help_text='Feature values in the order of the schema names, as little-endian float32', verbose_name='Values'),
+        ),
+    ]
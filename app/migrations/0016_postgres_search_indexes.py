@@ -0,0 +1,30 @@
+# Generated by Django 5.2.9 on 2026-10-18 00:13
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations, models
+
+from app.operations import PostgresAddIndex
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_radiomic_feature_vectors'),
+        ('lookup', '0002_search_indexes'),
+    ]
+
+    operations = [
+        PostgresAddIndex(
+            model_name='dicomstudy',
+            index=django.contrib.postgres.indexes.GinIndex(models.Func('study_description', function='to_tsvector', template="%(function)s('simple', %(expressions)s)"), name='dicom_study_fts_idx'),
+        ),
+        PostgresAddIndex(
+            model_name='patient',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('patient_uid'), name='gin_trgm_ops'), name='patient_uid_trgm_idx'),
+        ),
+        PostgresAddIndex(
+            model_name='patient',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass('name', name='gin_trgm_ops'), name='patient_name_trgm_idx'),
+        ),
+    ]
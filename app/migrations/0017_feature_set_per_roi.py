@@ -0,0 +1,33 @@
+# Generated by Django 5.2.9 on 2026-10-18 00:41
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def keep_latest_feature_sets(apps, schema_editor):
+    '''
+    A structure set sent again with edited contours left a row per version of a ROI; keep the latest.
+    '''
+    RadiomicFeatureSet = apps.get_model('app', 'RadiomicFeatureSet')
+    latest = RadiomicFeatureSet.objects.values('structure_set_uid', 'roi_number', 'parameter_hash').annotate(latest=Max('pk')).values('latest')
+    RadiomicFeatureSet.objects.exclude(pk__in=list(latest)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_postgres_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='radiomicfeatureset',
+            name='cache_key',
+            field=models.CharField(db_index=True, help_text='SHA-256 of the image series UID, ROI contour data and parameter file, shared by ROIs with the same inputs', max_length=64, verbose_name='Cache Key'),
+        ),
+        migrations.RunPython(keep_latest_feature_sets, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='radiomicfeatureset',
+            constraint=models.UniqueConstraint(fields=('structure_set_uid', 'roi_number', 'parameter_hash'), name='unique_feature_set_roi'),
+        ),
+    ]
@@ -1,5 +1,9 @@
+import numpy as np
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.db.models.functions import Upper
+from django.utils import timezone
 from django.core.exceptions import ValidationError
 from lookup.models import *
 
@@ -35,74 +39,74 @@ class AJCCMajorTStageChoices(models.TextChoices):
     '''
     Enum to store choices related to the major stage for AJCC T Stage.
     '''
-    'is' = 'is', 'Tis'
-    'x' = 'x', 'Tx'
-    '0' = '0', 'T0'
-    '1' = '1', 'T1'
-    '1a' = '1a', 'T1a'
-    '1b' = '1b', 'T1b'
-    '1c' = '1c', 'T1c'
-    '1d' = '1d', 'T1d'
-    '2' = '2', 'T2'
-    '2a' = '2a', 'T2a'
-    '2b' = '2b', 'T2b'
-    '2c' = '2c', 'T2c'
-    '2d' = '2d', 'T2d'
-    '3' = '3', 'T3'
-    '3a' = '3a', 'T3a'
-    '3b' = '3b', 'T3b'
-    '3c' = '3c', 'T3c'
-    '3d' = '3d', 'T3d'
-    '4' = '4', 'T4'
-    '4a' = '4a', 'T4a'
-    '4b' = '4b', 'T4b'
-    '4c' = '4c', 'T4c'
-    '4d' = '4d', 'T4d'
+    Tis = 'is', 'Tis'
+    Tx = 'x', 'Tx'
+    T0 = '0', 'T0'
+    T1 = '1', 'T1'
+    T1a = '1a', 'T1a'
+    T1b = '1b', 'T1b'
+    T1c = '1c', 'T1c'
+    T1d = '1d', 'T1d'
+    T2 = '2', 'T2'
+    T2a = '2a', 'T2a'
+    T2b = '2b', 'T2b'
+    T2c = '2c', 'T2c'
+    T2d = '2d', 'T2d'
+    T3 = '3', 'T3'
+    T3a = '3a', 'T3a'
+    T3b = '3b', 'T3b'
+    T3c = '3c', 'T3c'
+    T3d = '3d', 'T3d'
+    T4 = '4', 'T4'
+    T4a = '4a', 'T4a'
+    T4b = '4b', 'T4b'
+    T4c = '4c', 'T4c'
+    T4d = '4d', 'T4d'
     
 class AJCCMajorNStageChoices(models.TextChoices):
     '''
     Enum to store choices related to the major stage for AJCC N Stage
     '''
-    '0' = '0', 'N0'
-    '1' = '1', 'N1'
-    '1a' = '1a','N1a'
-    '1b' = '1b','N1b'
-    '1c' = '1c','N1c'
-    '1d' = '1d','N1d'
-    '2' = '2', 'N2'
-    '2a' = '2a','N2a'
-    '2b' = '2b','N2b'
-    '2c' = '2c','N2c'
-    '2d' = '2d','N2d'
-    '3' = '3', 'N3'
-    '3a'= '3a', 'N3a'
-    '3b'= '3b', 'N3b'
-    '3c'= '3c', 'N3c'
-    '3d'= '3d', 'N3d'
-    '4' = '4', 'N4'
-    '4a' = '4a', 'N4a'
-    '4b' = '4b', 'N4b'
-    '4c' = '4c', 'N4c'
-    '4d' = '4d', 'N4d'
-    'x' = 'x', 'Nx'
+    N0 = '0', 'N0'
+    N1 = '1', 'N1'
+    N1a = '1a','N1a'
+    N1b = '1b','N1b'
+    N1c = '1c','N1c'
+    N1d = '1d','N1d'
+    N2 = '2', 'N2'
+    N2a = '2a','N2a'
+    N2b = '2b','N2b'
+    N2c = '2c','N2c'
+    N2d = '2d','N2d'
+    N3 = '3', 'N3'
+    N3a= '3a', 'N3a'
+    N3b= '3b', 'N3b'
+    N3c= '3c', 'N3c'
+    N3d= '3d', 'N3d'
+    N4 = '4', 'N4'
+    N4a = '4a', 'N4a'
+    N4b = '4b', 'N4b'
+    N4c = '4c', 'N4c'
+    N4d = '4d', 'N4d'
+    Nx = 'x', 'Nx'
 
 class AJCCMajorMStageChoices(models.TextChoices):
     '''
     Enum to store choices related to major stage for AJCC M Stage
     '''
-    '0' = '0', 'M0'
-    '1' = '1', 'M1'
-    '1a' = '1a', 'M1a'
-    '1b' = '1b', 'M1b'
-    '1c' = '1c', 'M1c'
+    M0 = '0', 'M0'
+    M1 = '1', 'M1'
+    M1a = '1a', 'M1a'
+    M1b = '1b', 'M1b'
+    M1c = '1c', 'M1c'
 
 class AJCCSuffixChoices(models.TextChoices):
     '''
     Enum to store choices related to suffix for AJCC T, N and M Stage.
     '''
-    '(i+)' = 'i', 'isolated tumor cells'
-    '(m)' = 'm', 'multifocal'
-    '(mi)' = 'mi', 'micrometastasis'
+    i = 'i', 'isolated tumor cells'
+    m = 'm', 'multifocal'
+    mi = 'mi', 'micrometastasis'
 
 class TreatmentIntentChoices(models.TextChoices):
     '''
@@ -132,8 +136,46 @@ class SimulationAppointmentTypes(models.TextChoices):
     '''
     Enum to store choices related to Simulation Appointment Types.
     '''
-    'Practice' =  'Practice', 'Practice Session'
-    'Final' = 'Final', 'Final Scan Session' 
+    Practice =  'Practice', 'Practice Session'
+    Final = 'Final', 'Final Scan Session' 
+
+class AggregateSourceChoices(models.TextChoices):
+    '''
+    Enum to store the measurements aggregated into cohort summaries.
+    '''
+    DOSE = 'dose', 'Dose Volume Histogram Metrics'
+    RADIOMICS = 'radiomics', 'Radiomic Features'
+    VOLUME = 'volume', 'Structure Volumes'
+
+class AggregateGroupingChoices(models.TextChoices):
+    '''
+    Enum to store the cohort keys measurements are aggregated over.
+    '''
+    SITE = 'site', 'Cancer Site'
+    PATHOLOGY = 'pathology', 'Cancer Site and Pathology'
+    STAGE = 'stage', 'Cancer Site and AJCC Stage'
+    TECHNIQUE = 'technique', 'Cancer Site and Treatment Technique'
+    FULL = 'full', 'Cancer Site, Pathology, AJCC Stage and Treatment Technique'
+
+class JobKindChoices(models.TextChoices):
+    '''
+    Enum to store the computations run by the background workers.
+    '''
+    RASTERIZE = 'rasterize', 'Rasterize Structure Sets'
+    VOLUMES = 'volumes', 'Structure Volumes'
+    DVH = 'dvh', 'Dose Volume Histograms'
+    RADIOMICS = 'radiomics', 'Radiomic Features'
+    TILES = 'tiles', 'Slice Tiles'
+    GAMMA = 'gamma', 'Gamma Analysis'
+
+class JobStatusChoices(models.TextChoices):
+    '''
+    Enum to store the states of a background job.
+    '''
+    PENDING = 'pending', 'Pending'
+    RUNNING = 'running', 'Running'
+    DONE = 'done', 'Done'
+    FAILED = 'failed', 'Failed'
     
 # Create your models here.
 
@@ -157,6 +199,11 @@ class Patient(models.Model):
     class Meta:
         verbose_name = "Patient"
         verbose_name_plural = "Patients"
+        indexes = [
+            # Search by UID fragment and by trigram similarity of the name (app/search.py), on PostgreSQL only.
+            GinIndex(OpClass(Upper('patient_uid'), name='gin_trgm_ops'), name='patient_uid_trgm_idx'),
+            GinIndex(OpClass('name', name='gin_trgm_ops'), name='patient_name_trgm_idx'),
+        ]
 
     def clean(self):
         super().clean()
@@ -203,6 +250,15 @@ class Diagnosis(models.Model):
                 name='unique_patient_cancer_site_side_pathology'
             )
         ]
+        indexes = [
+            models.Index(fields=['date_of_diagnosis'], name='diagnosis_date_idx'),
+            # Latest diagnosis of a patient (app/summaries.py).
+            models.Index(fields=['patient', '-date_of_diagnosis', '-id'], name='diagnosis_patient_latest_idx'),
+            # Cohorts of a cancer site over a diagnosis period, answered from the index alone.
+            models.Index(fields=['cancer_site', 'date_of_diagnosis'], include=['patient'], name='diagnosis_site_date_idx'),
+            # Latest diagnoses of a pathology (app/search.py).
+            models.Index(fields=['cancer_pathology', 'date_of_diagnosis'], name='diagnosis_pathology_date_idx'),
+        ]
     
     def __str__(self):
         return f"{self.patient.patient_uid} - {self.cancer_site}"
@@ -239,14 +295,16 @@ class RadiotherapyBooking(models.Model):
     planned_dose_per_fraction = models.GeneratedField(
         verbose_name = "Planned Dose per Fraction",
         help_text="The planned dose per fraction",
-        expression = "F('planned_total_dose') / F('planned_total_number_of_fractions')",
-        output_field = models.DecimalField(max_digits=5,decimal_places=2)
+        expression = models.F('planned_total_dose') / models.F('planned_total_number_of_fractions'),
+        output_field = models.DecimalField(max_digits=5,decimal_places=2),
+        db_persist=True
     )
     planned_overall_treatment_duration = models.GeneratedField(
         verbose_name = "Planned Overall Treatment Duration in days",
         help_text="The planned overall treatment duration in days",
-        expression = "(F('planned_total_number_of_fractions') * 7)/ F('planned_number_of_fractions_per_day')*F('planned_number_of_fractions_per_week')",
-        output_field = models.IntegerField()
+        expression = (models.F('planned_total_number_of_fractions') * 7)/ models.F('planned_number_of_fractions_per_day')*models.F('planned_number_of_fractions_per_week'),
+        output_field = models.IntegerField(),
+        db_persist=True
     )
     created_at = models.DateTimeField(auto_now_add=True,verbose_name = "Created At", help_text="Enter Date Time when this patient's record was created")
     modified_at = models.DateTimeField(auto_now=True,verbose_name = "Modified At", help_text="Enter the Date Time when this patient's record was modified")
@@ -254,6 +312,12 @@ class RadiotherapyBooking(models.Model):
     class Meta:
         verbose_name = "Radiotherapy Booking"
         verbose_name_plural = "Radiotherapy Bookings"
+        indexes = [
+            models.Index(fields=['proposed_treatment_start_date'], name='booking_start_date_idx'),
+            models.Index(fields=['proposed_planning_image_date'], name='booking_planning_date_idx'),
+            # Technique cohorts join bookings to their diagnosis without reading the table.
+            models.Index(fields=['radiotherapy_treatment_technique', 'diagnosis'], name='booking_technique_dx_idx'),
+        ]
 
     def __str__(self):
         return f"{self.diagnosis.patient.patient_uid} - {self.radiotherapy_modality}"
@@ -300,6 +364,13 @@ class RadiotherapySimulation(models.Model):
     class Meta:
         verbose_name = "Radiotherapy Simulation"
         verbose_name_plural = "Radiotherapy Simulations"
+        indexes = [
+            models.Index(fields=['date_of_simulation'], name='simulation_date_idx'),
+            # Last simulation of a booking and the candidates matched by DICOM ingest.
+            models.Index(fields=['radiotherapy_booking', 'date_of_simulation'], include=['simulation_done'], name='simulation_booking_date_idx'),
+            # Simulations still to be done are a small fraction of the table.
+            models.Index(fields=['date_of_simulation'], condition=models.Q(simulation_done=False), name='simulation_pending_idx'),
+        ]
 
     def __str__(self):
         return f"Simulation for {self.radiotherapy_booking}"
@@ -337,11 +408,421 @@ class DICOMStudy(models.Model):
     class Meta:
         verbose_name = "DICOM Study"
         verbose_name_plural = "DICOM Studies"
+        constraints = [
+            models.UniqueConstraint(fields=['study_instance_uid'], name='unique_study_instance_uid'),
+        ]
+        indexes = [
+            # Newest studies matching a search (app/search.py).
+            models.Index(fields=['study_date_time'], name='dicom_study_date_idx'),
+            # Full-text search of the description, the expression of app.search.DescriptionVector, on PostgreSQL only.
+            GinIndex(models.Func('study_description', function='to_tsvector', template="%(function)s('simple', %(expressions)s)"), name='dicom_study_fts_idx'),
+        ]
 
     def __str__(self):
         return f"DICOM Study {self.study_instance_uid} for {self.radiotherapy_simulation}"
 
-        
-    
 
+class DICOMFileManifest(models.Model):
+    '''
+    Model to store the manifest of DICOM files that have already been ingested
+    '''
+    path = models.CharField(max_length=1024, unique=True, verbose_name="Path", help_text="Absolute path of the file")
+    size = models.BigIntegerField(verbose_name="Size", help_text="Size of the file in bytes when it was ingested")
+    mtime_ns = models.BigIntegerField(verbose_name="Modification Time", help_text="Modification time of the file in nanoseconds when it was ingested")
+    sop_instance_uid = models.CharField(max_length=256, blank=True, db_index=True, verbose_name="SOP Instance UID", help_text="SOP Instance UID of the file, empty if the file is not DICOM")
+    study_instance_uid = models.CharField(max_length=256, blank=True, db_index=True, verbose_name="Study Instance UID")
+    series_instance_uid = models.CharField(max_length=256, blank=True, db_index=True, verbose_name="Series Instance UID")
+    modality = models.CharField(max_length=16, blank=True, verbose_name="Modality")
+    content_hash = models.CharField(max_length=64, verbose_name="Content Hash", help_text="SHA-256 of the file content")
+    dicom_study = models.ForeignKey(DICOMStudy, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="DICOM Study", help_text="DICOM Study the file was ingested into")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated At")
+
+    class Meta:
+        verbose_name = "DICOM File Manifest Entry"
+        verbose_name_plural = "DICOM File Manifest"
 
+    def __str__(self):
+        return self.path
+
+
+class DICOMObject(models.Model):
+    '''
+    Model to store the index of DICOM objects, one per SOP Instance UID however many copies of it were ingested
+    '''
+    sop_instance_uid = models.CharField(max_length=256, unique=True, verbose_name="SOP Instance UID")
+    study_instance_uid = models.CharField(max_length=256, verbose_name="Study Instance UID")
+    series_instance_uid = models.CharField(max_length=256, db_index=True, verbose_name="Series Instance UID")
+    modality = models.CharField(max_length=16, blank=True, verbose_name="Modality")
+    content_hash = models.CharField(max_length=64, db_index=True, verbose_name="Content Hash", help_text="SHA-256 of the payload")
+    size = models.BigIntegerField(verbose_name="Size", help_text="Size of the payload in bytes")
+    path = models.CharField(max_length=1024, db_index=True, verbose_name="Path", help_text="Absolute path of the payload in the object store, or of an ingested copy when the store is disabled")
+    header = models.JSONField(verbose_name="Header", help_text="Header elements read at ingestion, reused for further copies of the payload")
+    dicom_study = models.ForeignKey(DICOMStudy, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="DICOM Study", help_text="DICOM Study the object was ingested into")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated At")
+
+    class Meta:
+        verbose_name = "DICOM Object"
+        verbose_name_plural = "DICOM Objects"
+        indexes = [
+            # study_files() reads the objects of one modality of a set of studies; the index also serves lookups by study.
+            models.Index(fields=['study_instance_uid', 'modality'], name='dicom_object_study_idx'),
+        ]
+
+    def __str__(self):
+        return self.sop_instance_uid
+
+
+class ProcessedObject(models.Model):
+    '''
+    Model to store which DICOM object payloads a pipeline stage has already processed
+    '''
+    content_hash = models.CharField(max_length=64, verbose_name="Content Hash", help_text="SHA-256 of the processed payload")
+    stage = models.CharField(max_length=32, verbose_name="Stage")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
+
+    class Meta:
+        verbose_name = "Processed Object"
+        verbose_name_plural = "Processed Objects"
+        constraints = [
+            models.UniqueConstraint(fields=['content_hash', 'stage'], name='unique_processed_object_stage')
+        ]
+
+    def __str__(self):
+        return f"{self.stage} {self.content_hash}"
+
+
+class RadiomicFeatureSchema(models.Model):
+    '''
+    Model to store the ordered feature names of the radiomic feature vectors extracted with one parameter file
+    '''
+    parameter_hash = models.CharField(max_length=64, verbose_name="Parameter Hash", help_text="SHA-256 of the extraction parameter file")
+    names_hash = models.CharField(max_length=64, verbose_name="Names Hash", help_text="SHA-256 of the feature names, so a pyradiomics version returning other features gets a new schema")
+    names = models.JSONField(verbose_name="Names", help_text="Feature names in the order of the feature vectors")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
+
+    class Meta:
+        verbose_name = "Radiomic Feature Schema"
+        verbose_name_plural = "Radiomic Feature Schemas"
+        constraints = [
+            models.UniqueConstraint(fields=['parameter_hash', 'names_hash'], name='unique_feature_schema')
+        ]
+
+    def __str__(self):
+        return f"{len(self.names)} features ({self.parameter_hash[:12]})"
+
+
+class RadiomicFeatureSet(models.Model):
+    '''
+    Model to store the radiomic features extracted for a ROI of a DICOM study
+    '''
+    dicom_study = models.ForeignKey(DICOMStudy, on_delete=models.CASCADE, verbose_name="DICOM Study", help_text="DICOM Study containing the structure set and image")
+    structure_set_uid = models.CharField(max_length=256, verbose_name="Structure Set SOP Instance UID")
+    roi_number = models.IntegerField(verbose_name="ROI Number")
+    roi_name = models.CharField(max_length=256, verbose_name="ROI Name")
+    series_instance_uid = models.CharField(max_length=256, verbose_name="Image Series Instance UID", help_text="Series Instance UID of the image the features were extracted from")
+    parameter_hash = models.CharField(max_length=64, verbose_name="Parameter Hash", help_text="SHA-256 of the extraction parameter file")
+    cache_key = models.CharField(max_length=64, db_index=True, verbose_name="Cache Key", help_text="SHA-256 of the image series UID, ROI contour data and parameter file, shared by ROIs with the same inputs")
+    schema = models.ForeignKey(RadiomicFeatureSchema, on_delete=models.PROTECT, verbose_name="Schema", help_text="Feature names of the values")
+    values = models.BinaryField(verbose_name="Values", help_text="Feature values in the order of the schema names, as little-endian float32")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
+
+    class Meta:
+        verbose_name = "Radiomic Feature Set"
+        verbose_name_plural = "Radiomic Feature Sets"
+        constraints = [
+            models.UniqueConstraint(fields=['structure_set_uid', 'roi_number', 'parameter_hash'], name='unique_feature_set_roi')
+        ]
+
+    def __str__(self):
+        return f"{self.roi_name} ({self.structure_set_uid})"
+
+    def vector(self):
+        '''
+        Return the feature values as a float32 array, indexed like the schema names.
+        '''
+        return np.frombuffer(bytes(self.values), dtype='<f4')
+
+    def features(self):
+        '''
+        Return {name: value} of the features.
+        '''
+        return dict(zip(self.schema.names, self.vector().tolist()))
+
+
+class StructureVolume(models.Model):
+    '''
+    Model to store the volumetric information of a ROI computed from its contours
+    '''
+    dicom_study = models.ForeignKey(DICOMStudy, on_delete=models.CASCADE, verbose_name="DICOM Study", help_text="DICOM Study containing the structure set")
+    structure_set_uid = models.CharField(max_length=256, verbose_name="Structure Set SOP Instance UID")
+    roi_number = models.IntegerField(verbose_name="ROI Number")
+    roi_name = models.CharField(max_length=256, verbose_name="ROI Name")
+    volume = models.FloatField(null=True, blank=True, verbose_name="Volume (cm³)", help_text="Contoured area times slice thickness, empty if the slice thickness is unknown")
+    centroid_x = models.FloatField(verbose_name="Centroid X (mm)")
+    centroid_y = models.FloatField(verbose_name="Centroid Y (mm)")
+    centroid_z = models.FloatField(verbose_name="Centroid Z (mm)")
+    extent_x = models.FloatField(verbose_name="Extent X (mm)", help_text="Size of the bounding box of the contour points")
+    extent_y = models.FloatField(verbose_name="Extent Y (mm)", help_text="Size of the bounding box of the contour points")
+    extent_z = models.FloatField(verbose_name="Extent Z (mm)", help_text="Size of the bounding box of the contour points")
+    slice_count = models.IntegerField(verbose_name="Slice Count", help_text="Number of contoured planes")
+    slice_thickness = models.FloatField(null=True, blank=True, verbose_name="Slice Thickness (mm)", help_text="Smallest spacing between contoured planes")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated At")
+
+    class Meta:
+        verbose_name = "Structure Volume"
+        verbose_name_plural = "Structure Volumes"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['structure_set_uid', 'roi_number'],
+                name='unique_structure_set_roi_volume'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.roi_name} ({self.structure_set_uid})"
+
+
+class DoseVolumeHistogram(models.Model):
+    '''
+    Model to store the cumulative dose volume histogram of a ROI for a dose distribution and its metrics
+    '''
+    dicom_study = models.ForeignKey(DICOMStudy, on_delete=models.CASCADE, verbose_name="DICOM Study", help_text="DICOM Study containing the dose and structure set")
+    dose_uid = models.CharField(max_length=256, verbose_name="RT Dose SOP Instance UID")
+    plan_uid = models.CharField(max_length=256, blank=True, db_index=True, verbose_name="RT Plan SOP Instance UID", help_text="Plan referenced by the dose, empty if none")
+    structure_set_uid = models.CharField(max_length=256, verbose_name="Structure Set SOP Instance UID")
+    roi_number = models.IntegerField(verbose_name="ROI Number")
+    roi_name = models.CharField(max_length=256, db_index=True, verbose_name="ROI Name")
+    volume = models.FloatField(verbose_name="Volume (cm³)", help_text="Volume of the ROI mask the dose was sampled on")
+    bin_width = models.FloatField(verbose_name="Bin Width (Gy)")
+    histogram = models.BinaryField(verbose_name="Histogram", help_text="Cumulative volume in cm³ receiving at least i × bin width, as little-endian float32")
+    d_min = models.FloatField(verbose_name="Dmin (Gy)")
+    d_mean = models.FloatField(db_index=True, verbose_name="Dmean (Gy)")
+    d_max = models.FloatField(db_index=True, verbose_name="Dmax (Gy)")
+    d_2 = models.FloatField(db_index=True, verbose_name="D2% (Gy)")
+    d_50 = models.FloatField(db_index=True, verbose_name="D50% (Gy)")
+    d_95 = models.FloatField(db_index=True, verbose_name="D95% (Gy)")
+    d_98 = models.FloatField(db_index=True, verbose_name="D98% (Gy)")
+    v_5 = models.FloatField(db_index=True, verbose_name="V5Gy (%)")
+    v_10 = models.FloatField(db_index=True, verbose_name="V10Gy (%)")
+    v_20 = models.FloatField(db_index=True, verbose_name="V20Gy (%)")
+    v_30 = models.FloatField(db_index=True, verbose_name="V30Gy (%)")
+    v_40 = models.FloatField(db_index=True, verbose_name="V40Gy (%)")
+    v_50 = models.FloatField(db_index=True, verbose_name="V50Gy (%)")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated At")
+
+    class Meta:
+        verbose_name = "Dose Volume Histogram"
+        verbose_name_plural = "Dose Volume Histograms"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dose_uid', 'structure_set_uid', 'roi_number'],
+                name='unique_dose_structure_set_roi_dvh'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.roi_name} ({self.dose_uid})"
+
+    def cumulative(self):
+        '''
+        Return the cumulative histogram as a float32 array, indexed by dose bin.
+        '''
+        return np.frombuffer(bytes(self.histogram), dtype='<f4')
+
+
+class GammaAnalysis(models.Model):
+    '''
+    Model to store the gamma index comparison of a measured dose with the calculated dose of its plan for one criterion
+    '''
+    dicom_study = models.ForeignKey(DICOMStudy, on_delete=models.CASCADE, verbose_name="DICOM Study", help_text="DICOM Study containing the doses")
+    plan_uid = models.CharField(max_length=256, db_index=True, verbose_name="RT Plan SOP Instance UID")
+    measured_dose_uid = models.CharField(max_length=256, verbose_name="Measured RT Dose SOP Instance UID")
+    calculated_dose_uid = models.CharField(max_length=256, verbose_name="Calculated RT Dose SOP Instance UID")
+    dose_percent = models.FloatField(verbose_name="Dose Difference (%)")
+    distance_mm = models.FloatField(verbose_name="Distance to Agreement (mm)")
+    local = models.BooleanField(verbose_name="Local", help_text="Dose difference relative to the local dose instead of the maximum dose")
+    threshold_percent = models.FloatField(verbose_name="Threshold (%)", help_text="Measured points below this percent of the maximum dose are not evaluated")
+    dimensions = models.IntegerField(verbose_name="Dimensions", help_text="2 for a measured plane, 3 for a measured volume")
+    points = models.IntegerField(verbose_name="Points", help_text="Number of measured points evaluated")
+    pass_rate = models.FloatField(db_index=True, verbose_name="Pass Rate (%)", help_text="Percent of the points with a gamma of at most 1")
+    gamma_mean = models.FloatField(verbose_name="Mean Gamma")
+    gamma_max = models.FloatField(verbose_name="Maximum Gamma", help_text="Gammas are capped at the end of the search radius")
+    bin_width = models.FloatField(verbose_name="Bin Width")
+    histogram = models.BinaryField(verbose_name="Histogram", help_text="Percent of the points in each gamma bin of bin width, as little-endian float32")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated At")
+
+    class Meta:
+        verbose_name = "Gamma Analysis"
+        verbose_name_plural = "Gamma Analyses"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['measured_dose_uid', 'calculated_dose_uid', 'dose_percent', 'distance_mm', 'local'],
+                name='unique_gamma_doses_criteria'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.dose_percent:g}%/{self.distance_mm:g}mm{' local' if self.local else ''} ({self.measured_dose_uid})"
+
+    def frequencies(self):
+        '''
+        Return the histogram as a float32 array, indexed by gamma bin.
+        '''
+        return np.frombuffer(bytes(self.histogram), dtype='<f4')
+
+class RegistrationShift(models.Model):
+    '''
+    Model to store the rigid setup correction of one fraction, from a spatial registration of verification imaging to the planning image
+    '''
+    dicom_study = models.ForeignKey(DICOMStudy, on_delete=models.CASCADE, verbose_name="DICOM Study", help_text="DICOM Study containing the registration")
+    radiotherapy_booking = models.ForeignKey(RadiotherapyBooking, on_delete=models.CASCADE, related_name='registration_shifts', verbose_name="Radiotherapy Booking", help_text="Course the fraction belongs to")
+    sop_instance_uid = models.CharField(max_length=256, unique=True, verbose_name="Registration SOP Instance UID")
+    fixed_frame_uid = models.CharField(max_length=256, verbose_name="Fixed Frame of Reference UID", help_text="Frame of reference of the planning image")
+    moving_frame_uid = models.CharField(max_length=256, verbose_name="Moving Frame of Reference UID", help_text="Frame of reference of the verification image")
+    acquired_at = models.DateTimeField(null=True, blank=True, verbose_name="Acquired At", help_text="Content date and time of the registration")
+    translation_x = models.FloatField(verbose_name="Translation X (mm)")
+    translation_y = models.FloatField(verbose_name="Translation Y (mm)")
+    translation_z = models.FloatField(verbose_name="Translation Z (mm)")
+    rotation_x = models.FloatField(verbose_name="Rotation X (°)")
+    rotation_y = models.FloatField(verbose_name="Rotation Y (°)")
+    rotation_z = models.FloatField(verbose_name="Rotation Z (°)")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated At")
+
+    class Meta:
+        verbose_name = "Registration Shift"
+        verbose_name_plural = "Registration Shifts"
+        indexes = [
+            # setup_errors() reads the shifts of a cohort in course and fraction order.
+            models.Index(fields=['radiotherapy_booking', 'acquired_at'], name='registration_booking_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"Registration {self.sop_instance_uid}"
+
+
+class CohortAggregate(models.Model):
+    '''
+    Model to store summary statistics of one measurement over a cohort, maintained by app/aggregates.py
+    '''
+    grouping = models.CharField(max_length=20, choices=AggregateGroupingChoices.choices, verbose_name="Grouping", help_text="Cohort key the statistics are grouped by; fields outside the grouping are empty")
+    cancer_site = models.ForeignKey(LookupCancerSite, on_delete=models.CASCADE, verbose_name="Primary Site of the Cancer")
+    cancer_pathology = models.ForeignKey(LookupPathology, on_delete=models.CASCADE, null=True, blank=True, verbose_name="Pathology of the Cancer")
+    ajcc_t_stage_major = models.CharField(max_length=20, null=True, blank=True, choices=AJCCMajorTStageChoices.choices, verbose_name="AJCC T Stage Major")
+    ajcc_n_stage_major = models.CharField(max_length=20, null=True, blank=True, choices=AJCCMajorNStageChoices.choices, verbose_name="AJCC N Stage Major")
+    ajcc_m_stage_major = models.CharField(max_length=20, null=True, blank=True, choices=AJCCMajorMStageChoices.choices, verbose_name="AJCC M Stage Major")
+    radiotherapy_treatment_technique = models.ForeignKey(LookupRadiotherapyTreatmentTechnique, on_delete=models.CASCADE, null=True, blank=True, verbose_name="Radiotherapy Treatment Technique")
+    source = models.CharField(max_length=20, choices=AggregateSourceChoices.choices, verbose_name="Source")
+    roi_name = models.CharField(max_length=256, verbose_name="ROI Name")
+    metric = models.CharField(max_length=256, verbose_name="Metric", help_text="DVH metric, radiomic feature name or volume")
+    count = models.IntegerField(verbose_name="Count")
+    mean = models.FloatField(verbose_name="Mean")
+    std = models.FloatField(verbose_name="Standard Deviation")
+    minimum = models.FloatField(verbose_name="Minimum")
+    maximum = models.FloatField(verbose_name="Maximum")
+    p5 = models.FloatField(verbose_name="5th Percentile")
+    p25 = models.FloatField(verbose_name="25th Percentile")
+    p50 = models.FloatField(verbose_name="Median")
+    p75 = models.FloatField(verbose_name="75th Percentile")
+    p95 = models.FloatField(verbose_name="95th Percentile")
+    histogram = models.JSONField(verbose_name="Histogram", help_text="Counts of equal-width bins between minimum and maximum")
+    refreshed_at = models.DateTimeField(auto_now=True, verbose_name="Refreshed At")
+
+    class Meta:
+        verbose_name = "Cohort Aggregate"
+        verbose_name_plural = "Cohort Aggregates"
+        indexes = [
+            models.Index(fields=['source', 'metric', 'roi_name', 'grouping'], name='cohort_aggregate_metric_idx'),
+            models.Index(fields=['cancer_site', 'grouping'], name='cohort_aggregate_site_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.metric} of {self.roi_name} ({self.get_grouping_display()})"
+
+
+class AggregateRefreshQueue(models.Model):
+    '''
+    Model to store the cancer sites and measurement sources whose cohort aggregates are out of date
+    '''
+    cancer_site = models.ForeignKey(LookupCancerSite, on_delete=models.CASCADE, verbose_name="Primary Site of the Cancer")
+    source = models.CharField(max_length=20, choices=AggregateSourceChoices.choices, verbose_name="Measurement Source")
+    queued_at = models.DateTimeField(auto_now_add=True, verbose_name="Queued At")
+
+    class Meta:
+        verbose_name = "Aggregate Refresh Queue Entry"
+        verbose_name_plural = "Aggregate Refresh Queue"
+        constraints = [
+            models.UniqueConstraint(fields=['cancer_site', 'source'], name='aggregate_refresh_queue_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.cancer_site} ({self.get_source_display()})"
+
+
+class PatientSummary(models.Model):
+    '''
+    Model to store a denormalized overview row per patient, maintained by app/summaries.py
+    '''
+    patient = models.OneToOneField(Patient, on_delete=models.CASCADE, primary_key=True, verbose_name="Patient")
+    patient_uid = models.CharField(max_length=255, verbose_name="Patient Hospital Unique ID")
+    name = models.CharField(max_length=255, verbose_name="Patient Name")
+    gender = models.CharField(max_length=10, choices=GenderChoices.choices, verbose_name="Gender")
+    date_of_birth = models.DateField(verbose_name="Date of Birth")
+    date_of_registration = models.DateField(verbose_name="Date of Registration")
+    latest_diagnosis = models.ForeignKey(Diagnosis, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Latest Diagnosis")
+    latest_cancer_site = models.ForeignKey(LookupCancerSite, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Primary Site of the Latest Cancer")
+    latest_cancer_pathology = models.ForeignKey(LookupPathology, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Pathology of the Latest Cancer")
+    latest_date_of_diagnosis = models.DateField(null=True, blank=True, verbose_name="Date of the Latest Diagnosis")
+    booking_count = models.IntegerField(default=0, verbose_name="Radiotherapy Bookings")
+    last_simulation_date = models.DateField(null=True, blank=True, verbose_name="Date of the Last Simulation")
+    study_count = models.IntegerField(default=0, verbose_name="DICOM Studies")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated At")
+
+    class Meta:
+        verbose_name = "Patient Summary"
+        verbose_name_plural = "Patient Summaries"
+        indexes = [
+            models.Index(fields=['date_of_registration', 'patient'], name='patient_summary_keyset_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.patient_uid})"
+
+
+class Job(models.Model):
+    '''
+    Model to store a background computation on a DICOM study, claimed and run by app/jobs.py workers
+    '''
+    kind = models.CharField(max_length=20, choices=JobKindChoices.choices, verbose_name="Kind")
+    dicom_study = models.ForeignKey(DICOMStudy, on_delete=models.CASCADE, related_name='jobs', verbose_name="DICOM Study")
+    status = models.CharField(max_length=20, choices=JobStatusChoices.choices, default=JobStatusChoices.PENDING, verbose_name="Status")
+    priority = models.IntegerField(default=0, verbose_name="Priority", help_text="Jobs with a higher priority are claimed first")
+    depends_on = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='dependents', verbose_name="Depends On", help_text="Job that must be done before this one can start")
+    attempts = models.IntegerField(default=0, verbose_name="Attempts")
+    max_attempts = models.IntegerField(default=3, verbose_name="Maximum Attempts")
+    run_after = models.DateTimeField(default=timezone.now, verbose_name="Run After", help_text="The job is not claimed before this time, which delays retries")
+    progress = models.FloatField(default=0, verbose_name="Progress", help_text="Fraction of the job done, from 0 to 1")
+    message = models.CharField(max_length=1024, blank=True, verbose_name="Message")
+    error = models.TextField(blank=True, verbose_name="Last Error")
+    worker = models.CharField(max_length=255, blank=True, verbose_name="Worker")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="Started At")
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name="Heartbeat At")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Finished At")
+
+    class Meta:
+        verbose_name = "Job"
+        verbose_name_plural = "Jobs"
+        indexes = [
+            # The claim query reads pending jobs by priority; finished jobs stay out of the index.
+            models.Index(fields=['-priority', 'created_at'], condition=models.Q(status='pending'), name='job_claim_idx'),
+            models.Index(fields=['status', 'heartbeat_at'], name='job_status_heartbeat_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} of {self.dicom_study.study_instance_uid} ({self.status})"
@@ -0,0 +1,104 @@
+'''
+Content-addressed store of DICOM object payloads.
+
+Every payload is kept once, at a path derived from the SHA-256 of its content,
+however many times the same object is re-exported or re-sent. A payload is
+added by the first of OBJECT_STORE_METHODS that works:
+
+- reflink: a copy-on-write clone (FICLONE) on filesystems that support it
+  (Btrfs, XFS), sharing the data blocks with the ingested file;
+- hardlink: a second name for the ingested file, on the same filesystem;
+- copy: a full copy.
+
+Hard links share the file itself, so ingested files must be replaced rather
+than rewritten in place once they are stored. Writes go to a temporary name
+that is renamed into place, so several processes can add the same payload at
+once. The store holds no state besides the files: the DICOMObject table is
+the index from UIDs to stored paths.
+'''
+import errno
+import fcntl
+import os
+import shutil
+from pathlib import Path
+
+from django.conf import settings
+
+# ioctl request of the Linux FICLONE call, _IOW(0x94, 9, int).
+FICLONE = 0x40049409
+
+# Errors of a method that cannot work for this pair of paths, so the next method is tried.
+UNSUPPORTED = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EPERM, errno.EMLINK, errno.ENOSYS}
+
+
+def reflink(source, target):
+    with open(source, 'rb') as stream, open(target, 'xb') as clone:
+        fcntl.ioctl(clone.fileno(), FICLONE, stream.fileno())
+
+
+def hardlink(source, target):
+    os.link(source, target)
+
+
+def copy(source, target):
+    shutil.copyfile(source, target)
+
+
+METHODS = {
+    'reflink': reflink,
+    'hardlink': hardlink,
+    'copy': copy,
+}
+
+
+class ObjectStore:
+    '''
+    Directory of DICOM payloads named by content hash.
+    '''
+
+    def __init__(self, directory, methods=('reflink', 'hardlink', 'copy')):
+        unknown = set(methods) - set(METHODS)
+        if unknown:
+            raise ValueError(f"Unknown object store methods: {', '.join(sorted(unknown))}")
+        self.directory = Path(directory)
+        self.methods = list(methods)
+
+    def path(self, content_hash):
+        return self.directory / content_hash[:2] / content_hash[2:4] / f'{content_hash}.dcm'
+
+    def put(self, source, content_hash):
+        '''
+        Store the payload of the file source, whose SHA-256 is content_hash, and return its path in the store.
+
+        A payload that is already stored is left as it is.
+        '''
+        path = self.path(content_hash)
+        if path.exists():
+            return path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.parent / f'.tmp-{os.getpid()}-{content_hash}'
+        error = None
+        for method in self.methods:
+            try:
+                METHODS[method](source, temporary)
+            except OSError as exception:
+                temporary.unlink(missing_ok=True)
+                if exception.errno not in UNSUPPORTED:
+                    raise
+                error = exception
+                continue
+            os.replace(temporary, path)
+            return path
+        raise error or OSError(f'No object store method configured for {source}')
+
+    def remove(self, content_hash):
+        self.path(content_hash).unlink(missing_ok=True)
+
+
+def get_object_store():
+    '''
+    Return the ObjectStore of OBJECT_STORE_DIR, or None if the store is disabled and objects are indexed where they were ingested.
+    '''
+    if not settings.OBJECT_STORE_DIR:
+        return None
+    return ObjectStore(settings.OBJECT_STORE_DIR, settings.OBJECT_STORE_METHODS)
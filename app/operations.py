@@ -0,0 +1,22 @@
+'''
+Migration operations for schema objects that only PostgreSQL can build.
+'''
+from django.db import migrations
+
+
+class PostgresAddIndex(migrations.AddIndex):
+    '''
+    AddIndex of an index only PostgreSQL supports, such as a GIN index with a trigram operator class.
+
+    The index is added to the migration state on every database, so the state
+    matches the model, but it is only created on PostgreSQL. On other
+    databases the queries it serves run without it.
+    '''
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
@@ -0,0 +1,36 @@
+'''
+Paginator for large tables that never counts every row.
+'''
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+class EstimatedCountPaginator(Paginator):
+    '''
+    Paginator whose count is bounded in cost.
+
+    An unfiltered PostgreSQL table is counted from the planner estimate in
+    pg_class. Anything else is counted up to max_count rows only, so the
+    last reachable page is max_count / per_page.
+    '''
+    max_count = 10000
+
+    def estimate(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql' or queryset.query.where:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        return row[0] if row and row[0] > self.max_count else None
+
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, 'query'):
+            return super().count
+        estimate = self.estimate()
+        if estimate is not None:
+            return estimate
+        return self.object_list[:self.max_count].count()
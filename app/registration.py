@@ -0,0 +1,232 @@
+'''
+Setup errors of verification imaging from DICOM Spatial Registration objects.
+
+Each REG object (Spatial Registration) registering a verification image (usually a CBCT) to the
+planning CT holds a rigid 4x4 matrix per frame of reference. The matrices
+are read in a process pool, combined into the transform from the
+verification image to the planning image and decomposed for the whole batch
+at once into a translation in mm and rotations in degrees, stored as one
+RegistrationShift row per fraction.
+
+setup_errors() computes the population statistics of a cohort in a single
+pass over its shifts: rows are sorted by course (radiotherapy booking) and
+every per-course sum is an np.add.reduceat over the course boundaries, so
+no Python loop runs per patient. Courses follow van Herk: the systematic
+error Σ is the standard deviation of the course means and the random error
+σ the root mean square of the course standard deviations.
+'''
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+import pydicom
+
+from app.dicom_files import mark_processed, study_files
+from app.ingest import study_datetime
+from app.metrics import timed
+from app.models import RegistrationShift
+
+# Margin recipes, as (systematic, random) coefficients of CTV-to-PTV margins in mm.
+MARGIN_RECIPES = {
+    'van_herk': (2.5, 0.7),
+    'stroom': (2.0, 0.7),
+}
+
+SHIFT_FIELDS = ['translation_x', 'translation_y', 'translation_z', 'rotation_x', 'rotation_y', 'rotation_z']
+
+
+def read_registration(path):
+    '''
+    Read the rigid registration of a REG file. Runs inside pool workers.
+
+    Returns (sop instance uid, study instance uid, fixed frame, moving frame,
+    aware datetime, 4x4 matrix from the moving to the fixed frame), or None
+    if the file is not a rigid registration of two frames of reference.
+    '''
+    try:
+        dataset = pydicom.dcmread(path, stop_before_pixels=True)
+    except Exception:
+        return None
+    matrices = {}
+    for registration in dataset.get('RegistrationSequence', []):
+        for matrix_registration in registration.get('MatrixRegistrationSequence', []):
+            for matrix in matrix_registration.get('MatrixSequence', []):
+                if matrix.get('FrameOfReferenceTransformationMatrixType', 'RIGID') == 'RIGID':
+                    values = np.asarray(matrix.FrameOfReferenceTransformationMatrix, dtype=np.float64).reshape(4, 4)
+                    matrices[str(registration.get('FrameOfReferenceUID', ''))] = values
+    fixed = str(dataset.get('FrameOfReferenceUID', ''))
+    if fixed not in matrices:
+        fixed = next(iter(matrices), '')
+    moving = [frame for frame in matrices if frame != fixed]
+    if not fixed or len(moving) != 1:
+        return None
+    # Each matrix maps its frame to the registered frame of the REG object.
+    transform = np.linalg.solve(matrices[fixed], matrices[moving[0]])
+    acquired = study_datetime(
+        str(dataset.get('ContentDate') or dataset.get('SeriesDate') or dataset.get('StudyDate') or ''),
+        str(dataset.get('ContentTime') or dataset.get('SeriesTime') or dataset.get('StudyTime') or ''),
+    )
+    return str(dataset.SOPInstanceUID), str(dataset.StudyInstanceUID), fixed, moving[0], acquired, transform
+
+
+def read_registrations(paths):
+    return [registration for registration in map(read_registration, paths) if registration is not None]
+
+
+def decompose(transforms):
+    '''
+    Split (N, 4, 4) rigid transforms into (N, 6) shifts: translations in mm and rotations about x, y and z in degrees.
+
+    Rotations are the angles of R = Rz Ry Rx.
+    '''
+    rotation = transforms[:, :3, :3]
+    angles = np.column_stack([
+        np.arctan2(rotation[:, 2, 1], rotation[:, 2, 2]),
+        -np.arcsin(np.clip(rotation[:, 2, 0], -1, 1)),
+        np.arctan2(rotation[:, 1, 0], rotation[:, 0, 0]),
+    ])
+    return np.column_stack([transforms[:, :3, 3], np.degrees(angles)])
+
+
+def compose(shifts):
+    '''
+    Build (N, 4, 4) rigid transforms from (N, 6) shifts. The inverse of decompose().
+    '''
+    shifts = np.asarray(shifts, dtype=np.float64).reshape(-1, 6)
+    (cx, cy, cz), (sx, sy, sz) = np.cos(np.radians(shifts[:, 3:])).T, np.sin(np.radians(shifts[:, 3:])).T
+    transforms = np.zeros((len(shifts), 4, 4))
+    transforms[:, :3, :3] = np.stack([
+        np.stack([cz * cy, cz * sy * sx - sz * cx, cz * sy * cx + sz * sx], axis=-1),
+        np.stack([sz * cy, sz * sy * sx + cz * cx, sz * sy * cx - cz * sx], axis=-1),
+        np.stack([-sy, cy * sx, cy * cx], axis=-1),
+    ], axis=1)
+    transforms[:, :3, 3] = shifts[:, :3]
+    transforms[:, 3, 3] = 1
+    return transforms
+
+
+@timed('registrations')
+def ingest_registrations(studies, processes=None, batch_size=1000, files_per_task=64, recompute=False):
+    '''
+    Parse the REG files of the DICOM studies and store a RegistrationShift for each.
+
+    REG files parsed by an earlier run are skipped unless recompute is set.
+    Returns (registrations, elapsed).
+    '''
+    start = time.perf_counter()
+    study_ids = {
+        study_instance_uid: (pk, booking_id)
+        for pk, study_instance_uid, booking_id in studies.values_list('pk', 'study_instance_uid', 'radiotherapy_simulation__radiotherapy_booking_id')
+    }
+    paths = [path for study_paths in study_files(study_ids, 'REG', unprocessed=None if recompute else 'registrations').values() for path in study_paths]
+    tasks = [paths[index:index + files_per_task] for index in range(0, len(paths), files_per_task)]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        registrations = [
+            registration for batch in executor.map(read_registrations, tasks) for registration in batch
+            if registration[1] in study_ids
+        ]
+    if not registrations:
+        mark_processed('registrations', paths, batch_size)
+        return 0, time.perf_counter() - start
+
+    shifts = decompose(np.stack([registration[5] for registration in registrations]))
+    objects = [
+        RegistrationShift(
+            dicom_study_id=study_ids[study_instance_uid][0],
+            radiotherapy_booking_id=study_ids[study_instance_uid][1],
+            sop_instance_uid=sop_instance_uid,
+            fixed_frame_uid=fixed,
+            moving_frame_uid=moving,
+            acquired_at=acquired,
+            **dict(zip(SHIFT_FIELDS, (float(value) for value in shift))),
+        )
+        for (sop_instance_uid, study_instance_uid, fixed, moving, acquired, transform), shift in zip(registrations, shifts)
+    ]
+    RegistrationShift.objects.bulk_create(
+        objects,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['sop_instance_uid'],
+        update_fields=['dicom_study', 'radiotherapy_booking', 'fixed_frame_uid', 'moving_frame_uid', 'acquired_at', *SHIFT_FIELDS, 'updated_at'],
+    )
+    mark_processed('registrations', paths, batch_size)
+    return len(objects), time.perf_counter() - start
+
+
+@dataclass
+class SetupErrorReport:
+    '''
+    Setup errors of a cohort. Arrays hold the six shift components in SHIFT_FIELDS order.
+
+    Per-course arrays are aligned with courses (booking ids). drift is the
+    least-squares slope of each translation over the fractions of a course,
+    in mm per fraction; it and the course SDs are NaN for single-fraction
+    courses.
+    '''
+    fractions: int
+    courses: np.ndarray
+    course_fractions: np.ndarray
+    course_mean: np.ndarray
+    course_sd: np.ndarray
+    drift: np.ndarray
+    mean: np.ndarray
+    systematic: np.ndarray
+    random: np.ndarray
+
+    def margins(self):
+        '''
+        Return {recipe: (x, y, z) CTV-to-PTV margin in mm} from the translations.
+        '''
+        return {
+            recipe: systematic * self.systematic[:3] + random * self.random[:3]
+            for recipe, (systematic, random) in MARGIN_RECIPES.items()
+        }
+
+    def drifting(self, threshold):
+        '''
+        Return the ids of the courses whose translation drifts by more than threshold mm per fraction on any axis.
+        '''
+        return self.courses[np.nanmax(np.abs(self.drift), axis=1, initial=0) > threshold]
+
+
+def setup_errors(queryset=None):
+    '''
+    Compute the setup errors of the RegistrationShift queryset (default: all of them) in one vectorized pass.
+
+    Returns a SetupErrorReport, or None if the queryset holds no shifts.
+    '''
+    queryset = RegistrationShift.objects.all() if queryset is None else queryset
+    rows = np.array(
+        list(queryset.order_by('radiotherapy_booking_id', 'acquired_at', 'pk').values_list('radiotherapy_booking_id', *SHIFT_FIELDS)),
+        dtype=np.float64,
+    ).reshape(-1, 1 + len(SHIFT_FIELDS))
+    if not len(rows):
+        return None
+    bookings, shifts = rows[:, 0].astype(np.int64), rows[:, 1:]
+    starts = np.flatnonzero(np.r_[True, bookings[1:] != bookings[:-1]])
+    counts = np.diff(np.r_[starts, len(bookings)])
+    course = np.repeat(np.arange(len(starts)), counts)
+
+    course_mean = np.add.reduceat(shifts, starts) / counts[:, np.newaxis]
+    deviations = shifts - course_mean[course]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        course_sd = np.sqrt(np.add.reduceat(deviations ** 2, starts) / (counts - 1)[:, np.newaxis])
+        # Slope of each translation against the fraction number within its course.
+        fraction = np.arange(len(bookings)) - np.repeat(starts, counts)
+        centred = (fraction - (counts[course] - 1) / 2)[:, np.newaxis]
+        drift = np.add.reduceat(centred * deviations[:, :3], starts) / np.add.reduceat(centred ** 2, starts)
+    course_sd[counts < 2] = np.nan
+    drift[counts < 2] = np.nan
+
+    return SetupErrorReport(
+        fractions=len(bookings),
+        courses=bookings[starts],
+        course_fractions=counts,
+        course_mean=course_mean,
+        course_sd=course_sd,
+        drift=drift,
+        mean=course_mean.mean(axis=0),
+        systematic=course_mean.std(axis=0, ddof=1) if len(starts) > 1 else np.full(len(SHIFT_FIELDS), np.nan),
+        random=np.sqrt(np.nanmean(course_sd ** 2, axis=0)) if (counts > 1).any() else np.full(len(SHIFT_FIELDS), np.nan),
+    )
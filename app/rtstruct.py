@@ -0,0 +1,163 @@
+'''
+Reading of RTSTRUCT contours, image series and their geometry.
+'''
+from dataclasses import dataclass, field
+
+import numpy as np
+import pydicom
+import SimpleITK as sitk
+
+
+@dataclass
+class Roi:
+    '''
+    A structure of an RT Structure Set. Each contour is an (N, 3) array of patient coordinates in mm.
+    '''
+    number: int
+    name: str
+    contours: list = field(default_factory=list)
+
+    def contour_bytes(self):
+        '''
+        Return the contour points as bytes, for hashing.
+        '''
+        return b''.join(np.ascontiguousarray(contour, dtype=np.float64).tobytes() for contour in self.contours)
+
+
+@dataclass
+class StructureSet:
+    '''
+    The ROIs of an RTSTRUCT file and the image series they were drawn on.
+    '''
+    sop_instance_uid: str
+    study_instance_uid: str
+    referenced_series_uid: str
+    rois: list = field(default_factory=list)
+
+
+@dataclass
+class Geometry:
+    '''
+    Voxel grid of an image. size is (x, y, z), direction a row-major 3x3 matrix.
+    '''
+    origin: tuple
+    spacing: tuple
+    direction: tuple
+    size: tuple
+
+    @classmethod
+    def from_image(cls, image):
+        return cls(tuple(image.GetOrigin()), tuple(image.GetSpacing()), tuple(image.GetDirection()), tuple(image.GetSize()))
+
+    def matrix(self):
+        return np.asarray(self.direction, dtype=np.float64).reshape(3, 3) * np.asarray(self.spacing, dtype=np.float64)
+
+    def to_index(self, points):
+        '''
+        Convert (N, 3) patient coordinates to continuous (x, y, z) voxel indices.
+        '''
+        return np.linalg.solve(self.matrix(), (np.asarray(points, dtype=np.float64) - np.asarray(self.origin)).T).T
+
+    def to_points(self, index):
+        '''
+        Convert (N, 3) (x, y, z) voxel indices to patient coordinates.
+        '''
+        return np.asarray(index, dtype=np.float64) @ self.matrix().T + np.asarray(self.origin)
+
+    def supersampled(self, factor):
+        '''
+        Return the geometry with each voxel split into factor x factor voxels in plane.
+        '''
+        spacing = (self.spacing[0] / factor, self.spacing[1] / factor, self.spacing[2])
+        shift = (1 - factor) / (2 * factor)
+        origin = tuple(self.to_points([[shift, shift, 0.0]])[0])
+        return Geometry(origin, spacing, self.direction, (self.size[0] * factor, self.size[1] * factor, self.size[2]))
+
+
+def referenced_series_uid(dataset):
+    for frame in dataset.get('ReferencedFrameOfReferenceSequence', []):
+        for study in frame.get('RTReferencedStudySequence', []):
+            for series in study.get('RTReferencedSeriesSequence', []):
+                if series.get('SeriesInstanceUID'):
+                    return str(series.SeriesInstanceUID)
+    return ''
+
+
+def read_structure_set(path):
+    '''
+    Read the closed planar contours of every ROI in an RTSTRUCT file.
+    '''
+    dataset = pydicom.dcmread(path)
+    names = {int(roi.ROINumber): str(roi.get('ROIName', '')) for roi in dataset.get('StructureSetROISequence', [])}
+    structure_set = StructureSet(
+        sop_instance_uid=str(dataset.SOPInstanceUID),
+        study_instance_uid=str(dataset.StudyInstanceUID),
+        referenced_series_uid=referenced_series_uid(dataset),
+    )
+    for roi_contour in dataset.get('ROIContourSequence', []):
+        number = int(roi_contour.ReferencedROINumber)
+        roi = Roi(number=number, name=names.get(number, ''))
+        for contour in roi_contour.get('ContourSequence', []):
+            if contour.get('ContourGeometricType', 'CLOSED_PLANAR') != 'CLOSED_PLANAR':
+                continue
+            points = np.asarray(contour.ContourData, dtype=np.float64).reshape(-1, 3)
+            if len(points) >= 3:
+                roi.contours.append(points)
+        if roi.contours:
+            structure_set.rois.append(roi)
+    return structure_set
+
+
+def load_structure_set(path):
+    '''
+    Read a structure set, returning None if the file cannot be parsed. Used from pool workers.
+    '''
+    try:
+        return read_structure_set(path)
+    except Exception:
+        return None
+
+
+def sort_slices(paths):
+    '''
+    Read the geometry headers of an image series and return [(position, path, dataset), ...] sorted along the slice normal.
+    '''
+    slices = []
+    for path in paths:
+        dataset = pydicom.dcmread(
+            path,
+            stop_before_pixels=True,
+            specific_tags=['ImagePositionPatient', 'ImageOrientationPatient', 'PixelSpacing', 'Rows', 'Columns'],
+        )
+        orientation = np.asarray(dataset.ImageOrientationPatient, dtype=np.float64)
+        normal = np.cross(orientation[:3], orientation[3:])
+        slices.append((float(np.dot(normal, np.asarray(dataset.ImagePositionPatient, dtype=np.float64))), path, dataset))
+    slices.sort(key=lambda item: item[0])
+    return slices
+
+
+def read_series_geometry(paths):
+    '''
+    Return the Geometry of an image series from its headers, without reading pixel data.
+    '''
+    slices = sort_slices(paths)
+    first = slices[0][2]
+    orientation = np.asarray(first.ImageOrientationPatient, dtype=np.float64)
+    normal = np.cross(orientation[:3], orientation[3:])
+    gaps = np.diff([position for position, path, dataset in slices])
+    row_spacing, column_spacing = (float(value) for value in first.PixelSpacing)
+    return Geometry(
+        origin=tuple(float(value) for value in first.ImagePositionPatient),
+        spacing=(column_spacing, row_spacing, float(np.median(gaps)) if len(gaps) else 1.0),
+        direction=tuple(np.column_stack([orientation[:3], orientation[3:], normal]).ravel()),
+        size=(int(first.Columns), int(first.Rows), len(slices)),
+    )
+
+
+def read_image_series(paths):
+    '''
+    Read the slices of an image series into a SimpleITK image, sorted along the slice normal.
+    '''
+    reader = sitk.ImageSeriesReader()
+    reader.SetFileNames([path for position, path, dataset in sort_slices(paths)])
+    return reader.Execute()
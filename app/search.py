@@ -0,0 +1,166 @@
+'''
+Ranked search of patients, diagnoses and DICOM studies for typeahead boxes.
+
+On PostgreSQL every kind of result is answered from an index:
+
+- patients by a fragment of their UID (ILIKE on a trigram index of the
+  upper-cased UID) or by a possibly misspelled name (trigram word
+  similarity), best match first;
+- diagnoses by the label or code of their cancer site or pathology. Labels
+  are matched by trigram word similarity on the small lookup tables and the
+  newest diagnoses of each label read from its (label, date) index, best
+  label first;
+- DICOM studies by full-text search of their description, every word of the
+  query matching as a prefix, newest first.
+
+The pg_trgm extension and the trigram and full-text GIN indexes are created
+by migrations on PostgreSQL only (app.operations.PostgresAddIndex). Elsewhere
+the search falls back to case-insensitive substring matching.
+'''
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchVectorField, TrigramWordSimilarity
+from django.db import connection, transaction
+from django.db.models import Case, F, FloatField, Func, Q, Value, When
+from django.db.models.functions import Greatest
+
+from app.models import Diagnosis, DICOMStudy, Patient
+from lookup.models import LookupCancerSite, LookupPathology
+
+KINDS = ['patients', 'diagnoses', 'studies']
+
+# Queries shorter than this return nothing: they would match most rows.
+MIN_QUERY_LENGTH = 2
+
+# Lookup labels whose diagnoses are listed, best match first.
+MAX_LABELS = 10
+
+class DescriptionVector(Func):
+    '''
+    to_tsvector('simple', expression), the expression of the full-text index dicom_study_fts_idx.
+    '''
+    function = 'to_tsvector'
+    template = "%(function)s('simple', %(expressions)s)"
+    output_field = SearchVectorField()
+
+
+def prefix_query(query):
+    '''
+    Return a tsquery matching every word of query as a prefix, or None if query has no words.
+    '''
+    words = re.findall(r'\w+', query.lower())
+    return ' & '.join(f'{word}:*' for word in words) or None
+
+
+def postgres():
+    return connection.vendor == 'postgresql'
+
+
+def search_patients(query, limit):
+    '''
+    Return patients whose UID contains query or whose name is similar to it, best match first.
+    '''
+    uid_rank = Case(
+        When(patient_uid__iexact=query, then=Value(1.0)),
+        When(patient_uid__istartswith=query, then=Value(0.9)),
+        When(patient_uid__icontains=query, then=Value(0.7)),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+    if postgres():
+        matches = Q(patient_uid__icontains=query) | Q(name__trigram_word_similar=query)
+        name_rank = TrigramWordSimilarity(query, 'name')
+    else:
+        matches = Q(patient_uid__icontains=query) | Q(name__icontains=query)
+        name_rank = Case(
+            When(name__istartswith=query, then=Value(0.8)),
+            When(name__icontains=query, then=Value(0.6)),
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+    rows = Patient.objects.filter(matches).annotate(rank=Greatest(uid_rank, name_rank)).order_by('-rank', 'patient_uid')
+    return list(rows.values('id', 'patient_uid', 'name', 'date_of_birth', 'rank')[:limit])
+
+
+def matching_labels(model, query):
+    '''
+    Return [(code, label, rank), ...] of the lookup codes matching query, best match first.
+    '''
+    if postgres():
+        matches = Q(label__trigram_word_similar=query)
+        rank = TrigramWordSimilarity(query, 'label')
+    else:
+        matches = Q(label__icontains=query)
+        rank = Case(When(label__istartswith=query, then=Value(0.8)), default=Value(0.6), output_field=FloatField())
+    rank = Case(When(id__iexact=query, then=Value(1.0)), default=rank, output_field=FloatField())
+    rows = model.objects.filter(matches | Q(id__iexact=query)).annotate(rank=rank).order_by('-rank', 'id')
+    return list(rows.values_list('id', 'label', 'rank')[:MAX_LABELS])
+
+
+def search_diagnoses(query, limit):
+    '''
+    Return the newest diagnoses of the cancer sites and pathologies matching query, best matching label first.
+    '''
+    labels = sorted(
+        [('cancer_site', *label) for label in matching_labels(LookupCancerSite, query)]
+        + [('cancer_pathology', *label) for label in matching_labels(LookupPathology, query)],
+        key=lambda label: -label[3],
+    )
+    results = {}
+    for field, code, label, rank in labels:
+        if len(results) >= limit:
+            break
+        rows = (
+            Diagnosis.objects.filter(**{field: code}).exclude(pk__in=results).order_by('-date_of_diagnosis', '-pk')
+            .values('id', 'date_of_diagnosis', patient_uid=F('patient__patient_uid'), patient_name=F('patient__name'),
+                    cancer_site_label=F('cancer_site__label'), cancer_pathology_label=F('cancer_pathology__label'))
+        )
+        for row in rows[:limit - len(results)]:
+            results[row['id']] = {**row, 'matched': label, 'rank': rank}
+    return list(results.values())
+
+
+def search_studies(query, limit):
+    '''
+    Return the newest DICOM studies whose description matches every word of query as a prefix.
+    '''
+    if postgres():
+        tsquery = prefix_query(query)
+        if tsquery is None:
+            return []
+        rows = DICOMStudy.objects.annotate(vector=DescriptionVector('study_description')).filter(
+            vector=SearchQuery(tsquery, search_type='raw', config='simple')
+        )
+    else:
+        rows = DICOMStudy.objects.all()
+        for word in re.findall(r'\w+', query):
+            rows = rows.filter(study_description__icontains=word)
+    rows = rows.order_by('-study_date_time', '-pk').values(
+        'id', 'study_instance_uid', 'study_date_time', 'study_modality', 'study_description',
+        patient_uid=F('radiotherapy_simulation__radiotherapy_booking__diagnosis__patient__patient_uid'),
+    )
+    return list(rows[:limit])
+
+
+SEARCHES = {
+    'patients': search_patients,
+    'diagnoses': search_diagnoses,
+    'studies': search_studies,
+}
+
+
+def search(query, kinds=None, limit=10):
+    '''
+    Return {kind: [result, ...]} of at most limit results of each kind in kinds (default: all of KINDS).
+    '''
+    query = query.strip()
+    kinds = kinds or KINDS
+    if len(query) < MIN_QUERY_LENGTH:
+        return {kind: [] for kind in kinds}
+    with transaction.atomic():
+        if postgres():
+            with connection.cursor() as cursor:
+                # Misspelled names and labels fall below the default threshold of 0.6.
+                cursor.execute("SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)", [str(settings.SEARCH_SIMILARITY_THRESHOLD)])
+        return {kind: SEARCHES[kind](query, limit) for kind in kinds}
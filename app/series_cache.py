@@ -0,0 +1,126 @@
+'''
+Cache of decoded image series shared by every computation on them.
+
+Radiomic feature extraction and tile rendering each need the voxels of a
+CT series, and decoding hundreds of DICOM files and sorting them along the
+slice normal costs far more than the computations themselves. A series is
+decoded once into a contiguous (z, y, x) array stored as .npy with its
+geometry in a JSON sidecar, in a DiskCache bounded to SERIES_CACHE_BYTES.
+Consumers open the array memory-mapped, so every process reading the same
+series shares its pages through the page cache instead of holding a copy.
+
+Entries are keyed by the series UID and the path, size and modification
+time of its files, so a series whose files change is decoded again. Each
+process also keeps the series it opened last, up to
+SERIES_CACHE_MEMORY_BYTES, to skip reopening them.
+'''
+import hashlib
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+import SimpleITK as sitk
+from django.conf import settings
+
+from app.disk_cache import DiskCache
+from app.rtstruct import Geometry, read_image_series
+
+
+@dataclass
+class SeriesVolume:
+    '''
+    A decoded image series. pixels is a read-only, memory-mapped (z, y, x) array.
+    '''
+    series_instance_uid: str
+    pixels: np.ndarray
+    geometry: Geometry
+
+    def image(self):
+        '''
+        Return the series as a SimpleITK image. The voxels are copied.
+        '''
+        image = sitk.GetImageFromArray(np.asarray(self.pixels))
+        image.SetOrigin(self.geometry.origin)
+        image.SetSpacing(self.geometry.spacing)
+        image.SetDirection(self.geometry.direction)
+        return image
+
+
+class SeriesCache:
+    '''
+    Decoded image series keyed by Series Instance UID and the state of their files.
+    '''
+
+    def __init__(self, directory=None, max_bytes=None, memory_bytes=None):
+        self.cache = DiskCache(directory or settings.SERIES_CACHE_DIR, max_bytes or settings.SERIES_CACHE_BYTES)
+        self.memory_bytes = settings.SERIES_CACHE_MEMORY_BYTES if memory_bytes is None else memory_bytes
+        self.opened = OrderedDict()
+
+    @staticmethod
+    def key(series_instance_uid, image_paths):
+        digest = hashlib.blake2b(series_instance_uid.encode(), digest_size=16)
+        for path in sorted(image_paths):
+            stat = os.stat(path)
+            digest.update(f'\0{path}\0{stat.st_size}\0{stat.st_mtime_ns}'.encode())
+        return digest.hexdigest()
+
+    def open(self, key):
+        '''
+        Open a cached series, or return None if it is not cached.
+        '''
+        metadata = self.cache.read_json(key, 'json')
+        if metadata is None:
+            return None
+        pixels = self.cache.load_array(key, 'npy')
+        if pixels is None:
+            return None
+        geometry = Geometry(*(tuple(metadata[name]) for name in ('origin', 'spacing', 'direction', 'size')))
+        return SeriesVolume(metadata['series_instance_uid'], pixels, geometry)
+
+    def decode(self, key, series_instance_uid, image_paths):
+        image = read_image_series(image_paths)
+        geometry = Geometry.from_image(image)
+        self.cache.save_array(key, 'npy', sitk.GetArrayViewFromImage(image))
+        self.cache.write_json(key, 'json', {
+            'series_instance_uid': series_instance_uid,
+            'origin': list(geometry.origin),
+            'spacing': list(geometry.spacing),
+            'direction': list(geometry.direction),
+            'size': list(geometry.size),
+        })
+        self.cache.evict(keep={key})
+        return self.open(key)
+
+    def load(self, series_instance_uid, image_paths):
+        '''
+        Return the SeriesVolume of an image series, decoding it into the cache first if needed.
+        '''
+        key = self.key(series_instance_uid, image_paths)
+        if key in self.opened:
+            self.opened.move_to_end(key)
+            return self.opened[key]
+        volume = self.open(key)
+        if volume is None:
+            with self.cache.lock(key):
+                volume = self.open(key) or self.decode(key, series_instance_uid, image_paths)
+        self.remember(key, volume)
+        return volume
+
+    def remember(self, key, volume):
+        '''
+        Keep a volume open in this process, forgetting the least recently used ones beyond memory_bytes.
+        '''
+        self.opened[key] = volume
+        total = sum(opened.pixels.nbytes for opened in self.opened.values())
+        while total > self.memory_bytes and len(self.opened) > 1:
+            total -= self.opened.popitem(last=False)[1].pixels.nbytes
+
+
+@lru_cache(maxsize=1)
+def get_series_cache():
+    '''
+    Return the SeriesCache of this process.
+    '''
+    return SeriesCache()
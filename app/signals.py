@@ -0,0 +1,48 @@
+from app.aggregates import enqueue_sites
+from app.models import Diagnosis, RadiotherapyBooking, RadiotherapySimulation
+from app.summaries import patients_of, schedule_patient_summaries
+
+
+def remember_diagnosis_site(sender, instance, **kwargs):
+    '''
+    Keep the stored cancer site of a diagnosis about to be saved, so a change of site refreshes the old site too.
+    '''
+    instance._previous_sites = list(Diagnosis.objects.filter(pk=instance.pk).values_list('cancer_site_id', flat=True)) if instance.pk else []
+
+
+def remember_booking_site(sender, instance, **kwargs):
+    '''
+    Keep the cancer site of the stored diagnosis of a booking about to be saved, so a booking moved to another diagnosis refreshes the old site too.
+    '''
+    instance._previous_sites = list(
+        RadiotherapyBooking.objects.filter(pk=instance.pk).values_list('diagnosis__cancer_site_id', flat=True)
+    ) if instance.pk else []
+
+
+def queue_diagnosis_aggregates(sender, instance, **kwargs):
+    enqueue_sites([instance.cancer_site_id, *getattr(instance, '_previous_sites', ())])
+
+
+def queue_booking_aggregates(sender, instance, **kwargs):
+    sites = Diagnosis.objects.filter(pk=instance.diagnosis_id).values_list('cancer_site_id', flat=True)
+    enqueue_sites([*sites, *getattr(instance, '_previous_sites', ())])
+
+
+def refresh_patient_summary(sender, instance, **kwargs):
+    schedule_patient_summaries([instance.pk])
+
+
+def refresh_diagnosis_summary(sender, instance, **kwargs):
+    schedule_patient_summaries([instance.patient_id])
+
+
+def refresh_booking_summary(sender, instance, **kwargs):
+    schedule_patient_summaries(patients_of(Diagnosis, [instance.diagnosis_id]))
+
+
+def refresh_simulation_summary(sender, instance, **kwargs):
+    schedule_patient_summaries(patients_of(RadiotherapyBooking, [instance.radiotherapy_booking_id]))
+
+
+def refresh_study_summary(sender, instance, **kwargs):
+    schedule_patient_summaries(patients_of(RadiotherapySimulation, [instance.radiotherapy_simulation_id]))
@@ -0,0 +1,205 @@
+'''
+Denormalized per-patient overview rows.
+
+The patient overview lists each patient with their latest diagnosis, number
+of radiotherapy bookings, date of the last simulation and number of DICOM
+studies. Computing those per page costs a subquery per patient, so they are
+kept in PatientSummary instead and a page of the overview is a single range
+scan of its (date_of_registration, patient) index.
+
+Summaries are refreshed after commit whenever a patient, diagnosis, booking,
+simulation or DICOM study is saved or deleted, by the signals in
+app/signals.py and by the bulk importers and DICOM ingest, which bypass them.
+'''
+import binascii
+import datetime
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import BooleanField, Count, IntegerField, Max, OuterRef, Subquery, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+
+from app.models import Diagnosis, DICOMStudy, Patient, PatientSummary, RadiotherapyBooking, RadiotherapySimulation
+from lookup.cache import lookup_cache
+from lookup.models import LookupCancerSite, LookupPathology
+
+# Path from each model of the patient chain to its patient.
+PATIENT_PATHS = {
+    Patient: 'pk',
+    Diagnosis: 'patient_id',
+    RadiotherapyBooking: 'diagnosis__patient_id',
+    RadiotherapySimulation: 'radiotherapy_booking__diagnosis__patient_id',
+    DICOMStudy: 'radiotherapy_simulation__radiotherapy_booking__diagnosis__patient_id',
+}
+
+# Largest page of the overview.
+OVERVIEW_LIMIT = 500
+
+SUMMARY_FIELDS = [
+    'patient_uid', 'name', 'gender', 'date_of_birth', 'date_of_registration',
+    'latest_diagnosis_id', 'latest_cancer_site_id', 'latest_cancer_pathology_id', 'latest_date_of_diagnosis',
+    'booking_count', 'last_simulation_date', 'study_count',
+]
+
+
+def patients_of(model, ids):
+    '''
+    Return the ids of the patients of the model rows with the given primary keys.
+    '''
+    ids = [pk for pk in ids if pk is not None]
+    if not ids:
+        return []
+    return list(model.objects.filter(pk__in=ids).values_list(PATIENT_PATHS[model], flat=True).distinct())
+
+
+def per_patient(model, aggregate):
+    '''
+    Return a subquery of an aggregate of the model rows of the outer patient.
+    '''
+    path = PATIENT_PATHS[model]
+    return Subquery(
+        model.objects.filter(**{path: OuterRef('pk')}).order_by().values(path).annotate(value=aggregate).values('value')
+    )
+
+
+def summary_queryset():
+    '''
+    Return the patients annotated with the values of their summary.
+    '''
+    latest = Diagnosis.objects.filter(patient=OuterRef('pk')).order_by('-date_of_diagnosis', '-pk')
+    return Patient.objects.annotate(
+        latest_diagnosis_id=Subquery(latest.values('pk')[:1]),
+        latest_cancer_site_id=Subquery(latest.values('cancer_site_id')[:1]),
+        latest_cancer_pathology_id=Subquery(latest.values('cancer_pathology_id')[:1]),
+        latest_date_of_diagnosis=Subquery(latest.values('date_of_diagnosis')[:1]),
+        booking_count=Coalesce(per_patient(RadiotherapyBooking, Count('pk')), Value(0), output_field=IntegerField()),
+        last_simulation_date=per_patient(RadiotherapySimulation, Max('date_of_simulation')),
+        study_count=Coalesce(per_patient(DICOMStudy, Count('pk')), Value(0), output_field=IntegerField()),
+    ).values_list('pk', *SUMMARY_FIELDS)
+
+
+def refresh_patient_summaries(patient_ids=None, batch_size=1000):
+    '''
+    Recompute the summaries of the patients, or of every patient if patient_ids is None.
+
+    Returns the number of summaries written.
+    '''
+    queryset = summary_queryset().order_by('pk')
+    if patient_ids is None:
+        rows = queryset.iterator(chunk_size=batch_size)
+    else:
+        ids = sorted(set(patient_ids))
+        rows = (row for start in range(0, len(ids), batch_size) for row in queryset.filter(pk__in=ids[start:start + batch_size]))
+
+    written = 0
+    batch = []
+    for pk, *values in rows:
+        batch.append(PatientSummary(patient_id=pk, **dict(zip(SUMMARY_FIELDS, values))))
+        if len(batch) == batch_size:
+            written += write_summaries(batch)
+            batch = []
+    if batch:
+        written += write_summaries(batch)
+    return written
+
+
+def write_summaries(summaries):
+    PatientSummary.objects.bulk_create(
+        summaries,
+        update_conflicts=True,
+        unique_fields=['patient'],
+        update_fields=SUMMARY_FIELDS + ['updated_at'],
+    )
+    return len(summaries)
+
+
+def schedule_patient_summaries(patient_ids):
+    '''
+    Refresh the summaries of the patients once the current transaction commits.
+
+    Deferring the refresh lets a cascade delete remove the patient first.
+    '''
+    ids = {pk for pk in patient_ids if pk is not None}
+    if ids:
+        transaction.on_commit(lambda: refresh_patient_summaries(ids))
+
+
+def encode_cursor(summary):
+    return urlsafe_b64encode(f'{summary.date_of_registration.isoformat()}|{summary.patient_id}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    '''
+    Return the (date_of_registration, patient id) of a cursor. Raises ValueError if it is malformed.
+    '''
+    try:
+        date, pk = urlsafe_b64decode(cursor.encode()).decode().split('|')
+    except (binascii.Error, UnicodeDecodeError) as error:
+        raise ValueError(f'Invalid cursor {cursor!r}') from error
+    return datetime.date.fromisoformat(date), int(pk)
+
+
+def overview_labels():
+    return {'sites': lookup_cache.labels(LookupCancerSite), 'pathologies': lookup_cache.labels(LookupPathology)}
+
+
+def summary_row(summary, labels):
+    '''
+    Return the overview row of a summary, with lookup codes resolved through the maps of overview_labels().
+    '''
+    return {
+        'patient_uid': summary.patient_uid,
+        'name': summary.name,
+        'gender': summary.gender,
+        'date_of_birth': summary.date_of_birth,
+        'date_of_registration': summary.date_of_registration,
+        'latest_cancer_site': labels['sites'].get(summary.latest_cancer_site_id, summary.latest_cancer_site_id),
+        'latest_cancer_pathology': labels['pathologies'].get(summary.latest_cancer_pathology_id, summary.latest_cancer_pathology_id),
+        'latest_date_of_diagnosis': summary.latest_date_of_diagnosis,
+        'booking_count': summary.booking_count,
+        'last_simulation_date': summary.last_simulation_date,
+        'study_count': summary.study_count,
+    }
+
+
+def overview_queryset(cursor=None):
+    '''
+    Return the summaries after the cursor, newest registrations first.
+    '''
+    queryset = PatientSummary.objects.order_by('-date_of_registration', '-patient_id')
+    if cursor:
+        queryset = queryset.filter(RawSQL('(date_of_registration, patient_id) < (%s, %s)', decode_cursor(cursor), output_field=BooleanField()))
+    return queryset
+
+
+def check_limit(limit):
+    if not 0 < limit <= OVERVIEW_LIMIT:
+        raise ValueError(f'limit must be between 1 and {OVERVIEW_LIMIT}')
+
+
+def overview_result(summaries, limit, labels):
+    next_cursor = encode_cursor(summaries[limit - 1]) if len(summaries) > limit else None
+    return [summary_row(summary, labels) for summary in summaries[:limit]], next_cursor
+
+
+def overview_page(cursor=None, limit=50):
+    '''
+    Return (rows, next cursor) of the page of summaries after the cursor, newest registrations first.
+
+    The page is read by seeking past the (date_of_registration, patient)
+    key of the cursor, so its cost does not grow with the page number. The
+    next cursor is None on the last page.
+    '''
+    check_limit(limit)
+    return overview_result(list(overview_queryset(cursor)[:limit + 1]), limit, overview_labels())
+
+
+async def aoverview_page(cursor=None, limit=50):
+    '''
+    Asynchronous overview_page() for the async API.
+    '''
+    check_limit(limit)
+    summaries = [summary async for summary in overview_queryset(cursor)[:limit + 1]]
+    return overview_result(summaries, limit, await sync_to_async(overview_labels)())
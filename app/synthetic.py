@@ -0,0 +1,459 @@
+'''
+Synthetic cohorts for benchmarks and tests.
+
+generate_cohort() fills the lookup tables and creates patients with the
+fan-out of a radiotherapy registry: one or more diagnoses per patient,
+bookings per diagnosis with concurrent systemic therapy, a practice session
+before some final simulations and a planning CT study per completed
+simulation, sometimes with an MR study. Everything is drawn from a seeded
+generator, so the same seed gives the same cohort, and written with
+bulk_create one batch of patients at a time.
+
+write_dicom() writes a CT series, RT Structure Set, RT Plan and RT Dose for
+generated studies, with the patient, study UID and date of their DICOMStudy
+row, so the files ingest back onto the same records, and optionally a
+Spatial Registration per treatment fraction with a setup error drawn as a
+systematic error per study plus a random error per fraction.
+'''
+import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.sequence import Sequence
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+from app.aggregates import enqueue_sites
+from app.models import Diagnosis, DICOMStudy, Patient, RadiotherapyBooking, RadiotherapySimulation
+from app.registration import compose
+from app.summaries import refresh_patient_summaries
+from lookup.cache import lookup_cache
+from lookup.models import (
+    LookupBillingCode,
+    LookupCancerSite,
+    LookupPathology,
+    LookupRadiotherapyTreatmentTechnique,
+    LookupSystemicTherapyType,
+)
+
+LOOKUPS = {
+    LookupCancerSite: [
+        ('C34', 'Lung'), ('C50', 'Breast'), ('C61', 'Prostate'), ('C20', 'Rectum'),
+        ('C71', 'Brain'), ('C53', 'Cervix uteri'), ('C15', 'Oesophagus'), ('C32', 'Larynx'),
+    ],
+    LookupPathology: [
+        ('8140', 'Adenocarcinoma'), ('8070', 'Squamous cell carcinoma'), ('8500', 'Infiltrating duct carcinoma'),
+        ('8041', 'Small cell carcinoma'), ('9440', 'Glioblastoma'),
+    ],
+    LookupRadiotherapyTreatmentTechnique: [
+        ('3DCRT', '3D Conformal Radiotherapy'), ('IMRT', 'Intensity Modulated Radiotherapy'),
+        ('VMAT', 'Volumetric Modulated Arc Therapy'), ('SBRT', 'Stereotactic Body Radiotherapy'),
+        ('HDR', 'High Dose Rate Brachytherapy'),
+    ],
+    LookupBillingCode: [('RT1', 'Simple'), ('RT2', 'Intermediate'), ('RT3', 'Complex')],
+    LookupSystemicTherapyType: [
+        ('CHEMO', 'Chemotherapy'), ('IMMUNO', 'Immunotherapy'), ('TARGETED', 'Targeted Therapy'), ('HORMONE', 'Hormone Therapy'),
+    ],
+}
+
+# (fractions, dose) schedules drawn for curative and palliative bookings.
+SCHEDULES = {
+    'curative': [(30, 60), (20, 55), (25, 50), (39, 78), (5, 40)],
+    'palliative': [(1, 8), (5, 20), (10, 30)],
+}
+
+# Patient names combine these, so name searches see repeated and similar names.
+GIVEN_NAMES = [
+    'Amina', 'Arjun', 'Beatriz', 'Chen', 'Daniel', 'Elena', 'Fatima', 'Grace', 'Hiroshi', 'Ibrahim', 'Joanna', 'John',
+    'Katarzyna', 'Liam', 'Maria', 'Mohammed', 'Nadia', 'Oliver', 'Priya', 'Rafael', 'Sofia', 'Thomas', 'Wei', 'Yusuf',
+]
+FAMILY_NAMES = [
+    'Adeyemi', 'Andersen', 'Brown', 'Chatterjee', 'Costa', 'Dubois', 'Fernandez', 'Fischer', 'Garcia', 'Haddad',
+    'Ivanova', 'Johansson', 'Kaur', 'Kowalski', 'Li', 'MacDonald', 'Martin', 'Nakamura', 'Nguyen', 'OConnor',
+    'Patel', 'Rossi', 'Schmidt', 'Silva', 'Smith', 'Tanaka', 'Van der Berg', 'Wang', 'Williams', 'Yilmaz',
+]
+
+T_STAGES = ['1', '1a', '1b', '2', '2a', '3', '4']
+N_STAGES = ['0', '1', '2', '3']
+M_STAGES = ['0', '0', '0', '1']
+
+CT_SOP_CLASS = '1.2.840.10008.5.1.4.1.1.2'
+RTSTRUCT_SOP_CLASS = '1.2.840.10008.5.1.4.1.1.481.3'
+RTPLAN_SOP_CLASS = '1.2.840.10008.5.1.4.1.1.481.5'
+RTDOSE_SOP_CLASS = '1.2.840.10008.5.1.4.1.1.481.2'
+REG_SOP_CLASS = '1.2.840.10008.5.1.4.1.1.66.1'
+
+# Standard deviations of the synthetic setup errors: (translation in mm, rotation in degrees).
+SYSTEMATIC_SETUP_ERROR = (2.0, 0.5)
+RANDOM_SETUP_ERROR = (1.5, 0.5)
+
+
+@dataclass
+class CohortReport:
+    '''
+    Rows created by one generate_cohort() run.
+    '''
+    patients: int = 0
+    diagnoses: int = 0
+    bookings: int = 0
+    systemic_therapies: int = 0
+    simulations: int = 0
+    studies: int = 0
+
+
+def create_lookups():
+    '''
+    Create the lookup codes of LOOKUPS that do not exist yet.
+    '''
+    for model, codes in LOOKUPS.items():
+        model.objects.bulk_create([model(id=code, label=label) for code, label in codes], ignore_conflicts=True)
+        lookup_cache.invalidate(model)
+
+
+def derived_uid(*sources):
+    '''
+    Return a UID that depends only on the sources, so a seed always gives the same UIDs.
+    '''
+    return generate_uid(entropy_srcs=[str(source) for source in sources])
+
+
+def study_uid(prefix, seed, key):
+    return derived_uid(prefix, seed, 'study', key)
+
+
+def synthetic_name(seed, number):
+    '''
+    Return the name of a generated patient. Names do not use the generator, so the cohort drawn from a seed does not depend on them.
+    '''
+    given = GIVEN_NAMES[(number * 7 + seed) % len(GIVEN_NAMES)]
+    family = FAMILY_NAMES[(number // len(GIVEN_NAMES) + number + seed) % len(FAMILY_NAMES)]
+    return f'{given} {family}'
+
+
+def generate_cohort(patients, seed=0, batch_size=1000, prefix='SYN'):
+    '''
+    Create patients with their diagnoses, bookings, simulations and DICOM studies.
+
+    Patient UIDs are prefix followed by the seed and a running number, so
+    cohorts generated with different seeds or prefixes can share a database.
+    Returns a CohortReport.
+    '''
+    create_lookups()
+    rng = np.random.default_rng(seed)
+    report = CohortReport()
+    for start in range(0, patients, batch_size):
+        with transaction.atomic():
+            generate_batch(rng, prefix, seed, start, min(batch_size, patients - start), report)
+    return report
+
+
+def generate_batch(rng, prefix, seed, start, count, report):
+    sites = [code for code, label in LOOKUPS[LookupCancerSite]]
+    pathologies = [code for code, label in LOOKUPS[LookupPathology]]
+    techniques = [code for code, label in LOOKUPS[LookupRadiotherapyTreatmentTechnique]]
+    billing = [code for code, label in LOOKUPS[LookupBillingCode]]
+    therapies = [code for code, label in LOOKUPS[LookupSystemicTherapyType]]
+    today = datetime.date.today()
+
+    registered = [today - datetime.timedelta(days=int(days)) for days in rng.integers(0, 3650, count)]
+    patients = Patient.objects.bulk_create([
+        Patient(
+            patient_uid=f'{prefix}{seed}-{number:07d}',
+            name=synthetic_name(seed, number),
+            gender=str(rng.choice(['M', 'F', 'O'], p=[0.49, 0.49, 0.02])),
+            date_of_birth=date_of_registration - datetime.timedelta(days=int(rng.integers(30 * 365, 85 * 365))),
+        )
+        for number, date_of_registration in zip(range(start, start + count), registered)
+    ])
+    # date_of_registration is set on insert, so the spread is applied afterwards.
+    for patient, date_of_registration in zip(patients, registered):
+        patient.date_of_registration = date_of_registration
+    Patient.objects.bulk_update(patients, ['date_of_registration'])
+
+    diagnoses = []
+    for patient in patients:
+        for index in range(1 + rng.poisson(0.2)):
+            diagnoses.append(Diagnosis(
+                patient=patient,
+                cancer_site_id=str(rng.choice(sites)),
+                cancer_side=str(rng.choice(['L', 'R', 'ML', 'NA'])),
+                cancer_pathology_id=str(rng.choice(pathologies)),
+                date_of_diagnosis=patient.date_of_registration - datetime.timedelta(days=int(rng.integers(0, 60)) + 365 * index),
+                ajcc_t_stage_major=str(rng.choice(T_STAGES)),
+                ajcc_n_stage_major=str(rng.choice(N_STAGES)),
+                ajcc_m_stage_major=str(rng.choice(M_STAGES)),
+            ))
+    # A patient can have one diagnosis per site, side and pathology.
+    diagnoses = list({(d.patient_id, d.cancer_site_id, d.cancer_side, d.cancer_pathology_id): d for d in diagnoses}.values())
+    Diagnosis.objects.bulk_create(diagnoses)
+
+    bookings, booking_therapies = [], []
+    for diagnosis in diagnoses:
+        for index in range(1 + rng.poisson(0.3)):
+            intent = 'curative' if rng.random() < 0.7 else 'palliative'
+            fractions, dose = SCHEDULES[intent][rng.integers(len(SCHEDULES[intent]))]
+            concurrent = intent == 'curative' and rng.random() < 0.4
+            start_date = diagnosis.date_of_diagnosis + datetime.timedelta(days=int(rng.integers(14, 60)) + 180 * index)
+            bookings.append(RadiotherapyBooking(
+                diagnosis=diagnosis,
+                radiotherapy_treatment_intent=intent,
+                radiotherapy_treatment_sequence='definitive' if intent == 'curative' else 'palliative',
+                radiotherapy_modality='BRT' if rng.random() < 0.05 else 'EBRT',
+                radiotherapy_treatment_technique_id=str(rng.choice(techniques)),
+                radiotherapy_billing_category_id=str(rng.choice(billing)),
+                concurrent_systemic_therapy=concurrent,
+                proposed_planning_image_date=start_date - datetime.timedelta(days=7),
+                proposed_treatment_start_date=start_date,
+                planned_total_dose=dose,
+                planned_total_number_of_fractions=fractions,
+            ))
+            booking_therapies.append(rng.choice(therapies, size=rng.integers(1, 3), replace=False) if concurrent else [])
+    RadiotherapyBooking.objects.bulk_create(bookings)
+    through = RadiotherapyBooking.systemic_therapy_type.through
+    links = through.objects.bulk_create([
+        through(radiotherapybooking_id=booking.pk, lookupsystemictherapytype_id=str(code))
+        for booking, codes in zip(bookings, booking_therapies)
+        for code in codes
+    ])
+
+    simulations = []
+    for booking in bookings:
+        if rng.random() < 0.25:
+            simulations.append(RadiotherapySimulation(
+                radiotherapy_booking=booking, simulation_appointment_type='Practice',
+                date_of_simulation=booking.proposed_planning_image_date - datetime.timedelta(days=3), simulation_done=True,
+            ))
+        done = rng.random() < 0.97
+        simulations.append(RadiotherapySimulation(
+            radiotherapy_booking=booking, simulation_appointment_type='Final',
+            date_of_simulation=booking.proposed_planning_image_date, simulation_done=done,
+            reason_why_simulation_not_done=None if done else 'Patient unwell',
+        ))
+    RadiotherapySimulation.objects.bulk_create(simulations)
+
+    studies = []
+    for simulation in simulations:
+        if simulation.simulation_appointment_type != 'Final' or not simulation.simulation_done:
+            continue
+        acquired = timezone.make_aware(datetime.datetime.combine(simulation.date_of_simulation, datetime.time(10)))
+        studies.append(DICOMStudy(
+            radiotherapy_simulation=simulation, study_instance_uid=study_uid(prefix, seed, f'{start}.{len(studies)}'),
+            study_date_time=acquired, study_modality='CT\\RTSTRUCT\\RTPLAN\\RTDOSE', study_description='Planning CT',
+        ))
+        if rng.random() < 0.1:
+            studies.append(DICOMStudy(
+                radiotherapy_simulation=simulation, study_instance_uid=study_uid(prefix, seed, f'{start}.{len(studies)}'),
+                study_date_time=acquired + datetime.timedelta(hours=1), study_modality='MR', study_description='Planning MR',
+            ))
+    DICOMStudy.objects.bulk_create(studies)
+
+    # bulk_create sends no signals.
+    refresh_patient_summaries([patient.pk for patient in patients])
+    enqueue_sites({diagnosis.cancer_site_id for diagnosis in diagnoses})
+
+    report.patients += len(patients)
+    report.diagnoses += len(diagnoses)
+    report.bookings += len(bookings)
+    report.systemic_therapies += len(links)
+    report.simulations += len(simulations)
+    report.studies += len(studies)
+
+
+def dicom_dataset(sop_class_uid, sop_instance_uid, patient_uid, study_instance_uid, modality, acquired):
+    dataset = Dataset()
+    dataset.file_meta = FileMetaDataset()
+    dataset.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    dataset.file_meta.MediaStorageSOPClassUID = sop_class_uid
+    dataset.file_meta.MediaStorageSOPInstanceUID = sop_instance_uid
+    dataset.SOPClassUID = sop_class_uid
+    dataset.SOPInstanceUID = sop_instance_uid
+    dataset.PatientID = patient_uid
+    dataset.StudyInstanceUID = study_instance_uid
+    dataset.Modality = modality
+    dataset.StudyDate = acquired.strftime('%Y%m%d')
+    dataset.StudyTime = acquired.strftime('%H%M%S')
+    dataset.StudyDescription = 'Planning CT'
+    return dataset
+
+
+def circle(radius, z, points=64):
+    angles = np.linspace(0, 2 * np.pi, points, endpoint=False)
+    return np.column_stack([radius * np.cos(angles), radius * np.sin(angles), np.full(points, z)])
+
+
+def write_registrations(directory, patient_uid, study_instance_uid, acquired, frame_uid, fractions):
+    '''
+    Write a Spatial Registration of a verification CBCT to the planning CT for each of the daily fractions of a study.
+    '''
+    rng = np.random.default_rng(int(study_instance_uid.replace('.', '')[-18:]) + 1)
+    scale = np.repeat([SYSTEMATIC_SETUP_ERROR, RANDOM_SETUP_ERROR], 3, axis=1)
+    shifts = rng.normal(0, scale[0], 6) + rng.normal(0, scale[1], (fractions, 6))
+    for fraction, transform in enumerate(compose(shifts)):
+        fraction_acquired = acquired + datetime.timedelta(days=7 + fraction)
+        registration = dicom_dataset(REG_SOP_CLASS, derived_uid(study_instance_uid, 'reg', fraction), patient_uid, study_instance_uid, 'REG', acquired)
+        registration.SeriesInstanceUID = derived_uid(study_instance_uid, 'reg', 'series')
+        registration.FrameOfReferenceUID = frame_uid
+        registration.ContentDate = fraction_acquired.strftime('%Y%m%d')
+        registration.ContentTime = fraction_acquired.strftime('%H%M%S')
+        items = []
+        for item_frame_uid, matrix in ((frame_uid, np.eye(4)), (derived_uid(study_instance_uid, 'cbct', fraction), transform)):
+            matrix_item = Dataset()
+            matrix_item.FrameOfReferenceTransformationMatrixType = 'RIGID'
+            matrix_item.FrameOfReferenceTransformationMatrix = [round(float(value), 6) for value in matrix.ravel()]
+            matrix_registration = Dataset()
+            matrix_registration.MatrixSequence = Sequence([matrix_item])
+            item = Dataset()
+            item.FrameOfReferenceUID = item_frame_uid
+            item.MatrixRegistrationSequence = Sequence([matrix_registration])
+            items.append(item)
+        registration.RegistrationSequence = Sequence(items)
+        registration.save_as(os.path.join(directory, f'RE.{fraction:04d}.dcm'), enforce_file_format=True)
+    return fractions
+
+
+def write_study(task):
+    '''
+    Write the CT series, structure set, plan and dose of one study, and its registrations if any. Runs inside pool workers.
+
+    The patient is an elliptical body of soft tissue with a spherical tumour
+    whose size and position are drawn from the study UID. The structure set
+    outlines the tumour as GTV and a 5 mm margin as PTV, and the dose falls
+    off from 60 Gy around the tumour. Returns the number of files written.
+    '''
+    root, patient_uid, study_instance_uid, acquired, slices, size, registrations = task
+    rng = np.random.default_rng(int(study_instance_uid.replace('.', '')[-18:]))
+    directory = os.path.join(root, patient_uid, study_instance_uid)
+    os.makedirs(directory, exist_ok=True)
+
+    series_uid = derived_uid(study_instance_uid, 'ct')
+    frame_uid = derived_uid(study_instance_uid, 'frame')
+    spacing, thickness = 400.0 / size, 3.0
+    radius = float(rng.uniform(10, 30))
+    centre = np.array([rng.uniform(-40, 40), rng.uniform(-30, 30), thickness * slices / 2 + rng.uniform(-10, 10)])
+    origin = np.array([-spacing * (size - 1) / 2, -spacing * (size - 1) / 2, 0.0])
+
+    axis = origin[0] + spacing * np.arange(size)
+    yy, xx = np.meshgrid(axis, axis, indexing='ij')
+    body = (xx / 180) ** 2 + (yy / 120) ** 2 <= 1
+    for index in range(slices):
+        z = thickness * index
+        hu = np.where(body, 40, -1000) + rng.normal(0, 15, (size, size))
+        hu[(xx - centre[0]) ** 2 + (yy - centre[1]) ** 2 + (z - centre[2]) ** 2 <= radius ** 2] += 30
+        dataset = dicom_dataset(CT_SOP_CLASS, derived_uid(study_instance_uid, 'ct', index), patient_uid, study_instance_uid, 'CT', acquired)
+        dataset.SeriesInstanceUID = series_uid
+        dataset.FrameOfReferenceUID = frame_uid
+        dataset.InstanceNumber = index + 1
+        dataset.ImagePositionPatient = [float(origin[0]), float(origin[1]), z]
+        dataset.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        dataset.PixelSpacing = [spacing, spacing]
+        dataset.SliceThickness = thickness
+        dataset.Rows = dataset.Columns = size
+        dataset.SamplesPerPixel = 1
+        dataset.PhotometricInterpretation = 'MONOCHROME2'
+        dataset.BitsAllocated = dataset.BitsStored = 16
+        dataset.HighBit = 15
+        dataset.PixelRepresentation = 1
+        dataset.RescaleIntercept = -1024
+        dataset.RescaleSlope = 1
+        dataset.PixelData = np.round(hu + 1024).astype(np.int16).tobytes()
+        dataset.save_as(os.path.join(directory, f'CT.{index:04d}.dcm'), enforce_file_format=True)
+
+    structure_set = dicom_dataset(RTSTRUCT_SOP_CLASS, derived_uid(study_instance_uid, 'rtstruct'), patient_uid, study_instance_uid, 'RTSTRUCT', acquired)
+    structure_set.SeriesInstanceUID = derived_uid(study_instance_uid, 'rtstruct', 'series')
+    referenced_series = Dataset()
+    referenced_series.SeriesInstanceUID = series_uid
+    referenced_study = Dataset()
+    referenced_study.ReferencedSOPInstanceUID = study_instance_uid
+    referenced_study.RTReferencedSeriesSequence = Sequence([referenced_series])
+    referenced_frame = Dataset()
+    referenced_frame.FrameOfReferenceUID = frame_uid
+    referenced_frame.RTReferencedStudySequence = Sequence([referenced_study])
+    structure_set.ReferencedFrameOfReferenceSequence = Sequence([referenced_frame])
+    rois, roi_contours = [], []
+    for number, (name, roi_radius) in enumerate([('GTV', radius), ('PTV', radius + 5)], start=1):
+        roi = Dataset()
+        roi.ROINumber = number
+        roi.ROIName = name
+        rois.append(roi)
+        contours = []
+        for index in range(slices):
+            z = thickness * index
+            section = roi_radius ** 2 - (z - centre[2]) ** 2
+            if section <= 1:
+                continue
+            contour = Dataset()
+            contour.ContourGeometricType = 'CLOSED_PLANAR'
+            points = circle(np.sqrt(section), z) + [centre[0], centre[1], 0]
+            contour.NumberOfContourPoints = len(points)
+            contour.ContourData = [round(float(value), 3) for value in points.ravel()]
+            contours.append(contour)
+        roi_contour = Dataset()
+        roi_contour.ReferencedROINumber = number
+        roi_contour.ContourSequence = Sequence(contours)
+        roi_contours.append(roi_contour)
+    structure_set.StructureSetROISequence = Sequence(rois)
+    structure_set.ROIContourSequence = Sequence(roi_contours)
+    structure_set.save_as(os.path.join(directory, 'RS.dcm'), enforce_file_format=True)
+
+    plan = dicom_dataset(RTPLAN_SOP_CLASS, derived_uid(study_instance_uid, 'rtplan'), patient_uid, study_instance_uid, 'RTPLAN', acquired)
+    plan.SeriesInstanceUID = derived_uid(study_instance_uid, 'rtplan', 'series')
+    referenced_structure_set = Dataset()
+    referenced_structure_set.ReferencedSOPClassUID = RTSTRUCT_SOP_CLASS
+    referenced_structure_set.ReferencedSOPInstanceUID = structure_set.SOPInstanceUID
+    plan.ReferencedStructureSetSequence = Sequence([referenced_structure_set])
+    plan.save_as(os.path.join(directory, 'RP.dcm'), enforce_file_format=True)
+
+    dose = dicom_dataset(RTDOSE_SOP_CLASS, derived_uid(study_instance_uid, 'rtdose'), patient_uid, study_instance_uid, 'RTDOSE', acquired)
+    dose.SeriesInstanceUID = derived_uid(study_instance_uid, 'rtdose', 'series')
+    dose.FrameOfReferenceUID = frame_uid
+    referenced_plan = Dataset()
+    referenced_plan.ReferencedSOPClassUID = RTPLAN_SOP_CLASS
+    referenced_plan.ReferencedSOPInstanceUID = plan.SOPInstanceUID
+    dose.ReferencedRTPlanSequence = Sequence([referenced_plan])
+    dose.DoseSummationType = 'PLAN'
+    dose.DoseUnits = 'GY'
+    dose.DoseType = 'PHYSICAL'
+    grid = 4.0
+    shape = (int(thickness * slices / grid), int(spacing * size / grid), int(spacing * size / grid))
+    dose_origin = [float(origin[0]), float(origin[1]), 0.0]
+    dose.ImagePositionPatient = dose_origin
+    dose.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+    dose.PixelSpacing = [grid, grid]
+    dose.GridFrameOffsetVector = [grid * index for index in range(shape[0])]
+    dose.NumberOfFrames = shape[0]
+    dose.FrameIncrementPointer = (0x3004, 0x000C)
+    dose.Rows, dose.Columns = shape[1], shape[2]
+    dose.SamplesPerPixel = 1
+    dose.PhotometricInterpretation = 'MONOCHROME2'
+    dose.BitsAllocated = dose.BitsStored = 32
+    dose.HighBit = 31
+    dose.PixelRepresentation = 0
+    zz, yy, xx = np.meshgrid(*(offset + grid * np.arange(count) for offset, count in zip(dose_origin[::-1], shape)), indexing='ij')
+    distance = np.sqrt((xx - centre[0]) ** 2 + (yy - centre[1]) ** 2 + (zz - centre[2]) ** 2)
+    values = 60.0 / (1 + np.exp((distance - radius - 8) / 4))
+    dose.DoseGridScaling = 1e-4
+    dose.PixelData = np.round(values / dose.DoseGridScaling).astype(np.uint32).tobytes()
+    dose.save_as(os.path.join(directory, 'RD.dcm'), enforce_file_format=True)
+    return slices + 3 + write_registrations(directory, patient_uid, study_instance_uid, acquired, frame_uid, registrations)
+
+
+def write_dicom(root, studies, processes=None, slices=40, size=128, registrations=0):
+    '''
+    Write synthetic DICOM files for the planning CT studies of a DICOMStudy queryset below root.
+
+    Files go to root/<patient uid>/<study instance uid>/, with registrations
+    REG files per study. Returns the number of files written.
+    '''
+    rows = studies.filter(study_modality__startswith='CT').values_list(
+        'radiotherapy_simulation__radiotherapy_booking__diagnosis__patient__patient_uid', 'study_instance_uid', 'study_date_time',
+    )
+    tasks = [
+        (root, patient_uid, study_instance_uid, timezone.localtime(study_date_time), slices, size, registrations)
+        for patient_uid, study_instance_uid, study_date_time in rows
+    ]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return sum(executor.map(write_study, tasks, chunksize=4))
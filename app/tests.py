@@ -1,3 +1,1467 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import os
+import shutil
+import struct
+import tempfile
+import time
+import zlib
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+import pydicom
+import SimpleITK as sitk
+from asgiref.sync import sync_to_async
+
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from app.models import (
+    AggregateRefreshQueue,
+    CohortAggregate,
+    Diagnosis,
+    DICOMFileManifest,
+    DICOMObject,
+    DICOMStudy,
+    DoseVolumeHistogram,
+    GammaAnalysis,
+    Job,
+    Patient,
+    PatientSummary,
+    ProcessedObject,
+    RadiomicFeatureSchema,
+    RadiomicFeatureSet,
+    RadiotherapyBooking,
+    RadiotherapySimulation,
+    RegistrationShift,
+    StructureVolume,
+)
+from app.aggregates import enqueue_studies, refresh_aggregates
+from app.benchmark import run_benchmark
+from app.bulk_import import DiagnosisImporter, PatientImporter
+from app import features, filters, jobs, metrics, rtstruct
+from app.dicom_files import instance_files, series_files, study_files
+from app.disk_cache import DiskCache
+from app.dvh import DoseGrid, Histogram, compute_dvhs
+from app.export import cohort_queryset
+from app.feature_vectors import encode, feature_matrix, get_schema
+from app.gamma import GammaCriteria, compute_gamma, gamma_index
+from app.ingest import content_hash, ingest_directory
+from app.masks import MaskStore, rasterize
+from app.registration import compose, decompose, ingest_registrations, setup_errors
+from app.search import search
+from app.series_cache import SeriesCache, get_series_cache
+from app.summaries import encode_cursor, overview_queryset, refresh_patient_summaries
+from app.synthetic import derived_uid, generate_cohort, write_dicom
+from app.volumes import compute_volumes, roi_volumes
+from lookup.models import (
+    LookupBillingCode,
+    LookupCancerSite,
+    LookupPathology,
+    LookupRadiotherapyTreatmentTechnique,
+    LookupSystemicTherapyType,
+)
+
+
+def create_lookups():
+    return {
+        'site': LookupCancerSite.objects.create(id='C34', label='Lung'),
+        'pathology': LookupPathology.objects.create(id='8140', label='Adenocarcinoma'),
+        'technique': LookupRadiotherapyTreatmentTechnique.objects.create(id='IMRT', label='IMRT'),
+        'billing': LookupBillingCode.objects.create(id='B1', label='Billing 1'),
+        'therapies': [
+            LookupSystemicTherapyType.objects.create(id='CHEMO', label='Chemotherapy'),
+            LookupSystemicTherapyType.objects.create(id='IMMUNO', label='Immunotherapy'),
+        ],
+    }
+
+
+def create_patients(lookups, start, count):
+    '''
+    Create count patients, each with the full chain down to a DICOM study and its measurements.
+    '''
+    schema = get_schema('0' * 64, ['original_shape_VoxelVolume'])
+    for number in range(start, start + count):
+        patient = Patient.objects.create(patient_uid=f'P{number:05d}', name=f'Patient {number}', date_of_birth=datetime.date(1960, 1, 1), gender='M')
+        diagnosis = Diagnosis.objects.create(
+            patient=patient,
+            cancer_site=lookups['site'],
+            cancer_side='L',
+            cancer_pathology=lookups['pathology'],
+            date_of_diagnosis=datetime.date(2020, 1, 1),
+        )
+        booking = RadiotherapyBooking.objects.create(
+            diagnosis=diagnosis,
+            radiotherapy_treatment_intent='curative',
+            radiotherapy_treatment_sequence='definitive',
+            radiotherapy_modality='EBRT',
+            radiotherapy_treatment_technique=lookups['technique'],
+            radiotherapy_billing_category=lookups['billing'],
+            concurrent_systemic_therapy=True,
+            planned_total_dose=60,
+            planned_total_number_of_fractions=30,
+        )
+        booking.systemic_therapy_type.set(lookups['therapies'])
+        simulation = RadiotherapySimulation.objects.create(
+            radiotherapy_booking=booking,
+            simulation_appointment_type='Final',
+            date_of_simulation=datetime.date(2020, 2, 1),
+            simulation_done=True,
+        )
+        study = DICOMStudy.objects.create(
+            radiotherapy_simulation=simulation,
+            study_instance_uid=f'1.2.3.{number}',
+            study_date_time=timezone.now(),
+            study_modality='CT',
+            study_description='Planning CT',
+        )
+        DICOMFileManifest.objects.create(
+            path=f'/data/{number}/ct.dcm', size=1, mtime_ns=1, sop_instance_uid=f'1.2.3.{number}.1',
+            study_instance_uid=study.study_instance_uid, modality='CT', content_hash='0' * 64, dicom_study=study,
+        )
+        DICOMObject.objects.create(
+            sop_instance_uid=f'1.2.3.{number}.1', study_instance_uid=study.study_instance_uid, series_instance_uid=f'1.2.3.{number}.3',
+            modality='CT', content_hash='0' * 64, size=1, path=f'/data/{number}/ct.dcm', header={}, dicom_study=study,
+        )
+        RadiomicFeatureSet.objects.create(
+            dicom_study=study, structure_set_uid=f'1.2.3.{number}.2', roi_number=1, roi_name='GTV',
+            series_instance_uid=f'1.2.3.{number}.3', parameter_hash='0' * 64, cache_key=f'{number:064d}',
+            schema=schema, values=encode({'original_shape_VoxelVolume': 1.0}, schema.names),
+        )
+        StructureVolume.objects.create(
+            dicom_study=study, structure_set_uid=f'1.2.3.{number}.2', roi_number=1, roi_name='GTV', volume=1.0,
+            centroid_x=0, centroid_y=0, centroid_z=0, extent_x=1, extent_y=1, extent_z=1, slice_count=1, slice_thickness=1,
+        )
+        DoseVolumeHistogram.objects.create(
+            dicom_study=study, dose_uid=f'1.2.3.{number}.4', structure_set_uid=f'1.2.3.{number}.2', roi_number=1, roi_name='GTV',
+            volume=1.0, bin_width=0.1, histogram=b'\0' * 4, d_min=0, d_mean=0, d_max=0, d_2=0, d_50=0, d_95=0, d_98=0,
+            v_5=0, v_10=0, v_20=0, v_30=0, v_40=0, v_50=0,
+        )
+        Job.objects.create(kind='dvh', dicom_study=study)
+        CohortAggregate.objects.create(
+            grouping='site', cancer_site=lookups['site'], source='dose', roi_name='GTV', metric=f'd_{number}',
+            count=1, mean=0, std=0, minimum=0, maximum=0, p5=0, p25=0, p50=0, p75=0, p95=0, histogram=[1],
+        )
+
+
+class MigrationTests(TestCase):
+    '''
+    Every model change comes with its migration.
+    '''
+
+    def test_migrations(self):
+        output = io.StringIO()
+        call_command('makemigrations', dry_run=True, stdout=output)
+        self.assertEqual(output.getvalue().strip(), 'No changes detected')
+
+
+class AdminQueryBudgetTests(TestCase):
+    '''
+    Every changelist and autocomplete view of the app runs a fixed number of queries, whatever the number of rows.
+    '''
+    budget = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lookups = create_lookups()
+        create_patients(cls.lookups, 0, 3)
+        cls.user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(queries)
+
+    def assertConstantQueries(self, urls):
+        before = {url: self.count_queries(url) for url in urls}
+        create_patients(self.lookups, 100, 10)
+        for url in urls:
+            with self.subTest(url=url):
+                after = self.count_queries(url)
+                self.assertEqual(after, before[url], f'{url} runs more queries as rows are added')
+                self.assertLessEqual(after, self.budget)
+
+    def test_changelists(self):
+        urls = [
+            reverse(f'admin:{model._meta.app_label}_{model._meta.model_name}_changelist')
+            for model in admin.site._registry if model._meta.app_label == 'app'
+        ]
+        self.assertEqual(len(urls), 15)
+        self.assertConstantQueries(urls)
+
+    def test_autocomplete(self):
+        fields = [
+            (model, field)
+            for model, model_admin in admin.site._registry.items() if model._meta.app_label == 'app'
+            for field in model_admin.autocomplete_fields
+        ]
+        urls = [
+            f"{reverse('admin:autocomplete')}?app_label=app&model_name={model._meta.model_name}&field_name={field}&term="
+            for model, field in fields
+        ]
+        self.assertConstantQueries(urls)
+
+
+class PatientOverviewTests(TestCase):
+    '''
+    The overview pages through every patient summary with a constant number of queries per page.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lookups = create_lookups()
+        create_patients(cls.lookups, 0, 7)
+        # Several patients share a registration date, so pages must break ties on the id.
+        Patient.objects.filter(pk__in=Patient.objects.order_by('pk').values('pk')[:4]).update(date_of_registration=datetime.date(2021, 5, 1))
+        refresh_patient_summaries()
+        cls.user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def fetch(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(queries)
+
+    def test_pages(self):
+        url = reverse('app:patient_overview') + '?limit=3'
+        rows, counts = [], []
+        while url:
+            page, queries = self.fetch(url)
+            rows.extend(page['results'])
+            counts.append(queries)
+            url = page['next']
+        self.assertEqual(len(counts), 3)
+        self.assertEqual(len(set(counts[1:])), 1)
+        self.assertEqual(sorted(row['patient_uid'] for row in rows), sorted(Patient.objects.values_list('patient_uid', flat=True)))
+        keys = [(row['date_of_registration'], row['patient_uid']) for row in rows]
+        self.assertEqual([key[0] for key in keys], sorted((key[0] for key in keys), reverse=True))
+        self.assertEqual(rows[0]['latest_cancer_site'], 'Lung')
+        self.assertEqual((rows[0]['booking_count'], rows[0]['study_count'], rows[0]['last_simulation_date']), (1, 1, '2020-02-01'))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('app:patient_overview') + '?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 400)
+
+    def test_summary_follows_writes(self):
+        patient = Patient.objects.order_by('pk').first()
+        with self.captureOnCommitCallbacks(execute=True):
+            Diagnosis.objects.create(
+                patient=patient, cancer_site=self.lookups['site'], cancer_side='R',
+                cancer_pathology=self.lookups['pathology'], date_of_diagnosis=datetime.date(2022, 3, 1),
+            )
+        summary = PatientSummary.objects.get(patient=patient)
+        self.assertEqual(summary.latest_date_of_diagnosis, datetime.date(2022, 3, 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            DICOMStudy.objects.filter(radiotherapy_simulation__radiotherapy_booking__diagnosis__patient=patient).delete()
+        self.assertEqual(PatientSummary.objects.get(patient=patient).study_count, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            patient.delete()
+        self.assertFalse(PatientSummary.objects.filter(patient_id=patient.pk).exists())
+
+
+class ReadAPITests(TestCase):
+    '''
+    The async read API pages through the studies and returns the measurements of a study.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        create_patients(create_lookups(), 0, 5)
+        DoseVolumeHistogram.objects.update(histogram=np.array([2.0, 1.5, 0.5], dtype='<f4').tobytes())
+        cls.user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_study_pages(self):
+        url = reverse('app:study_list') + '?limit=2&modality=CT'
+        uids = []
+        while url:
+            page = self.client.get(url).json()
+            uids.extend(row['study_instance_uid'] for row in page['results'])
+            url = page['next']
+        self.assertEqual(uids, [f'1.2.3.{number}' for number in reversed(range(5))])
+
+        page = self.client.get(reverse('app:study_list') + '?patient_uid=P00003').json()
+        self.assertEqual([(row['study_instance_uid'], row['patient_uid']) for row in page['results']], [('1.2.3.3', 'P00003')])
+        self.assertEqual(self.client.get(reverse('app:study_list') + '?after=x').status_code, 400)
+
+    def test_modality_filter(self):
+        DICOMStudy.objects.filter(study_instance_uid='1.2.3.0').update(study_modality='RTSTRUCT')
+        DICOMStudy.objects.filter(study_instance_uid='1.2.3.1').update(study_modality='CT\\RTDOSE\\RTSTRUCT')
+        page = self.client.get(reverse('app:study_list') + '?modality=CT').json()
+        self.assertEqual([row['study_instance_uid'] for row in page['results']], ['1.2.3.4', '1.2.3.3', '1.2.3.2', '1.2.3.1'])
+        page = self.client.get(reverse('app:study_list') + '?modality=RTSTRUCT').json()
+        self.assertEqual([row['study_instance_uid'] for row in page['results']], ['1.2.3.1', '1.2.3.0'])
+
+        uids = cohort_queryset(modality=['RTDOSE', 'MR']).values_list('study_instance_uid', flat=True)
+        self.assertEqual(list(uids), ['1.2.3.1'])
+        self.assertEqual(cohort_queryset(modality=['CT'], cancer_site=['C34']).count(), 4)
+        self.assertEqual(cohort_queryset(modality=['T']).count(), 0)
+
+    def test_study_measurements(self):
+        page = self.client.get(reverse('app:study_features', args=['1.2.3.1']) + '?prefix=original_shape').json()
+        self.assertEqual(page['features'][0]['features'], {'original_shape_VoxelVolume': 1.0})
+        self.assertEqual(page['volumes'][0]['roi_name'], 'GTV')
+        page = self.client.get(reverse('app:study_features', args=['1.2.3.1']) + '?prefix=wavelet').json()
+        self.assertEqual(page['features'][0]['features'], {})
+
+        page = self.client.get(reverse('app:study_dvhs', args=['1.2.3.1'])).json()
+        self.assertNotIn('histogram', page['dvhs'][0])
+        self.assertEqual(page['dvhs'][0]['d_95'], 0)
+        page = self.client.get(reverse('app:study_dvhs', args=['1.2.3.1']) + '?histogram=1').json()
+        self.assertEqual(page['dvhs'][0]['histogram'], [2.0, 1.5, 0.5])
+
+        self.assertEqual(self.client.get(reverse('app:study_dvhs', args=['9.9.9'])).status_code, 404)
+
+    def test_search(self):
+        url = reverse('app:registry_search')
+        page = self.client.get(url + '?q=p0000').json()
+        self.assertEqual([(row['patient_uid'], row['rank']) for row in page['patients']], [(f'P0000{number}', 0.9) for number in range(5)])
+        self.assertEqual(page['studies'], [])
+        page = self.client.get(url + '?q=P00003&kind=patients').json()
+        self.assertEqual(set(page), {'query', 'patients'})
+        self.assertEqual((page['patients'][0]['patient_uid'], page['patients'][0]['rank']), ('P00003', 1.0))
+
+        page = self.client.get(url + '?q=adenocarc&kind=diagnoses&limit=2').json()
+        self.assertEqual([(row['matched'], row['cancer_site_label']) for row in page['diagnoses']], [('Adenocarcinoma', 'Lung')] * 2)
+        page = self.client.get(url + '?q=plan%20c&kind=studies').json()
+        self.assertEqual(len(page['studies']), 5)
+        self.assertEqual(page['studies'][0]['study_description'], 'Planning CT')
+
+        self.assertEqual(self.client.get(url + '?q=p').json()['patients'], [])
+        self.assertEqual(self.client.get(url + '?q=p0&kind=plans').status_code, 400)
+
+    def test_permissions(self):
+        user = get_user_model().objects.create_user('viewer', 'viewer@example.com', 'password')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse('app:study_features', args=['1.2.3.1'])).status_code, 403)
+
+
+class FeatureMatrixTests(TestCase):
+    '''
+    Feature vectors of several schemas read back as one ROI x feature matrix, sliced by the database or in NumPy.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        create_patients(create_lookups(), 0, 3)
+        schema = get_schema('1' * 64, ['original_shape_VoxelVolume', 'original_firstorder_Mean', 'wavelet-LLH_firstorder_Mean'])
+        for number, study in enumerate(DICOMStudy.objects.order_by('pk')):
+            RadiomicFeatureSet.objects.create(
+                dicom_study=study, structure_set_uid=f'1.2.3.{number}.2', roi_number=2, roi_name='CTV',
+                series_instance_uid=f'1.2.3.{number}.3', parameter_hash=schema.parameter_hash, cache_key=f'{number + 100:064d}', schema=schema,
+                values=encode({'original_shape_VoxelVolume': number, 'original_firstorder_Mean': np.nan, 'wavelet-LLH_firstorder_Mean': -number}, schema.names),
+            )
+
+    def test_matrix(self):
+        get_schema('1' * 64, ['original_shape_VoxelVolume', 'original_firstorder_Mean', 'wavelet-LLH_firstorder_Mean'])
+        self.assertEqual(RadiomicFeatureSchema.objects.count(), 2)
+        matrix = feature_matrix()
+        self.assertEqual(matrix.names, ['original_shape_VoxelVolume', 'original_firstorder_Mean', 'wavelet-LLH_firstorder_Mean'])
+        self.assertEqual(matrix.values.shape, (6, 3))
+        self.assertEqual(matrix.roi_names, ['GTV'] * 3 + ['CTV'] * 3)
+        np.testing.assert_array_equal(matrix.column('original_shape_VoxelVolume'), [1, 1, 1, 0, 1, 2])
+        np.testing.assert_array_equal(matrix.column('wavelet-LLH_firstorder_Mean'), [np.nan] * 3 + [0, -1, -2])
+
+        queryset = RadiomicFeatureSet.objects.filter(roi_name='CTV')
+        for slices in (32, 0):
+            with mock.patch('app.feature_vectors.MAX_SLICES', slices):
+                matrix = feature_matrix(queryset, names=['wavelet-LLH_firstorder_Mean', 'missing'])
+            np.testing.assert_array_equal(matrix.values, [[0, np.nan], [-1, np.nan], [-2, np.nan]])
+            self.assertEqual(matrix.study_ids.tolist(), list(DICOMStudy.objects.order_by('pk').values_list('pk', flat=True)))
+        matrix = feature_matrix(queryset, prefixes=['original_'])
+        self.assertEqual(matrix.names, ['original_shape_VoxelVolume', 'original_firstorder_Mean'])
+        self.assertEqual(feature_matrix(RadiomicFeatureSet.objects.none()).values.shape, (0, 0))
+
+    def test_api(self):
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password'))
+        page = self.client.get(reverse('app:study_features', args=['1.2.3.2']) + '?prefix=original_').json()
+        self.assertEqual([row['features'] for row in page['features']], [
+            {'original_shape_VoxelVolume': 2.0, 'original_firstorder_Mean': None},
+            {'original_shape_VoxelVolume': 1.0},
+        ])
+
+
+class BulkImportTests(TestCase):
+    '''
+    Importers reject invalid and duplicate records, including duplicates in another batch of a dry run.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        create_patients(create_lookups(), 0, 2)
+
+    def test_patients(self):
+        records = [
+            {'patient_uid': 'N1', 'name': 'New 1', 'date_of_birth': '1970-01-01', 'gender': 'F'},
+            {'patient_uid': 'N2', 'name': 'New 2', 'date_of_birth': 'not a date', 'gender': 'F'},
+            {'patient_uid': 'N3', 'name': 'New 3', 'date_of_birth': '1970-01-01', 'gender': 'X'},
+            {'patient_uid': 'P00000', 'name': 'Existing', 'date_of_birth': '1970-01-01', 'gender': 'M'},
+            {'patient_uid': 'N1', 'name': 'New 1 again', 'date_of_birth': '1970-01-01', 'gender': 'F'},
+        ]
+        for dry_run in (True, False):
+            result = PatientImporter(batch_size=2, dry_run=dry_run).run(records)
+            self.assertEqual((result.records, result.created), (5, 1))
+            self.assertEqual([(number, list(errors)) for number, errors in result.errors], [
+                (2, ['date_of_birth']), (3, ['gender']), (4, ['patient_uid']), (5, ['patient_uid']),
+            ])
+            self.assertEqual(Patient.objects.filter(patient_uid='N1').count(), 0 if dry_run else 1)
+
+    def test_diagnoses(self):
+        diagnosis = {'patient_uid': 'P00000', 'cancer_site': 'C34', 'cancer_side': 'R', 'cancer_pathology': '8140', 'date_of_diagnosis': '2021-01-01'}
+        records = [
+            diagnosis,
+            {**diagnosis, 'patient_uid': 'missing'},
+            {**diagnosis, 'cancer_site': 'C99'},
+            {**diagnosis, 'patient_uid': 'P00001', 'date_of_diagnosis': '1950-01-01'},
+            {**diagnosis, 'cancer_side': 'L'},
+            {**diagnosis, 'cancer_pathology': ''},
+            diagnosis,
+        ]
+        result = DiagnosisImporter(batch_size=3, dry_run=True).run(records)
+        self.assertEqual((result.records, result.created), (7, 1))
+        self.assertEqual([(number, list(errors)) for number, errors in result.errors], [
+            (2, ['patient']), (3, ['cancer_site']), (4, ['date_of_diagnosis']), (5, ['__all__']), (6, ['cancer_pathology']), (7, ['__all__']),
+        ])
+        self.assertEqual(Diagnosis.objects.count(), 2)
+
+
+class AggregateTests(TestCase):
+    '''
+    Moving a diagnosis or booking queues both cancer sites, and a refresh recomputes only the queued sources.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lookups = create_lookups()
+        create_patients(cls.lookups, 0, 3)
+
+    def queued(self):
+        return set(AggregateRefreshQueue.objects.values_list('cancer_site_id', 'source'))
+
+    def test_move_site(self):
+        other = LookupCancerSite.objects.create(id='C50', label='Breast')
+        sources = {'dose', 'radiomics', 'volume'}
+        AggregateRefreshQueue.objects.all().delete()
+        diagnosis = Diagnosis.objects.order_by('pk').first()
+        diagnosis.cancer_site = other
+        diagnosis.save()
+        self.assertEqual(self.queued(), {(site, source) for site in ('C34', 'C50') for source in sources})
+
+        AggregateRefreshQueue.objects.all().delete()
+        booking = RadiotherapyBooking.objects.exclude(diagnosis=diagnosis).order_by('pk').first()
+        booking.diagnosis = diagnosis
+        booking.save()
+        self.assertEqual(self.queued(), {(site, source) for site in ('C34', 'C50') for source in sources})
+
+    def test_refresh_source(self):
+        self.assertEqual(refresh_aggregates(full=True)[0], 1)
+        self.assertFalse(AggregateRefreshQueue.objects.exists())
+        site = {'grouping': 'site', 'roi_name': 'GTV', 'cancer_site_id': 'C34'}
+        self.assertEqual(CohortAggregate.objects.get(source='volume', metric='volume', **site).mean, 1)
+
+        StructureVolume.objects.update(volume=F('volume') + 1)
+        DoseVolumeHistogram.objects.update(d_mean=5)
+        enqueue_studies(DICOMStudy.objects.values_list('pk', flat=True), ['volume'])
+        self.assertEqual(self.queued(), {('C34', 'volume')})
+        refresh_aggregates()
+        self.assertEqual(CohortAggregate.objects.get(source='volume', metric='volume', **site).mean, 2)
+        # The dose aggregates were not queued, so they keep the old values until their source is refreshed.
+        self.assertEqual(CohortAggregate.objects.get(source='dose', metric='d_mean', **site).mean, 0)
+        self.assertTrue(CohortAggregate.objects.filter(source='radiomics', **site).exists())
+
+
+class MetricsTests(TestCase):
+    '''
+    Sampled requests and stages are recorded per URL pattern and exposed in the Prometheus text format.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        create_patients(create_lookups(), 0, 2)
+        cls.user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def sample(self, line):
+        exposition = self.client.get(reverse('app:metrics')).content.decode()
+        values = [float(sample.rsplit(' ', 1)[1]) for sample in exposition.splitlines() if sample.startswith(line + ' ')]
+        return values[0] if values else 0.0
+
+    def test_requests(self):
+        labels = '{route="app:api/studies",method="GET"}'
+        count, queries = self.sample(f'quantrad_request_seconds_count{labels}'), self.sample(f'quantrad_request_queries_sum{labels}')
+        self.client.get(reverse('app:study_list'))
+        self.assertEqual(self.sample(f'quantrad_request_seconds_count{labels}'), count + 1)
+        self.assertGreater(self.sample(f'quantrad_request_queries_sum{labels}'), queries)
+        self.assertEqual(self.sample('quantrad_responses_total{route="app:api/studies",method="GET",status="200"}'), count + 1)
+
+        with override_settings(METRICS_SAMPLE_RATE=0):
+            self.client.get(reverse('app:study_list'))
+        self.assertEqual(self.sample(f'quantrad_request_seconds_count{labels}'), count + 1)
+
+        with override_settings(METRICS_SLOW_REQUEST_SECONDS=0), self.assertLogs('app.metrics', 'WARNING') as logs:
+            self.client.get(reverse('app:study_list'))
+        self.assertIn('SELECT', logs.output[0])
+
+        self.assertEqual(self.client.get(reverse('app:metrics'), REMOTE_ADDR='10.0.0.1').status_code, 403)
+
+    async def test_async_requests(self):
+        await self.async_client.aforce_login(self.user)
+        line = 'quantrad_request_queries_sum{route="app:api/studies",method="GET"}'
+        queries = await sync_to_async(self.sample)(line)
+        response = await self.async_client.get(reverse('app:study_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(await sync_to_async(self.sample)(line), queries)
+
+    def test_stages(self):
+        count = self.sample('quantrad_stage_seconds_count{stage="test"}')
+        with metrics.timed('test'):
+            pass
+        with self.assertRaises(ValueError), metrics.timed('test'):
+            raise ValueError
+        self.assertEqual(self.sample('quantrad_stage_seconds_count{stage="test"}'), count + 2)
+        self.assertEqual(self.sample('quantrad_stage_seconds_bucket{stage="test",le="+Inf"}'), count + 2)
+        self.assertGreaterEqual(self.sample('quantrad_stage_failures_total{stage="test"}'), 1)
+
+
+def plan_nodes(plan):
+    '''
+    Yield the nodes of an EXPLAIN (FORMAT JSON) plan.
+    '''
+    yield plan
+    for child in plan.get('Plans', ()):
+        yield from plan_nodes(child)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'query plans are checked against PostgreSQL only')
+class QueryPlanTests(TestCase):
+    '''
+    The canonical queries of the clinical schema are answered from indexes.
+
+    A seeded registry is analyzed and each query is EXPLAINed. A plan fails if
+    it scans a seeded table sequentially, or if its estimated cost exceeds
+    cost_fraction of the cost of reading the largest table it touches in full.
+    '''
+    patients = 5000
+    cost_fraction = 0.1
+    seeded = {'app_patient', 'app_diagnosis', 'app_radiotherapybooking', 'app_radiotherapysimulation', 'app_dicomstudy', 'app_patientsummary'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lookups = create_lookups()
+        sites = [cls.lookups['site']] + [LookupCancerSite.objects.create(id=f'C{number:02d}', label=f'Site {number}') for number in range(20)]
+        start = datetime.date(2014, 1, 1)
+        patients = Patient.objects.bulk_create([
+            Patient(patient_uid=f'P{number:06d}', name=f'Patient {number}', date_of_birth=datetime.date(1950, 1, 1), gender='F')
+            for number in range(cls.patients)
+        ])
+        diagnoses = Diagnosis.objects.bulk_create([
+            Diagnosis(
+                patient=patient, cancer_site=sites[number % len(sites)], cancer_side='L', cancer_pathology=cls.lookups['pathology'],
+                date_of_diagnosis=start + datetime.timedelta(days=number % 3650),
+            )
+            for number, patient in enumerate(patients)
+        ])
+        bookings = RadiotherapyBooking.objects.bulk_create([
+            RadiotherapyBooking(
+                diagnosis=diagnosis, radiotherapy_treatment_intent='curative', radiotherapy_treatment_sequence='definitive',
+                radiotherapy_modality='EBRT', radiotherapy_treatment_technique=cls.lookups['technique'],
+                radiotherapy_billing_category=cls.lookups['billing'], planned_total_dose=60, planned_total_number_of_fractions=30,
+                proposed_planning_image_date=diagnosis.date_of_diagnosis + datetime.timedelta(days=20),
+                proposed_treatment_start_date=diagnosis.date_of_diagnosis + datetime.timedelta(days=30),
+            )
+            for diagnosis in diagnoses
+        ])
+        simulations = RadiotherapySimulation.objects.bulk_create([
+            RadiotherapySimulation(
+                radiotherapy_booking=booking, simulation_appointment_type='Final',
+                date_of_simulation=booking.proposed_planning_image_date,
+                simulation_done=number % 50 != 0, reason_why_simulation_not_done='Cancelled' if number % 50 == 0 else None,
+            )
+            for number, booking in enumerate(bookings)
+        ])
+        DICOMStudy.objects.bulk_create([
+            DICOMStudy(
+                radiotherapy_simulation=simulation, study_instance_uid=f'1.2.840.{number}', study_date_time=timezone.now(),
+                study_modality='CT', study_description='Planning CT',
+            )
+            for number, simulation in enumerate(simulations)
+        ])
+        refresh_patient_summaries()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def queries(self):
+        patient = Patient.objects.get(patient_uid=f'P{self.patients // 2:06d}')
+        day = datetime.date(2018, 6, 1)
+        week = (day, day + datetime.timedelta(days=7))
+        return {
+            'study_by_uid': DICOMStudy.objects.filter(study_instance_uid=f'1.2.840.{self.patients // 2}'),
+            'overview_page': overview_queryset(encode_cursor(patient.patientsummary))[:50],
+            'latest_diagnosis': Diagnosis.objects.filter(patient=patient).order_by('-date_of_diagnosis', '-pk')[:1],
+            'diagnoses_by_date': Diagnosis.objects.filter(date_of_diagnosis__range=week),
+            'site_cohort': Diagnosis.objects.filter(cancer_site=self.lookups['site'], date_of_diagnosis__range=week).values('patient_id'),
+            'bookings_by_start_date': RadiotherapyBooking.objects.filter(proposed_treatment_start_date__range=week),
+            'pending_simulations': RadiotherapySimulation.objects.filter(simulation_done=False, date_of_simulation__gte=day),
+            'simulations_of_patient': RadiotherapySimulation.objects.filter(
+                radiotherapy_booking__diagnosis__patient__patient_uid__in=[patient.patient_uid]
+            ).values_list('date_of_simulation', 'simulation_done', 'pk'),
+        }
+
+    def full_scan_cost(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT relpages * current_setting('seq_page_cost')::float8 + reltuples * current_setting('cpu_tuple_cost')::float8"
+                " FROM pg_class WHERE oid = %s::regclass",
+                [table],
+            )
+            return cursor.fetchone()[0]
+
+    def test_plans(self):
+        for name, queryset in self.queries().items():
+            with self.subTest(query=name):
+                plan = json.loads(queryset.explain(format='json'))[0]['Plan']
+                nodes = list(plan_nodes(plan))
+                scanned = {node['Relation Name'] for node in nodes if node['Node Type'].endswith('Seq Scan')}
+                self.assertFalse(scanned & self.seeded, f'{name} scans {sorted(scanned & self.seeded)} sequentially')
+                tables = {node['Relation Name'] for node in nodes if 'Relation Name' in node}
+                budget = self.cost_fraction * max(self.full_scan_cost(table) for table in tables)
+                self.assertLessEqual(plan['Total Cost'], budget, f'{name} costs {plan["Total Cost"]}')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'trigram and full-text indexes exist on PostgreSQL only')
+class SearchLatencyTests(TestCase):
+    '''
+    Typeahead searches of a large synthetic registry are answered from indexes within the latency budget.
+
+    Each query runs repeats times; its slowest run must stay under budget
+    seconds, and none of its SQL may scan a seeded table sequentially.
+    '''
+    patients = 20000
+    repeats = 5
+    budget = 0.05
+    seeded = {'app_patient', 'app_diagnosis', 'app_dicomstudy'}
+    queries = [
+        'SYN0-00123', '0012345', 'Jonh Smiht', 'nakamu', 'Van der', 'prostat', 'adenocarcinom', 'C61', 'planning m', 'ct',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        generate_cohort(cls.patients, seed=0, batch_size=5000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def test_results(self):
+        self.assertEqual(search('Jonh Smiht', ['patients'])['patients'][0]['name'], 'John Smith')
+        self.assertEqual(search('SYN0-0001234', ['patients'])['patients'][0]['patient_uid'], 'SYN0-0001234')
+        diagnoses = search('prostat', ['diagnoses'], limit=20)['diagnoses']
+        self.assertEqual({row['cancer_site_label'] for row in diagnoses}, {'Prostate'})
+        self.assertEqual([row['date_of_diagnosis'] for row in diagnoses], sorted((row['date_of_diagnosis'] for row in diagnoses), reverse=True))
+        self.assertEqual({row['study_description'] for row in search('planning m', ['studies'])['studies']}, {'Planning MR'})
+
+    def test_latency(self):
+        for query in self.queries:
+            with self.subTest(query=query):
+                search(query)
+                timings = []
+                for repeat in range(self.repeats):
+                    start = time.perf_counter()
+                    with CaptureQueriesContext(connection) as queries:
+                        search(query)
+                    timings.append(time.perf_counter() - start)
+                self.assertLess(max(timings), self.budget, f'{query!r} took {max(timings) * 1000:.1f} ms')
+                statements = [captured['sql'] for captured in queries.captured_queries if 'set_config' not in captured['sql']]
+                for sql in statements:
+                    with connection.cursor() as cursor:
+                        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+                        plan = cursor.fetchone()[0]
+                    plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]['Plan']
+                    scanned = {node['Relation Name'] for node in plan_nodes(plan) if node['Node Type'].endswith('Seq Scan')}
+                    self.assertFalse(scanned & self.seeded, f'{sql} scans {sorted(scanned & self.seeded)} sequentially')
+
+
+class SyntheticCohortTests(TestCase):
+    '''
+    The synthetic cohort has the registry fan-out and its DICOM files ingest back onto it.
+    '''
+
+    def test_cohort(self):
+        report = generate_cohort(40, seed=3, batch_size=15)
+        self.assertEqual(Patient.objects.count(), report.patients)
+        self.assertEqual(DICOMStudy.objects.count(), report.studies)
+        self.assertGreaterEqual(report.diagnoses, report.patients)
+        self.assertGreaterEqual(report.bookings, report.diagnoses)
+        self.assertGreater(report.systemic_therapies, 0)
+        self.assertEqual(PatientSummary.objects.count(), report.patients)
+        # The same seed gives the same cohort under another prefix.
+        self.assertEqual(generate_cohort(40, seed=3, batch_size=15, prefix='ALT'), report)
+
+    def test_dicom_round_trip(self):
+        generate_cohort(5, seed=1)
+        studies = DICOMStudy.objects.filter(study_modality__startswith='CT').order_by('pk')[:1]
+        study = DICOMStudy.objects.get(pk=studies[0].pk)
+        with tempfile.TemporaryDirectory() as root:
+            self.assertEqual(write_dicom(root, DICOMStudy.objects.filter(pk=study.pk), processes=1, slices=20, size=64), 23)
+            report = ingest_directory(root, processes=1)
+            self.assertEqual((report.studies, report.created, report.unmatched), (1, 0, []))
+            compute_volumes([study], processes=1)
+        volumes = dict(StructureVolume.objects.filter(dicom_study=study).values_list('roi_name', 'volume'))
+        self.assertEqual(set(volumes), {'GTV', 'PTV'})
+        self.assertGreater(volumes['PTV'], volumes['GTV'])
+
+    def test_benchmark(self):
+        results = run_benchmark(30, stages=['generate', 'validation', 'overview', 'export'])
+        json.dumps(results)
+        self.assertEqual(list(results['stages']), ['generate', 'validation', 'overview', 'export'])
+        self.assertEqual(results['stages']['validation']['rejected'], 0)
+        self.assertEqual(results['stages']['overview']['rows'], 30)
+
+
+def rectangle(u, v, width, height, plane, axis=2):
+    '''
+    Return a rectangular contour on the plane normal to axis, as an (N, 3) array of patient coordinates.
+    '''
+    corners = np.array([[u, v], [u + width, v], [u + width, v + height], [u, v + height]], dtype=np.float64)
+    return np.insert(corners, axis, plane, axis=1)
+
+
+class VolumeTests(TestCase):
+    '''
+    Volumes of contoured prisms match their analytic values, and structure sets that fail to parse are read again by the next run.
+    '''
+
+    def test_prism(self):
+        planes = [0.0, 2.5, 5.0, 7.5]
+        rois = [
+            # 20 x 30 mm box on four axial planes: 4 x 600 mm² x 2.5 mm = 6 cm³.
+            rtstruct.Roi(1, 'Box', [rectangle(0, 0, 20, 30, z) for z in planes]),
+            # The same box with a 10 x 10 mm hole in the middle of every plane: 6 - 1 = 5 cm³.
+            rtstruct.Roi(2, 'Ring', [contour for z in planes for contour in (rectangle(0, 0, 20, 30, z), rectangle(5, 10, 10, 10, z))]),
+            # The box contoured on sagittal planes.
+            rtstruct.Roi(3, 'Sagittal', [rectangle(0, 0, 20, 30, x, axis=0) for x in planes]),
+            # A single plane takes the plane spacing of the other ROIs.
+            rtstruct.Roi(4, 'Slab', [rectangle(0, 0, 20, 30, 0)]),
+        ]
+        structure_set = rtstruct.StructureSet('1.2.3.2', '1.2.3', '1.2.3.3', rois)
+        box, ring, sagittal, slab = roi_volumes([structure_set])
+        self.assertAlmostEqual(box.volume, 6.0)
+        self.assertAlmostEqual(ring.volume, 5.0)
+        self.assertAlmostEqual(sagittal.volume, 6.0)
+        self.assertAlmostEqual(slab.volume, 1.5)
+        np.testing.assert_allclose(box.centroid, (10, 15, 3.75))
+        np.testing.assert_allclose(ring.centroid, (10, 15, 3.75))
+        np.testing.assert_allclose(sagittal.centroid, (3.75, 10, 15))
+        np.testing.assert_allclose(box.extent, (20, 30, 7.5))
+        self.assertEqual((box.slice_count, box.slice_thickness), (4, 2.5))
+        self.assertEqual((slab.slice_count, slab.slice_thickness), (1, 2.5))
+
+    def test_unreadable(self):
+        generate_cohort(5, seed=1)
+        study = DICOMStudy.objects.filter(study_modality__startswith='CT').order_by('pk').first()
+        with tempfile.TemporaryDirectory() as root:
+            write_dicom(root, DICOMStudy.objects.filter(pk=study.pk), processes=1, slices=4, size=16)
+            ingest_directory(root, processes=1)
+            path = DICOMObject.objects.get(study_instance_uid=study.study_instance_uid, modality='RTSTRUCT').path
+            shutil.move(path, f'{path}.saved')
+            with open(path, 'wb') as handle:
+                handle.write(b'not a DICOM file')
+            self.assertEqual(compute_volumes([study], processes=1)[0], 0)
+            self.assertFalse(ProcessedObject.objects.filter(stage='volumes').exists())
+
+            shutil.move(f'{path}.saved', path)
+            self.assertEqual(compute_volumes([study], processes=1)[0], 2)
+            self.assertEqual(ProcessedObject.objects.filter(stage='volumes').count(), 1)
+
+
+class DvhTests(TestCase):
+    '''
+    DVH metrics of uniform and linear dose distributions match their analytic values, and stored histograms agree with the metrics.
+    '''
+
+    def test_uniform(self):
+        histogram = Histogram(0.01)
+        histogram.add(np.full(600, 50.0), 0.001)
+        histogram.add(np.full(400, 50.0), 0.001)
+        metrics = histogram.metrics()
+        self.assertAlmostEqual(histogram.volume, 1.0)
+        for name in ('d_min', 'd_mean', 'd_max', 'd_2', 'd_50', 'd_95', 'd_98'):
+            self.assertAlmostEqual(metrics[name], 50.0, msg=name)
+        for name in ('v_5', 'v_10', 'v_20', 'v_30', 'v_40', 'v_50'):
+            self.assertAlmostEqual(metrics[name], 100.0, msg=name)
+
+    def test_gradient(self):
+        # Doses spread evenly over 0-60 Gy, as in a ROI across a linear dose gradient.
+        histogram = Histogram(0.01)
+        histogram.add((np.arange(60000) + 0.5) / 1000, 0.0001)
+        metrics = histogram.metrics()
+        self.assertAlmostEqual(histogram.volume, 6.0)
+        self.assertAlmostEqual(metrics['d_mean'], 30.0)
+        for percent in (2, 50, 95, 98):
+            self.assertAlmostEqual(metrics[f'd_{percent}'], 60 * (1 - percent / 100), delta=0.01, msg=percent)
+        for dose in (5, 10, 20, 30, 40, 50):
+            self.assertAlmostEqual(metrics[f'v_{dose}'], 100 * (60 - dose) / 60, delta=0.02, msg=dose)
+
+        # Trilinear sampling of a dose grid rising 2 Gy/mm along x, zero beyond the grid.
+        x = np.arange(10, dtype=np.float32) * 2.5
+        grid = DoseGrid(
+            sop_instance_uid='1.2', plan_uid='', dose=np.broadcast_to(2 * x, (3, 4, 10)).copy(),
+            origin=np.zeros(3), row_direction=np.array([1.0, 0, 0]), column_direction=np.array([0, 1.0, 0]),
+            normal=np.array([0, 0, 1.0]), spacing=(2.5, 2.5), offsets=np.array([0.0, 3.0, 6.0]),
+        )
+        np.testing.assert_allclose(grid.sample([[0, 0, 0], [3.75, 2.5, 4.5], [22.5, 7.5, 6.0], [40, 0, 0], [5, 0, 20]]), [0, 7.5, 45, 0, 0])
+
+    def test_round_trip(self):
+        generate_cohort(5, seed=1)
+        study = DICOMStudy.objects.filter(study_modality__startswith='CT').order_by('pk').first()
+        with tempfile.TemporaryDirectory() as root, override_settings(MASK_STORE_DIR=f'{root}/masks'):
+            write_dicom(f'{root}/dicom', DICOMStudy.objects.filter(pk=study.pk), processes=1, slices=20, size=64)
+            ingest_directory(f'{root}/dicom', processes=1)
+            pairs, histograms, failed, elapsed = compute_dvhs([study], processes=1)
+            self.assertEqual((pairs, histograms, failed), (1, 2, []))
+            self.assertEqual(compute_dvhs([study], processes=1)[:3], (0, 0, []))
+
+        rows = {row.roi_name: row for row in DoseVolumeHistogram.objects.filter(dicom_study=study)}
+        self.assertEqual(set(rows), {'GTV', 'PTV'})
+        self.assertGreater(rows['GTV'].d_mean, rows['PTV'].d_mean)
+        for row in rows.values():
+            cumulative = np.frombuffer(bytes(row.histogram), dtype='<f4')
+            # The stored bins are every FINE_BINS-th bin the metrics were computed on.
+            self.assertAlmostEqual(float(cumulative[0]), row.volume, places=4)
+            self.assertTrue((np.diff(cumulative) <= 0).all())
+            self.assertEqual(np.count_nonzero(cumulative), int(row.d_max / row.bin_width) + 1)
+            for dose in (5, 10, 20, 30, 40, 50):
+                self.assertAlmostEqual(100 * float(cumulative[round(dose / row.bin_width)]) / row.volume, getattr(row, f'v_{dose}'), places=3)
+            self.assertLessEqual(row.d_min, row.d_98)
+            self.assertLessEqual(row.d_98, row.d_50)
+            self.assertLessEqual(row.d_2, row.d_max)
+            self.assertAlmostEqual(row.d_50, (np.count_nonzero(cumulative >= row.volume / 2) - 1) * row.bin_width, delta=row.bin_width)
+
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password'))
+        page = self.client.get(reverse('app:study_dvhs', args=[study.study_instance_uid]) + '?histogram=1').json()
+        for dvh in page['dvhs']:
+            np.testing.assert_array_equal(np.asarray(dvh['histogram'], dtype='<f4'), np.frombuffer(bytes(rows[dvh['roi_name']].histogram), dtype='<f4'))
+
+
+class GammaTests(TestCase):
+    '''
+    Measured doses are compared with the calculated dose of their plan, and the results are stored per criterion.
+    '''
+
+    def test_gamma_index(self):
+        measured = np.full((6, 8, 10), 10, dtype=np.float32)
+        result = gamma_index(measured, measured * 1.0165, (2, 2, 2), GammaCriteria(3, 2))
+        self.assertEqual(result.points, measured.size)
+        np.testing.assert_allclose(result.gamma, 0.55, atol=1e-5)
+        np.testing.assert_allclose(result.histogram(0.1), np.eye(20)[5] * 100)
+        # 1.5% of the local dose is 1 Gy at 66.7 Gy and 0.15 Gy at 10 Gy.
+        measured[3, :, :5] = 66.7
+        local = gamma_index(measured[3:4], measured[3:4] + 0.15, (0, 2, 2), GammaCriteria(1.5, 2, local=True), threshold_percent=0)
+        self.assertLess(local.gamma[0, 4, 0], 0.2)
+        self.assertAlmostEqual(float(local.gamma[0, 4, 9]), 1.0, places=4)
+
+        # A ramp of 5 Gy/mm shifted by 1 mm agrees within the 2 mm distance, but not within the 3% dose difference alone.
+        # The last column has no calculated dose beyond it to agree with.
+        ramp = np.broadcast_to(5 * 2 * np.arange(10, dtype=np.float32), (4, 6, 10))
+        shifted = gamma_index(ramp, ramp - 5, (2, 2, 2), GammaCriteria(3, 2), threshold_percent=20)
+        np.testing.assert_allclose(shifted.gamma[:, :, 2:-1], 0.5, atol=1e-4)
+        self.assertLess(gamma_index(ramp, ramp - 5, (2, 2, 2), GammaCriteria(3, 0.2), threshold_percent=20).pass_rate, 50)
+
+    def test_compute_gamma(self):
+        generate_cohort(5, seed=1)
+        study = DICOMStudy.objects.filter(study_modality__startswith='CT').order_by('pk').first()
+        with tempfile.TemporaryDirectory() as root:
+            write_dicom(root, DICOMStudy.objects.filter(pk=study.pk), processes=1, slices=20, size=64)
+            directory = os.path.join(root, os.listdir(root)[0], study.study_instance_uid)
+            dose = pydicom.dcmread(os.path.join(directory, 'RD.dcm'))
+            dose.SOPInstanceUID = dose.file_meta.MediaStorageSOPInstanceUID = derived_uid(dose.SOPInstanceUID, 'measured')
+            dose.SeriesDescription = 'Measured QA'
+            dose.DoseGridScaling = dose.DoseGridScaling * 1.01
+            dose.save_as(os.path.join(directory, 'RD.measured.dcm'))
+            ingest_directory(root, processes=1)
+            self.assertEqual(compute_gamma([study], processes=1)[:2], (1, 3))
+            self.assertEqual(compute_gamma([study], processes=1)[:2], (0, 0))
+        analyses = {str(GammaCriteria(row.dose_percent, row.distance_mm, row.local)): row for row in GammaAnalysis.objects.all()}
+        self.assertEqual(set(analyses), {'3%/2mm', '2%/2mm', '3%/2mm local'})
+        analysis = analyses['3%/2mm']
+        self.assertEqual((analysis.measured_dose_uid, analysis.dimensions), (dose.SOPInstanceUID, 3))
+        self.assertEqual(analysis.pass_rate, 100)
+        self.assertAlmostEqual(float(analysis.frequencies().sum()), 100, places=3)
+        self.assertLessEqual(analyses['3%/2mm local'].pass_rate, analysis.pass_rate)
+
+
+class IngestTests(TestCase):
+    '''
+    DICOM headers read in parallel create the studies matching a simulation, report the others and count only real changes.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        generate_cohort(5, seed=1)
+        cls.studies = list(DICOMStudy.objects.filter(study_modality__startswith='CT').order_by('pk')[:2])
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        self.files = write_dicom(self.root, DICOMStudy.objects.filter(pk__in=[study.pk for study in self.studies]), processes=1, slices=2, size=16)
+        # The second study was acquired a month after its simulation.
+        RadiotherapySimulation.objects.filter(pk=self.studies[1].radiotherapy_simulation_id).update(
+            date_of_simulation=F('date_of_simulation') - datetime.timedelta(days=30),
+        )
+        DICOMStudy.objects.filter(pk__in=[study.pk for study in self.studies]).delete()
+
+    def test_ingest(self):
+        report = ingest_directory(self.root, processes=2)
+        self.assertEqual((report.files, report.changed, report.dicom_files, report.studies), (self.files, self.files, self.files, 2))
+        self.assertEqual(report.series, 2 * 4)
+        self.assertEqual((report.created, report.updated, report.unmatched), (1, 0, [self.studies[1].study_instance_uid]))
+        study = DICOMStudy.objects.get(study_instance_uid=self.studies[0].study_instance_uid)
+        self.assertEqual(study.radiotherapy_simulation_id, self.studies[0].radiotherapy_simulation_id)
+        self.assertEqual(study.study_modality, 'CT\\RTDOSE\\RTPLAN\\RTSTRUCT')
+        self.assertEqual(DICOMFileManifest.objects.filter(dicom_study=study).count(), self.files // 2)
+
+        # Reading the same files again changes nothing.
+        report = ingest_directory(self.root, processes=2)
+        self.assertEqual((report.created, report.updated, len(report.unmatched)), (0, 0, 1))
+        DICOMStudy.objects.filter(pk=study.pk).update(study_description='Edited')
+        report = ingest_directory(self.root, processes=1, date_tolerance=30)
+        self.assertEqual((report.created, report.updated, report.unmatched), (1, 1, []))
+        self.assertEqual(DICOMStudy.objects.get(pk=study.pk).study_description, 'Planning CT')
+
+        report = ingest_directory(self.root, incremental=True, processes=1)
+        self.assertEqual((report.files, report.changed, report.files_per_second), (self.files, 0, 0))
+
+    def test_incremental(self):
+        first, second = (study.study_instance_uid for study in self.studies)
+        report = ingest_directory(self.root, incremental=True, processes=1)
+        self.assertEqual((report.changed, report.created, report.unmatched), (self.files, 1, [second]))
+        report = ingest_directory(self.root, incremental=True, processes=1)
+        self.assertEqual((report.changed, report.removed, report.created, report.unmatched), (0, 0, 0, [second]))
+
+        # Unmatched studies are matched again, without reading their files, once their simulation exists.
+        RadiotherapySimulation.objects.filter(pk=self.studies[1].radiotherapy_simulation_id).update(
+            date_of_simulation=F('date_of_simulation') + datetime.timedelta(days=30),
+        )
+        report = ingest_directory(self.root, incremental=True, processes=1)
+        self.assertEqual((report.changed, report.created, report.unmatched), (0, 1, []))
+        study = DICOMStudy.objects.get(study_instance_uid=second)
+        self.assertEqual(study.study_modality, 'CT\\RTDOSE\\RTPLAN\\RTSTRUCT')
+        self.assertEqual(DICOMFileManifest.objects.filter(dicom_study=study).count(), self.files // 2)
+
+        # A changed file is read again and updates its study.
+        directory = next(path for path, _, names in os.walk(self.root) if path.endswith(first))
+        dataset = pydicom.dcmread(os.path.join(directory, 'CT.0000.dcm'))
+        dataset.StudyDescription = 'Edited'
+        dataset.save_as(os.path.join(directory, 'CT.0000.dcm'))
+        report = ingest_directory(self.root, incremental=True, processes=1)
+        self.assertEqual((report.changed, report.new_payloads, report.created, report.updated), (1, 1, 0, 1))
+        self.assertEqual(DICOMStudy.objects.get(study_instance_uid=first).study_description, 'Edited')
+
+        # A removed file leaves the manifest and the modalities of its study.
+        os.remove(os.path.join(directory, 'RD.dcm'))
+        report = ingest_directory(self.root, incremental=True, processes=1)
+        self.assertEqual((report.changed, report.removed, report.updated), (0, 1, 1))
+        self.assertEqual(DICOMStudy.objects.get(study_instance_uid=first).study_modality, 'CT\\RTPLAN\\RTSTRUCT')
+        self.assertEqual(DICOMFileManifest.objects.filter(path__startswith=self.root).count(), self.files - 1)
+
+
+class RegistrationTests(TestCase):
+    '''
+    REG files are parsed into one shift per fraction, and the cohort setup errors match a course by course computation.
+    '''
+
+    def test_decompose(self):
+        shifts = np.random.default_rng(0).normal(0, [3, 3, 3, 2, 2, 2], (50, 6))
+        transforms = compose(shifts)
+        np.testing.assert_allclose(np.einsum('nij,nkj->nik', transforms[:, :3, :3], transforms[:, :3, :3]), np.broadcast_to(np.eye(3), (50, 3, 3)), atol=1e-12)
+        np.testing.assert_allclose(decompose(transforms), shifts, atol=1e-9)
+
+    def test_setup_errors(self):
+        generate_cohort(5, seed=1)
+        studies = DICOMStudy.objects.filter(study_modality__startswith='CT').order_by('pk')[:3]
+        studies = DICOMStudy.objects.filter(pk__in=[study.pk for study in studies])
+        with tempfile.TemporaryDirectory() as root:
+            self.assertEqual(write_dicom(root, studies, processes=1, slices=2, size=16, registrations=6), 3 * 11)
+            ingest_directory(root, processes=1)
+            self.assertEqual(ingest_registrations(studies, processes=1)[0], 18)
+            # REG files are parsed once, unless they are recomputed.
+            self.assertEqual(ingest_registrations(studies, processes=1)[0], 0)
+            self.assertEqual(ingest_registrations(studies, processes=1, recompute=True)[0], 18)
+        self.assertEqual(RegistrationShift.objects.count(), 18)
+        shift = RegistrationShift.objects.select_related('dicom_study__radiotherapy_simulation').first()
+        self.assertEqual(shift.radiotherapy_booking_id, shift.dicom_study.radiotherapy_simulation.radiotherapy_booking_id)
+        self.assertNotEqual(shift.fixed_frame_uid, shift.moving_frame_uid)
+
+        report = setup_errors()
+        courses = {}
+        for booking_id, *values in RegistrationShift.objects.order_by('radiotherapy_booking_id', 'acquired_at', 'pk').values_list(
+            'radiotherapy_booking_id', 'translation_x', 'translation_y', 'translation_z', 'rotation_x', 'rotation_y', 'rotation_z',
+        ):
+            courses.setdefault(booking_id, []).append(values)
+        means = np.array([np.mean(values, axis=0) for values in courses.values()])
+        sds = np.array([np.std(values, axis=0, ddof=1) for values in courses.values()])
+        slopes = np.array([np.polyfit(np.arange(len(values)), np.array(values)[:, :3], 1)[0] for values in courses.values()])
+        self.assertEqual(report.fractions, 18)
+        self.assertEqual(list(report.courses), list(courses))
+        np.testing.assert_allclose(report.mean, means.mean(axis=0))
+        np.testing.assert_allclose(report.random, np.sqrt((sds ** 2).mean(axis=0)))
+        np.testing.assert_allclose(report.drift, slopes, atol=1e-9)
+        if len(courses) > 1:
+            np.testing.assert_allclose(report.systematic, means.std(axis=0, ddof=1))
+            np.testing.assert_allclose(report.margins()['van_herk'], 2.5 * report.systematic[:3] + 0.7 * report.random[:3])
+        self.assertIsNone(setup_errors(RegistrationShift.objects.none()))
+
+
+class ObjectStoreTests(TestCase):
+    '''
+    Objects ingested several times are parsed, stored and processed once, and looked up by UID.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        generate_cohort(5, seed=1)
+        cls.study = DICOMStudy.objects.filter(study_modality__startswith='CT').order_by('pk').first()
+
+    def resend(self, root):
+        files = write_dicom(f'{root}/export', DICOMStudy.objects.filter(pk=self.study.pk), processes=1, slices=4, size=16)
+        first = ingest_directory(f'{root}/export', processes=1)
+        shutil.copytree(f'{root}/export', f'{root}/resend')
+        second = ingest_directory(f'{root}/resend', processes=1)
+        self.assertEqual((first.new_payloads, second.new_payloads, second.dicom_files), (files, 0, files))
+        self.assertEqual((DICOMObject.objects.count(), DICOMFileManifest.objects.count()), (files, 2 * files))
+        return files
+
+    def test_object_store(self):
+        with tempfile.TemporaryDirectory() as root, override_settings(OBJECT_STORE_DIR=f'{root}/objects', OBJECT_STORE_METHODS=['hardlink']):
+            self.resend(root)
+            structure_set = DICOMObject.objects.get(study_instance_uid=self.study.study_instance_uid, modality='RTSTRUCT')
+            self.assertEqual(structure_set.dicom_study_id, self.study.pk)
+            self.assertTrue(structure_set.path.startswith(f'{root}/objects/'))
+            self.assertEqual(instance_files([structure_set.sop_instance_uid]), {structure_set.sop_instance_uid: structure_set.path})
+            source = os.path.join(f'{root}/export', os.listdir(f'{root}/export')[0], self.study.study_instance_uid, 'RS.dcm')
+            self.assertTrue(os.path.samefile(structure_set.path, source))
+            series = DICOMObject.objects.filter(study_instance_uid=self.study.study_instance_uid, modality='CT').values_list('series_instance_uid', flat=True).first()
+            self.assertEqual(len(series_files([series])[series]), 4)
+
+            self.assertGreater(compute_volumes([self.study], processes=1)[0], 0)
+            self.assertEqual(compute_volumes([self.study], processes=1)[0], 0)
+            self.assertGreater(compute_volumes([self.study], processes=1, recompute=True)[0], 0)
+
+            # A TPS round trip changes the payload of the SOP instance, which is then processed again.
+            dataset = pydicom.dcmread(source.replace('/export/', '/resend/'))
+            dataset.StructureSetLabel = 'Edited'
+            os.remove(source.replace('/export/', '/resend/'))
+            dataset.save_as(source.replace('/export/', '/resend/'))
+            self.assertEqual(ingest_directory(f'{root}/resend', incremental=True, processes=1).new_payloads, 1)
+            edited = DICOMObject.objects.get(pk=structure_set.pk)
+            self.assertNotEqual(edited.content_hash, structure_set.content_hash)
+            self.assertEqual(content_hash(edited.path), edited.content_hash)
+            self.assertEqual(content_hash(structure_set.path), structure_set.content_hash)
+            self.assertEqual(study_files([self.study.study_instance_uid], 'RTSTRUCT', unprocessed='volumes'), {self.study.study_instance_uid: [edited.path]})
+
+    def test_indexed_in_place(self):
+        with tempfile.TemporaryDirectory() as root:
+            files = self.resend(root)
+            self.assertEqual(DICOMObject.objects.filter(path__startswith=f'{root}/export/').count(), files)
+            # Removed files hand their objects over to the remaining copies.
+            shutil.rmtree(f'{root}/export')
+            os.mkdir(f'{root}/export')
+            self.assertEqual(ingest_directory(f'{root}/export', processes=1).removed, files)
+            self.assertEqual(DICOMObject.objects.filter(path__startswith=f'{root}/resend/').count(), files)
+            shutil.rmtree(f'{root}/resend')
+            os.mkdir(f'{root}/resend')
+            ingest_directory(f'{root}/resend', processes=1)
+            self.assertFalse(DICOMObject.objects.exists())
+
+
+def decode_png(data):
+    '''
+    Decode a PNG written by app.tiles.encode_png into a (height, width, 3) array.
+    '''
+    width, height = struct.unpack('>II', data[16:24])
+    position, compressed = 8, b''
+    while position < len(data):
+        length, kind = struct.unpack('>I4s', data[position:position + 8])
+        if kind == b'IDAT':
+            compressed += data[position + 8:position + 8 + length]
+        position += length + 12
+    rows = np.frombuffer(zlib.decompress(compressed), dtype=np.uint8).reshape(height, width * 3 + 1)
+    assert set(rows[:, 0]) == {2}
+    return np.cumsum(rows[:, 1:], axis=0, dtype=np.uint8).reshape(height, width, 3)
+
+
+def inside_polygon(polygon, x, y):
+    '''
+    Return whether the point (x, y) is inside the (N, 2+) polygon, by casting a ray towards +x.
+    '''
+    inside = False
+    for (x_a, y_a), (x_b, y_b) in zip(polygon[:, :2], np.roll(polygon, -1, axis=0)[:, :2]):
+        if min(y_a, y_b) <= y < max(y_a, y_b) and x_a + (y - y_a) * (x_b - x_a) / (y_b - y_a) > x:
+            inside = not inside
+    return inside
+
+
+class MaskTests(TestCase):
+    '''
+    Contours rasterize by the even-odd rule and round-trip through the bit-packed mask store, which notices edited contours.
+    '''
+    geometry = rtstruct.Geometry((0.0, 0.0, 0.0), (1.0, 1.0, 1.0), (1, 0, 0, 0, 1, 0, 0, 0, 1), (32, 24, 4))
+
+    @staticmethod
+    def contours(shift=0.0):
+        '''
+        A concave polygon on slice 1 and a square with a square hole on slice 2, in voxel coordinates.
+        '''
+        polygons = [
+            (1, [[2.3, 1.7], [25.6, 4.2], [18.1, 20.4], [9.5, 12.2], [3.2, 19.6]]),
+            (2, [[4.5, 3.5], [20.5, 3.5], [20.5, 19.5], [4.5, 19.5]]),
+            (2, [[8.2, 7.7], [14.6, 7.7], [14.6, 13.1], [8.2, 13.1]]),
+        ]
+        return [np.array([[x + shift, y, z] for x, y in points]) for z, points in polygons]
+
+    def reference(self, contours):
+        size_x, size_y, size_z = self.geometry.size
+        mask = np.zeros((size_z, size_y, size_x), dtype=bool)
+        for contour in contours:
+            z = int(contour[0, 2])
+            for y in range(size_y):
+                for x in range(size_x):
+                    mask[z, y, x] ^= inside_polygon(contour, x, y)
+        return mask
+
+    def test_rasterize(self):
+        contours = self.contours()
+        mask, (z0, y0, x0) = rasterize(contours, self.geometry)
+        dense = np.zeros((4, 24, 32), dtype=bool)
+        dense[z0:z0 + mask.shape[0], y0:y0 + mask.shape[1], x0:x0 + mask.shape[2]] = mask
+        expected = self.reference(contours)
+        np.testing.assert_array_equal(dense, expected)
+        self.assertFalse(expected[2, 10, 11])
+        self.assertEqual(rasterize([], self.geometry), (None, None))
+        self.assertEqual(rasterize([contour + [0, 0, 10] for contour in contours], self.geometry), (None, None))
+
+    def test_store(self):
+        with tempfile.TemporaryDirectory() as root:
+            store = MaskStore(root, 1 << 20)
+            stored = store.get_or_rasterize('1.2.3', 1, self.contours(), self.geometry)
+            expected = self.reference(self.contours())
+            np.testing.assert_array_equal(stored.dense(), expected)
+            self.assertEqual(stored.voxels, expected.sum())
+            self.assertEqual(stored.packed.nbytes, -(-np.prod(stored.shape) // 8))
+
+            with mock.patch('app.masks.rasterize') as rasterized:
+                store.get_or_rasterize('1.2.3', 1, self.contours(), self.geometry)
+            rasterized.assert_not_called()
+            moved = rtstruct.Geometry((1.0, 0.0, 0.0), self.geometry.spacing, self.geometry.direction, self.geometry.size)
+            self.assertIsNone(store.open('1.2.3', 1, moved))
+
+            # Resent with the same UIDs but edited contours.
+            edited = store.get_or_rasterize('1.2.3', 1, self.contours(shift=3.0), self.geometry)
+            np.testing.assert_array_equal(edited.dense(), self.reference(self.contours(shift=3.0)))
+
+
+class StubExtractor:
+    '''
+    Stands in for the pyradiomics feature extractor: the voxel count and mean intensity inside the mask.
+    '''
+
+    def execute(self, image, mask, label=1):
+        voxels = sitk.GetArrayViewFromImage(image)[sitk.GetArrayViewFromImage(mask) == label]
+        return {'diagnostics_Versions_PyRadiomics': 'stub', 'original_shape_VoxelNum': voxels.size, 'original_firstorder_Mean': voxels.mean()}
+
+
+class RadiomicsTests(TestCase):
+    '''
+    Features are extracted once per series, ROI and parameter file, and filtered images are cached on disk by the settings their filter reads.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        generate_cohort(5, seed=1)
+        cls.study = DICOMStudy.objects.filter(study_modality__startswith='CT').order_by('pk').first()
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        settings = override_settings(MASK_STORE_DIR=f'{self.root}/masks', SERIES_CACHE_DIR=f'{self.root}/series')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        for cached in (get_series_cache, features.get_mask_store, features.get_image):
+            cached.cache_clear()
+            self.addCleanup(cached.cache_clear)
+
+    def test_extract(self):
+        write_dicom(f'{self.root}/dicom', DICOMStudy.objects.filter(pk=self.study.pk), processes=1, slices=20, size=64)
+        ingest_directory(f'{self.root}/dicom', processes=1)
+        parameter_file = f'{self.root}/params.yaml'
+        with open(parameter_file, 'w') as handle:
+            handle.write('setting:\n  binWidth: 25\n')
+
+        def extract(parameter_file=None):
+            report = features.extract_features([self.study], parameter_file=parameter_file, processes=1)
+            return report.jobs, report.cached, report.extracted, len(report.failed)
+
+        with mock.patch('app.filters.install'), mock.patch('app.features.get_extractor', return_value=StubExtractor()):
+            self.assertEqual(extract(), (2, 0, 2, 0))
+            # The same series, contours and parameters are not extracted again.
+            self.assertEqual(extract(), (2, 2, 0, 0))
+            self.assertEqual(extract(parameter_file), (2, 0, 2, 0))
+        with mock.patch('app.filters.install'), mock.patch('app.features.get_extractor', side_effect=ValueError('bad parameters')):
+            with open(parameter_file, 'a') as handle:
+                handle.write('  label: 2\n')
+            self.assertEqual(extract(parameter_file), (2, 0, 0, 2))
+
+        queryset = RadiomicFeatureSet.objects.filter(dicom_study=self.study, parameter_hash=features.parameter_hash(None)).order_by('roi_name')
+        matrix = feature_matrix(queryset)
+        self.assertEqual(matrix.roi_names, ['GTV', 'PTV'])
+        self.assertEqual(matrix.names, ['original_shape_VoxelNum', 'original_firstorder_Mean'])
+        gtv, ptv = matrix.column('original_shape_VoxelNum')
+        self.assertGreater(ptv, gtv)
+        self.assertEqual(RadiomicFeatureSet.objects.filter(dicom_study=self.study).count(), 4)
+        self.assertTrue(AggregateRefreshQueue.objects.filter(source='radiomics').exists())
+
+    def test_shared_inputs(self):
+        write_dicom(f'{self.root}/dicom', DICOMStudy.objects.filter(pk=self.study.pk), processes=1, slices=20, size=64)
+        source = next(os.path.join(directory, 'RS.dcm') for directory, _, files in os.walk(f'{self.root}/dicom') if 'RS.dcm' in files)
+        # A copy of the structure set under another UID has the contours, and so the cache keys, of the original.
+        copy = pydicom.dcmread(source)
+        original = str(copy.SOPInstanceUID)
+        copy.SOPInstanceUID = copy.file_meta.MediaStorageSOPInstanceUID = derived_uid(original, 'copy')
+        copy.save_as(source.replace('RS.dcm', 'RS1.dcm'))
+        ingest_directory(f'{self.root}/dicom', processes=1)
+
+        def extract():
+            with mock.patch('app.filters.install'), mock.patch('app.features.get_extractor', return_value=StubExtractor()):
+                report = features.extract_features([self.study], processes=1)
+            return report.jobs, report.cached, report.extracted, len(report.failed)
+
+        self.assertEqual(extract(), (4, 0, 4, 0))
+        rows = RadiomicFeatureSet.objects.filter(dicom_study=self.study, parameter_hash=features.parameter_hash(None))
+        self.assertEqual(sorted(rows.values_list('structure_set_uid', 'roi_name')), [
+            (uid, name) for uid in sorted([original, str(copy.SOPInstanceUID)]) for name in ('GTV', 'PTV')
+        ])
+        self.assertEqual(len(set(rows.values_list('cache_key', flat=True))), 2)
+
+        # Edited contours replace the row of the ROI instead of adding one.
+        for roi in copy.ROIContourSequence:
+            for contour in roi.ContourSequence:
+                contour.ContourData = [float(value) + 1 for value in contour.ContourData]
+        copy.save_as(source.replace('RS.dcm', 'RS1.dcm'))
+        ingest_directory(f'{self.root}/dicom', incremental=True, processes=1)
+        self.assertEqual(extract(), (4, 2, 2, 0))
+        self.assertEqual(rows.count(), 4)
+        self.assertEqual(len(set(rows.values_list('cache_key', flat=True))), 4)
+
+    def test_filter_key(self):
+        image = sitk.GetImageFromArray(np.arange(64, dtype=np.float32).reshape(4, 4, 4))
+        key = filters.filter_key(image, 'LoG', {'sigma': [1.0], 'binWidth': 25})
+        # Settings the filter does not read share the derivative.
+        self.assertEqual(filters.filter_key(image, 'LoG', {'sigma': [1.0], 'binWidth': 5}), key)
+        self.assertNotEqual(filters.filter_key(image, 'LoG', {'sigma': [2.0], 'binWidth': 25}), key)
+        self.assertNotEqual(filters.filter_key(image, 'Square', {'sigma': [1.0], 'binWidth': 25}), key)
+        self.assertNotEqual(filters.filter_key(sitk.GetImageFromArray(np.zeros((4, 4, 4), dtype=np.float32)), 'LoG', {'sigma': [1.0]}), key)
+        # Filters without a list of settings are keyed on all of them.
+        self.assertNotEqual(filters.filter_key(image, 'Custom', {'binWidth': 25}), filters.filter_key(image, 'Custom', {'binWidth': 5}))
+
+    def test_filter_cache(self):
+        calls = []
+
+        def square(inputImage, inputMask, **kwargs):
+            calls.append(kwargs)
+            yield sitk.Square(inputImage), 'square', kwargs
+
+        image = sitk.GetImageFromArray(np.arange(64, dtype=np.float32).reshape(4, 4, 4))
+        image.SetSpacing((1.0, 1.0, 2.0))
+        generator = filters.cached_filter('Square', square)
+        with mock.patch.object(filters, '_cache', DiskCache(f'{self.root}/filters', 10 ** 6)):
+            computed = list(generator(image, None, binWidth=25))
+            cached = list(generator(image, None, binWidth=5))
+            self.assertEqual(len(calls), 1)
+            self.assertEqual([name for _, name, _ in cached], ['square'])
+            self.assertEqual(cached[0][0].GetSpacing(), (1.0, 1.0, 2.0))
+            np.testing.assert_array_equal(sitk.GetArrayFromImage(cached[0][0]), sitk.GetArrayFromImage(computed[0][0]))
+            list(generator(sitk.GetImageFromArray(np.ones((4, 4, 4), dtype=np.float32)), None))
+            self.assertEqual(len(calls), 2)
+        # Without an installed cache the filter runs every time.
+        list(generator(image, None))
+        self.assertEqual(len(calls), 3)
+
+    def test_eviction(self):
+        cache = DiskCache(f'{self.root}/cache', max_bytes=250)
+        for age, key in enumerate(['cc3', 'bb2', 'aa1'], start=1):
+            path = cache.write_bytes(key, 'bin', b'x' * 100)
+            os.utime(path, (time.time() - age * 60,) * 2)
+        # Reading an entry makes it the most recently used.
+        self.assertEqual(cache.read_bytes('aa1', 'bin'), b'x' * 100)
+        self.assertEqual(cache.evict(), 200)
+        self.assertEqual([cache.exists(key, 'bin') for key in ('aa1', 'bb2', 'cc3')], [True, False, True])
+        cache.max_bytes = 0
+        self.assertEqual(cache.evict(keep={'cc3'}), 100)
+        self.assertEqual(list(cache.entries()), ['cc3'])
+        self.assertIsNone(cache.read_bytes('aa1', 'bin'))
+
+
+class SliceTileTests(TestCase):
+    '''
+    Series are decoded once into the series cache, and their slices render once into PNG tiles with ROI outlines served with an ETag.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        generate_cohort(5, seed=1)
+        cls.study = DICOMStudy.objects.filter(study_modality__startswith='CT').order_by('pk').first()
+        cls.user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(
+            TILE_CACHE_DIR=f'{directory.name}/tiles', MASK_STORE_DIR=f'{directory.name}/masks', SERIES_CACHE_DIR=f'{directory.name}/series',
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        get_series_cache.cache_clear()
+        self.addCleanup(get_series_cache.cache_clear)
+        write_dicom(f'{directory.name}/dicom', DICOMStudy.objects.filter(pk=self.study.pk), processes=1, slices=20, size=64)
+        ingest_directory(f'{directory.name}/dicom', processes=1)
+        self.series = DICOMFileManifest.objects.filter(study_instance_uid=self.study.study_instance_uid, modality='CT').values_list('series_instance_uid', flat=True).first()
+
+    def test_tiles(self):
+        info = self.client.get(reverse('app:series_tiles', args=[self.series, 'soft_tissue'])).json()
+        self.assertEqual((info['slices'], info['width'], info['height']), (20, 64, 64))
+        self.assertEqual([roi['name'] for roi in info['rois']], ['GTV', 'PTV'])
+
+        url = reverse('app:slice_tile', args=[self.series, 'soft_tissue', 10])
+        with mock.patch('app.series_cache.read_image_series') as read_image_series:
+            response = self.client.get(url)
+        read_image_series.assert_not_called()
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'image/png'))
+        self.assertIn('max-age', response['Cache-Control'])
+        image = decode_png(response.content)
+        self.assertEqual(image.shape, (64, 64, 3))
+        colours = {tuple(pixel) for pixel in image.reshape(-1, 3)}
+        self.assertIn((230, 25, 75), colours)
+        self.assertIn((60, 180, 75), colours)
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        thumbnail = self.client.get(reverse('app:slice_thumbnail', args=[self.series, 'soft_tissue', 10]))
+        self.assertEqual(decode_png(thumbnail.content).shape, (64, 64, 3))
+        self.assertEqual(self.client.get(reverse('app:slice_tile', args=[self.series, 'soft_tissue', 20])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('app:slice_tile', args=[self.series, 'rainbow', 0])).status_code, 404)
+
+    def test_series_cache(self):
+        paths = list(DICOMFileManifest.objects.filter(series_instance_uid=self.series).values_list('path', flat=True))
+        volume = SeriesCache(memory_bytes=0).load(self.series, paths)
+        self.assertIsInstance(volume.pixels, np.memmap)
+        self.assertEqual(volume.pixels.shape, (20, 64, 64))
+        self.assertEqual(volume.geometry.size, (64, 64, 20))
+        self.assertTrue(np.array_equal(sitk.GetArrayFromImage(volume.image()), volume.pixels))
+
+        with mock.patch('app.series_cache.read_image_series') as read_image_series:
+            cached = SeriesCache().load(self.series, paths)
+        read_image_series.assert_not_called()
+        self.assertTrue(np.array_equal(cached.pixels, volume.pixels))
+
+        # A changed file invalidates the series.
+        os.utime(paths[0], ns=(0, 0))
+        with mock.patch('app.series_cache.read_image_series', wraps=rtstruct.read_image_series) as read_image_series:
+            SeriesCache().load(self.series, paths)
+        read_image_series.assert_called_once()
+
+    def test_tiles_job(self):
+        jobs.enqueue('tiles', [self.study])
+        self.assertEqual(jobs.work('test', burst=True), 1)
+        self.assertEqual(Job.objects.get().message, 'Rendered the tiles of 1 series')
+
+
+@override_settings(JOB_RETRY_DELAY=0)
+class JobQueueTests(TestCase):
+    '''
+    Workers claim runnable jobs by priority, follow the per-study chain and retry failures.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        create_patients(create_lookups(), 0, 2)
+        Job.objects.all().delete()
+        cls.studies = list(DICOMStudy.objects.order_by('pk'))
+
+    def test_pipeline_order(self):
+        self.assertEqual(jobs.enqueue_pipeline(self.studies[:1]), 3)
+        self.assertEqual(jobs.enqueue_pipeline(self.studies[1:], priority=5), 3)
+        ran = []
+        handlers = {kind: (lambda kind: lambda study, progress: ran.append((kind, study.pk)) or 'ok')(kind) for kind in jobs.HANDLERS}
+        with mock.patch.dict(jobs.HANDLERS, handlers):
+            # Only the first job of each chain is runnable, the higher priority first.
+            first = jobs.claim('test')
+            self.assertEqual((first.kind, first.dicom_study_id), ('rasterize', self.studies[1].pk))
+            second = jobs.claim('test')
+            self.assertEqual((second.kind, second.dicom_study_id), ('rasterize', self.studies[0].pk))
+            self.assertIsNone(jobs.claim('test'))
+            jobs.run(first)
+            jobs.run(second)
+            self.assertEqual(jobs.work('test', burst=True), 4)
+        self.assertEqual(ran[2:], [('dvh', self.studies[1].pk), ('radiomics', self.studies[1].pk), ('dvh', self.studies[0].pk), ('radiomics', self.studies[0].pk)])
+        self.assertEqual(set(Job.objects.values_list('status', 'progress')), {('done', 1.0)})
+
+    def test_retries_then_fails_dependents(self):
+        jobs.enqueue_pipeline(self.studies[:1])
+
+        def broken(study, progress):
+            progress(0.5, 'half way')
+            raise ValueError('corrupt structure set')
+
+        with mock.patch.dict(jobs.HANDLERS, {'rasterize': broken}), self.assertLogs('app.jobs', 'ERROR'):
+            self.assertEqual(jobs.work('test', burst=True), 3)
+        rasterize = Job.objects.get(kind='rasterize')
+        self.assertEqual((rasterize.status, rasterize.attempts), ('failed', 3))
+        self.assertIn('corrupt structure set', rasterize.error)
+        self.assertEqual(list(Job.objects.exclude(pk=rasterize.pk).values_list('status', flat=True)), ['failed', 'failed'])
+
+    @override_settings(JOB_STALE_AFTER=60)
+    def test_stale_job_is_requeued(self):
+        jobs.enqueue('dvh', self.studies[:1])
+        job = jobs.claim('gone')
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - datetime.timedelta(minutes=5))
+        self.assertEqual(jobs.requeue_stale(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('pending', 1))
+
+    @override_settings(JOB_STALE_AFTER=60)
+    def test_requeued_job_keeps_its_new_owner(self):
+        jobs.enqueue('dvh', self.studies[:1])
+        slow = jobs.claim('slow')
+        Job.objects.filter(pk=slow.pk).update(heartbeat_at=timezone.now() - datetime.timedelta(minutes=5))
+        jobs.requeue_stale()
+        Job.objects.filter(pk=slow.pk).update(run_after=timezone.now())
+        current = jobs.claim('current')
+        with self.assertLogs('app.jobs', 'WARNING'):
+            self.assertFalse(jobs.finish(slow, 'late'))
+            jobs.fail(slow, 'late')
+        jobs.report_progress(slow, 0.9)
+        job = Job.objects.get(pk=slow.pk)
+        self.assertEqual((job.status, job.worker, job.progress), ('running', 'current', 0))
+        self.assertTrue(jobs.finish(current, 'ok'))
+        self.assertEqual(Job.objects.get(pk=slow.pk).status, 'done')
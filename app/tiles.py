@@ -0,0 +1,242 @@
+'''
+Rendered slice tiles and thumbnails of image series for the patient viewer.
+
+Windowing the voxels of a series and compositing the ROI outlines takes
+seconds, so it is done once per series and window preset: every slice of
+the volume from the series cache is windowed to 8 bits, the outlines of the
+ROIs of the structure sets drawn on the series are painted over it from the
+mask store, and the slice and a thumbnail are encoded as PNG into a
+size-bounded DiskCache. Requests then only read a small file.
+
+Tiles are keyed by a signature of the series, the content hashes of the
+structure sets of its study and RENDER_VERSION, so ingesting a new
+structure set or changing the rendering makes fresh tiles instead of
+serving stale ones, and the signature doubles as the HTTP ETag.
+'''
+import hashlib
+import struct
+import zlib
+from dataclasses import dataclass
+
+import numpy as np
+from django.conf import settings
+
+from app.disk_cache import DiskCache
+from app.masks import MaskStore
+from app.metrics import timed
+from app.models import DICOMObject
+from app.rtstruct import load_structure_set, read_series_geometry
+from app.series_cache import get_series_cache
+
+# Window (centre, width) in HU of each preset.
+WINDOW_PRESETS = {
+    'soft_tissue': (40, 400),
+    'mediastinum': (50, 350),
+    'lung': (-600, 1500),
+    'bone': (400, 1800),
+    'brain': (40, 80),
+}
+
+# Outline colours, assigned to the ROIs of a series in order of structure set and ROI number.
+ROI_COLORS = [
+    (230, 25, 75), (60, 180, 75), (255, 225, 25), (0, 130, 200),
+    (245, 130, 48), (145, 30, 180), (70, 240, 240), (240, 50, 230),
+]
+
+# Longest side of a thumbnail in pixels.
+THUMBNAIL_SIZE = 128
+
+# Bump when the rendering changes, so tiles rendered before are not served.
+RENDER_VERSION = 1
+
+
+def png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def encode_png(image, level=6):
+    '''
+    Encode a (height, width) grey or (height, width, 3) RGB uint8 image as PNG.
+
+    Rows are stored with the Up filter, which suits the smooth rows of
+    medical images much better than no filter at all.
+    '''
+    height, width = image.shape[:2]
+    rows = np.ascontiguousarray(image, dtype=np.uint8).reshape(height, -1)
+    filtered = np.diff(rows, axis=0, prepend=np.zeros((1, rows.shape[1]), dtype=np.uint8))
+    raw = np.hstack([np.full((height, 1), 2, dtype=np.uint8), filtered]).tobytes()
+    header = struct.pack('>IIBBBBB', width, height, 8, 2 if image.ndim == 3 else 0, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', header) + png_chunk(b'IDAT', zlib.compress(raw, level)) + png_chunk(b'IEND', b'')
+
+
+def apply_window(pixels, preset):
+    centre, width = WINDOW_PRESETS[preset]
+    scaled = (np.asarray(pixels, dtype=np.float32) - (centre - width / 2)) * (255 / width)
+    return np.clip(scaled, 0, 255).astype(np.uint8)
+
+
+def outline(mask):
+    '''
+    Return the voxels of a (z, y, x) mask with a 4-connected in-plane neighbour outside it.
+    '''
+    padded = np.pad(mask, ((0, 0), (1, 1), (1, 1)))
+    inner = padded[:, :-2, 1:-1] & padded[:, 2:, 1:-1] & padded[:, 1:-1, :-2] & padded[:, 1:-1, 2:]
+    return mask & ~inner
+
+
+def thumbnail(image):
+    '''
+    Shrink an RGB image by averaging square blocks so its longest side is at most THUMBNAIL_SIZE.
+    '''
+    factor = max(1, -(-max(image.shape[:2]) // THUMBNAIL_SIZE))
+    height, width = image.shape[0] // factor * factor, image.shape[1] // factor * factor
+    blocks = image[:height, :width].reshape(height // factor, factor, width // factor, factor, 3)
+    return blocks.mean(axis=(1, 3)).astype(np.uint8)
+
+
+@dataclass
+class SeriesSource:
+    '''
+    The files a series is rendered from and the signature of its tiles.
+    '''
+    series_instance_uid: str
+    image_paths: list
+    structure_set_paths: list
+    signature: str
+
+
+def series_source(series_instance_uid):
+    '''
+    Return the SeriesSource of an ingested image series, or None if the series has no files.
+    '''
+    rows = DICOMObject.objects.filter(series_instance_uid=series_instance_uid).order_by('path').values_list('path', 'study_instance_uid')
+    image_paths = [path for path, study_instance_uid in rows]
+    if not image_paths:
+        return None
+    structure_sets = sorted(
+        DICOMObject.objects.filter(study_instance_uid=rows[0][1], modality='RTSTRUCT').values_list('content_hash', 'path')
+    )
+    signature = hashlib.blake2b(
+        '/'.join([str(RENDER_VERSION), series_instance_uid, *(content_hash for content_hash, path in structure_sets)]).encode(),
+        digest_size=16,
+    ).hexdigest()
+    return SeriesSource(series_instance_uid, image_paths, [path for content_hash, path in structure_sets], signature)
+
+
+def roi_outlines(source):
+    '''
+    Return [(name, colour, outline, offset), ...] for the ROIs of the structure sets drawn on the series.
+
+    outline is a boolean (z, y, x) array cropped to the ROI and offset its (z, y, x) position on the image grid.
+    '''
+    structure_sets = [load_structure_set(path) for path in source.structure_set_paths]
+    rois = [
+        (structure_set, roi)
+        for structure_set in structure_sets if structure_set is not None and structure_set.referenced_series_uid == source.series_instance_uid
+        for roi in sorted(structure_set.rois, key=lambda roi: roi.number)
+    ]
+    if not rois:
+        return []
+    geometry = read_series_geometry(source.image_paths)
+    store = MaskStore()
+    outlines = []
+    for structure_set, roi in rois:
+        stored = store.get_or_rasterize(structure_set.sop_instance_uid, roi.number, roi.contours, geometry)
+        if stored is not None:
+            outlines.append((roi.name, ROI_COLORS[len(outlines) % len(ROI_COLORS)], outline(stored.cropped()), stored.offset))
+    return outlines
+
+
+class TileCache:
+    '''
+    PNG slice tiles and thumbnails keyed by series signature, window preset and slice index.
+    '''
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.cache = DiskCache(directory or settings.TILE_CACHE_DIR, max_bytes or settings.TILE_CACHE_BYTES)
+
+    @staticmethod
+    def key(signature, preset, name):
+        return hashlib.blake2b(f'{signature}/{preset}/{name}'.encode(), digest_size=16).hexdigest()
+
+    @staticmethod
+    def tile_name(index, thumbnail=False):
+        return f'thumbnail-{index}' if thumbnail else f'{index}'
+
+    def info(self, source, preset):
+        '''
+        Return the slice count, size and ROI legend of the rendered series, rendering it first if needed.
+        '''
+        info = self.cache.read_json(self.key(source.signature, preset, 'series'), 'json')
+        return info if info is not None else self.render(source, preset)
+
+    def read(self, source, preset, index, thumbnail=False):
+        '''
+        Return the PNG of a slice or its thumbnail, rendering the series first if needed, or None if there is no such slice.
+        '''
+        if not 0 <= index < self.info(source, preset)['slices']:
+            return None
+        key = self.key(source.signature, preset, self.tile_name(index, thumbnail))
+        data = self.cache.read_bytes(key, 'png')
+        if data is None:
+            self.render(source, preset, wanted=key)
+            data = self.cache.read_bytes(key, 'png')
+        return data
+
+    def render(self, source, preset, wanted=None):
+        '''
+        Render every slice and thumbnail of a series with a window preset into the cache and return its info.
+
+        The info is written last, so a series whose info is cached is complete
+        unless some of its tiles were evicted since. The series is not
+        rendered again if its info and the wanted tile key, if any, are cached.
+        '''
+        series_key = self.key(source.signature, preset, 'series')
+        with self.cache.lock(series_key):
+            info = self.cache.read_json(series_key, 'json')
+            if info is not None and (wanted is None or self.cache.exists(wanted, 'png')):
+                return info
+            keys = {series_key}
+            pixels = get_series_cache().load(source.series_instance_uid, source.image_paths).pixels
+            outlines = roi_outlines(source)
+            for index, plane in enumerate(pixels):
+                image = np.repeat(apply_window(plane, preset)[:, :, np.newaxis], 3, axis=2)
+                for name, colour, edges, (z0, y0, x0) in outlines:
+                    if z0 <= index < z0 + len(edges):
+                        height, width = edges.shape[1:]
+                        image[y0:y0 + height, x0:x0 + width][edges[index - z0]] = colour
+                for thumbnail_tile, tile in ((False, image), (True, thumbnail(image))):
+                    key = self.key(source.signature, preset, self.tile_name(index, thumbnail_tile))
+                    self.cache.write_bytes(key, 'png', encode_png(tile))
+                    keys.add(key)
+            info = {
+                'series_instance_uid': source.series_instance_uid,
+                'preset': preset,
+                'slices': len(pixels),
+                'width': int(pixels.shape[2]),
+                'height': int(pixels.shape[1]),
+                'rois': [{'name': name, 'color': '#%02x%02x%02x' % colour} for name, colour, edges, offset in outlines],
+            }
+            self.cache.write_json(series_key, 'json', info)
+            self.cache.evict(keep=keys)
+        return info
+
+
+@timed('tiles')
+def render_study_tiles(study, presets=None):
+    '''
+    Render the tiles of every CT series of a DICOM study with the presets. Returns the number of series rendered.
+    '''
+    presets = presets or settings.TILE_PRESETS
+    series_uids = (
+        DICOMObject.objects.filter(study_instance_uid=study.study_instance_uid, modality='CT')
+        .order_by('series_instance_uid').values_list('series_instance_uid', flat=True).distinct()
+    )
+    cache = TileCache()
+    rendered = 0
+    for series_instance_uid in series_uids:
+        source = series_source(series_instance_uid)
+        for preset in presets:
+            cache.render(source, preset)
+        rendered += 1
+    return rendered
@@ -0,0 +1,18 @@
+from django.urls import path
+
+from app import api, views
+
+app_name = 'app'
+
+urlpatterns = [
+    path('api/patients/overview', api.patient_overview, name='patient_overview'),
+    path('api/search', api.registry_search, name='registry_search'),
+    path('api/studies', api.study_list, name='study_list'),
+    path('api/studies/<str:study_instance_uid>/features', api.study_features, name='study_features'),
+    path('api/studies/<str:study_instance_uid>/dvhs', api.study_dvhs, name='study_dvhs'),
+    path('export/cohort.<str:format>', views.export_cohort, name='export_cohort'),
+    path('tiles/<str:series_instance_uid>/<str:preset>', views.series_tiles, name='series_tiles'),
+    path('tiles/<str:series_instance_uid>/<str:preset>/<int:index>.png', views.slice_tile, name='slice_tile'),
+    path('tiles/<str:series_instance_uid>/<str:preset>/thumbnails/<int:index>.png', views.slice_tile, {'thumbnail': True}, name='slice_thumbnail'),
+    path('metrics', views.metrics, name='metrics'),
+]
@@ -1,3 +1,83 @@
-from django.shortcuts import render
+from django.contrib.auth.decorators import login_required, permission_required
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_GET
 
-# Create your views here.
+from app.export import FILTERS, FORMATS, cohort_queryset, export_chunks
+from app.metrics import registry
+from app.tiles import WINDOW_PRESETS, TileCache, series_source
+
+
+@require_GET
+@login_required
+@permission_required('app.view_dicomstudy', raise_exception=True)
+def export_cohort(request, format):
+    '''
+    Stream the cohort as CSV or Parquet. Query parameters named as in app.export.FILTERS
+    (repeatable) restrict the exported studies.
+    '''
+    if format not in FORMATS:
+        return HttpResponseBadRequest(f'Unknown export format {format!r}')
+    if format == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return HttpResponseBadRequest('Parquet export needs pyarrow to be installed')
+    queryset = cohort_queryset(**{name: request.GET.getlist(name) for name in FILTERS})
+    response = StreamingHttpResponse(export_chunks(queryset, format), content_type=FORMATS[format])
+    response['Content-Disposition'] = f'attachment; filename="cohort.{format}"'
+    return response
+
+
+def tile_source(series_instance_uid, preset):
+    if preset not in WINDOW_PRESETS:
+        raise Http404(f'Unknown window preset {preset!r}')
+    source = series_source(series_instance_uid)
+    if source is None:
+        raise Http404(f'Series {series_instance_uid} has no ingested files')
+    return source
+
+
+@require_GET
+@login_required
+@permission_required('app.view_dicomstudy', raise_exception=True)
+def series_tiles(request, series_instance_uid, preset):
+    '''
+    Return the slice count, size and ROI legend of the tiles of a series as JSON, rendering them first if needed.
+    '''
+    return JsonResponse(TileCache().info(tile_source(series_instance_uid, preset), preset))
+
+
+@require_GET
+@login_required
+@permission_required('app.view_dicomstudy', raise_exception=True)
+def slice_tile(request, series_instance_uid, preset, index, thumbnail=False):
+    '''
+    Return the PNG tile or thumbnail of a slice of a series with a window preset.
+
+    Tiles never change under their signature, so they are served with an
+    ETag and may be reused by the browser for TILE_MAX_AGE seconds.
+    '''
+    source = tile_source(series_instance_uid, preset)
+    etag = quote_etag(TileCache.key(source.signature, preset, TileCache.tile_name(index, thumbnail)))
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        data = TileCache().read(source, preset, index, thumbnail)
+        if data is None:
+            raise Http404(f'Series {series_instance_uid} has no slice {index}')
+        response = HttpResponse(data, content_type='image/png')
+        response['ETag'] = etag
+    patch_cache_control(response, private=True, max_age=settings.TILE_MAX_AGE)
+    return response
+
+
+@require_GET
+def metrics(request):
+    '''
+    Return the request and stage metrics of this process in the Prometheus text format, to METRICS_ALLOWED_IPS only.
+    '''
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,245 @@
+'''
+Analytic volume, extent and centroid of ROIs computed from their contours.
+
+The volume of a ROI is the sum of the areas of its planar contours times the
+spacing of the contoured planes, without rasterizing anything. Areas are
+computed for every contour of every ROI of a batch of structure sets at once as a fan of signed
+triangles (the shoelace formula in 3D), projected on the normal of the ROI,
+so any slice orientation works. A contour nested inside an odd number of
+other contours on the same plane is a hole and is subtracted, which is the
+even-odd rule the rasterizer applies.
+'''
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+
+from app.aggregates import enqueue_studies
+from app.dicom_files import mark_processed, study_files
+from app.metrics import timed
+from app.models import AggregateSourceChoices, StructureVolume
+from app.rtstruct import load_structure_set
+
+# Contours whose plane positions differ by less than this (mm) lie on the same plane.
+PLANE_TOLERANCE = 0.01
+
+
+@dataclass
+class RoiVolume:
+    '''
+    Volumetric information about one ROI. Lengths in mm, volume in cm³.
+    '''
+    structure_set_uid: str
+    study_instance_uid: str
+    roi_number: int
+    roi_name: str
+    volume: float
+    centroid: tuple
+    extent: tuple
+    slice_count: int
+    slice_thickness: float
+
+
+def segment_sums(values, starts):
+    '''
+    Sum consecutive segments of values beginning at starts along the first axis.
+    '''
+    return np.add.reduceat(values, starts, axis=0) if len(values) else values
+
+
+def nesting_depth(points, starts, lengths, group, axes):
+    '''
+    Return for every contour the number of other contours of the same group that contain its first point.
+    '''
+    depth = np.zeros(len(starts), dtype=np.int64)
+    order = np.argsort(group, kind='stable')
+    group_starts = np.searchsorted(group[order], group[order], side='left')
+    sizes = np.bincount(group)[group[order]]
+    nested = sizes > 1
+    if not nested.any():
+        return depth
+
+    # Every (contour, other contour of its group) pair.
+    inner = np.repeat(order[nested], sizes[nested])
+    position = np.arange(len(inner)) - np.repeat(np.cumsum(sizes[nested]) - sizes[nested], sizes[nested])
+    outer = order[np.repeat(group_starts[nested], sizes[nested]) + position]
+    keep = inner != outer
+    inner, outer = inner[keep], outer[keep]
+
+    # Crossing-number test of the first point of inner against every edge of outer.
+    edges = lengths[outer]
+    pair = np.repeat(np.arange(len(inner)), edges)
+    edge = np.repeat(starts[outer], edges) + np.arange(len(pair)) - np.repeat(np.cumsum(edges) - edges, edges)
+    following = np.where(edge + 1 == np.repeat(starts[outer] + edges, edges), np.repeat(starts[outer], edges), edge + 1)
+    u, v = axes[pair, 0], axes[pair, 1]
+    qu, qv = points[starts[inner][pair], u], points[starts[inner][pair], v]
+    ua, va = points[edge, u], points[edge, v]
+    ub, vb = points[following, u], points[following, v]
+    straddles = (va > qv) != (vb > qv)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crossing = straddles & (qu < ua + (qv - va) * (ub - ua) / (vb - va))
+    inside = np.bincount(pair, weights=crossing, minlength=len(inner)).astype(np.int64) % 2
+    np.add.at(depth, inner, inside)
+    return depth
+
+
+def roi_volumes(structure_sets):
+    '''
+    Compute the RoiVolume of every ROI of the structure sets in a single batch.
+    '''
+    rois = [(structure_set, roi) for structure_set in structure_sets for roi in structure_set.rois]
+    roi_set = np.array([number for number, structure_set in enumerate(structure_sets) for roi in structure_set.rois], dtype=np.int64)
+    contours = [contour for structure_set, roi in rois for contour in roi.contours]
+    if not contours:
+        return []
+    points = np.concatenate(contours)
+    lengths = np.array([len(contour) for contour in contours])
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    contour_roi = np.repeat(np.arange(len(rois)), [len(roi.contours) for structure_set, roi in rois])
+    point_contour = np.repeat(np.arange(len(contours)), lengths)
+    roi_starts = np.concatenate(([0], np.cumsum([len(roi.contours) for structure_set, roi in rois])[:-1]))
+
+    # Fan of triangles from the first point of each contour: area vectors and centroids.
+    following = np.arange(len(points)) + 1
+    following[starts + lengths - 1] = starts
+    apex = points[starts][point_contour]
+    triangles = 0.5 * np.cross(points - apex, points[following] - apex)
+    triangle_centroids = (apex + points + points[following]) / 3
+    area_vectors = segment_sums(triangles, starts)
+
+    # Normal of each ROI: area vectors of its contours aligned with the largest one.
+    magnitudes = np.linalg.norm(area_vectors, axis=1)
+    by_size = np.lexsort((magnitudes, contour_roi))
+    last = np.append(contour_roi[by_size][1:] != contour_roi[by_size][:-1], True)
+    largest = np.zeros(len(rois), dtype=np.int64)
+    largest[contour_roi[by_size][last]] = by_size[last]
+    reference = area_vectors[largest][contour_roi]
+    aligned = area_vectors * np.where(np.einsum('ij,ij->i', area_vectors, reference) < 0, -1.0, 1.0)[:, None]
+    normals = segment_sums(aligned, roi_starts)
+    norms = np.linalg.norm(normals, axis=1)
+    normals = np.where(norms[:, None] > 0, normals / np.where(norms > 0, norms, 1)[:, None], [0.0, 0.0, 1.0])
+
+    # Signed areas and first moments projected on the ROI normal.
+    weights = np.einsum('ij,ij->i', triangles, normals[contour_roi][point_contour])
+    signed_areas = segment_sums(weights, starts)
+    moments = segment_sums(triangle_centroids * weights[:, None], starts)
+
+    # Contoured planes, their spacing, and holes from the nesting parity within a plane.
+    heights = np.einsum('ij,ij->i', segment_sums(points, starts) / lengths[:, None], normals[contour_roi])
+    plane = np.rint(heights / PLANE_TOLERANCE).astype(np.int64)
+    planes, group = np.unique(np.column_stack([contour_roi, plane]), axis=0, return_inverse=True)
+    group = group.ravel()
+    axes = np.argsort(np.abs(normals), axis=1)[:, :2][contour_roi]
+    holes = nesting_depth(points, starts, lengths, group, axes) % 2 == 1
+    orientation = np.where(signed_areas < 0, -1.0, 1.0) * np.where(holes, -1.0, 1.0)
+    areas = np.abs(signed_areas) * np.where(holes, -1.0, 1.0)
+    moments = moments * orientation[:, None]
+
+    plane_roi = planes[:, 0]
+    plane_height = planes[:, 1] * PLANE_TOLERANCE
+    slice_counts = np.bincount(plane_roi, minlength=len(rois))
+    gaps = np.diff(plane_height)
+    same_roi = plane_roi[1:] == plane_roi[:-1]
+    thickness = np.full(len(rois), np.inf)
+    np.minimum.at(thickness, plane_roi[1:][same_roi], gaps[same_roi])
+
+    # ROIs contoured on a single plane take the spacing of the other ROIs of their structure set.
+    set_thickness = np.full(len(structure_sets), np.inf)
+    np.minimum.at(set_thickness, roi_set, thickness)
+    thickness = np.where(np.isfinite(thickness), thickness, set_thickness[roi_set])
+    thickness[~np.isfinite(thickness)] = np.nan
+
+    # Degenerate ROIs without area fall back to the mean of their points as centroid.
+    area_sums = np.bincount(contour_roi, weights=areas, minlength=len(rois))
+    point_roi = contour_roi[point_contour]
+    roi_point_starts = np.searchsorted(point_roi, np.arange(len(rois)))
+    point_means = segment_sums(points, roi_point_starts) / np.bincount(point_roi, minlength=len(rois))[:, None]
+    flat = np.abs(area_sums) < 1e-9
+    centroids = np.where(flat[:, None], point_means, segment_sums(moments, roi_starts) / np.where(flat, 1.0, area_sums)[:, None])
+    extents = np.maximum.reduceat(points, roi_point_starts, axis=0) - np.minimum.reduceat(points, roi_point_starts, axis=0)
+    volumes = area_sums * thickness / 1000
+
+    return [
+        RoiVolume(
+            structure_set_uid=structure_set.sop_instance_uid,
+            study_instance_uid=structure_set.study_instance_uid,
+            roi_number=roi.number,
+            roi_name=roi.name,
+            volume=None if np.isnan(volumes[index]) else float(volumes[index]),
+            centroid=tuple(float(value) for value in centroids[index]),
+            extent=tuple(float(value) for value in extents[index]),
+            slice_count=int(slice_counts[index]),
+            slice_thickness=None if np.isnan(thickness[index]) else float(thickness[index]),
+        )
+        for index, (structure_set, roi) in enumerate(rois)
+    ]
+
+
+def read_volumes(paths):
+    '''
+    Read a batch of RTSTRUCT files and compute the volumes of all their ROIs. Runs inside pool workers.
+
+    Returns (paths read, volumes). Files that failed to parse are left out of the paths.
+    '''
+    read, structure_sets = [], []
+    for path in paths:
+        structure_set = load_structure_set(path)
+        if structure_set is not None:
+            read.append(path)
+            structure_sets.append(structure_set)
+    return read, roi_volumes(structure_sets)
+
+
+@timed('volumes')
+def compute_volumes(studies, processes=None, batch_size=1000, files_per_task=32, recompute=False):
+    '''
+    Compute and store the StructureVolume of every ROI in the structure sets of the DICOM studies.
+
+    Each pool task reads files_per_task structure sets and computes all their
+    ROIs in one batch, which bounds the memory of a batch and keeps contour
+    data inside the workers. Structure sets processed by an earlier run are
+    skipped unless recompute is set; files that failed to parse are tried
+    again by the next run. Returns (rois, elapsed).
+    '''
+    start = time.perf_counter()
+    study_ids = {study.study_instance_uid: study.pk for study in studies}
+    paths = [path for study_paths in study_files(study_ids, 'RTSTRUCT', unprocessed=None if recompute else 'volumes').values() for path in study_paths]
+    tasks = [paths[index:index + files_per_task] for index in range(0, len(paths), files_per_task)]
+    read, volumes = [], []
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for batch_paths, batch in executor.map(read_volumes, tasks):
+            read.extend(batch_paths)
+            volumes.extend(volume for volume in batch if volume.study_instance_uid in study_ids)
+
+    objects = [
+        StructureVolume(
+            dicom_study_id=study_ids[volume.study_instance_uid],
+            structure_set_uid=volume.structure_set_uid,
+            roi_number=volume.roi_number,
+            roi_name=volume.roi_name,
+            volume=volume.volume,
+            centroid_x=volume.centroid[0],
+            centroid_y=volume.centroid[1],
+            centroid_z=volume.centroid[2],
+            extent_x=volume.extent[0],
+            extent_y=volume.extent[1],
+            extent_z=volume.extent[2],
+            slice_count=volume.slice_count,
+            slice_thickness=volume.slice_thickness,
+        )
+        for volume in volumes
+    ]
+    StructureVolume.objects.bulk_create(
+        objects,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['structure_set_uid', 'roi_number'],
+        update_fields=[
+            'dicom_study', 'roi_name', 'volume', 'centroid_x', 'centroid_y', 'centroid_z',
+            'extent_x', 'extent_y', 'extent_z', 'slice_count', 'slice_thickness', 'updated_at',
+        ],
+    )
+    mark_processed('volumes', read, batch_size)
+    enqueue_studies({volume.dicom_study_id for volume in objects}, [AggregateSourceChoices.VOLUME])
+    return len(objects), time.perf_counter() - start
@@ -1,3 +1,16 @@
 from django.contrib import admin
 
-# Register your models here.
+from lookup.models import (
+    LookupBillingCode,
+    LookupCancerSite,
+    LookupPathology,
+    LookupRadiotherapyTreatmentTechnique,
+    LookupSystemicTherapyType,
+)
+
+
+@admin.register(LookupCancerSite, LookupPathology, LookupRadiotherapyTreatmentTechnique, LookupBillingCode, LookupSystemicTherapyType)
+class LookupAdmin(admin.ModelAdmin):
+    list_display = ('id', 'label', 'modified_at')
+    search_fields = ('id', 'label')
+    ordering = ('id',)
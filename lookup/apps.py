@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class LookupConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'lookup'
+
+    def ready(self):
+        from lookup.cache import lookup_cache
+        from lookup.signals import invalidate_lookup_cache
+
+        for model in lookup_cache.lookup_models():
+            post_save.connect(invalidate_lookup_cache, sender=model, dispatch_uid=f'lookup_cache_save_{model._meta.model_name}')
+            post_delete.connect(invalidate_lookup_cache, sender=model, dispatch_uid=f'lookup_cache_delete_{model._meta.model_name}')
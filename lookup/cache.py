@@ -0,0 +1,127 @@
+'''
+Process-wide cache of the lookup tables.
+
+Every LookupAbstract subclass is held as an {id: label} map, so resolving codes
+is a dict lookup instead of a query. Saves and deletes in this process drop
+the map immediately. Changes made elsewhere are picked up by comparing a
+version token (row count and latest modified_at) at most once every
+LOOKUP_CACHE_TIMEOUT seconds. If LOOKUP_CACHE_ALIAS names a Django cache, the
+maps and version tokens are shared through it, so other processes see a
+change on their next check without querying the database. A shared version
+token expires after LOOKUP_CACHE_TIMEOUT seconds too, so changes that send
+no signal, such as update() or raw SQL, are still picked up.
+'''
+import logging
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError
+from django.db.models import Count, Max
+
+from lookup.models import LookupAbstract
+
+logger = logging.getLogger(__name__)
+
+
+class LookupCache:
+    '''
+    In-memory {id: label} maps for the lookup models.
+    '''
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {}
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'LOOKUP_CACHE_TIMEOUT', 60)
+
+    @property
+    def backend(self):
+        alias = getattr(settings, 'LOOKUP_CACHE_ALIAS', None)
+        return caches[alias] if alias else None
+
+    @staticmethod
+    def lookup_models():
+        return [model for model in apps.get_app_config('lookup').get_models() if issubclass(model, LookupAbstract)]
+
+    @staticmethod
+    def _key(model, suffix):
+        return f'lookup:{model._meta.label_lower}:{suffix}'
+
+    def _database_version(self, model):
+        summary = model.objects.aggregate(count=Count('pk'), modified=Max('modified_at'))
+        modified = summary['modified'].isoformat() if summary['modified'] else ''
+        return f"{summary['count']}:{modified}"
+
+    def _version(self, model):
+        backend = self.backend
+        if backend is None:
+            return self._database_version(model)
+        version = backend.get(self._key(model, 'version'))
+        if version is None:
+            version = self._database_version(model)
+            backend.set(self._key(model, 'version'), version, self.timeout)
+        return version
+
+    def _load(self, model, version):
+        backend = self.backend
+        labels = backend.get(self._key(model, version)) if backend is not None else None
+        if labels is None:
+            labels = dict(model.objects.values_list('pk', 'label'))
+            if backend is not None:
+                backend.set(self._key(model, version), labels, None)
+        return labels
+
+    def labels(self, model):
+        '''
+        Return the {id: label} map of a lookup model. Treat it as read-only.
+        '''
+        with self._lock:
+            entry = self._entries.get(model)
+            now = time.monotonic()
+            if entry is not None and now - entry['checked'] < self.timeout:
+                return entry['labels']
+            version = self._version(model)
+            if entry is None or entry['version'] != version:
+                entry = {'version': version, 'labels': self._load(model, version)}
+                self._entries[model] = entry
+            entry['checked'] = now
+            return entry['labels']
+
+    def label(self, model, code, default=None):
+        return self.labels(model).get(code, default)
+
+    def resolve(self, model, codes):
+        '''
+        Return {code: label} for the codes that exist in the lookup model.
+        '''
+        labels = self.labels(model)
+        return {code: labels[code] for code in codes if code in labels}
+
+    def invalidate(self, model=None):
+        '''
+        Drop the cached map of one lookup model, or of all of them.
+        '''
+        backend = self.backend
+        with self._lock:
+            for lookup_model in [model] if model else self.lookup_models():
+                self._entries.pop(lookup_model, None)
+                if backend is not None:
+                    backend.delete(self._key(lookup_model, 'version'))
+
+    def warm(self):
+        '''
+        Load every lookup model. Failures are logged, not raised, so a server can start before the database is ready.
+        '''
+        try:
+            for model in self.lookup_models():
+                self.labels(model)
+        except DatabaseError:
+            logger.warning('Could not warm the lookup cache', exc_info=True)
+
+
+lookup_cache = LookupCache()
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.9 on 2026-10-18 00:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LookupBillingCode',
+            fields=[
+                ('id', models.CharField(help_text='Enter the Unique ID or Code', max_length=255, primary_key=True, serialize=False)),
+                ('label', models.CharField(help_text='Enter the Label for the Code', max_length=1024)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Lookup Billing Code',
+                'verbose_name_plural': 'Lookup Billing Codes',
+            },
+        ),
+        migrations.CreateModel(
+            name='LookupCancerSite',
+            fields=[
+                ('id', models.CharField(help_text='Enter the Unique ID or Code', max_length=255, primary_key=True, serialize=False)),
+                ('label', models.CharField(help_text='Enter the Label for the Code', max_length=1024)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Lookup Cancer Site',
+                'verbose_name_plural': 'Lookup Cancer Sites',
+            },
+        ),
+        migrations.CreateModel(
+            name='LookupPathology',
+            fields=[
+                ('id', models.CharField(help_text='Enter the Unique ID or Code', max_length=255, primary_key=True, serialize=False)),
+                ('label', models.CharField(help_text='Enter the Label for the Code', max_length=1024)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Lookup Pathology',
+                'verbose_name_plural': 'Lookup Pathologies',
+            },
+        ),
+        migrations.CreateModel(
+            name='LookupRadiotherapyTreatmentTechnique',
+            fields=[
+                ('id', models.CharField(help_text='Enter the Unique ID or Code', max_length=255, primary_key=True, serialize=False)),
+                ('label', models.CharField(help_text='Enter the Label for the Code', max_length=1024)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Lookup Radiotherapy Treatment Techniques',
+                'verbose_name_plural': 'Lookup Radiotherapy Treatment Techniques',
+            },
+        ),
+        migrations.CreateModel(
+            name='LookupSystemicTherapyType',
+            fields=[
+                ('id', models.CharField(help_text='Enter the Unique ID or Code', max_length=255, primary_key=True, serialize=False)),
+                ('label', models.CharField(help_text='Enter the Label for the Code', max_length=1024)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Lookup Systemic Therapy Type',
+                'verbose_name_plural': 'Lookup Systemic Therapy Types',
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.9 on 2026-10-18 00:13
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+from app.operations import PostgresAddIndex
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lookup', '0001_initial'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        PostgresAddIndex(
+            model_name='lookupcancersite',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass('label', name='gin_trgm_ops'), name='lookup_site_trgm_idx'),
+        ),
+        PostgresAddIndex(
+            model_name='lookuppathology',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass('label', name='gin_trgm_ops'), name='lookup_pathology_trgm_idx'),
+        ),
+    ]
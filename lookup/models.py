@@ -1,3 +1,4 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
 
 # Create your models here.
@@ -11,12 +12,19 @@ class LookupAbstract(models.Model):
     class Meta:
         abstract = True
 
+    def __str__(self):
+        return self.label
+
 
 class LookupCancerSite(LookupAbstract):
     
     class Meta:
         verbose_name = "Lookup Cancer Site"
         verbose_name_plural = "Lookup Cancer Sites"
+        indexes = [
+            # Search by trigram similarity of the label (app/search.py), on PostgreSQL only.
+            GinIndex(OpClass('label', name='gin_trgm_ops'), name='lookup_site_trgm_idx'),
+        ]
 
 
 class LookupPathology(LookupAbstract):
@@ -24,6 +32,10 @@ class LookupPathology(LookupAbstract):
     class Meta: 
         verbose_name = "Lookup Pathology"
         verbose_name_plural = "Lookup Pathologies"
+        indexes = [
+            # Search by trigram similarity of the label (app/search.py), on PostgreSQL only.
+            GinIndex(OpClass('label', name='gin_trgm_ops'), name='lookup_pathology_trgm_idx'),
+        ]
 
 
 class LookupRadiotherapyTreatmentTechnique(LookupAbstract):
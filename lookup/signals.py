@@ -0,0 +1,5 @@
+from lookup.cache import lookup_cache
+
+
+def invalidate_lookup_cache(sender, **kwargs):
+    lookup_cache.invalidate(sender)
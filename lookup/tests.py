@@ -1,3 +1,79 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from lookup.cache import LookupCache, lookup_cache
+from lookup.models import LookupCancerSite, LookupPathology
+
+SHARED_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+    'lookup': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'lookup-tests'},
+}
+
+
+class LookupCacheTests(TestCase):
+    '''
+    Lookup maps follow saves and deletes in this process and, once the timeout passes, changes made elsewhere.
+    '''
+
+    def setUp(self):
+        # Test transactions roll back without signals, so start and end with empty maps.
+        lookup_cache.invalidate()
+        self.addCleanup(lookup_cache.invalidate)
+        LookupCancerSite.objects.create(id='C34', label='Lung')
+
+    def test_signals(self):
+        self.assertEqual(lookup_cache.labels(LookupCancerSite), {'C34': 'Lung'})
+        with self.assertNumQueries(0):
+            self.assertEqual(lookup_cache.label(LookupCancerSite, 'C34'), 'Lung')
+
+        site = LookupCancerSite.objects.get(pk='C34')
+        site.label = 'Bronchus and Lung'
+        site.save()
+        self.assertEqual(lookup_cache.labels(LookupCancerSite), {'C34': 'Bronchus and Lung'})
+        LookupCancerSite.objects.create(id='C50', label='Breast')
+        self.assertEqual(lookup_cache.resolve(LookupCancerSite, ['C50', 'C99']), {'C50': 'Breast'})
+        site.delete()
+        self.assertEqual(lookup_cache.labels(LookupCancerSite), {'C50': 'Breast'})
+
+    def test_version(self):
+        lookup_cache.labels(LookupCancerSite)
+        # update() sends no signals, as if another process had changed the row.
+        LookupCancerSite.objects.update(label='Bronchus and Lung', modified_at=timezone.now())
+        self.assertEqual(lookup_cache.label(LookupCancerSite, 'C34'), 'Lung')
+        with override_settings(LOOKUP_CACHE_TIMEOUT=0):
+            self.assertEqual(lookup_cache.label(LookupCancerSite, 'C34'), 'Bronchus and Lung')
+
+    @override_settings(CACHES=SHARED_CACHES, LOOKUP_CACHE_ALIAS='lookup')
+    def test_shared(self):
+        caches['lookup'].clear()
+        other = LookupCache()
+        self.assertEqual(other.labels(LookupCancerSite), {'C34': 'Lung'})
+        # The version token is shared, so an unchanged table costs no query in either process.
+        with self.assertNumQueries(0):
+            self.assertEqual(lookup_cache.labels(LookupCancerSite), {'C34': 'Lung'})
+
+        site = LookupCancerSite.objects.get(pk='C34')
+        site.label = 'Bronchus and Lung'
+        site.save()
+        with override_settings(LOOKUP_CACHE_TIMEOUT=0):
+            self.assertEqual(other.labels(LookupCancerSite), {'C34': 'Bronchus and Lung'})
+
+        # The shared version token expires, so a change that sends no signal is seen after the timeout.
+        LookupCancerSite.objects.update(label='Lung', modified_at=timezone.now())
+        self.assertEqual(other.labels(LookupCancerSite), {'C34': 'Bronchus and Lung'})
+        with override_settings(LOOKUP_CACHE_TIMEOUT=0):
+            self.assertEqual(other.labels(LookupCancerSite), {'C34': 'Lung'})
+
+    def test_warm(self):
+        lookup_cache.warm()
+        with self.assertNumQueries(0):
+            lookup_cache.labels(LookupCancerSite)
+            lookup_cache.labels(LookupPathology)
+
+        lookup_cache.invalidate()
+        with mock.patch.object(LookupCache, '_load', side_effect=DatabaseError), self.assertLogs('lookup.cache', 'WARNING'):
+            lookup_cache.warm()
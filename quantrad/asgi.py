@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'quantrad.settings')
 
 application = get_asgi_application()
+
+from lookup.cache import lookup_cache  # noqa: E402
+
+lookup_cache.warm()
@@ -43,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'allauth',
     'allauth.account',
     'app',
@@ -51,6 +52,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -92,9 +94,119 @@ DATABASES = {
         'PASSWORD': os.getenv('DJANGO_DB_PASSWORD', ''),
         'HOST': os.getenv('DJANGO_DB_HOST', 'localhost'),
         'PORT': os.getenv('DJANGO_DB_PORT', '5432'),
+        # Seconds to keep a connection open between requests, checked before reuse.
+        'CONN_MAX_AGE': int(os.getenv('DJANGO_DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Connection pool (psycopg 3 only). Under ASGI every request runs its ORM
+# queries in a thread of its own, so persistent connections are not reused
+# across requests; set DJANGO_DB_POOL to share a pool of connections instead.
+if os.getenv('DJANGO_DB_POOL', 'False').lower() in ('true', '1'):
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.getenv('DJANGO_DB_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.getenv('DJANGO_DB_POOL_MAX_SIZE', '20')),
+            'timeout': int(os.getenv('DJANGO_DB_POOL_TIMEOUT', '10')),
+        },
+    }
+
+# Lookup table cache (see lookup/cache.py). LOOKUP_CACHE_ALIAS names an entry in
+# CACHES to share the lookup maps between processes; leave it empty to keep them
+# per process. LOOKUP_CACHE_TIMEOUT bounds how stale a process may be, in seconds.
+LOOKUP_CACHE_ALIAS = os.getenv('DJANGO_LOOKUP_CACHE_ALIAS') or None
+LOOKUP_CACHE_TIMEOUT = int(os.getenv('DJANGO_LOOKUP_CACHE_TIMEOUT', '60'))
+
+# Search (see app/search.py): names and lookup labels whose trigram word
+# similarity to the query reaches SEARCH_SIMILARITY_THRESHOLD match, so that
+# misspellings are found.
+SEARCH_SIMILARITY_THRESHOLD = float(os.getenv('DJANGO_SEARCH_SIMILARITY_THRESHOLD', '0.4'))
+
+# Content-addressed object store of ingested DICOM payloads (see
+# app/object_store.py). Leave OBJECT_STORE_DIR empty to index the ingested
+# files where they are. OBJECT_STORE_METHODS are tried in order to add a
+# payload: reflink, hardlink and copy.
+OBJECT_STORE_DIR = os.getenv('DJANGO_OBJECT_STORE_DIR') or None
+OBJECT_STORE_METHODS = os.getenv('DJANGO_OBJECT_STORE_METHODS', 'reflink,hardlink,copy').split(',')
+
+# Radiomic feature extraction (see app/features.py). Path of the pyradiomics
+# parameter file; leave it empty to use the pyradiomics defaults.
+RADIOMICS_PARAMETER_FILE = os.getenv('DJANGO_RADIOMICS_PARAMETER_FILE') or None
+
+# Filtered images (Wavelet, LoG, ...) are cached here and shared by every ROI
+# and parameter set; the cache is kept under RADIOMICS_FILTER_CACHE_BYTES.
+RADIOMICS_FILTER_CACHE_DIR = os.getenv('DJANGO_RADIOMICS_FILTER_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'filters'))
+RADIOMICS_FILTER_CACHE_BYTES = int(os.getenv('DJANGO_RADIOMICS_FILTER_CACHE_BYTES', str(8 * 1024 ** 3)))
+
+# Decoded image series (see app/series_cache.py), stored as memory-mapped
+# arrays under SERIES_CACHE_BYTES of disk. Each process keeps the series it
+# opened last open, up to SERIES_CACHE_MEMORY_BYTES.
+SERIES_CACHE_DIR = os.getenv('DJANGO_SERIES_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'series'))
+SERIES_CACHE_BYTES = int(os.getenv('DJANGO_SERIES_CACHE_BYTES', str(32 * 1024 ** 3)))
+SERIES_CACHE_MEMORY_BYTES = int(os.getenv('DJANGO_SERIES_CACHE_MEMORY_BYTES', str(1024 ** 3)))
+
+# Rasterized RTSTRUCT masks (see app/masks.py), stored bit-packed and cropped.
+MASK_STORE_DIR = os.getenv('DJANGO_MASK_STORE_DIR', os.path.join(BASE_DIR, 'cache', 'masks'))
+MASK_STORE_BYTES = int(os.getenv('DJANGO_MASK_STORE_BYTES', str(32 * 1024 ** 3)))
+
+# Rendered slice tiles and thumbnails (see app/tiles.py), kept under
+# TILE_CACHE_BYTES. TILE_PRESETS are the window presets rendered ahead by the
+# tiles job; TILE_MAX_AGE is how long browsers may reuse a tile, in seconds.
+TILE_CACHE_DIR = os.getenv('DJANGO_TILE_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'tiles'))
+TILE_CACHE_BYTES = int(os.getenv('DJANGO_TILE_CACHE_BYTES', str(8 * 1024 ** 3)))
+TILE_PRESETS = os.getenv('DJANGO_TILE_PRESETS', 'soft_tissue').split(',')
+TILE_MAX_AGE = int(os.getenv('DJANGO_TILE_MAX_AGE', str(24 * 3600)))
+
+# Dose volume histograms (see app/dvh.py): stored bin width in Gy, and ROIs
+# covering fewer than DVH_SUPERSAMPLE_VOXELS image voxels are resampled on a
+# grid DVH_SUPERSAMPLING times finer in plane.
+DVH_BIN_WIDTH = float(os.getenv('DJANGO_DVH_BIN_WIDTH', '0.1'))
+DVH_SUPERSAMPLING = int(os.getenv('DJANGO_DVH_SUPERSAMPLING', '4'))
+DVH_SUPERSAMPLE_VOXELS = int(os.getenv('DJANGO_DVH_SUPERSAMPLE_VOXELS', '2000'))
+
+# Gamma analysis of measured doses (see app/gamma.py). RTDOSE files whose
+# series description or dose comment match QA_DOSE_DESCRIPTION are measured
+# doses, compared with the calculated dose of their plan with each of
+# GAMMA_CRITERIA (3%/2mm, optionally followed by local). Points below
+# GAMMA_THRESHOLD_PERCENT of the maximum are skipped; the search covers
+# GAMMA_MAX distances to agreement in GAMMA_STEPS steps per distance, then
+# halves the step around the best offset of each point GAMMA_REFINEMENTS
+# times. Gammas beyond the search are capped at GAMMA_MAX. GAMMA_BIN_WIDTH
+# is the width of the stored gamma histogram bins.
+QA_DOSE_DESCRIPTION = os.getenv('DJANGO_QA_DOSE_DESCRIPTION', r'measure|\bQA\b|verification')
+GAMMA_CRITERIA = os.getenv('DJANGO_GAMMA_CRITERIA', '3%/2mm,2%/2mm,3%/2mm local').split(',')
+GAMMA_THRESHOLD_PERCENT = float(os.getenv('DJANGO_GAMMA_THRESHOLD_PERCENT', '10'))
+GAMMA_MAX = float(os.getenv('DJANGO_GAMMA_MAX', '2'))
+GAMMA_STEPS = int(os.getenv('DJANGO_GAMMA_STEPS', '3'))
+GAMMA_REFINEMENTS = int(os.getenv('DJANGO_GAMMA_REFINEMENTS', '2'))
+GAMMA_BIN_WIDTH = float(os.getenv('DJANGO_GAMMA_BIN_WIDTH', '0.05'))
+
+# Group-wise aggregates (see app/aggregates.py): bins of the stored value
+# histograms, and the radiomic features summarized (by name prefix).
+AGGREGATE_HISTOGRAM_BINS = int(os.getenv('DJANGO_AGGREGATE_HISTOGRAM_BINS', '20'))
+AGGREGATE_FEATURE_PREFIXES = [prefix for prefix in os.getenv('DJANGO_AGGREGATE_FEATURE_PREFIXES', 'original_').split(',') if prefix]
+
+# Cohort exports (see app/export.py) read and write this many studies at a time.
+EXPORT_CHUNK_SIZE = int(os.getenv('DJANGO_EXPORT_CHUNK_SIZE', '2000'))
+
+# Background jobs (see app/jobs.py): attempts per job, delay before the first
+# retry in seconds (doubled on each attempt), seconds without a heartbeat after
+# which a running job is requeued, and seconds an idle worker waits between polls.
+JOB_MAX_ATTEMPTS = int(os.getenv('DJANGO_JOB_MAX_ATTEMPTS', '3'))
+JOB_RETRY_DELAY = float(os.getenv('DJANGO_JOB_RETRY_DELAY', '60'))
+JOB_STALE_AFTER = float(os.getenv('DJANGO_JOB_STALE_AFTER', '600'))
+JOB_POLL_INTERVAL = float(os.getenv('DJANGO_JOB_POLL_INTERVAL', '2'))
+
+# Request and stage metrics (see app/metrics.py). METRICS_SAMPLE_RATE is the
+# fraction of requests measured, 0 to turn it off. Sampled requests slower
+# than METRICS_SLOW_REQUEST_SECONDS are logged with their queries. The
+# /metrics endpoint only answers METRICS_ALLOWED_IPS.
+METRICS_SAMPLE_RATE = float(os.getenv('DJANGO_METRICS_SAMPLE_RATE', '1.0'))
+METRICS_SLOW_REQUEST_SECONDS = float(os.getenv('DJANGO_METRICS_SLOW_REQUEST_SECONDS', '1.0'))
+METRICS_ALLOWED_IPS = os.getenv('DJANGO_METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+
 # Django AllAuth Backend (see https://docs.allauth.org/en/latest/installation/quickstart.html)
 AUTHENTICATION_BACKENDS = (
     'django.contrib.auth.backends.ModelBackend',
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'quantrad.settings')
 
 application = get_wsgi_application()
+
+from lookup.cache import lookup_cache  # noqa: E402
+
+lookup_cache.warm()